@@ -2,7 +2,18 @@ from flask import Flask
 from flask_audit_log.middleware import AuditLogMiddleware
 from flask_cors import CORS
 
+from gobstuf.compression import init_compression
 from gobstuf.config import AUDIT_LOG_CONFIG
+from gobstuf.lib.capture import mks_capture
+from gobstuf.lib.deadline import init_deadlines
+from gobstuf.lib.fair_share import mks_fair_share
+from gobstuf.lib.hedging import mks_hedging
+from gobstuf.lib.load_shedding import init_load_shedding, load_shedder
+from gobstuf.lib.metrics import init_metrics
+from gobstuf.lib.retry import mks_retry
+from gobstuf.lib.timing import get_timings, server_timing_header
+from gobstuf.lib.upstream_guard import mks_guard
+from gobstuf.lib.url_templates import init_url_templates
 from gobstuf.logger import get_default_logger
 
 logger = get_default_logger()
@@ -13,6 +24,13 @@ def _health() -> str:
     return 'Connectivity OK'
 
 
+def _add_server_timing(response):
+    """Report the time spent in each phase of the request in the Server-Timing header."""
+    if timings := get_timings():
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+
 def get_flask_app():
     """
     Initializes the Flask App that serves the SOAP endpoint(s)
@@ -26,6 +44,25 @@ def get_flask_app():
     app.config['AUDIT_LOG'] = AUDIT_LOG_CONFIG
     AuditLogMiddleware(app)
 
+    # Metrics for Prometheus, including the refused requests
+    # see oauth2-proxy.cfg for bypass
+    init_metrics(app, {
+        'mks_guard': mks_guard,
+        'mks_hedging': mks_hedging,
+        'mks_retry': mks_retry,
+        'mks_fair_share': mks_fair_share,
+        'load_shedder': load_shedder,
+        'mks_capture': mks_capture,
+    })
+
+    # Overloaded requests are refused before any other processing
+    init_load_shedding(app)
+    init_deadlines(app)
+    app.after_request(_add_server_timing)
+
+    # Registered after the server timing, so that it runs before it and the compression time is included
+    init_compression(app)
+
     logger.info("Available endpoints:")
 
     # Health check route for HC endpoint (/brp prefix is required)
@@ -38,4 +75,7 @@ def get_flask_app():
     app.register_blueprint(secure_bp)
     app.register_blueprint(hc_bp)
 
+    # Links in responses are built from templates for all routes
+    init_url_templates(app)
+
     return app
@@ -0,0 +1,5 @@
+from gobstuf.app import get_app
+from gobstuf.async_api import get_asgi_app
+
+# Run the app with an ASGI server, eg uvicorn gobstuf.asgi:app
+app = get_asgi_app(get_app())
@@ -0,0 +1,251 @@
+"""
+ASGI app
+
+An alternative way to serve the Flask app, see gobstuf.asgi. Requests are routed and handled by the Flask app, with
+its request hooks (load shedding, deadlines, compression, ...) and error handlers.
+
+GET requests of the BRP REST views (StufRestView) are handled asynchronously, see AsyncStufRestView: while MKS is
+queried no thread is used. All other requests (the StUF proxy, batch requests, exports and the health check) are
+handled by the Flask app in the thread pool.
+
+When the client disconnects, the handling of its request is cancelled, including any MKS request in flight.
+
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import httpx
+from flask import Flask, Response, request
+
+from gobstuf.auth.routes import has_access
+from gobstuf.certrequest import get_async_client
+from gobstuf.config import ASGI_THREADS, ASGI_MKS_CONNECTIONS
+from gobstuf.lib.request_runner import RequestRunner
+from gobstuf.logger import get_default_logger
+from gobstuf.rest.brp.async_view import AsyncStufRestView
+from gobstuf.rest.brp.base_view import StufRestView
+from gobstuf.rest.routes import REST_ROUTES
+
+logger = get_default_logger()
+
+
+def _async_views(blueprint_name: str) -> dict:
+    """
+    Returns the views of the REST routes that can be handled asynchronously
+
+    :param blueprint_name: the name of the blueprint of the REST routes
+    :return: the view class for every endpoint
+    """
+    return {
+        f"{blueprint_name}.{view_func.__name__}": view_func.view_class
+        for _, view_func, methods in REST_ROUTES
+        if "GET" in methods and issubclass(view_func.view_class, StufRestView)
+    }
+
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """
+    Returns the WSGI environment for an ASGI HTTP request
+
+    :param scope: the ASGI connection scope
+    :param body: the request body
+    :return:
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        value = value.decode('latin-1')
+        if name in environ:
+            # Repeated headers are joined, cookies are separated by a semicolon (RFC 6265)
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = f"{environ[name]}{separator}{value}"
+        environ[name] = value
+    return environ
+
+
+class AsgiApp:
+
+    def __init__(self, app: Flask, blueprint_name: str):
+        """
+        :param app: the Flask app
+        :param blueprint_name: the name of the blueprint of the REST routes
+        """
+        self.app = app
+        self.async_views = _async_views(blueprint_name)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def __call__(self, scope: dict, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # The client is bound to the event loop, it is created on first use
+        if self._client is None:
+            self._client = get_async_client(ASGI_MKS_CONNECTIONS)
+        return self._client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+        return self._executor
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._client is not None:
+                    await self._client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope: dict, receive, send):
+        """
+        Handle the request, cancel the handling when the client disconnects
+
+        :param scope:
+        :param receive:
+        :param send:
+        :return:
+        """
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        handler = asyncio.ensure_future(self._handle(wsgi_environ(scope, body), send))
+        disconnect = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        await asyncio.wait([handler, disconnect], return_when=asyncio.FIRST_COMPLETED)
+
+        if not handler.done():
+            logger.info("Client disconnected, request is cancelled")
+            handler.cancel()
+        disconnect.cancel()
+        await asyncio.gather(handler, disconnect, return_exceptions=True)
+
+    async def _read_body(self, receive) -> Optional[bytes]:
+        """
+        :return: the request body, None if the client disconnected
+        """
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                return body
+
+    async def _wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _handle(self, environ: dict, send):
+        runner = RequestRunner(self.app, environ, self.executor)
+        runner.push()
+        response = None
+        try:
+            response = await self._get_response(runner)
+            await self._send(runner, response, send)
+        finally:
+            await runner.close(response)
+
+    async def _get_response(self, runner: RequestRunner) -> Response:
+        """
+        Handles the request like Flask.full_dispatch_request
+
+        :param runner:
+        :return:
+        """
+        try:
+            try:
+                rv = await runner.run(self.app.preprocess_request)
+                if rv is None:
+                    rv = await self._dispatch_request(runner)
+            except Exception as e:
+                rv = runner.sync(self.app.handle_user_exception, e)
+            return await runner.run(self.app.finalize_request, rv)
+        except Exception as e:
+            return runner.sync(self.app.handle_exception, e)
+
+    async def _dispatch_request(self, runner: RequestRunner):
+        view_class = runner.sync(self._get_async_view)
+        if view_class is None:
+            return await runner.run(self.app.dispatch_request)
+
+        view_args = runner.sync(lambda: request.view_args)
+        if not runner.sync(lambda: has_access(request.url_rule.rule, **view_args)):
+            return "Forbidden", 403
+        return await AsyncStufRestView(view_class(), self.client, runner).get(**view_args)
+
+    def _get_async_view(self) -> Optional[type]:
+        """
+        :return: the view class if the current request can be handled asynchronously, else None
+        """
+        if request.routing_exception is not None or request.method != 'GET':
+            return None
+        return self.async_views.get(request.endpoint)
+
+    async def _send(self, runner: RequestRunner, response: Response, send):
+        """
+        Sends the response. A streamed response is produced in the thread pool
+
+        :param runner:
+        :param response:
+        :param send:
+        :return:
+        """
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+
+        if response.is_sequence:
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+            return
+
+        chunks = response.iter_encoded()
+        while (chunk := await runner.run(next, chunks, None)) is not None:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def get_asgi_app(app: Flask) -> AsgiApp:
+    """
+    Returns the ASGI app that serves the Flask app
+
+    :param app:
+    :return:
+    """
+    from gobstuf.blueprints import hc_bp
+
+    return AsgiApp(app, hc_bp.name)
@@ -77,6 +77,30 @@ def log_response(**kwargs):
     logger.info(f"response: {json.dumps(kwargs)}", kwargs)
 
 
+def log_incomplete_response(exception: Exception):
+    """
+    Log a response that failed after it has been (partly) sent to the client
+
+    The audit log middleware logs the response when it is started, for a streamed response
+    that is before the body is sent. This adds a response log that marks the response as incomplete.
+
+    :param exception: the exception that aborted the response
+    :return:
+    """
+    log_response(
+        source=request.url,
+        destination=get_client_ip(request),
+        extra_data={
+            'http_response': {
+                'incomplete': True,
+                'exception': str(exception),
+            },
+            CORRELATION_ID_HEADER: request.headers.get(CORRELATION_ID_HEADER),
+            UNIQUE_ID_HEADER: request.headers.get(UNIQUE_ID_HEADER),
+        },
+        request_uuid=request.headers.get(CORRELATION_ID_HEADER, str(uuid.uuid4())))
+
+
 def on_audit_log_exception(exception, msg):
     """
     If for any reason the audit log should fail
@@ -4,6 +4,8 @@ from flask import g, request, url_for
 
 from gobcore.secure.request import is_secured_request, extract_roles, USER_NAME_HEADER
 
+from gobstuf.lib.url_templates import get_url_template, url_prefix
+
 REQUIRED_ROLE_PREFIX = 'fp_'
 REQUIRED_ROLE = 'brp_r'
 
@@ -21,8 +23,7 @@ def secure_route(rule: str, func: Callable) -> Callable:
     :return: 403 if access is not allowed, else wrapped `func`
     """
     def wrapper(*args, **kwargs) -> tuple[str, int]:
-        # Check that the endpoint is protected by oauth2-proxy and check access
-        if is_secured_request(request.headers) and _allows_access(rule, *args, **kwargs):
+        if has_access(rule, *args, **kwargs):
             return func(*args, **kwargs)
         else:
             return "Forbidden", 403
@@ -31,6 +32,15 @@ def secure_route(rule: str, func: Callable) -> Callable:
     return wrapper
 
 
+def has_access(rule: str, *args, **kwargs) -> bool:
+    """
+    Check that the endpoint is protected by oauth2-proxy and check access
+
+    Stores the MKS user and application of the request when access is allowed
+    """
+    return is_secured_request(request.headers) and _allows_access(rule, *args, **kwargs)
+
+
 def _get_role_fp(roles: list[str]) -> Optional[str]:
     """Get the first active `functieprofiel` role, which starts with 'fp_'."""
     return next((role for role in roles if role.startswith(REQUIRED_ROLE_PREFIX)), None)
@@ -53,5 +63,18 @@ def _allows_access(rule, *args, **kwargs) -> bool:
 
 
 def get_auth_url(view_name, **kwargs):
-    view_url = url_for(f"{request.blueprint}.{view_name}", **kwargs)
+    """
+    Returns the absolute url of the given view in the blueprint of the current request
+
+    The precomputed url template is used when available, url_for otherwise
+
+    :param view_name: eg brp_ingeschrevenpersonen_bsn
+    :param kwargs: the url arguments, eg bsn
+    :return:
+    """
+    endpoint = f"{request.blueprint}.{view_name}"
+    if template := get_url_template(endpoint):
+        return f"{url_prefix()}{template.expand(**kwargs)}"
+
+    view_url = url_for(endpoint, **kwargs)
     return f"{request.scheme}://{request.host}{view_url}"
@@ -0,0 +1,290 @@
+"""
+Benchmark comparison
+
+Stores the results of a benchmark as a baseline, and compares the results of a new run with the baseline.
+
+The baselines are versioned JSON files in gobstuf/benchmarks/baselines, one per benchmark, with the commit, Python
+version and platform they were measured on. Update a baseline after an intended change and commit it.
+
+The results of the pipeline and load benchmarks can be compared:
+- pipeline: the median duration of every case
+- load: the p50 and p95 latency, the throughput and the error rate of every concurrency level
+
+A median or percentile is compared by the ratio of the new and the baseline value. When both runs have a sample of
+the durations, the confidence interval of the ratio is bootstrapped from the samples. A measurement has regressed when
+the whole interval is more than the threshold worse than the baseline, eg a lower bound of 1.12 for 12% slower with a
+threshold of 10%. The throughput is compared by its ratio and the error rate by its difference.
+
+The check exits with status 1 when any measurement has regressed.
+
+Usage:
+    python -m gobstuf.benchmarks.compare save pipeline.json [--baselines DIR]
+    python -m gobstuf.benchmarks.compare check pipeline.json [--baselines DIR] [--threshold 0.1]
+                                         [--confidence 0.95] [--resamples 1000] [--output comparison.json]
+
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+# The version of the format of the baselines
+FORMAT_VERSION = 1
+
+BASELINES = Path(__file__).parent / 'baselines'
+
+# The minimal size of the samples for a bootstrapped confidence interval
+MIN_SAMPLES = 5
+
+# The increase of the error rate that is accepted
+ERROR_RATE_TOLERANCE = 0.01
+
+REGRESSION = 'regression'
+IMPROVEMENT = 'improvement'
+UNCHANGED = 'unchanged'
+
+
+class Measurement(NamedTuple):
+    value: float
+    unit: str
+    # A sample of the values of which value is the percentile, eg the durations of which value is the median
+    samples: Optional[list[float]] = None
+    percentile: int = 50
+    higher_is_better: bool = False
+    # Compare by the difference with the baseline instead of the ratio, the difference that is accepted
+    tolerance: Optional[float] = None
+
+
+def _pipeline_measurements(results: list[dict]) -> Iterator[tuple[str, Measurement]]:
+    for r in results:
+        yield f"{r['stage']} {r['case']}", Measurement(r['p50_us'], 'us', r.get('samples_us'))
+
+
+def _load_measurements(results: list[dict]) -> Iterator[tuple[str, Measurement]]:
+    for r in results:
+        level = f"{r['concurrency']} clients"
+        for percentile in [50, 95]:
+            if f'p{percentile}' in r['latency_ms']:
+                yield f"{level} p{percentile}", Measurement(r['latency_ms'][f'p{percentile}'], 'ms',
+                                                            r.get('samples_ms'), percentile)
+        yield f"{level} throughput", Measurement(r['throughput'], 'req/s', higher_is_better=True)
+        yield f"{level} error rate", Measurement(r['error_rate'], '', tolerance=ERROR_RATE_TOLERANCE)
+
+
+MEASUREMENTS = {
+    'pipeline': _pipeline_measurements,
+    'load': _load_measurements,
+}
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percentile // 100)]
+
+
+def bootstrap_ratio(baseline: list[float], current: list[float], percentile: int, confidence: float,
+                    resamples: int, rng: random.Random) -> tuple[float, float]:
+    """
+    Bootstraps the confidence interval of the ratio of the percentiles of two samples
+
+    :param baseline:
+    :param current:
+    :param percentile: eg 50 for the median
+    :param confidence: eg 0.95
+    :param resamples: the number of resamples of each sample
+    :param rng:
+    :return: the lower and upper bound of current / baseline
+    """
+    ratios = sorted(
+        _percentile(rng.choices(current, k=len(current)), percentile) /
+        _percentile(rng.choices(baseline, k=len(baseline)), percentile)
+        for _ in range(resamples)
+    )
+    alpha = (1 - confidence) / 2
+    return ratios[int(alpha * resamples)], ratios[min(resamples - 1, int((1 - alpha) * resamples))]
+
+
+def compare_measurement(baseline: Measurement, current: Measurement, threshold: float, confidence: float,
+                        resamples: int, rng: random.Random) -> dict:
+    """
+    :param baseline:
+    :param current:
+    :param threshold: the relative change that is accepted, eg 0.1 for 10%
+    :param confidence: of the bootstrapped interval
+    :param resamples: for the bootstrapped interval
+    :param rng:
+    :return: the change and the verdict (REGRESSION, IMPROVEMENT or UNCHANGED)
+    """
+    comparison = {'baseline': baseline.value, 'current': current.value, 'unit': current.unit}
+
+    if current.tolerance is not None:
+        change = current.value - baseline.value
+        comparison['change'] = change
+        worse, better = change > current.tolerance, change < -current.tolerance
+    else:
+        ratio = current.value / baseline.value if baseline.value else float('inf')
+        low = high = ratio
+        if baseline.samples and current.samples and min(len(baseline.samples), len(current.samples)) >= MIN_SAMPLES:
+            low, high = bootstrap_ratio(baseline.samples, current.samples, current.percentile, confidence,
+                                        resamples, rng)
+            comparison['interval'] = [low - 1, high - 1]
+        comparison['change'] = ratio - 1
+        if current.higher_is_better:
+            worse, better = high < 1 - threshold, low > 1 + threshold
+        else:
+            worse, better = low > 1 + threshold, high < 1 - threshold
+
+    comparison['verdict'] = REGRESSION if worse else IMPROVEMENT if better else UNCHANGED
+    return comparison
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, confidence: float = 0.95, resamples: int = 1000,
+            seed: int = 0) -> dict:
+    """
+    Compares the results of a benchmark with its baseline
+
+    :param baseline: the baseline, see save
+    :param current: the results of a benchmark
+    :param threshold: see compare_measurement
+    :param confidence: see compare_measurement
+    :param resamples: see compare_measurement
+    :param seed: for the bootstrap
+    :raises ValueError: for baselines of another version or benchmark
+    :return: name -> comparison, measurements of only one of the results have the verdict new or only in baseline
+    """
+    if baseline.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Baseline version {baseline.get('version')} is not supported, expected {FORMAT_VERSION}")
+    if baseline['benchmark'] != current['benchmark']:
+        raise ValueError(f"Baseline of {baseline['benchmark']} cannot be compared with {current['benchmark']}")
+    if current['benchmark'] not in MEASUREMENTS:
+        raise ValueError(f"Benchmark {current['benchmark']} cannot be compared")
+
+    measurements = MEASUREMENTS[current['benchmark']]
+    baseline_measurements = dict(measurements(baseline['results']))
+    current_measurements = dict(measurements(current['results']))
+
+    rng = random.Random(seed)
+    comparisons = {}
+    for name in dict.fromkeys([*baseline_measurements, *current_measurements]):
+        if name in baseline_measurements and name in current_measurements:
+            comparisons[name] = compare_measurement(baseline_measurements[name], current_measurements[name],
+                                                    threshold, confidence, resamples, rng)
+        else:
+            comparisons[name] = {'verdict': 'only in baseline' if name in baseline_measurements else 'new'}
+    return comparisons
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results: dict, directory: Path = BASELINES) -> Path:
+    """
+    Saves the results of a benchmark as its baseline
+
+    :param results: the results of a benchmark, eg {'benchmark': 'pipeline', 'results': [...]}
+    :param directory:
+    :return: the path of the baseline
+    """
+    baseline = {
+        'version': FORMAT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        **results,
+    }
+    path = Path(directory, f"{results['benchmark']}.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    return path
+
+
+def _value(comparison: dict, key: str) -> str:
+    if comparison['unit']:
+        return f"{comparison[key]:.1f} {comparison['unit']}"
+    return f"{comparison[key]:.3f}"
+
+
+def report(baseline: dict, comparisons: dict) -> str:
+    lines = [f"Baseline of {baseline['created']}, commit {baseline['commit']}, Python {baseline['python']}", '']
+    header = f"{'measurement':<50} {'baseline':>12} {'current':>12} {'change':>8} {'interval':>17}  verdict"
+    lines += [header, '-' * len(header)]
+    for name, c in comparisons.items():
+        if 'change' not in c:
+            lines.append(f"{name[-50:]:<50} {'':>12} {'':>12} {'':>8} {'':>17}  {c['verdict']}")
+            continue
+        change = f"{c['change']:+.1%}" if c['unit'] else f"{c['change']:+.3f}"
+        interval = f"{c['interval'][0]:+.1%}..{c['interval'][1]:+.1%}" if 'interval' in c else ''
+        lines.append(f"{name[-50:]:<50} {_value(c, 'baseline'):>12} {_value(c, 'current'):>12} {change:>8} "
+                     f"{interval:>17}  {c['verdict']}")
+
+    verdicts = [c['verdict'] for c in comparisons.values()]
+    lines += ['', f"{verdicts.count(REGRESSION)} regressions, {verdicts.count(IMPROVEMENT)} improvements, "
+                  f"{verdicts.count(UNCHANGED)} unchanged"]
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Store benchmark results as baseline or compare them with it")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    save_parser = subparsers.add_parser('save', help="Store the results as the baseline of the benchmark")
+    check_parser = subparsers.add_parser('check', help="Compare the results with the baseline of the benchmark")
+    for subparser in [save_parser, check_parser]:
+        subparser.add_argument('results', help="The JSON output of a benchmark")
+        subparser.add_argument('--baselines', default=BASELINES, type=Path, help="The directory of the baselines")
+
+    check_parser.add_argument('--threshold', type=float, default=0.1, help="The relative change that is accepted")
+    check_parser.add_argument('--confidence', type=float, default=0.95)
+    check_parser.add_argument('--resamples', type=int, default=1000)
+    check_parser.add_argument('--seed', type=int, default=0)
+    check_parser.add_argument('--output', help="Write the comparison as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with open(args.results) as f:
+        results = json.load(f)
+
+    if args.command == 'save':
+        print(f"Saved baseline {save(results, args.baselines)}")
+        return 0
+    return _check(parser, args, results)
+
+
+def _check(parser: argparse.ArgumentParser, args: argparse.Namespace, results: dict) -> int:
+    """
+    Compares the results with the baseline and reports the comparison
+
+    :return: 1 when any measurement has regressed, 0 otherwise
+    """
+    path = Path(args.baselines, f"{results['benchmark']}.json")
+    if not path.exists():
+        parser.error(f"No baseline {path}, save one first")
+    with open(path) as f:
+        baseline = json.load(f)
+
+    try:
+        comparisons = compare(baseline, results, args.threshold, args.confidence, args.resamples, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(report(baseline, comparisons))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': results['benchmark'], 'baseline': str(path), 'comparisons': comparisons}, f,
+                      indent=2)
+
+    return int(any(c['verdict'] == REGRESSION for c in comparisons.values()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
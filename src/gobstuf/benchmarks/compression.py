@@ -0,0 +1,118 @@
+"""
+Compression benchmark
+
+Compresses representative payloads with every available encoding and level and reports
+the bytes saved against the CPU time spent.
+
+Payloads:
+- the SOAP (XML) files that are given on the command line, as passed by the SOAP proxy
+- generated hal+json list responses of increasing size
+
+Usage:
+    python -m gobstuf.benchmarks.compression [--output results.json] [xml files...]
+
+"""
+import argparse
+import json
+import time
+
+from gobstuf.benchmarks.results import persons
+from gobstuf.compression import available_encodings, compress, GZIP, BROTLI
+
+LEVELS = {
+    GZIP: [1, 6, 9],
+    BROTLI: [1, 4, 6, 11],
+}
+
+# Number of persons in the generated hal+json responses
+LIST_SIZES = [1, 10, 100]
+
+
+def generated_payloads() -> dict:
+    """hal+json list responses of LIST_SIZES persons"""
+    return {
+        f'ingeschrevenpersonen_{size}.json': json.dumps({
+            '_links': {'self': {'href': 'https://acc.api.data.amsterdam.nl/brp/ingeschrevenpersonen'}},
+            '_embedded': {'ingeschrevenpersonen': persons(size)}
+        }, separators=(',', ':')).encode('utf-8')
+        for size in LIST_SIZES
+    }
+
+
+def file_payloads(paths: list[str]) -> dict:
+    payloads = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            payloads[path] = f.read()
+    return payloads
+
+
+def measure(data: bytes, encoding: str, level: int, min_duration: float = 0.2) -> dict:
+    """
+    Compress data repeatedly for at least min_duration seconds of CPU time
+
+    :param data:
+    :param encoding:
+    :param level:
+    :param min_duration:
+    :return: the measurement
+    """
+    compressed = compress(data, encoding, level)
+
+    calls = 0
+    start = time.process_time()
+    while (cpu_time := time.process_time() - start) < min_duration:
+        compress(data, encoding, level)
+        calls += 1
+
+    cpu_per_call = cpu_time / calls
+    saved = len(data) - len(compressed)
+    return {
+        'encoding': encoding,
+        'level': level,
+        'size': len(data),
+        'compressed_size': len(compressed),
+        'bytes_saved': saved,
+        'ratio': len(compressed) / len(data),
+        'cpu_ms': cpu_per_call * 1000,
+        # Bytes saved per millisecond CPU, higher is better
+        'bytes_saved_per_cpu_ms': saved / (cpu_per_call * 1000),
+    }
+
+
+def run(payloads: dict, min_duration: float = 0.2) -> list[dict]:
+    return [
+        {'payload': name, **measure(data, encoding, level, min_duration)}
+        for name, data in payloads.items()
+        for encoding in available_encodings()
+        for level in LEVELS[encoding]
+    ]
+
+
+def report(results: list[dict]) -> str:
+    header = f"{'payload':<45} {'enc':>4} {'lvl':>3} {'size':>9} {'compr':>9} {'saved':>6} {'cpu ms':>8} {'B/ms':>9}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r['payload'][-45:]:<45} {r['encoding']:>4} {r['level']:>3} {r['size']:>9} "
+                     f"{r['compressed_size']:>9} {1 - r['ratio']:>6.1%} {r['cpu_ms']:>8.3f} "
+                     f"{r['bytes_saved_per_cpu_ms']:>9.0f}")
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Compression benchmark: bytes saved against CPU spent")
+    parser.add_argument('files', nargs='*', help="XML (SOAP) files to compress, eg tests/fixtures/*.xml")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--min-duration', type=float, default=0.2, help="Minimal CPU seconds per measurement")
+    args = parser.parse_args(argv)
+
+    results = run({**file_payloads(args.files), **generated_payloads()}, args.min_duration)
+    print(report(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'compression', 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
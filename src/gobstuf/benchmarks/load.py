@@ -0,0 +1,491 @@
+"""
+Load test
+
+Drives the gateway over HTTP at increasing concurrency levels and reports per level the latency percentiles,
+throughput, error rate and the time spent in each phase of the request, as reported in the Server-Timing header.
+
+By default the gateway and the MKS stand-in (see gobstuf.stand_in.mks) are started in separate processes, with the
+gateway pointed at the stand-in. The gateway runs in a threaded WSGI server (wsgiref) or, with --server uwsgi, in
+uWSGI with the given number of processes, as in production. With --url an already running gateway is tested, it
+should be pointed at a stand-in MKS itself.
+
+The requests are drawn from a traffic mix: the name of a mix in MIXES, or weights per kind of request, eg
+bsn=5,filter_naam=1. The kinds of request (see KINDS) cover the REST routes and the SOAP proxy route. The requests
+carry the role headers of oauth2-proxy, for the given roles. The persons are drawn from a fixed number of BSNs.
+
+Every concurrency level is a closed loop: every client sends its next request when the previous one is answered.
+Requests that start within the warm-up are not reported.
+
+Usage:
+    python -m gobstuf.benchmarks.load [--url URL | --server wsgiref|uwsgi] [--processes 4]
+                                      [--generate production] [--mks-latency [ACTION=]SPEC ...]
+                                      [--mix realistic | --mix KIND=WEIGHT,...] [--concurrency 1 4 16 64]
+                                      [--duration 30] [--warmup 5] [--persons 1000] [--roles fp_test_burger brp_r]
+                                      [--seed SEED] [--output load.json]
+
+The base paths are read from API_BASE_PATH, HC_BASE_PATH and ROUTE_PATH_310 in the environment, as for the gateway.
+
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from socketserver import ThreadingMixIn
+from typing import Iterator, NamedTuple, Optional
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+
+import jwt
+import requests
+from gobcore.secure.request import ACCESS_TOKEN_HEADER, USER_NAME_HEADER
+
+from gobstuf.benchmarks.responses import SIZES
+from gobstuf.stuf.brp.request.ingeschrevenpersonen import IngeschrevenpersonenBsnStufRequest
+
+REST = 'rest'
+SOAP = 'soap'
+
+
+class Kind(NamedTuple):
+    method: str
+    # Relative to the REST (HC_BASE_PATH) or SOAP (API_BASE_PATH + ROUTE_PATH_310) base path, {bsn} is filled in
+    path: str
+    api: str = REST
+
+
+PERSONEN = '/brp/ingeschrevenpersonen'
+
+KINDS = {
+    'bsn': Kind('GET', PERSONEN + '/{bsn}'),
+    'bsn_expand': Kind('GET', PERSONEN + '/{bsn}?expand=partners,ouders,kinderen'),
+    'filter_bsn': Kind('GET', PERSONEN + '?burgerservicenummer={bsn}'),
+    'filter_postcode': Kind('GET', PERSONEN + '?verblijfplaats__postcode=1011PN&verblijfplaats__huisnummer=1'),
+    'filter_adres': Kind('GET', PERSONEN + '?verblijfplaats__gemeentevaninschrijving=0363'
+                                           '&verblijfplaats__naamopenbareruimte=Amstel&verblijfplaats__huisnummer=1'),
+    'filter_naam': Kind('GET', PERSONEN + '?geboorte__datum=1970-01-01&naam__geslachtsnaam=Ja*'),
+    'partners': Kind('GET', PERSONEN + '/{bsn}/partners'),
+    'partner': Kind('GET', PERSONEN + '/{bsn}/partners/1'),
+    'ouders': Kind('GET', PERSONEN + '/{bsn}/ouders'),
+    'ouder': Kind('GET', PERSONEN + '/{bsn}/ouders/1'),
+    'kinderen': Kind('GET', PERSONEN + '/{bsn}/kinderen'),
+    'kind': Kind('GET', PERSONEN + '/{bsn}/kinderen/1'),
+    'historie': Kind('GET', PERSONEN + '/{bsn}/verblijfplaatshistorie'),
+    'batch': Kind('POST', PERSONEN + '/batch'),
+    'soap': Kind('POST', '', SOAP),
+}
+
+MIXES = {
+    # Mostly single persons, as requested by the applications that use the gateway
+    'realistic': {
+        'bsn': 40, 'bsn_expand': 10, 'filter_bsn': 10, 'filter_postcode': 4, 'filter_adres': 2, 'filter_naam': 4,
+        'partners': 3, 'ouders': 3, 'kinderen': 3, 'historie': 5, 'batch': 1, 'soap': 15,
+    },
+    'rest': {kind: 1 for kind, spec in KINDS.items() if spec.api == REST},
+    'search': {'filter_bsn': 1, 'filter_postcode': 1, 'filter_adres': 1, 'filter_naam': 1},
+    'soap': {'soap': 1},
+}
+
+# The number of persons in a batch request
+BATCH_SIZE = 10
+
+PERCENTILES = [50, 95, 99]
+
+# The maximum number of latencies in the sample of a level, for comparisons with a baseline
+MAX_SAMPLES = 200
+
+
+class Target:
+    """Builds the requests for a gateway"""
+
+    def __init__(self, url: str, headers: dict, hc_base_path: str = '', soap_path: str = '/310'):
+        """
+        :param url: the url of the gateway, eg http://localhost:8165
+        :param headers: the role headers
+        :param hc_base_path: the base path of the REST routes
+        :param soap_path: the path of the SOAP proxy route
+        """
+        self.bases = {REST: f"{url}{hc_base_path}", SOAP: f"{url}{soap_path}"}
+        self.headers = headers
+
+    def request(self, kind: str, bsns: list[str], rng: random.Random) -> tuple[str, str, Optional[bytes], dict]:
+        """
+        :param kind: the kind of request, see KINDS
+        :param bsns: the persons to choose from
+        :param rng:
+        :return: method, url, body and headers of the request
+        """
+        spec = KINDS[kind]
+        bsn = rng.choice(bsns)
+        url = self.bases[spec.api] + spec.path.format(bsn=bsn)
+
+        if kind == 'batch':
+            body = json.dumps({'burgerservicenummers': rng.sample(bsns, min(BATCH_SIZE, len(bsns)))})
+            return spec.method, url, body.encode('utf-8'), {**self.headers, 'Content-Type': 'application/json'}
+        if kind == 'soap':
+            stuf_request = IngeschrevenpersonenBsnStufRequest('gebruiker', 'applicatie')
+            stuf_request.set_values({'bsn': bsn})
+            headers = {**self.headers, 'Soapaction': stuf_request.soap_action, 'Content-Type': 'text/xml'}
+            return spec.method, url, stuf_request.to_string(), headers
+        return spec.method, url, None, self.headers
+
+
+class Sample(NamedTuple):
+    kind: str
+    # 0 when the request failed without a response
+    status: int
+    # Seconds
+    duration: float
+    # Phase -> milliseconds
+    phases: dict
+
+
+def role_headers(roles: list[str], user: str) -> dict:
+    """
+    The headers of oauth2-proxy for an authenticated user
+
+    :param roles: eg ['fp_test_burger', 'brp_r']
+    :param user: the preferred username
+    :return:
+    """
+    token = jwt.encode({'realm_access': {'roles': roles}}, key='', algorithm='HS256')
+    return {ACCESS_TOKEN_HEADER: token, USER_NAME_HEADER: user}
+
+
+def parse_server_timing(value: str) -> dict:
+    """
+    Example: 'mks;dur=12.500, serialise;dur=1.200' => {'mks': 12.5, 'serialise': 1.2}
+
+    :param value: a Server-Timing header value
+    :return: the durations in milliseconds by phase
+    """
+    phases = {}
+    for metric in filter(None, (metric.strip() for metric in value.split(','))):
+        name, *params = metric.split(';')
+        durations = [param.strip()[4:] for param in params if param.strip().startswith('dur=')]
+        if durations:
+            phases[name.strip()] = float(durations[0])
+    return phases
+
+
+def parse_mix(value: str) -> dict:
+    """
+    :param value: the name of a mix in MIXES, or KIND=WEIGHT,... eg bsn=5,filter_naam=1
+    :return: kind -> weight
+    """
+    if value in MIXES:
+        return MIXES[value]
+
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight in {item}, use KIND=WEIGHT, eg bsn=5")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown kind {kind}, use one of {', '.join(KINDS)}")
+    return mix
+
+
+def run_level(target: Target, mix: dict, bsns: list[str], concurrency: int, duration: float, warmup: float = 0.0,
+              seed: int = None, timeout: float = 60.0) -> dict:
+    """
+    Sends requests with the given number of clients for warmup + duration seconds
+
+    :param target:
+    :param mix: kind -> weight
+    :param bsns: the persons to request
+    :param concurrency: the number of clients
+    :param duration: seconds
+    :param warmup: seconds
+    :param seed:
+    :param timeout: of a single request, in seconds
+    :return: the summary of the level, see summarise
+    """
+    kinds, weights = list(mix), list(mix.values())
+    start = time.perf_counter()
+    measure_from = start + warmup
+    end = measure_from + duration
+
+    samples = []
+    lock = threading.Lock()
+
+    def client(n: int):
+        rng = random.Random(None if seed is None else seed * 1000 + n)
+        with requests.Session() as session:
+            while time.perf_counter() < end:
+                kind = rng.choices(kinds, weights)[0]
+                method, url, body, headers = target.request(kind, bsns, rng)
+                request_start = time.perf_counter()
+                try:
+                    response = session.request(method, url, data=body, headers=headers, timeout=timeout)
+                    status = response.status_code
+                    phases = parse_server_timing(response.headers.get('Server-Timing', ''))
+                except requests.RequestException:
+                    status, phases = 0, {}
+                if request_start >= measure_from:
+                    with lock:
+                        samples.append(Sample(kind, status, time.perf_counter() - request_start, phases))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+
+    return summarise(samples, concurrency, time.perf_counter() - measure_from)
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    """
+    :param values: sorted values
+    :param percentile: eg 99
+    :return: the value below which percentile percent of the values fall
+    """
+    return values[min(len(values) - 1, len(values) * percentile // 100)]
+
+
+def _latency(durations: list[float]) -> dict:
+    """The percentiles and maximum of the durations, in milliseconds"""
+    if not durations:
+        return {}
+    durations = sorted(duration * 1000 for duration in durations)
+    return {**{f'p{percentile}': _percentile(durations, percentile) for percentile in PERCENTILES},
+            'max': durations[-1]}
+
+
+def _is_error(sample: Sample) -> bool:
+    return not 200 <= sample.status < 300
+
+
+def summarise(samples: list[Sample], concurrency: int, elapsed: float) -> dict:
+    """
+    :param samples:
+    :param concurrency:
+    :param elapsed: seconds in which the samples were taken
+    :return: the summary, overall and per kind of request, with a random sample of the latencies
+    """
+    errors = sum(_is_error(sample) for sample in samples)
+    durations = [sample.duration * 1000 for sample in samples]
+
+    kinds = defaultdict(list)
+    phases = defaultdict(list)
+    for sample in samples:
+        kinds[sample.kind].append(sample)
+        for phase, duration in sample.phases.items():
+            phases[phase].append(duration)
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'throughput': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'statuses': {str(status): n for status, n in sorted(Counter(sample.status for sample in samples).items())},
+        'latency_ms': _latency([sample.duration for sample in samples]),
+        'samples_ms': random.Random(0).sample(durations, min(MAX_SAMPLES, len(durations))),
+        'kinds': {
+            kind: {
+                'requests': len(kind_samples),
+                'errors': sum(_is_error(sample) for sample in kind_samples),
+                'latency_ms': _latency([sample.duration for sample in kind_samples]),
+            } for kind, kind_samples in kinds.items()
+        },
+        # The phases of the requests that report the phase
+        'phases_ms': {
+            phase: {'mean': sum(durations) / len(durations), 'p95': _percentile(sorted(durations), 95)}
+            for phase, durations in phases.items()
+        },
+    }
+
+
+def report(results: list[dict]) -> str:
+    header = f"{'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        latency = r['latency_ms']
+        lines.append(f"{r['concurrency']:>7} {r['throughput']:>9.1f} {latency.get('p50', 0):>9.1f} "
+                     f"{latency.get('p95', 0):>9.1f} {latency.get('p99', 0):>9.1f} {r['error_rate']:>7.1%}")
+
+    phases = list(dict.fromkeys(phase for r in results for phase in r['phases_ms']))
+    if phases:
+        header = f"{'clients':>7} " + ' '.join(f"{phase[:11]:>11}" for phase in phases)
+        lines += ['', 'Mean time per phase (ms)', header, '-' * len(header)]
+        for r in results:
+            lines.append(f"{r['concurrency']:>7} " + ' '.join(
+                f"{r['phases_ms'][phase]['mean']:>11.2f}" if phase in r['phases_ms'] else f"{'':>11}"
+                for phase in phases))
+    return '\n'.join(lines)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format: str, *args):
+        pass
+
+
+def serve(port: int):
+    """Serve the gateway at the given port, every request is handled in its own thread"""
+    from gobstuf.api import get_flask_app
+
+    server = make_server('localhost', port, get_flask_app(), ThreadingWSGIServer, QuietWSGIRequestHandler)
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    """
+    Wait until the url answers
+
+    :raises RuntimeError: when the process stops or the url does not answer within timeout seconds
+    """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} stopped with exit code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} does not answer")
+
+
+def mks_command(args: argparse.Namespace, mks_port: int) -> list[str]:
+    """
+    :return: the command to start the MKS stand-in, with the response size, latencies and seed of the args
+    """
+    command = [sys.executable, '-m', 'gobstuf.stand_in.mks', '--port', str(mks_port), '--generate', args.generate]
+    for latency in args.mks_latency:
+        command += ['--latency', latency]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    return command
+
+
+def server_commands(args: argparse.Namespace, mks_port: int, app_port: int) -> tuple[list[str], list[str]]:
+    """
+    :return: the commands to start the MKS stand-in and the gateway
+    """
+    if args.server == 'uwsgi':
+        app = ['uwsgi', '--http', f'localhost:{app_port}', '--module', 'gobstuf.wsgi', '--callable', 'app',
+               '--processes', str(args.processes), '--enable-threads', '--need-app', '--die-on-term',
+               '--disable-logging']
+    else:
+        app = [sys.executable, '-m', 'gobstuf.benchmarks.load', '--serve', str(app_port)]
+    return mks_command(args, mks_port), app
+
+
+def gateway_env(mks_port: int) -> dict:
+    """
+    :param mks_port: the port of the MKS stand-in
+    :return: the environment of a gateway that is pointed at the stand-in
+    """
+    env = {
+        **os.environ,
+        'ROUTE_SCHEME': 'http',
+        'ROUTE_NETLOC': f'localhost:{mks_port}',
+        'ROUTE_PATH_310': os.getenv('ROUTE_PATH_310', '/310'),
+        'ROUTE_PATH_204': os.getenv('ROUTE_PATH_204', '/204'),
+    }
+    # The stand-in is not secured
+    env.pop('PKCS12_FILENAME', None)
+    return env
+
+
+@contextmanager
+def processes(commands: list[tuple[list[str], str]], env: dict) -> Iterator[list[subprocess.Popen]]:
+    """
+    Start the processes one by one, every process is started when its url answers
+
+    :param commands: the command and url of every process
+    :param env: the environment of the processes
+    :return: the processes, they are stopped on exit
+    """
+    started = []
+    try:
+        for command, url in commands:
+            started.append(subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            _wait_until_up(url, started[-1])
+        yield started
+    finally:
+        for process in started:
+            process.terminate()
+            process.wait()
+
+
+@contextmanager
+def servers(args: argparse.Namespace) -> Iterator[str]:
+    """
+    Start the MKS stand-in and the gateway, pointed at the stand-in
+
+    :param args:
+    :return: the url of the gateway
+    """
+    mks_port, app_port = _free_port(), _free_port()
+    mks_command, app_command = server_commands(args, mks_port, app_port)
+
+    with processes([(mks_command, f'http://localhost:{mks_port}/?wsdl'),
+                    (app_command, f'http://localhost:{app_port}/brp/status/health/')], gateway_env(mks_port)):
+        yield f'http://localhost:{app_port}'
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Load test: latency, throughput and errors per concurrency level")
+    parser.add_argument('--url', help="Test the running gateway at this url, eg http://localhost:8165")
+    parser.add_argument('--server', choices=['wsgiref', 'uwsgi'], default='wsgiref',
+                        help="The WSGI server of the gateway, when it is started")
+    parser.add_argument('--processes', type=int, default=4, help="The number of uWSGI processes")
+    parser.add_argument('--generate', choices=SIZES, default='production', help="The size of the MKS responses")
+    parser.add_argument('--mks-latency', action='append', default=[],
+                        help="Latency of the MKS stand-in, eg lognormal:0.05,0.5 or npsLv07=fixed:0.2")
+    parser.add_argument('--mix', type=parse_mix, default='realistic',
+                        help=f"One of {', '.join(MIXES)} or KIND=WEIGHT,... with KIND one of {', '.join(KINDS)}")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds per concurrency level")
+    parser.add_argument('--warmup', type=float, default=5.0, help="Seconds per level that are not reported")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds per request")
+    parser.add_argument('--persons', type=int, default=1000, help="The number of different BSNs")
+    parser.add_argument('--roles', nargs='+', default=['fp_test_burger', 'brp_r'])
+    parser.add_argument('--user', default='loadtest')
+    parser.add_argument('--hc-base-path', default=os.getenv('HC_BASE_PATH', ''))
+    parser.add_argument('--soap-path', default=os.getenv('API_BASE_PATH', '') + os.getenv('ROUTE_PATH_310', '/310'))
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    mix = parse_mix(args.mix) if isinstance(args.mix, str) else args.mix
+    rng = random.Random(args.seed)
+    bsns = [str(rng.randrange(100000000, 1000000000)) for _ in range(args.persons)]
+
+    with nullcontext(args.url) if args.url else servers(args) as url:
+        target = Target(url, role_headers(args.roles, args.user), args.hc_base_path, args.soap_path)
+        results = [run_level(target, mix, bsns, concurrency, args.duration, args.warmup, args.seed, args.timeout)
+                   for concurrency in args.concurrency]
+    print(report(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'load', 'mix': mix, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,124 @@
+"""
+Memory benchmark of the result representations
+
+Builds large synthetic result sets as dicts and in the compact representation and reports the memory
+that the result set holds, measured with tracemalloc, and the time to serialise the result set.
+The serialised results are checked to be equal.
+
+Usage:
+    python -m gobstuf.benchmarks.memory [--sizes 1000 10000] [--output results.json]
+
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+from gobstuf.benchmarks.results import person, verblijfplaatshistorie
+from gobstuf.rest.brp.serializer import get_serializer
+from gobstuf.stuf.brp.compact import to_compact
+
+SHAPES = {
+    'ingeschrevenpersonen': person,
+    'verblijfplaatshistorie': verblijfplaatshistorie,
+}
+
+REPRESENTATIONS = {
+    'dict': lambda obj: obj,
+    'compact': to_compact,
+}
+
+
+def build(factory: Callable[[int], dict], size: int, representation: Callable) -> tuple[list, int]:
+    """
+    Build a result set of size objects
+
+    :param factory: creates the n-th object
+    :param size:
+    :param representation: converts the dict to the representation
+    :return: the result set and the number of bytes it holds
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        results = [representation(factory(n)) for n in range(size)]
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return results, allocated
+
+
+def serialise(results: list, serializer) -> tuple[bytes, float]:
+    """
+    Serialise the result set in a list response
+
+    :param results:
+    :param serializer:
+    :return: the serialised result set and the duration in ms
+    """
+    start = time.perf_counter()
+    data = serializer.dumps({'_embedded': {'results': results}})
+    return data, (time.perf_counter() - start) * 1000
+
+
+def measure(shape: str, size: int, serializer) -> list[dict]:
+    factory = SHAPES[shape]
+    # Generate the classes for the compact shapes before measuring
+    to_compact(factory(0))
+
+    measurements = []
+    serialised = set()
+    for name, representation in REPRESENTATIONS.items():
+        results, allocated = build(factory, size, representation)
+        data, duration = serialise(results, serializer)
+        serialised.add(data)
+        measurements.append({
+            'shape': shape,
+            'size': size,
+            'representation': name,
+            'bytes': allocated,
+            'bytes_per_object': allocated / size,
+            'serialise_ms': duration,
+        })
+
+    # All representations serialise to the same JSON
+    assert len(serialised) == 1, "Representations serialise differently"
+    return measurements
+
+
+def run(sizes: list[int], serializer) -> list[dict]:
+    return [measurement
+            for shape in SHAPES
+            for size in sizes
+            for measurement in measure(shape, size, serializer)]
+
+
+def report(results: list[dict]) -> str:
+    header = f"{'shape':<24} {'size':>7} {'repr':>8} {'MB':>8} {'B/obj':>8} {'ser ms':>9}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r['shape']:<24} {r['size']:>7} {r['representation']:>8} {r['bytes'] / 1e6:>8.2f} "
+                     f"{r['bytes_per_object']:>8.0f} {r['serialise_ms']:>9.2f}")
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Memory benchmark: dict against compact result representation")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Result set sizes")
+    parser.add_argument('--serializer', help="json or orjson, default the fastest available")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, get_serializer(args.serializer))
+    print(report(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'memory', 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
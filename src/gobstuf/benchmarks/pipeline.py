@@ -0,0 +1,306 @@
+"""
+Pipeline benchmark
+
+Times every stage of the handling of a request separately:
+- parse: parsing of the MKS response in a StufMessage
+- find_elm: StufMessage.find_elm of the objects in a parsed response
+- map: mapping of the response, StufMappedResponse.get_mapped_object, get_answer_object and get_all_answer_objects
+- filter: the Mapping.filter chain of a mapped object
+- serialise: RESTResponse serialisation of the mapped objects
+- to_string: rendering of a StufRequest
+- validate: ArgumentCheck validation of request arguments
+- code_resolver: CodeResolver lookups
+
+The response stages run over the XML files that are given on the command line and over generated responses
+(see gobstuf.benchmarks.responses) of the given sizes.
+
+Every case reports the number of calls per second, the percentiles of the duration of a call and the memory
+that a call allocates, measured with tracemalloc. A random sample of the durations is kept for comparisons with a
+baseline, see gobstuf.benchmarks.compare.
+
+Usage:
+    python -m gobstuf.benchmarks.pipeline [--sizes production worst] [--stages parse map ...] [--seed SEED]
+                                          [--min-duration 0.5] [--output pipeline.json] [xml files...]
+
+The service configuration (eg ROUTE_PATH_310) is read from the environment, as for the service itself.
+
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import time
+import tracemalloc
+from typing import Any, Callable, NamedTuple, Optional
+
+from gobstuf.benchmarks.responses import GENERATORS, SIZES
+from gobstuf.config import HC_BASE_PATH
+from gobstuf.reference_data.code_resolver import CodeResolver
+from gobstuf.rest.brp.argument_checks import ArgumentCheck
+from gobstuf.rest.brp.rest_response import RESTResponse
+from gobstuf.stuf.brp.base_response import StufMappedResponse
+from gobstuf.stuf.brp.request.ingeschrevenpersonen import (
+    IngeschrevenpersonenBsnStufRequest,
+    IngeschrevenpersonenFilterStufRequest,
+    IngeschrevenpersonenBsnHistorieStufRequest,
+)
+from gobstuf.stuf.brp.response.ingeschrevenpersonen import (
+    IngeschrevenpersonenStufResponse,
+    IngeschrevenpersonenStufHistorieResponse,
+)
+from gobstuf.stuf.message import StufMessage
+
+STAGES = ['parse', 'find_elm', 'map', 'filter', 'serialise', 'to_string', 'validate', 'code_resolver']
+
+RESPONSES = {
+    'npsLa01': IngeschrevenpersonenStufResponse,
+    'npsLa07': IngeschrevenpersonenStufHistorieResponse,
+}
+
+# Request arguments, as they are validated by the views
+ARGUMENTS = {
+    'bsn': (IngeschrevenpersonenBsnStufRequest, {'bsn': '999991619', 'inclusiefoverledenpersonen': 'true'}),
+    'search': (IngeschrevenpersonenFilterStufRequest, {
+        'geboorte__datum': '1970-01-01',
+        'naam__geslachtsnaam': 'Ja*',
+        'verblijfplaats__postcode': '1011PN',
+        'verblijfplaats__huisnummer': '1',
+        'verblijfplaats__gemeentevaninschrijving': '0363',
+    }),
+    'historie': (IngeschrevenpersonenBsnHistorieStufRequest, {
+        'bsn': '999991619',
+        'datumVan': '2000-01-01',
+        'datumTotEnMet': '2020-12-31',
+    }),
+}
+
+LOOKUPS = {
+    'get_land': (CodeResolver.get_land, '6030'),
+    'get_gemeente': (CodeResolver.get_gemeente, '0363'),
+    'get_gemeente_code': (CodeResolver.get_gemeente_code, 'Amsterdam'),
+    'get_adellijke_titel_code': (CodeResolver.get_adellijke_titel_code, 'Baron'),
+}
+
+# Every case is called at least this number of times
+MIN_CALLS = 5
+
+# The maximum number of durations in the sample of a measurement
+MAX_SAMPLES = 200
+
+PERCENTILES = [50, 90, 99]
+
+
+class Case(NamedTuple):
+    stage: str
+    name: str
+    # Called for every measurement, the result of prepare is passed
+    call: Callable[[Any], Any]
+    # Prepares a call, not timed
+    prepare: Callable[[], Any] = lambda: None
+
+
+def _percentile(durations: list[int], percentile: int) -> int:
+    """
+    :param durations: sorted durations
+    :param percentile: eg 99
+    :return: the duration below which percentile percent of the durations fall
+    """
+    return durations[min(len(durations) - 1, len(durations) * percentile // 100)]
+
+
+def measure(case: Case, min_duration: float = 0.2) -> dict:
+    """
+    Call the case repeatedly for at least min_duration seconds
+
+    The memory is measured in a separate call, tracemalloc slows the calls down
+
+    :param case:
+    :param min_duration:
+    :return: the measurement
+    """
+    # Warm up
+    case.call(case.prepare())
+
+    durations = []
+    end = time.perf_counter() + min_duration
+    while time.perf_counter() < end or len(durations) < MIN_CALLS:
+        arg = case.prepare()
+        start = time.perf_counter_ns()
+        case.call(arg)
+        durations.append(time.perf_counter_ns() - start)
+
+    arg = case.prepare()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = case.call(arg)
+        allocated, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    samples = random.Random(0).sample(durations, min(MAX_SAMPLES, len(durations)))
+    durations.sort()
+    return {
+        'stage': case.stage,
+        'case': case.name,
+        'calls': len(durations),
+        'ops_per_sec': len(durations) / (sum(durations) / 1e9),
+        **{f'p{percentile}_us': _percentile(durations, percentile) / 1000 for percentile in PERCENTILES},
+        'max_us': durations[-1] / 1000,
+        # Peak memory during a call and the memory the result of the call holds
+        'peak_bytes': peak,
+        'allocated_bytes': allocated,
+        'samples_us': [duration / 1000 for duration in samples],
+    }
+
+
+def _answer_code(text: str) -> Optional[str]:
+    match = re.search(r'npsLa0[17]', text)
+    return match.group(0) if match else None
+
+
+def generated_payloads(sizes: list[str], seed: int = 0) -> dict:
+    """npsLa01 and npsLa07 responses of every size"""
+    return {
+        f'{answer_code} {size}': generator(SIZES[size], seed, None)
+        for size in sizes
+        for answer_code, generator in GENERATORS.items()
+    }
+
+
+def file_payloads(paths: list[str]) -> dict:
+    """The responses in the files, by file name"""
+    payloads = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            payloads[os.path.basename(path)] = f.read()
+    return payloads
+
+
+def response_cases(name: str, text: str) -> list[Case]:
+    """
+    The parse, find_elm, map, filter and serialise cases of a response
+
+    :param name:
+    :param text: the response
+    :return:
+    """
+    response_class = RESPONSES.get(_answer_code(text))
+    if response_class is None:
+        return []
+
+    def response() -> StufMappedResponse:
+        return response_class(text)
+
+    # Responses are parsed with the namespaces of the response class
+    namespaces = response_class.namespaces
+    message = StufMessage(text, namespaces)
+    objects_path = f'{response_class.answer_section} {response_class.object_elm}'
+    cases = [
+        Case('parse', name, lambda _: StufMessage(text, namespaces)),
+        Case('find_elm', name, lambda _: message.find_elm(objects_path)),
+    ]
+
+    # Responses without objects are only parsed and searched
+    elements = response().get_all_object_elms()
+    if not elements:
+        return cases
+
+    def element():
+        r = response()
+        return r, r.get_all_object_elms()[0]
+
+    def mapped_object():
+        r = response()
+        wrapper = r.get_mapped_object(elements[0])
+        r._add_embedded_objects(wrapper)
+        return wrapper, r._get_filter_kwargs()
+
+    objects = response().get_all_answer_objects()
+    cases += [
+        Case('map', f'{name} get_mapped_object', lambda args: args[0].get_mapped_object(args[1]), element),
+        Case('map', f'{name} get_answer_object', lambda r: r.get_answer_object(), response),
+        Case('map', f'{name} get_all_answer_objects', lambda r: r.get_all_answer_objects(), response),
+        Case('filter', name, lambda args: args[0].get_filtered_object(**args[1]), mapped_object),
+        Case('serialise', name, lambda _: RESTResponse.ok({'_embedded': {'ingeschrevenpersonen': objects}})),
+    ]
+    return cases
+
+
+def request_cases() -> list[Case]:
+    """The to_string, validate and code_resolver cases"""
+    cases = []
+    for name, (request_class, arguments) in ARGUMENTS.items():
+        def request(request_class=request_class, arguments=arguments):
+            stuf_request = request_class('gebruiker', 'applicatie')
+            stuf_request.set_values({key: value for key, value in arguments.items()
+                                     if key in stuf_request.parameter_paths})
+            return stuf_request
+
+        def validate(_, checks=request_class.parameter_checks, arguments=arguments):
+            return {key: ArgumentCheck.validate(checks[key], value) for key, value in arguments.items()}
+
+        cases += [
+            Case('to_string', name, lambda r: r.to_string(), request),
+            Case('validate', name, validate),
+        ]
+
+    for name, (lookup, value) in LOOKUPS.items():
+        cases.append(Case('code_resolver', name, lambda _, lookup=lookup, value=value: lookup(value)))
+    return cases
+
+
+def run(payloads: dict, stages: list[str] = STAGES, min_duration: float = 0.2) -> list[dict]:
+    """
+    Measures all cases of the stages
+
+    The response stages use url_for, they should be run in a request context
+
+    :param payloads: name -> StUF response
+    :param stages:
+    :param min_duration:
+    :return:
+    """
+    cases = [case for name, text in payloads.items() for case in response_cases(name, text)] + request_cases()
+    return [measure(case, min_duration) for case in cases if case.stage in stages]
+
+
+def report(results: list[dict]) -> str:
+    header = f"{'stage':<13} {'case':<45} {'ops/s':>10} {'p50 us':>9} {'p99 us':>9} {'peak KB':>9}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r['stage']:<13} {r['case'][-45:]:<45} {r['ops_per_sec']:>10.0f} {r['p50_us']:>9.1f} "
+                     f"{r['p99_us']:>9.1f} {r['peak_bytes'] / 1024:>9.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Pipeline benchmark: parse, map, filter and serialise per stage")
+    parser.add_argument('files', nargs='*', help="StUF responses, eg tests/fixtures/response_310*.xml")
+    parser.add_argument('--sizes', nargs='*', choices=SIZES, default=['production', 'worst'],
+                        help="Sizes of the generated responses")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generated responses")
+    parser.add_argument('--min-duration', type=float, default=0.2, help="Minimal seconds per measurement")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    # The app is only needed to resolve the urls of the links
+    from gobstuf.api import get_flask_app
+    app = get_flask_app()
+
+    payloads = {**file_payloads(args.files), **generated_payloads(args.sizes, args.seed)}
+    with app.test_request_context(f"{HC_BASE_PATH}/brp/ingeschrevenpersonen"):
+        results = run(payloads, args.stages, args.min_duration)
+    print(report(results))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'pipeline', 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,270 @@
+"""
+Replay of captured MKS traffic
+
+Replays the MKS requests and responses that were captured by the gateway (see gobstuf.lib.capture), with the key
+they were encrypted with (CAPTURE_KEY or --key):
+
+- list: lists the captured requests, with their soap action, status, duration, size and BSN
+- pipeline: feeds the captured responses through the parse, map, filter and serialise stages of the gateway, and
+  reports per stage the duration over all responses (see gobstuf.benchmarks.pipeline)
+- serve: serves the captured responses like the MKS stand-in (see gobstuf.stand_in.mks), at the recorded latency
+  divided by --speed (0 for no latency). A request is answered with a capture of the same request, of the same BSN or,
+  when there is none, of the same soap action with the requested BSN filled in. Captures of the same request are
+  answered in turn
+- pseudonymise: writes a pseudonymised copy of captures that were recorded without pseudonymisation
+
+Usage:
+    python -m gobstuf.benchmarks.replay list CAPTURE ... [--key KEY]
+    python -m gobstuf.benchmarks.replay pipeline CAPTURE ... [--stages parse map] [--output replay.json]
+    python -m gobstuf.benchmarks.replay serve CAPTURE ... [--port 8166] [--speed 1]
+    python -m gobstuf.benchmarks.replay pseudonymise CAPTURE ... --to pseudonymised.capture
+
+A key can be generated with:
+    python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from typing import Optional
+
+from gobstuf.benchmarks.pipeline import response_cases, _percentile
+from gobstuf.lib.capture import CaptureStore, Pseudonymiser
+from gobstuf.lib.hedging import soap_action_name
+from gobstuf.stand_in.mks import StandInMKS, Answer, STUF_FAULT, request_parameters, create_server
+
+# The stages of the pipeline that are replayed
+STAGES = ['parse', 'find_elm', 'map', 'filter', 'serialise']
+
+
+def read_captures(paths: list[str], key: bytes) -> list[dict]:
+    """
+    :param paths: capture files
+    :param key: the key the captures are encrypted with
+    :raises ValueError: when a file is not encrypted with the key
+    :return: the captured requests of all files, in the order they were made
+    """
+    store = CaptureStore(key)
+    return sorted((record for path in paths for record in store.read(path)), key=lambda record: record['time'])
+
+
+def _parameters(record: dict) -> dict:
+    try:
+        return request_parameters(record['request'].encode('utf-8'))
+    except ET.ParseError:
+        return {}
+
+
+def _key(parameters: dict) -> str:
+    return repr(sorted(parameters.items()))
+
+
+def summary(records: list[dict]) -> str:
+    header = f"{'time':<19} {'action':<10} {'status':>6} {'ms':>9} {'request B':>10} {'response B':>11}  bsn"
+    lines = [header, '-' * len(header)]
+    for record in records:
+        lines.append(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['time']))} "
+                     f"{soap_action_name(record['soap_action'])[:10]:<10} {record['status']:>6} "
+                     f"{record['duration'] * 1000:>9.1f} {record['request_bytes']:>10} {record['response_bytes']:>11}  "
+                     f"{_parameters(record).get('inp.bsn', '')}")
+    return '\n'.join(lines)
+
+
+def replay_pipeline(records: list[dict], stages: list[str]) -> tuple[list[dict], int]:
+    """
+    Feeds every captured response once through the stages
+
+    :param records: the captures
+    :param stages: eg ['parse', 'map']
+    :return: per stage and case the calls and their durations, and the number of responses that cannot be mapped
+    """
+    durations = defaultdict(list)
+    skipped = 0
+    for number, record in enumerate(records):
+        name = str(number)
+        cases = [case for case in response_cases(name, record['response']) if case.stage in stages]
+        if not cases:
+            skipped += 1
+        for case in cases:
+            arg = case.prepare()
+            start = time.perf_counter_ns()
+            case.call(arg)
+            # The name of a case is the number of the response, followed by the function for the map stage
+            durations[(case.stage, case.name[len(name):].strip())].append(time.perf_counter_ns() - start)
+
+    results = []
+    for (stage, case), stage_durations in durations.items():
+        stage_durations.sort()
+        results.append({
+            'stage': stage,
+            'case': case,
+            'calls': len(stage_durations),
+            'total_ms': sum(stage_durations) / 1e6,
+            'p50_us': _percentile(stage_durations, 50) / 1000,
+            'p95_us': _percentile(stage_durations, 95) / 1000,
+            'max_us': stage_durations[-1] / 1000,
+        })
+    return results, skipped
+
+
+def report(results: list[dict], skipped: int) -> str:
+    header = f"{'stage':<10} {'case':<24} {'calls':>7} {'total ms':>10} {'p50 us':>10} {'p95 us':>10} {'max us':>10}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r['stage']:<10} {r['case'][:24]:<24} {r['calls']:>7} {r['total_ms']:>10.1f} "
+                     f"{r['p50_us']:>10.1f} {r['p95_us']:>10.1f} {r['max_us']:>10.1f}")
+    lines += ['', f"{skipped} responses without a mapped answer were skipped"]
+    return '\n'.join(lines)
+
+
+class ReplayMKS(StandInMKS):
+    """
+    MKS stand-in that answers with captured responses
+    """
+
+    def __init__(self, records: list[dict], speed: float = 1.0):
+        """
+        :param records: the captures
+        :param speed: the recorded latency is divided by the speed, 0 for no latency
+        """
+        super().__init__(answers=None)
+        self.speed = speed
+
+        # (soap action, key) -> (capture, requested BSN), key is the request parameters, the BSN or None for any
+        captures = defaultdict(list)
+        for record in records:
+            action = soap_action_name(record['soap_action'])
+            parameters = _parameters(record)
+            bsn = parameters.get('inp.bsn')
+            for key in [_key(parameters), None] + ([bsn] if bsn else []):
+                captures[(action, key)].append((record, bsn))
+        self._captures = {key: itertools.cycle(records) for key, records in captures.items()}
+
+    def _capture(self, action: str, parameters: dict) -> tuple[Optional[dict], Optional[str]]:
+        """
+        :return: the capture for the request and the BSN it was captured for, when it is a capture of another request
+        """
+        for key in [_key(parameters), parameters.get('inp.bsn')]:
+            if key and (action, key) in self._captures:
+                record, _ = next(self._captures[(action, key)])
+                return record, None
+        if (action, None) in self._captures:
+            return next(self._captures[(action, None)])
+        return None, None
+
+    def answer(self, soap_action: str, body: bytes) -> Answer:
+        """
+        :param soap_action: eg http://www.egem.nl/StUF/sector/bg/0310/npsLv01
+        :param body: the request
+        :return: the captured response, with the recorded status and latency
+        """
+        try:
+            parameters = request_parameters(body)
+        except ET.ParseError as e:
+            return Answer(500, STUF_FAULT.format(code='StUF011', omschrijving=f"Invalid request: {e}"))
+
+        record, recorded_bsn = self._capture(soap_action_name(soap_action), parameters)
+        if record is None:
+            return Answer(500, STUF_FAULT.format(code='StUF003', omschrijving="Geen opname"))
+
+        text = record['response']
+        if recorded_bsn and (bsn := parameters.get('inp.bsn')):
+            # A capture of another request, for the requested BSN
+            text = text.replace(f'>{recorded_bsn}<', f'>{bsn}<', 1)
+        return Answer(record['status'], text, record['duration'] / self.speed if self.speed else 0.0)
+
+
+def pseudonymise(records: list[dict], key: bytes, path: str) -> int:
+    """
+    Writes the records, pseudonymised, to a new capture file
+
+    :param records:
+    :param key: the key of the captures, the pseudonyms are derived from it
+    :param path: the new capture file
+    :return: the number of records that were pseudonymised
+    """
+    store, pseudonymiser = CaptureStore(key), Pseudonymiser(key)
+    pseudonymised = 0
+    for record in records:
+        if not record.get('pseudonymised'):
+            record = pseudonymiser.record(record)
+            pseudonymised += 1
+        store.append(path, record)
+    return pseudonymised
+
+
+def _captures(parser: argparse.ArgumentParser, args: argparse.Namespace) -> list[dict]:
+    if not args.key:
+        parser.error("The key of the captures is required, set CAPTURE_KEY or use --key")
+    try:
+        return read_captures(args.captures, args.key.encode())
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Replay captured MKS traffic")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    commands = {
+        'list': subparsers.add_parser('list', help="List the captured requests"),
+        'pipeline': subparsers.add_parser('pipeline', help="Feed the captured responses through the pipeline"),
+        'serve': subparsers.add_parser('serve', help="Serve the captured responses like MKS"),
+        'pseudonymise': subparsers.add_parser('pseudonymise', help="Write a pseudonymised copy of the captures"),
+    }
+    for subparser in commands.values():
+        subparser.add_argument('captures', nargs='+', help="Capture files")
+        subparser.add_argument('--key', default=os.getenv('CAPTURE_KEY'), help="The key, default CAPTURE_KEY")
+
+    commands['pipeline'].add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    commands['pipeline'].add_argument('--output', help="Write the results as JSON to this file")
+    commands['serve'].add_argument('--host', default='localhost')
+    commands['serve'].add_argument('--port', type=int, default=8166)
+    commands['serve'].add_argument('--speed', type=float, default=1.0,
+                                   help="Divide the recorded latencies by this number, 0 for no latency")
+    commands['pseudonymise'].add_argument('--to', required=True, help="The pseudonymised capture file")
+    args = parser.parse_args(argv)
+
+    records = _captures(parser, args)
+
+    if args.command == 'list':
+        print(summary(records))
+    elif args.command == 'pipeline':
+        _pipeline(args, records)
+    elif args.command == 'serve':
+        _serve(args, records)
+    else:
+        count = pseudonymise(records, args.key.encode(), args.to)
+        print(f"Wrote {len(records)} captures to {args.to}, {count} pseudonymised")
+
+
+def _pipeline(args: argparse.Namespace, records: list[dict]):
+    from gobstuf.api import get_flask_app
+    from gobstuf.config import HC_BASE_PATH
+
+    # Links are built for a request of the REST API
+    with get_flask_app().test_request_context(f"{HC_BASE_PATH}/brp/ingeschrevenpersonen"):
+        results, skipped = replay_pipeline(records, args.stages)
+    print(report(results, skipped))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'replay', 'captures': len(records), 'results': results}, f, indent=2)
+
+
+def _serve(args: argparse.Namespace, records: list[dict]):
+    server = create_server(ReplayMKS(records, args.speed), args.host, args.port)
+    print(f"Replaying {len(records)} captures on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
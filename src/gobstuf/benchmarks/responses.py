@@ -0,0 +1,383 @@
+"""
+Synthetic StUF responses
+
+Generates npsLa01 and npsLa07 responses of any size, with the element layout of the MKS responses that the mappings
+in gobstuf.stuf.brp.response_mapping expect. The size is the number of objects, partners, ouders, kinderen,
+nationaliteiten and historieMaterieel elements and the rate of optional elements with a value, of noValue elements
+and of inOnderzoek markers. The same size and seed always result in the same response.
+
+Usage:
+    python -m gobstuf.benchmarks.responses [--answer npsLa01] [--size production] [--objects N] [--partners N] ...
+                                           [--seed SEED] [--bsn BSN] [--output response.xml]
+
+"""
+import argparse
+import datetime
+import random
+from typing import Callable, NamedTuple, Optional, Union
+from xml.sax.saxutils import escape
+
+NAMESPACES = ('xmlns:BG="http://www.egem.nl/StUF/sector/bg/0310" xmlns:StUF="http://www.egem.nl/StUF/StUF0301" '
+              'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"')
+
+ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<soapenv:Header/><soapenv:Body>{body}</soapenv:Body></soapenv:Envelope>')
+
+NO_VALUES = ['geenWaarde', 'waardeOnbekend', 'nietGeautoriseerd', 'nietOndersteund']
+
+GESLACHTSNAMEN = ['Jansen', 'de Vries', 'Bakker', 'Kumari', 'Yilmaz', 'Visser', 'El Amrani', 'Smit', 'Meijer']
+VOORNAMEN = ['Johanna Maria', 'Ayda', 'Benjamin', 'Mohammed', 'Sophie', 'Daan', 'Fatima Zahra', 'Pieter Jan']
+VOORVOEGSELS = ['van', 'de', 'van der', 'ter']
+ADELLIJKE_TITELS = ['Baron', 'Barones', 'Graaf', 'Gravin']
+STRATEN = ['Amstel', 'Huigenbos', 'Daalwijk', 'Ampèrestraat', 'Egeldonk', 'Keizersgracht', 'Javastraat']
+# Codes that are known in the reference data
+GEMEENTEN = ['0363', '0518', '0599']
+LANDEN = ['6030', '5024', '5010', '6014', '6043', '7035', '9089']
+NATIONALITEITEN = [('0001', 'Nederlandse'), ('0052', 'Belgische'), ('0315', 'Iraanse'), ('0057', 'Duitse')]
+VERBLIJFSTITELS = [('21', 'Vw 2000 art. 8, onder a, reg. onbepaalde tijd'), ('37', 'Vw 2000 art. 8, onder e')]
+
+
+class Size(NamedTuple):
+    objects: int = 1
+    partners: int = 1
+    ouders: int = 2
+    kinderen: int = 2
+    nationaliteiten: int = 1
+    historie: int = 3
+    # Rate of the optional elements that have a value
+    optional: float = 0.5
+    # Rate of the optional elements without value that are sent as noValue element, the others are left out
+    no_value: float = 0.8
+    # Rate of the inOnderzoek markers with value J
+    in_onderzoek: float = 0.05
+
+
+SIZES = {
+    'minimal': Size(partners=0, ouders=0, kinderen=0, nationaliteiten=0, historie=0,
+                    optional=0.0, no_value=0.0, in_onderzoek=0.0),
+    'production': Size(),
+    # A search that returns the maximum number of persons of a StUF request
+    'search': Size(objects=15),
+    'worst': Size(objects=15, partners=4, ouders=2, kinderen=12, nationaliteiten=4, historie=60,
+                  optional=1.0, no_value=1.0, in_onderzoek=1.0),
+}
+
+
+def _element(name: str, value: Union[str, list[str]] = None, no_value: str = None, **attrs) -> str:
+    """
+    :param name: eg BG:geslachtsnaam
+    :param value: the text, or the XML of the child elements
+    :param no_value: the StUF:noValue of an element without value
+    :param attrs: other attributes
+    :return: the XML of the element
+    """
+    attributes = ''.join(f' {key}="{escape(str(attr))}"' for key, attr in attrs.items())
+    if value is None:
+        no_value_attr = f' StUF:noValue="{no_value}" xsi:nil="true"' if no_value else ''
+        return f'<{name}{attributes}{no_value_attr}/>'
+    content = ''.join(value) if isinstance(value, list) else escape(value)
+    return f'<{name}{attributes}>{content}</{name}>'
+
+
+class _Generator:
+
+    def __init__(self, size: Size, seed: int):
+        self.size = size
+        self.rng = random.Random(seed)
+
+    def optional(self, name: str, value: Union[str, list[str]]) -> str:
+        """
+        An optional element: with value, as noValue element or left out, according to the size
+
+        :param name:
+        :param value:
+        :return:
+        """
+        if self.rng.random() < self.size.optional:
+            return _element(name, value)
+        if self.rng.random() < self.size.no_value:
+            return _element(name, no_value=self.rng.choice(NO_VALUES))
+        return ''
+
+    def in_onderzoek(self, **attrs) -> str:
+        if self.rng.random() < self.size.in_onderzoek:
+            return _element('BG:inOnderzoek', 'J', **{'StUF:metagegeven': 'true'}, **attrs)
+        return _element('BG:inOnderzoek', no_value='waardeOnbekend', **{'StUF:metagegeven': 'true'}, **attrs)
+
+    def bsn(self) -> str:
+        return str(self.rng.randrange(100000000, 999999999))
+
+    def datum(self, first_year: int = 1930, last_year: int = 2020) -> str:
+        jaar, maand, dag = self.rng.randint(first_year, last_year), self.rng.randint(1, 12), self.rng.randint(1, 28)
+        return f"{jaar:04d}{maand:02d}{dag:02d}"
+
+    def persoon(self, bsn: str = None) -> list[str]:
+        """
+        The person elements of an NPS object, also used for related persons
+
+        :param bsn:
+        :return:
+        """
+        voornamen = self.rng.choice(VOORNAMEN)
+        return [
+            _element('BG:inp.bsn', bsn or self.bsn()),
+            self.optional('BG:inp.a-nummer', str(self.rng.randrange(1000000000, 9999999999))),
+            _element('BG:geslachtsnaam', self.rng.choice(GESLACHTSNAMEN)),
+            self.optional('BG:voorvoegselGeslachtsnaam', self.rng.choice(VOORVOEGSELS)),
+            _element('BG:voorletters', ''.join(f'{naam[0]}.' for naam in voornamen.split())),
+            _element('BG:voornamen', voornamen),
+            self.optional('BG:aanduidingNaamgebruik', self.rng.choice('ENPV')),
+            self.optional('BG:adellijkeTitelPredikaat', self.rng.choice(ADELLIJKE_TITELS)),
+            self.optional('BG:geslachtsaanduiding', self.rng.choice('MVO')),
+            _element('BG:geboortedatum', self.datum()),
+            self.optional('BG:inp.geboorteplaats', self.rng.choice(GEMEENTEN)),
+            self.optional('BG:inp.geboorteLand', self.rng.choice(LANDEN)),
+            # Deceased persons are filtered out of the responses, they would not be mapped
+            _element('BG:overlijdensdatum', no_value='geenWaarde'),
+            _element('BG:inp.overlijdenplaats', no_value='geenWaarde'),
+            _element('BG:inp.overlijdenLand', no_value='geenWaarde'),
+        ]
+
+    def identificatie(self, object_type: str) -> str:
+        """
+        :param object_type: 01 (verblijfsobject) or 20 (nummeraanduiding)
+        :return: a BAG identification in Amsterdam
+        """
+        return f'0363{object_type}0000{self.rng.randrange(1000000):06d}'
+
+    def adres(self, postcode: str = 'BG:aoa.postcode') -> list[str]:
+        """
+        :param postcode: the name of the postcode element, BG:postcode in a correspondentieAdres
+        :return:
+        """
+        straat = self.rng.choice(STRATEN)
+        return [
+            self.optional('BG:aoa.identificatie', self.identificatie('20')),
+            _element('BG:wpl.woonplaatsNaam', 'Amsterdam'),
+            _element('BG:gor.openbareRuimteNaam', straat),
+            _element('BG:gor.straatnaam', straat),
+            _element(postcode, f'{self.rng.randint(1011, 1109)}{self.rng.choice("ABCKNP")}A'),
+            _element('BG:aoa.huisnummer', str(self.rng.randint(1, 999))),
+            self.optional('BG:aoa.huisletter', self.rng.choice('ABC')),
+            self.optional('BG:aoa.huisnummertoevoeging', self.rng.choice(['1', '2', 'H'])),
+            self.optional('BG:inp.locatiebeschrijving', 'Woonboot bij de brug'),
+        ]
+
+    def verblijfplaats(self, begin: str) -> list[str]:
+        """
+        The verblijfplaats elements of an NPS object or historieMaterieel element
+
+        :param begin: the date the person started living at the address
+        :return:
+        """
+        return [
+            _element('BG:inp.verblijftIn', [
+                _element('BG:gerelateerde', [self.optional('BG:identificatie', self.identificatie('01'))],
+                         **{'StUF:entiteittype': 'TGO'}),
+                self.in_onderzoek(),
+                _element('StUF:tijdvakRelatie', [
+                    _element('StUF:beginRelatie', begin),
+                    _element('StUF:eindRelatie', no_value='geenWaarde'),
+                ]),
+            ], **{'StUF:entiteittype': 'NPSTGO'}),
+            _element('BG:verblijfsadres', [*self.adres(), _element('BG:begindatumVerblijf', begin)]),
+        ]
+
+    def verblijfstitel(self) -> tuple[list[str], Optional[str]]:
+        """
+        :return: the verblijfstitel elements and the omschrijving of the verblijfstitel
+        """
+        code, omschrijving = self.rng.choice(VERBLIJFSTITELS)
+        if self.rng.random() < self.size.optional:
+            return [
+                _element('BG:vbt.aanduidingVerblijfstitel', code),
+                _element('BG:ing.datumVerkrijgingVerblijfstitel', self.datum(1990)),
+                self.optional('BG:ing.datumVerliesVerblijfstitel', self.datum(2030, 2040)),
+            ], omschrijving
+        return [_element('BG:vbt.aanduidingVerblijfstitel', no_value='geenWaarde')], None
+
+    def nationaliteit(self) -> str:
+        code, omschrijving = self.rng.choice(NATIONALITEITEN)
+        return _element('BG:inp.heeftAlsNationaliteit', [
+            _element('BG:gerelateerde', [_element('BG:code', code), self.optional('BG:omschrijving', omschrijving)],
+                     **{'StUF:entiteittype': 'NAT'}),
+            self.optional('BG:inp.datumVerkrijging', self.datum()),
+            _element('BG:inp.datumVerlies', no_value='geenWaarde'),
+            self.in_onderzoek(),
+        ], **{'StUF:entiteittype': 'NPSNAT'})
+
+    def partner(self) -> str:
+        return _element('BG:inp.heeftAlsEchtgenootPartner', [
+            _element('BG:gerelateerde', self.persoon(), **{'StUF:entiteittype': 'NPS'}),
+            _element('BG:soortVerbintenis', self.rng.choice('HP')),
+            _element('BG:datumSluiting', self.datum(1970)),
+            self.optional('BG:plaatsSluiting', self.rng.choice(GEMEENTEN)),
+            self.optional('BG:landSluiting', self.rng.choice(LANDEN)),
+            _element('BG:datumOntbinding', no_value='geenWaarde'),
+        ], **{'StUF:entiteittype': 'NPSNPSHUW'})
+
+    def familie(self, name: str, entity_type: str, ouder_aanduiding: str = None) -> str:
+        return _element(name, [
+            _element('BG:gerelateerde', self.persoon(), **{'StUF:entiteittype': 'NPS'}),
+            _element('BG:ouderAanduiding', ouder_aanduiding) if ouder_aanduiding else '',
+            self.optional('BG:datumIngangFamilierechtelijkeBetrekking', self.datum(1930, 2000)),
+            _element('BG:datumEindeFamilierechtelijkeBetrekking', no_value='geenWaarde'),
+            self.in_onderzoek(),
+        ], **{'StUF:entiteittype': entity_type})
+
+    def object(self, bsn: str = None) -> str:
+        """
+        An NPS object of an npsLa01 response
+
+        :param bsn:
+        :return:
+        """
+        begin = self.datum(1990)
+        verblijfstitel, omschrijving_verblijfstitel = self.verblijfstitel()
+        return _element('BG:object', [
+            *self.persoon(bsn),
+            *self.verblijfplaats(begin),
+            self.optional('BG:sub.correspondentieAdres', self.adres('BG:postcode')),
+            _element('BG:inp.gemeenteVanInschrijving', '363'),
+            _element('BG:inp.datumInschrijving', begin),
+            *verblijfstitel,
+            self.optional('BG:inp.datumVestigingInNederland', begin),
+            self.optional('BG:inp.immigratieLand', self.rng.choice(LANDEN)),
+            self.optional('BG:inp.aanduidingBijzonderNederlanderschap', self.rng.choice('BV')),
+            _element('BG:inp.indicatieGeheim', '0'),
+            self.in_onderzoek(groepsnaam='Persoonsgegevens'),
+            self.in_onderzoek(groepsnaam='Overlijden'),
+            self.in_onderzoek(elementnaam='aanduidingVerblijfstitel'),
+            self.in_onderzoek(groepsnaam='Verblijfsplaats'),
+            _element('StUF:tijdvakGeldigheid', [
+                _element('StUF:beginGeldigheid', begin),
+                _element('StUF:eindGeldigheid', no_value='geenWaarde'),
+            ]),
+            _element('StUF:extraElementen', [
+                _element('StUF:extraElement', omschrijving_verblijfstitel, naam='omschrijvingVerblijfstitel'),
+                _element('StUF:extraElement', 'N', naam='aanduidingGegevensInOnderzoek'),
+            ]),
+            *[self.partner() for _ in range(self.size.partners)],
+            *[self.familie('BG:inp.heeftAlsKinderen', 'NPSNPSKND') for _ in range(self.size.kinderen)],
+            *[self.familie('BG:inp.heeftAlsOuders', 'NPSNPSOUD', str(n % 2 + 1)) for n in range(self.size.ouders)],
+            *[self.nationaliteit() for _ in range(self.size.nationaliteiten)],
+        ], **{'StUF:entiteittype': 'NPS'})
+
+    def historie_object(self, bsn: str = None) -> str:
+        """
+        An NPS object of an npsLa07 response, with the previous verblijfplaatsen in historieMaterieel elements
+
+        :param bsn:
+        :return:
+        """
+        # Dates of the verblijfplaatsen, from the current one back in time
+        day = datetime.date(2020, 1, 1) - datetime.timedelta(days=self.rng.randrange(3650))
+        dates = []
+        for _ in range(self.size.historie + 1):
+            dates.append(day.strftime('%Y%m%d'))
+            day -= datetime.timedelta(days=self.rng.randint(30, 600))
+        historie = [
+            _element('BG:historieMaterieel', [
+                _element('BG:geslachtsnaam', self.rng.choice(GESLACHTSNAMEN)),
+                *self.verblijfplaats(begin),
+                _element('StUF:tijdvakGeldigheid', [
+                    _element('StUF:beginGeldigheid', begin),
+                    _element('StUF:eindGeldigheid', end),
+                ]),
+            ])
+            for end, begin in zip(dates, dates[1:])
+        ]
+        return _element('BG:object', [
+            _element('BG:inp.bsn', bsn or self.bsn()),
+            _element('BG:overlijdensdatum', no_value='geenWaarde'),
+            *self.verblijfplaats(dates[0]),
+            _element('BG:inp.gemeenteVanInschrijving', '363'),
+            _element('BG:inp.datumInschrijving', dates[-1]),
+            self.optional('BG:inp.datumVestigingInNederland', dates[-1]),
+            self.optional('BG:inp.immigratieLand', self.rng.choice(LANDEN)),
+            self.in_onderzoek(groepsnaam='Verblijfsplaats'),
+            _element('StUF:tijdvakGeldigheid', [
+                _element('StUF:beginGeldigheid', dates[0]),
+                _element('StUF:eindGeldigheid', no_value='geenWaarde'),
+            ]),
+            *historie,
+        ], **{'StUF:entiteittype': 'NPS'})
+
+
+def _response(answer_code: str, objects: list[str]) -> str:
+    berichtcode = answer_code[3:].capitalize()
+    body = ''.join([
+        f'<BG:{answer_code} {NAMESPACES}>',
+        _element('BG:stuurgegevens', [
+            _element('StUF:berichtcode', berichtcode),
+            _element('StUF:zender', [_element('StUF:organisatie', 'Amsterdam'), _element('StUF:applicatie', 'CGM')]),
+            _element('StUF:ontvanger', [_element('StUF:applicatie', 'BRP'), _element('StUF:gebruiker', 'benchmark')]),
+            _element('StUF:referentienummer', 'S00000000001'),
+            _element('StUF:tijdstipBericht', '2024010112000000'),
+            _element('StUF:crossRefnummer', 'K00000000001'),
+            _element('StUF:entiteittype', 'NPS'),
+        ]),
+        _element('BG:parameters', [_element('StUF:indicatorVervolgvraag', 'false')]),
+        _element('BG:antwoord', objects),
+        f'</BG:{answer_code}>',
+    ])
+    return ENVELOPE.format(body=body)
+
+
+def npsLa01(size: Size = SIZES['production'], seed: int = 0, bsn: str = None) -> str:
+    """
+    An npsLa01 response, the answer to an ingeschrevenpersonen request
+
+    :param size:
+    :param seed:
+    :param bsn: the bsn of the first person, a random bsn if not given
+    :return:
+    """
+    generator = _Generator(size, seed)
+    return _response('npsLa01', [generator.object(bsn if n == 0 else None) for n in range(size.objects)])
+
+
+def npsLa07(size: Size = SIZES['production'], seed: int = 0, bsn: str = None) -> str:
+    """
+    An npsLa07 response, the answer to a verblijfplaatshistorie request. The response holds one person.
+
+    :param size: the number of historieMaterieel elements is used, the number of objects is ignored
+    :param seed:
+    :param bsn:
+    :return:
+    """
+    return _response('npsLa07', [_Generator(size, seed).historie_object(bsn)])
+
+
+GENERATORS: dict[str, Callable[[Size, int, Optional[str]], str]] = {
+    'npsLa01': npsLa01,
+    'npsLa07': npsLa07,
+}
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic StUF response")
+    parser.add_argument('--answer', choices=GENERATORS, default='npsLa01')
+    parser.add_argument('--size', choices=SIZES, default='production', help="Size to start from")
+    for field, default in Size._field_defaults.items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default),
+                            help=f"Overrides the {field} of the size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bsn')
+    parser.add_argument('--output', help="Write the response to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    size = SIZES[args.size]._replace(**{field: value for field in Size._fields
+                                        if (value := getattr(args, field)) is not None})
+    text = GENERATORS[args.answer](size, args.seed, args.bsn)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
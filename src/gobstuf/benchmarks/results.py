@@ -0,0 +1,102 @@
+"""
+Synthetic mapped results
+
+Mapped and filtered objects shaped like the responses of the ingeschrevenpersonen endpoints.
+The objects vary with n, so that large result sets do not share values.
+
+"""
+HOST = 'https://acc.api.data.amsterdam.nl'
+BAG_URL = 'https://api.data.amsterdam.nl/v1/bag'
+
+
+def _datum(jaar: int, maand: int, dag: int) -> dict:
+    return {'datum': f'{jaar:04d}-{maand:02d}-{dag:02d}', 'jaar': jaar, 'maand': maand, 'dag': dag}
+
+
+def _naam(n: int) -> dict:
+    return {
+        'geslachtsnaam': f'Achternaam{n}',
+        'voorletters': 'J.M.',
+        'voornamen': f'Johanna Maria{n % 7}',
+        'aanhef': f'Geachte mevrouw Achternaam{n}',
+        'aanschrijfwijze': f'J.M. Achternaam{n}',
+    }
+
+
+def _plaats(n: int) -> dict:
+    return {'code': f'{363 + n % 5:04d}', 'omschrijving': 'Amsterdam'}
+
+
+def _verblijfplaats(n: int) -> dict:
+    return {
+        'straat': 'Amstel',
+        'huisnummer': n % 500 + 1,
+        'postcode': '1011PN',
+        'woonplaats': 'Amsterdam',
+        'adresseerbaarObjectIdentificatie': f'036301000{n:07d}',
+        'nummeraanduidingIdentificatie': f'036320000{n:07d}',
+        'functieAdres': 'woonadres',
+        'datumAanvangAdreshouding': _datum(2010, 5, n % 28 + 1),
+        'gemeenteVanInschrijving': {'code': '0363', 'omschrijving': 'Amsterdam'},
+        '_links': {
+            'adres': {'href': f'{BAG_URL}/nummeraanduidingen/036320000{n:07d}'},
+            'adresseerbaarObject': {'href': f'{BAG_URL}/verblijfsobjecten/036301000{n:07d}'},
+        },
+    }
+
+
+def relation(n: int, bsn: str, embedded_type: str, index: int) -> dict:
+    """A partner, ouder or kind of the person with the given bsn"""
+    relation_bsn = f'{200000000 + n}'
+    return {
+        'burgerservicenummer': relation_bsn,
+        'geheimhoudingPersoonsgegevens': False,
+        'naam': _naam(n),
+        'geboorte': {'datum': _datum(1950 + n % 50, 1 + n % 12, 1 + n % 28), 'plaats': _plaats(n)},
+        '_links': {
+            'self': {'href': f'{HOST}/brp/ingeschrevenpersonen/{bsn}/{embedded_type}/{index}'},
+            'ingeschrevenPersoon': {'href': f'{HOST}/brp/ingeschrevenpersonen/{relation_bsn}'},
+        },
+    }
+
+
+def person(n: int) -> dict:
+    """A mapped person, shaped like the ingeschrevenpersonen response"""
+    bsn = f'{100000000 + n}'
+    self_url = f'{HOST}/brp/ingeschrevenpersonen/{bsn}'
+    return {
+        'burgerservicenummer': bsn,
+        'geheimhoudingPersoonsgegevens': False,
+        'geslachtsaanduiding': 'vrouw',
+        'leeftijd': 20 + n % 60,
+        'naam': _naam(n),
+        'nationaliteiten': [{'nationaliteit': {'code': '0001', 'omschrijving': 'Nederlandse'}}],
+        'geboorte': {
+            'datum': _datum(1980, 1 + n % 12, 1 + n % 28),
+            'land': {'code': '6030', 'omschrijving': 'Nederland'},
+            'plaats': _plaats(n),
+        },
+        'verblijfplaats': _verblijfplaats(n),
+        '_embedded': {
+            'partners': [relation(n + 1, bsn, 'partners', 1)],
+            'ouders': [relation(n + 2, bsn, 'ouders', 1), relation(n + 3, bsn, 'ouders', 2)],
+        },
+        '_links': {
+            'self': {'href': self_url},
+            'partners': [{'href': f'{self_url}/partners/1'}],
+            'ouders': [{'href': f'{self_url}/ouders/1'}, {'href': f'{self_url}/ouders/2'}],
+            'verblijfplaatshistorie': {'href': f'{self_url}/verblijfplaatshistorie'},
+        },
+    }
+
+
+def verblijfplaatshistorie(n: int, size: int = 5) -> dict:
+    """A mapped verblijfplaatshistorie object with size historic verblijfplaatsen"""
+    return {
+        'verblijfplaats': _verblijfplaats(n),
+        'historieMaterieel': [{**_verblijfplaats(n + i), 'datumTot': _datum(2009 - i, 5, 1)} for i in range(size)],
+    }
+
+
+def persons(size: int) -> list[dict]:
+    return [person(n) for n in range(size)]
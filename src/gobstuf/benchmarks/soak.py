@@ -0,0 +1,436 @@
+"""
+Soak test
+
+Runs a mixed workload for hours against gateway workers that are pointed at the MKS stand-in, and checks that the
+memory of every worker reaches a steady state.
+
+Every worker is a separate process that serves the gateway in a single threaded WSGI server, so that the peak
+allocation of a request can be attributed to the request. The workers trace their allocations with tracemalloc and
+answer STATS_PATH with their resident set size (RSS), traced memory, the peak allocation per route and the allocation
+sites that grew most since the baseline snapshot. The baseline snapshot is taken after the warm-up.
+
+The workload is drawn from a traffic mix, as in the load test (see gobstuf.benchmarks.load). The workers are sampled
+every interval. The memory of a worker is steady when its RSS and traced memory grow less than --max-growth MB per
+hour over the last half of the samples, determined by a least squares fit. The soak test exits with status 1 when the
+memory of any worker is not steady.
+
+Tracing with many frames per allocation slows down the workers considerably, the throughput of a soak test is not
+representative for production.
+
+Usage:
+    python -m gobstuf.benchmarks.soak [--workers 2] [--concurrency 2] [--duration 4h] [--interval 5m] [--warmup 10m]
+                                      [--generate production] [--mks-latency [ACTION=]SPEC ...]
+                                      [--mix realistic | --mix KIND=WEIGHT,...] [--persons 1000]
+                                      [--max-growth 10] [--top 10] [--frames 10] [--seed SEED] [--output soak.json]
+
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server
+
+import requests
+from werkzeug.exceptions import HTTPException
+
+from gobstuf.benchmarks.load import Target, KINDS, MIXES, role_headers, parse_mix, run_level, mks_command, \
+    gateway_env, processes, _free_port, QuietWSGIRequestHandler
+from gobstuf.benchmarks.responses import SIZES
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+STATS_PATH = '/_soak/stats'
+
+# The part of the samples over which the growth of the memory is determined
+STEADY_WINDOW = 0.5
+
+# Allocations of the tracing itself
+TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+]
+
+MB = 1024 * 1024
+
+
+def parse_duration(value: str) -> float:
+    """
+    :param value: eg 30, 30s, 10m or 4h
+    :return: seconds
+    """
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smh]?)', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid duration {value}, use eg 30s, 10m or 4h")
+    number, unit = match.groups()
+    return float(number) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[unit]
+
+
+def rss() -> int:
+    """
+    :return: the resident set size of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Not on Linux, the maximum resident set size instead (bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _frames(traceback: tracemalloc.Traceback) -> list[str]:
+    """The frames of the traceback, most recent first"""
+    return [f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback)]
+
+
+class Profiler:
+    """
+    WSGI middleware that traces the allocations of a worker
+
+    Requests should be handled one at a time, the peak allocation of concurrent requests cannot be told apart.
+    """
+
+    def __init__(self, app, frames: int = 10):
+        """
+        :param app: the Flask app
+        :param frames: the number of frames that is stored per allocation
+        """
+        self.app = app
+        self.routes = defaultdict(lambda: {'requests': 0, 'peak_bytes': 0, 'total_peak_bytes': 0})
+        self.baseline = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def route(self, environ: dict) -> str:
+        """
+        :return: the endpoint of the request, eg brp_ingeschrevenpersonen_bsn
+        """
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'unmatched'
+        return endpoint
+
+    def __call__(self, environ: dict, start_response):
+        if environ.get('PATH_INFO') == STATS_PATH:
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            stats = self.stats(top=int(query.get('top', ['10'])[0]), baseline='baseline' in query)
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return [json.dumps(stats).encode('utf-8')]
+
+        route = self.route(environ)
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = self.app(environ, start_response)
+        try:
+            body = list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        peak = tracemalloc.get_traced_memory()[1] - start
+
+        stats = self.routes[route]
+        stats['requests'] += 1
+        stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+        stats['total_peak_bytes'] += peak
+        return body
+
+    def stats(self, top: int = 10, baseline: bool = False) -> dict:
+        """
+        :param top: the number of allocation sites that grew most
+        :param baseline: take a new baseline snapshot
+        :return: the memory of the worker, the peak allocation per route and the growth since the baseline
+        """
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+        if baseline or self.baseline is None:
+            self.baseline = snapshot
+
+        growth = [{
+            'size_diff': stat.size_diff,
+            'count_diff': stat.count_diff,
+            'size': stat.size,
+            'traceback': _frames(stat.traceback),
+        } for stat in snapshot.compare_to(self.baseline, 'traceback')[:top] if stat.size_diff > 0]
+
+        return {
+            'pid': os.getpid(),
+            'rss_bytes': rss(),
+            'traced_bytes': traced,
+            'routes': {route: {'requests': s['requests'],
+                               'peak_bytes': s['peak_bytes'],
+                               'mean_peak_bytes': s['total_peak_bytes'] / s['requests']}
+                       for route, s in self.routes.items()},
+            'growth': growth,
+        }
+
+
+def serve(port: int, frames: int):
+    """Serve the profiled gateway at the given port, one request at a time"""
+    from gobstuf.api import get_flask_app
+
+    server = make_server('localhost', port, Profiler(get_flask_app(), frames), handler_class=QuietWSGIRequestHandler)
+    server.serve_forever()
+
+
+def growth_rate(samples: list[tuple[float, int]]) -> float:
+    """
+    :param samples: (seconds, bytes)
+    :return: the growth in bytes per second, the slope of the least squares fit
+    """
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in samples)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in samples) / variance
+
+
+def steady_state(samples: list[dict], key: str, max_growth: float) -> dict:
+    """
+    :param samples: the samples of a worker, with elapsed seconds
+    :param key: eg rss_bytes
+    :param max_growth: MB per hour
+    :return: the first and last value, and the growth per hour over the last samples and whether it is steady
+    """
+    window = samples[int(len(samples) * (1 - STEADY_WINDOW)):]
+    growth = growth_rate([(s['elapsed'], s[key]) for s in window]) * 3600 / MB
+    return {
+        'start': samples[0][key],
+        'end': samples[-1][key],
+        'growth_mb_per_hour': growth,
+        'steady': growth <= max_growth,
+    }
+
+
+class Worker(NamedTuple):
+    url: str
+    target: Target
+
+
+def _stats(worker: Worker, top: int, baseline: bool = False) -> dict:
+    params = {'top': top, **({'baseline': 1} if baseline else {})}
+    response = requests.get(f'{worker.url}{STATS_PATH}', params=params, timeout=600)
+    response.raise_for_status()
+    return response.json()
+
+
+def _run_workload(workers: list[Worker], mix: dict, bsns: list[str], concurrency: int, duration: float,
+                  seed: int = None, timeout: float = 60.0) -> dict:
+    """
+    Send the workload to all workers at the same time
+
+    :return: the number of requests, errors and the throughput over all workers
+    """
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        levels = list(executor.map(
+            lambda n: run_level(workers[n].target, mix, bsns, concurrency, duration,
+                                seed=None if seed is None else seed + n, timeout=timeout),
+            range(len(workers))))
+    return {key: sum(level[key] for level in levels) for key in ['requests', 'errors', 'throughput']}
+
+
+def soak(workers: list[Worker], mix: dict, bsns: list[str], concurrency: int, duration: float, interval: float,
+         warmup: float, top: int = 10, seed: int = None, timeout: float = 60.0) -> dict:
+    """
+    Run the workload for warmup + duration seconds and sample the workers every interval
+
+    :param workers:
+    :param mix: kind -> weight
+    :param bsns: the persons to request
+    :param concurrency: the number of clients per worker
+    :param duration: seconds
+    :param interval: seconds between the samples
+    :param warmup: seconds before the baseline snapshot
+    :param top: the number of allocation sites that grew most
+    :param seed:
+    :param timeout: of a single request, in seconds
+    :return: the samples of every worker and the workload of every interval
+    """
+    if warmup:
+        _run_workload(workers, mix, bsns, concurrency, warmup, seed, timeout)
+
+    start = time.perf_counter()
+    stats = [_stats(worker, top, baseline=True) for worker in workers]
+    samples = [[{'elapsed': 0.0, 'rss_bytes': s['rss_bytes'], 'traced_bytes': s['traced_bytes']}] for s in stats]
+    intervals = []
+
+    n = 0
+    while (remaining := duration - (time.perf_counter() - start)) > 0:
+        n += 1
+        workload = _run_workload(workers, mix, bsns, concurrency, min(interval, remaining),
+                                 None if seed is None else seed + n * len(workers), timeout)
+        elapsed = time.perf_counter() - start
+        stats = [_stats(worker, top) for worker in workers]
+        for worker_samples, s in zip(samples, stats):
+            worker_samples.append({'elapsed': elapsed, 'rss_bytes': s['rss_bytes'], 'traced_bytes': s['traced_bytes']})
+        intervals.append({'elapsed': elapsed, **workload})
+
+    return {
+        'workers': [{'pid': s['pid'], 'samples': worker_samples, 'routes': s['routes'], 'growth': s['growth']}
+                    for s, worker_samples in zip(stats, samples)],
+        'intervals': intervals,
+    }
+
+
+def evaluate(result: dict, max_growth: float) -> list[dict]:
+    """
+    :param result: see soak
+    :param max_growth: MB per hour
+    :return: the steady state of the RSS and traced memory of every worker
+    """
+    return [{
+        'pid': worker['pid'],
+        'rss': steady_state(worker['samples'], 'rss_bytes', max_growth),
+        'traced': steady_state(worker['samples'], 'traced_bytes', max_growth),
+    } for worker in result['workers']]
+
+
+def is_steady(evaluation: list[dict]) -> bool:
+    return all(worker['rss']['steady'] and worker['traced']['steady'] for worker in evaluation)
+
+
+def _site(traceback: list[str]) -> str:
+    """The most recent frame, and the most recent frame in gobstuf when that is another frame"""
+    own = next((frame for frame in traceback if f'{os.sep}gobstuf{os.sep}' in frame), None)
+    return traceback[0] if own in (None, traceback[0]) else f"{traceback[0]} < {own}"
+
+
+def growing_sites(result: dict, top: int = 10) -> list[dict]:
+    """
+    :return: the allocation sites that grew most over all workers
+    """
+    sites = defaultdict(lambda: {'size_diff': 0, 'count_diff': 0})
+    for worker in result['workers']:
+        for growth in worker['growth']:
+            site = sites[_site(growth['traceback'])]
+            site['size_diff'] += growth['size_diff']
+            site['count_diff'] += growth['count_diff']
+    return [{'site': site, **s} for site, s in sorted(sites.items(), key=lambda item: -item[1]['size_diff'])[:top]]
+
+
+def route_peaks(result: dict) -> dict:
+    """
+    :return: route -> the number of requests, the mean and maximum peak allocation over all workers
+    """
+    routes = defaultdict(lambda: {'requests': 0, 'peak_bytes': 0, 'total_peak_bytes': 0.0})
+    for worker in result['workers']:
+        for route, s in worker['routes'].items():
+            routes[route]['requests'] += s['requests']
+            routes[route]['peak_bytes'] = max(routes[route]['peak_bytes'], s['peak_bytes'])
+            routes[route]['total_peak_bytes'] += s['mean_peak_bytes'] * s['requests']
+    return {route: {'requests': s['requests'], 'peak_bytes': s['peak_bytes'],
+                    'mean_peak_bytes': s['total_peak_bytes'] / s['requests']}
+            for route, s in sorted(routes.items())}
+
+
+def report(result: dict, evaluation: list[dict], top: int = 10) -> str:
+    requests_sent = sum(i['requests'] for i in result['intervals'])
+    errors = sum(i['errors'] for i in result['intervals'])
+    lines = [f"{requests_sent} requests, {errors} errors", '']
+
+    header = f"{'worker':>8} {'RSS MB':>8} {'-> MB':>8} {'MB/h':>8} {'traced MB':>10} {'-> MB':>8} {'MB/h':>8}  steady"
+    lines += [header, '-' * len(header)]
+    for worker in evaluation:
+        rss_state, traced = worker['rss'], worker['traced']
+        steady = 'yes' if rss_state['steady'] and traced['steady'] else 'NO'
+        lines.append(f"{worker['pid']:>8} {rss_state['start'] / MB:>8.1f} {rss_state['end'] / MB:>8.1f} "
+                     f"{rss_state['growth_mb_per_hour']:>8.2f} {traced['start'] / MB:>10.1f} "
+                     f"{traced['end'] / MB:>8.1f} {traced['growth_mb_per_hour']:>8.2f}  {steady}")
+
+    header = f"{'route':<50} {'requests':>9} {'mean peak KB':>13} {'max peak KB':>12}"
+    lines += ['', 'Peak allocation per request', header, '-' * len(header)]
+    for route, s in route_peaks(result).items():
+        lines.append(f"{route[-50:]:<50} {s['requests']:>9} {s['mean_peak_bytes'] / 1024:>13.1f} "
+                     f"{s['peak_bytes'] / 1024:>12.1f}")
+
+    header = f"{'KB':>10} {'blocks':>8}  site"
+    lines += ['', 'Top growing allocation sites since the warm-up', header, '-' * len(header)]
+    for site in growing_sites(result, top):
+        lines.append(f"{site['size_diff'] / 1024:>10.1f} {site['count_diff']:>8}  {site['site']}")
+    return '\n'.join(lines)
+
+
+def worker_commands(args: argparse.Namespace) -> Iterator[tuple[list[str], str]]:
+    """
+    :return: the command and url of every worker
+    """
+    for _ in range(args.workers):
+        port = _free_port()
+        yield ([sys.executable, '-m', 'gobstuf.benchmarks.soak', '--serve', str(port), '--frames', str(args.frames)],
+               f'http://localhost:{port}')
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Soak test: memory growth of the workers under a mixed workload")
+    parser.add_argument('--workers', type=int, default=2, help="The number of worker processes")
+    parser.add_argument('--concurrency', type=int, default=2, help="The number of clients per worker")
+    parser.add_argument('--duration', type=parse_duration, default='4h', help="eg 30m or 4h")
+    parser.add_argument('--interval', type=parse_duration, default='5m', help="Time between the samples")
+    parser.add_argument('--warmup', type=parse_duration, default='10m', help="Time before the baseline snapshot")
+    parser.add_argument('--generate', choices=SIZES, default='production', help="The size of the MKS responses")
+    parser.add_argument('--mks-latency', action='append', default=[],
+                        help="Latency of the MKS stand-in, eg lognormal:0.05,0.5 or npsLv07=fixed:0.2")
+    parser.add_argument('--mix', type=parse_mix, default='realistic',
+                        help=f"One of {', '.join(MIXES)} or KIND=WEIGHT,... with KIND one of {', '.join(KINDS)}")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds per request")
+    parser.add_argument('--persons', type=int, default=1000, help="The number of different BSNs")
+    parser.add_argument('--roles', nargs='+', default=['fp_test_burger', 'brp_r'])
+    parser.add_argument('--user', default='soaktest')
+    parser.add_argument('--max-growth', type=float, default=10.0,
+                        help="The growth in MB per hour of a worker in a steady state")
+    parser.add_argument('--top', type=int, default=10, help="The number of growing allocation sites to report")
+    parser.add_argument('--frames', type=int, default=10, help="The number of frames traced per allocation")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="Write the samples and results as JSON to this file")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.frames)
+        return 0
+
+    if args.duration < 4 * args.interval:
+        parser.error("The duration should be at least 4 intervals to determine a steady state")
+
+    mix = parse_mix(args.mix) if isinstance(args.mix, str) else args.mix
+    rng = random.Random(args.seed)
+    bsns = [str(rng.randrange(100000000, 1000000000)) for _ in range(args.persons)]
+    headers = role_headers(args.roles, args.user)
+    hc_base_path = os.getenv('HC_BASE_PATH', '')
+    soap_path = os.getenv('API_BASE_PATH', '') + os.getenv('ROUTE_PATH_310', '/310')
+
+    mks_port = _free_port()
+    commands = list(worker_commands(args))
+    with processes([(mks_command(args, mks_port), f'http://localhost:{mks_port}/?wsdl')] +
+                   [(command, f'{url}/brp/status/health/') for command, url in commands], gateway_env(mks_port)):
+        soak_workers = [Worker(url, Target(url, headers, hc_base_path, soap_path)) for _, url in commands]
+        result = soak(soak_workers, mix, bsns, args.concurrency, args.duration, args.interval, args.warmup,
+                      args.top, args.seed, args.timeout)
+
+    evaluation = evaluate(result, args.max_growth)
+    print(report(result, evaluation, args.top))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'soak', 'mix': mix, 'evaluation': evaluation, 'routes': route_peaks(result),
+                       'growth': growing_sites(result, args.top), **result}, f, indent=2)
+
+    return 0 if is_steady(evaluation) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -1,13 +1,19 @@
 import re
+from functools import partial
 from urllib.parse import urlsplit, SplitResult, urlunsplit
 
 import flask
 from flask import Blueprint, Response
-from werkzeug.exceptions import BadRequest, MethodNotAllowed, HTTPException
+from requests.exceptions import Timeout
+from werkzeug.exceptions import BadRequest, MethodNotAllowed, HTTPException, ServiceUnavailable, GatewayTimeout
 
 from gobstuf.auth.routes import secure_route
 from gobstuf.certrequest import cert_get, cert_post
 from gobstuf.config import API_BASE_PATH, ROUTE_PATH_310, ROUTE_PATH_204, ROUTE_SCHEME, ROUTE_NETLOC, GOB_STUF_PORT
+from gobstuf.lib.deadline import DeadlineExceeded, get_deadline, upstream_timeout
+from gobstuf.lib.hedging import mks_hedging
+from gobstuf.lib.timing import timed
+from gobstuf.lib.upstream_guard import mks_guard, UpstreamUnavailable
 from gobstuf.logger import get_default_logger
 
 logger = get_default_logger()
@@ -68,13 +74,33 @@ def _get_stuf(url):
     :param url: url of SOAP endpoint of underlying SOAP server
     :return: response object
     """
-    return cert_get(url)
+    try:
+        return cert_get(url, timeout=upstream_timeout(get_deadline()))
+    except (DeadlineExceeded, Timeout) as e:
+        raise GatewayTimeout(str(e))
+
+
+def _post_attempt(url, data, headers):
+    """
+    Post the data to the given url, through the upstream guard
+
+    Every attempt, including a hedge, gets the time that remains before the deadline of the request
+
+    :param url: url of SOAP endpoint of underlying SOAP server
+    :param data: XML message contents
+    :param headers: the SOAP headers
+    :return: response object
+    """
+    return mks_guard.call(cert_post, url, data=data, headers=headers, timeout=upstream_timeout(get_deadline()))
 
 
 def _post_stuf(url, data, headers):
     """
     Post the data to the given url
 
+    The request passes the upstream guard, a refused request results in 503 Service Unavailable.
+    A request that does not complete within the deadline results in 504 Gateway Timeout
+
     :param url: url of SOAP endpoint of underlying SOAP server
     :param data: XML message contents
     :param headers: incoming request headers
@@ -93,7 +119,12 @@ def _post_stuf(url, data, headers):
         "Soapaction": soap_action,
         "Content-Type": content_type
     }
-    return cert_post(url, data=data, headers=headers)
+    try:
+        return mks_hedging.call(soap_action, partial(_post_attempt, url, data, headers))
+    except UpstreamUnavailable as e:
+        raise ServiceUnavailable(str(e), retry_after=e.retry_after)
+    except (DeadlineExceeded, Timeout) as e:
+        raise GatewayTimeout(str(e))
 
 
 def _handle_stuf_request(request, routed_url):
@@ -125,7 +156,8 @@ def _stuf():
     response_log_data = {**request_log_data}
 
     try:
-        response = _handle_stuf_request(request, url)
+        with timed('mks'):
+            response = _handle_stuf_request(request, url)
     except HTTPException as e:
         # If Exception occurs, log exception and re-raise
         response_log_data['exception'] = str(e)
@@ -1,6 +1,18 @@
-from requests_pkcs12 import get, post
+import asyncio
+import ssl
+import time
+from functools import partial
+
+import certifi
+import httpx
+from requests import Response
+from requests.exceptions import Timeout
+from requests.structures import CaseInsensitiveDict
+from requests_pkcs12 import Pkcs12Adapter, get, post
 
 from gobstuf.config import PKCS12_FILENAME, PKCS12_PASSWORD
+from gobstuf.lib.capture import mks_capture
+from gobstuf.lib.metrics import record_mks_call
 from gobstuf.logger import get_default_logger
 
 
@@ -38,7 +50,8 @@ def cert_get(url, **kwargs):
 
 def cert_post(url, **kwargs):
     """
-    Post request with certificate
+    Post request with certificate, the request is registered in the metrics (see gobstuf.lib.metrics) and captured
+    when MKS capture is enabled (see gobstuf.lib.capture)
 
     :param url: url to post
     :param data: data to post
@@ -47,6 +60,81 @@ def cert_post(url, **kwargs):
     """
     logger.info(f"POST {url}")
     kwargs = _add_cert_info(kwargs)
-    response = post(url, **kwargs)
+    start, started = time.time(), time.perf_counter()
+    try:
+        response = post(url, **kwargs)
+    except Exception:
+        record_mks_call(kwargs.get('headers'), kwargs.get('data'), None, time.perf_counter() - started)
+        raise
+    duration = time.perf_counter() - started
     logger.info(f"RESPONSE {response.status_code}, {response.reason}")
+    record_mks_call(kwargs.get('headers'), kwargs.get('data'), response, duration)
+    mks_capture.record(url, kwargs.get('headers'), kwargs.get('data'), response, start, duration)
     return response
+
+
+def cert_ssl_context() -> ssl.SSLContext:
+    """
+    SSL context with the certificate, for clients that do not use requests
+
+    :return:
+    """
+    if PKCS12_FILENAME:
+        context = Pkcs12Adapter(pkcs12_filename=PKCS12_FILENAME, pkcs12_password=PKCS12_PASSWORD).ssl_context
+        context.load_verify_locations(certifi.where())
+        return context
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+def get_async_client(max_connections: int) -> httpx.AsyncClient:
+    """
+    Asynchronous HTTP client with certificate
+
+    :param max_connections: the maximum number of concurrent connections
+    :return:
+    """
+    return httpx.AsyncClient(verify=cert_ssl_context(), limits=httpx.Limits(max_connections=max_connections))
+
+
+async def async_cert_post(client: httpx.AsyncClient, url: str, data: str, headers: dict, timeout: tuple):
+    """
+    Asynchronous post request with certificate
+
+    The response is returned as a requests response, so it can be handled like the response of cert_post.
+    Like cert_post, the request is registered in the metrics and captured when MKS capture is enabled
+
+    :param client: see get_async_client
+    :param url: url to post
+    :param data: data to post
+    :param headers:
+    :param timeout: (connect timeout, read timeout)
+    :raises Timeout: when the request times out, like cert_post
+    :return: request response
+    """
+    logger.info(f"POST {url}")
+    connect_timeout, read_timeout = timeout
+    start, started = time.time(), time.perf_counter()
+    try:
+        response = await client.post(url, content=data, headers=headers,
+                                     timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+    except Exception as e:
+        record_mks_call(headers, data, None, time.perf_counter() - started)
+        if isinstance(e, httpx.TimeoutException):
+            raise Timeout(str(e)) from e
+        raise
+    duration = time.perf_counter() - started
+    logger.info(f"RESPONSE {response.status_code}, {response.reason_phrase}")
+
+    result = Response()
+    result.status_code = response.status_code
+    result.reason = response.reason_phrase
+    result.headers = CaseInsensitiveDict(response.headers)
+    result.encoding = response.encoding
+    result.url = str(response.url)
+    result._content = response.content
+    record_mks_call(headers, data, result, duration)
+    if mks_capture.enabled:
+        # Pseudonymising, encrypting and writing the capture would block the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(mks_capture.record, url, headers, data, result, start, duration))
+    return result
@@ -0,0 +1,224 @@
+"""
+Compression of responses
+
+The encoding is negotiated with the Accept-Encoding request header. Brotli is preferred when the client
+accepts it and the brotli module is installed, gzip otherwise.
+
+Regular responses are compressed when their size is at least COMPRESSION_MIN_SIZE.
+Streamed responses are compressed chunk by chunk, each chunk is flushed so that the client receives
+the data as soon as it is produced.
+
+A compressed response is a different representation than the uncompressed response. A strong ETag
+is therefore suffixed with the encoding, eg "abc" becomes "abc-gzip".
+
+"""
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Flask, Response, request
+
+from gobstuf.config import COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_LEVEL
+from gobstuf.lib.timing import timed
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+HTTP_304_NOT_MODIFIED = 304
+
+COMPRESSIBLE_MIMETYPES = [
+    'application/hal+json',
+    'application/problem+json',
+    'application/json',
+    'text/xml',
+]
+
+
+class GzipCompressor:
+    """Incremental gzip compressor"""
+
+    def __init__(self, level: int):
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    """Incremental brotli compressor"""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def available_encodings() -> list[str]:
+    """Encodings that can be produced, in order of preference"""
+    return [BROTLI, GZIP] if brotli else [GZIP]
+
+
+def get_compressor(encoding: str, level: int = None):
+    """
+    Get an incremental compressor for the given encoding
+
+    :param encoding: gzip or br
+    :param level: compression level, defaults to the configured level for the encoding
+    :return:
+    """
+    if encoding == BROTLI:
+        return BrotliCompressor(COMPRESSION_BROTLI_LEVEL if level is None else level)
+    return GzipCompressor(COMPRESSION_GZIP_LEVEL if level is None else level)
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """
+    Compress data in one go
+
+    :param data:
+    :param encoding: gzip or br
+    :param level:
+    :return: the compressed data
+    """
+    compressor = get_compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int = None) -> Iterator[bytes]:
+    """
+    Compress a stream of chunks. Every chunk is flushed, so the client can process it immediately
+
+    :param chunks:
+    :param encoding: gzip or br
+    :param level:
+    :return: the compressed chunks
+    """
+    compressor = get_compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if compressed := compressor.compress(chunk) + compressor.flush():
+            yield compressed
+    yield compressor.finish()
+
+
+def _negotiate_encoding() -> Optional[str]:
+    """
+    Returns the best encoding for the current request, or None if no compression is accepted
+
+    :return:
+    """
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def _is_compressible(response: Response) -> bool:
+    return (
+        response.mimetype in COMPRESSIBLE_MIMETYPES and
+        200 <= response.status_code < 300 and
+        response.status_code != 204 and
+        'Content-Encoding' not in response.headers and
+        not response.direct_passthrough
+    )
+
+
+def encode_etag(etag: str, encoding: str) -> str:
+    """
+    Returns the entity tag of the representation of etag in the given encoding
+
+    :param etag:
+    :param encoding:
+    :return:
+    """
+    return f"{etag}-{encoding}"
+
+
+def decode_etag(etag: str) -> str:
+    """
+    Returns the entity tag of the uncompressed representation
+
+    :param etag: entity tag of any representation
+    :return:
+    """
+    for encoding in (GZIP, BROTLI):
+        if etag.endswith(f"-{encoding}"):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def _compress_body(response: Response, encoding: str) -> bool:
+    """
+    Compresses the body of the response
+
+    :param response:
+    :param encoding:
+    :return: True if the body has been compressed
+    """
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        return True
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return False
+
+    with timed('compress'):
+        response.set_data(compress(data, encoding))
+    return True
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress the response if the client accepts a supported encoding
+
+    :param response:
+    :return:
+    """
+    if response.status_code == HTTP_304_NOT_MODIFIED:
+        # Send the Vary header of the response that is not modified
+        response.vary.add('Accept-Encoding')
+        return response
+
+    if not _is_compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = _negotiate_encoding()
+    if encoding is None or not _compress_body(response, encoding):
+        return response
+
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encode_etag(etag, encoding))
+    return response
+
+
+def init_compression(app: Flask):
+    """
+    Compress the responses of the given app
+
+    :param app:
+    :return:
+    """
+    app.after_request(compress_response)
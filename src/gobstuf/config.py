@@ -53,6 +53,140 @@ UNIQUE_ID_HEADER = 'X-Unique-ID'
 KEYCLOAK_AUTH_URL = _getenv('KEYCLOAK_AUTH_URL')
 KEYCLOAK_CLIENT_ID = _getenv('KEYCLOAK_CLIENT_ID')
 
+# Stream list responses (search results, verblijfplaatshistorie) while the objects are mapped
+STREAM_LIST_RESPONSES = _getenv("STREAM_LIST_RESPONSES", default_value="false", is_optional=True).lower() == "true"
+
+# Hold the objects of (non-streamed) list responses in the compact representation, trades CPU for memory
+COMPACT_LIST_RESULTS = _getenv("COMPACT_LIST_RESULTS", default_value="false", is_optional=True).lower() == "true"
+
+# Batch requests: maximum number of objects in a batch and maximum number of concurrent MKS requests per batch
+BATCH_MAX_SIZE = int(_getenv("BATCH_MAX_SIZE", default_value=500))
+BATCH_CONCURRENCY = int(_getenv("BATCH_CONCURRENCY", default_value=8))
+
+# Export jobs
+# The jobs and their results are stored in EXPORT_DIR and deleted EXPORT_RETENTION_HOURS after they have finished.
+# Every worker process executes at most EXPORT_WORKERS jobs at a time and queues at most EXPORT_MAX_QUEUED jobs.
+# A job is processed in chunks of EXPORT_CHUNK_SIZE items, with at most EXPORT_RATE MKS requests per second.
+EXPORT_DIR = _getenv("EXPORT_DIR", default_value="/tmp/gobstuf/exports")
+EXPORT_RETENTION_HOURS = int(_getenv("EXPORT_RETENTION_HOURS", default_value=24))
+EXPORT_WORKERS = int(_getenv("EXPORT_WORKERS", default_value=2))
+EXPORT_MAX_QUEUED = int(_getenv("EXPORT_MAX_QUEUED", default_value=10))
+EXPORT_MAX_SIZE = int(_getenv("EXPORT_MAX_SIZE", default_value=100000))
+EXPORT_CHUNK_SIZE = int(_getenv("EXPORT_CHUNK_SIZE", default_value=50))
+EXPORT_RATE = float(_getenv("EXPORT_RATE", default_value=10))
+
+# Load shedding, see gobstuf.lib.load_shedding
+# Requests that have waited more than LOAD_SHEDDING_MAX_QUEUE_DELAY seconds since the proxy received them (according to
+# the REQUEST_START_HEADER header) or that arrive when a process has LOAD_SHEDDING_MAX_IN_FLIGHT requests in flight are
+# refused with 503 Service Unavailable and Retry-After LOAD_SHEDDING_RETRY_AFTER. 0 means no maximum.
+LOAD_SHEDDING_ENABLED = _getenv("LOAD_SHEDDING_ENABLED", default_value="true", is_optional=True).lower() == "true"
+LOAD_SHEDDING_MAX_QUEUE_DELAY = float(_getenv("LOAD_SHEDDING_MAX_QUEUE_DELAY", default_value=10))
+LOAD_SHEDDING_MAX_IN_FLIGHT = int(_getenv("LOAD_SHEDDING_MAX_IN_FLIGHT", default_value=0, is_optional=True))
+LOAD_SHEDDING_RETRY_AFTER = int(_getenv("LOAD_SHEDDING_RETRY_AFTER", default_value=1))
+REQUEST_START_HEADER = _getenv("REQUEST_START_HEADER", default_value="X-Request-Start", is_optional=True)
+
+# Deadlines of requests, see gobstuf.lib.deadline
+# Every request should be answered within REQUEST_TIMEOUT seconds (0 for no deadline) or the timeout for its endpoint
+# in REQUEST_TIMEOUTS, eg "brp_ingeschrevenpersonen_list=60,brp_ingeschrevenpersonen_batch=180".
+# Clients can request a shorter timeout (in seconds) with the REQUEST_TIMEOUT_HEADER header.
+# MKS requests time out after MKS_CONNECT_TIMEOUT and MKS_READ_TIMEOUT seconds, or earlier at the deadline.
+REQUEST_TIMEOUT = float(_getenv("REQUEST_TIMEOUT", default_value=30))
+REQUEST_TIMEOUTS = {
+    'brp_ingeschrevenpersonen_batch': 120.0,
+    **{endpoint.strip(): float(timeout) for endpoint, timeout in (
+        item.split('=') for item in _getenv("REQUEST_TIMEOUTS", default_value="", is_optional=True).split(',')
+        if item.strip()
+    )}
+}
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
+MKS_CONNECT_TIMEOUT = float(_getenv("MKS_CONNECT_TIMEOUT", default_value=5))
+MKS_READ_TIMEOUT = float(_getenv("MKS_READ_TIMEOUT", default_value=30))
+
+# Upstream guard for MKS calls, see gobstuf.lib.upstream_guard
+# The number of concurrent MKS calls per process adapts between UPSTREAM_LIMIT_MIN and UPSTREAM_LIMIT_MAX.
+# A call waits at most UPSTREAM_LIMIT_TIMEOUT seconds for a slot.
+# A call that takes more than UPSTREAM_SLOW_CALL seconds is slow.
+# The circuit breaker opens when BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls has failed or BREAKER_SLOW_RATE
+# was slow, and lets probe calls through after BREAKER_OPEN_SECONDS. BREAKER_PROBES successful probes close it.
+UPSTREAM_GUARD_ENABLED = _getenv("UPSTREAM_GUARD_ENABLED", default_value="true", is_optional=True).lower() == "true"
+UPSTREAM_LIMIT_INITIAL = int(_getenv("UPSTREAM_LIMIT_INITIAL", default_value=20))
+UPSTREAM_LIMIT_MIN = int(_getenv("UPSTREAM_LIMIT_MIN", default_value=2))
+UPSTREAM_LIMIT_MAX = int(_getenv("UPSTREAM_LIMIT_MAX", default_value=100))
+UPSTREAM_LIMIT_TIMEOUT = float(_getenv("UPSTREAM_LIMIT_TIMEOUT", default_value=1.0))
+UPSTREAM_SLOW_CALL = float(_getenv("UPSTREAM_SLOW_CALL", default_value=5.0))
+BREAKER_WINDOW = int(_getenv("BREAKER_WINDOW", default_value=50))
+BREAKER_MIN_CALLS = int(_getenv("BREAKER_MIN_CALLS", default_value=20))
+BREAKER_FAILURE_RATE = float(_getenv("BREAKER_FAILURE_RATE", default_value=0.5))
+BREAKER_SLOW_RATE = float(_getenv("BREAKER_SLOW_RATE", default_value=0.8))
+BREAKER_OPEN_SECONDS = float(_getenv("BREAKER_OPEN_SECONDS", default_value=30))
+BREAKER_PROBES = int(_getenv("BREAKER_PROBES", default_value=3))
+
+# Hedged MKS requests, see gobstuf.lib.hedging
+# When enabled, a second request is sent for the soap actions in HEDGE_SOAP_ACTIONS when the first request has not
+# been answered within the HEDGE_PERCENTILE percentile of the last HEDGE_WINDOW latencies (after HEDGE_MIN_SAMPLES).
+# At most HEDGE_BUDGET (fraction) extra requests are sent. The requests are executed by HEDGE_WORKERS threads.
+HEDGING_ENABLED = _getenv("HEDGING_ENABLED", default_value="false", is_optional=True).lower() == "true"
+HEDGE_SOAP_ACTIONS = _getenv("HEDGE_SOAP_ACTIONS", default_value="npsLv01,npsLv07", is_optional=True).split(',')
+HEDGE_PERCENTILE = float(_getenv("HEDGE_PERCENTILE", default_value=95))
+HEDGE_BUDGET = float(_getenv("HEDGE_BUDGET", default_value=0.05))
+HEDGE_WINDOW = int(_getenv("HEDGE_WINDOW", default_value=1000))
+HEDGE_MIN_SAMPLES = int(_getenv("HEDGE_MIN_SAMPLES", default_value=100))
+HEDGE_WORKERS = int(_getenv("HEDGE_WORKERS", default_value=32))
+
+# Fair share of the MKS capacity between applications (fp_ roles), see gobstuf.lib.fair_share
+# At most FAIR_SHARE_CAPACITY concurrent MKS queries per process and FAIR_SHARE_APP_LIMIT per application.
+# Free slots are shared in proportion to the weights in FAIR_SHARE_WEIGHTS, eg "fp_balie=4,fp_batch=1" (default 1).
+# At most FAIR_SHARE_QUEUE_SIZE queries per application wait, each at most FAIR_SHARE_MAX_WAIT seconds.
+FAIR_SHARE_ENABLED = _getenv("FAIR_SHARE_ENABLED", default_value="true", is_optional=True).lower() == "true"
+FAIR_SHARE_CAPACITY = int(_getenv("FAIR_SHARE_CAPACITY", default_value=20))
+FAIR_SHARE_APP_LIMIT = int(_getenv("FAIR_SHARE_APP_LIMIT", default_value=10))
+FAIR_SHARE_WEIGHTS = {
+    application.strip(): float(weight) for application, weight in (
+        item.split('=') for item in _getenv("FAIR_SHARE_WEIGHTS", default_value="", is_optional=True).split(',')
+        if item.strip()
+    )
+}
+FAIR_SHARE_QUEUE_SIZE = int(_getenv("FAIR_SHARE_QUEUE_SIZE", default_value=100))
+FAIR_SHARE_MAX_WAIT = float(_getenv("FAIR_SHARE_MAX_WAIT", default_value=5))
+# With FAIR_SHARE_DIR the processes that share the directory (eg the uWSGI workers) together admit at most
+# FAIR_SHARE_APP_LIMIT concurrent MKS queries per application
+FAIR_SHARE_DIR = _getenv("FAIR_SHARE_DIR", is_optional=True)
+
+# Retries of MKS queries that are answered with a transient fault (StUF002, StUF005, StUF008), see gobstuf.lib.retry
+# At most RETRY_ATTEMPTS attempts in total, with a random wait of at most RETRY_BASE_DELAY * 2^retry seconds
+# (never more than RETRY_MAX_DELAY) between attempts
+RETRY_ATTEMPTS = int(_getenv("RETRY_ATTEMPTS", default_value=3))
+RETRY_BASE_DELAY = float(_getenv("RETRY_BASE_DELAY", default_value=0.1))
+RETRY_MAX_DELAY = float(_getenv("RETRY_MAX_DELAY", default_value=2.0))
+
+# ASGI app, see gobstuf.async_api
+# Synchronous work (validation, mapping, other routes) is executed by ASGI_THREADS threads per process.
+# At most ASGI_MKS_CONNECTIONS concurrent connections to MKS per process.
+ASGI_THREADS = int(_getenv("ASGI_THREADS", default_value=16))
+ASGI_MKS_CONNECTIONS = int(_getenv("ASGI_MKS_CONNECTIONS", default_value=200))
+
+# Compression of responses. Responses smaller than COMPRESSION_MIN_SIZE bytes are not compressed
+# Levels: gzip 1 (fastest) - 9 (smallest), brotli 0 (fastest) - 11 (smallest)
+COMPRESSION_MIN_SIZE = int(_getenv("COMPRESSION_MIN_SIZE", default_value=1024))
+COMPRESSION_GZIP_LEVEL = int(_getenv("COMPRESSION_GZIP_LEVEL", default_value=6))
+COMPRESSION_BROTLI_LEVEL = int(_getenv("COMPRESSION_BROTLI_LEVEL", default_value=4))
+
+# Capture of MKS traffic, see gobstuf.lib.capture
+# When enabled, every MKS request and response is written to a file per process in CAPTURE_DIR, encrypted with
+# CAPTURE_KEY (a Fernet key, required when enabled). BSNs, names and addresses are pseudonymised, unless
+# CAPTURE_PSEUDONYMISE is false. A process captures at most CAPTURE_MAX_RECORDS requests.
+CAPTURE_ENABLED = _getenv("CAPTURE_ENABLED", default_value="false", is_optional=True).lower() == "true"
+CAPTURE_DIR = _getenv("CAPTURE_DIR", default_value="/tmp/gobstuf/captures")
+CAPTURE_KEY = _getenv("CAPTURE_KEY", is_optional=not CAPTURE_ENABLED)
+CAPTURE_PSEUDONYMISE = _getenv("CAPTURE_PSEUDONYMISE", default_value="true", is_optional=True).lower() == "true"
+CAPTURE_MAX_RECORDS = int(_getenv("CAPTURE_MAX_RECORDS", default_value=10000))
+
+# Prometheus metrics, see gobstuf.lib.metrics
+# With multiple worker processes PROMETHEUS_MULTIPROC_DIR is required: the processes write their metrics to files in
+# this directory and the metrics endpoint aggregates them. The directory should be emptied when the service starts.
+METRICS_ENABLED = _getenv("METRICS_ENABLED", default_value="true", is_optional=True).lower() == "true"
+PROMETHEUS_MULTIPROC_DIR = _getenv("PROMETHEUS_MULTIPROC_DIR", is_optional=True)
+
 BAG_API_URL = "https://api.data.amsterdam.nl/v1/bag"
 BAG_NAG_ENDPOINT = f"{BAG_API_URL}/nummeraanduidingen"
 BAG_LPS_ENDPOINT = f"{BAG_API_URL}/ligplaatsen"
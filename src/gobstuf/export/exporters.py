@@ -0,0 +1,102 @@
+"""
+Exporters
+
+An exporter returns the lines of the export for a chunk of items of a job.
+The exporters use the REST views and are called in a request context for the job.
+
+"""
+import logging
+import traceback
+from typing import Iterator
+
+from flask import Response
+from requests.exceptions import HTTPError
+
+from gobstuf.lib.rate_limit import RateLimiter
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+from gobstuf.rest.brp.rest_response import RESTResponse, HTTP_200_OK
+from gobstuf.rest.brp.views import IngeschrevenpersonenBatchView, IngeschrevenpersonenFilterView
+from gobstuf.stuf.brp.error_response import StufErrorResponse
+
+BSN_EXPORT = 'burgerservicenummers'
+SEARCH_EXPORT = 'zoekvragen'
+
+# The search of a line in a search export
+SEARCH_KEY = 'zoekvraag'
+
+
+def export_bsn(spec: dict, bsns: list, rate_limiter: RateLimiter) -> list:
+    """
+    Export the persons with the given bsns, one line per bsn
+
+    The lines are formatted as the results of a batch request
+
+    :param spec: the job specification
+    :param bsns:
+    :param rate_limiter: the rate limit for the MKS requests of the job
+    :return:
+    """
+    view = IngeschrevenpersonenBatchView()
+    view.rate_limiter = rate_limiter
+    return view._get_results(spec['args'], bsns)
+
+
+def export_search(spec: dict, searches: list, rate_limiter: RateLimiter) -> Iterator[dict]:
+    """
+    Export the persons that are found by the given searches, one line per person
+
+    A search that fails results in one line with the error
+
+    :param spec: the job specification
+    :param searches: the query parameters of every search
+    :param rate_limiter: the rate limit for the MKS requests of the job
+    :return:
+    """
+    for search in searches:
+        try:
+            yield from _search(spec['args'], search, rate_limiter)
+        except UpstreamUnavailable as e:
+            yield _error(search, RESTResponse.service_unavailable(retry_after=e.retry_after))
+        except Exception:
+            logging.error(f"ERROR: Export search {search} failed:")
+            logging.error(traceback.format_exc())
+            yield _error(search, RESTResponse.internal_server_error())
+
+
+def _search(args: dict, search: dict, rate_limiter: RateLimiter) -> Iterator[dict]:
+    view = IngeschrevenpersonenFilterView()
+    view.args = {**args, **search}
+
+    if errors := _validate(view):
+        yield _error(search, RESTResponse.bad_request(**errors))
+        return
+
+    request_template = view._get_request_template()
+    rate_limiter.acquire()
+    response = view._post(request_template.soap_action, request_template.to_string(), request_template.applicatie)
+
+    try:
+        response.raise_for_status()
+    except HTTPError:
+        yield _error(search, view._error_response(StufErrorResponse(response.text)))
+        return
+
+    for obj in view._get_response_object(response.text).iter_answer_objects():
+        yield {SEARCH_KEY: search, 'status': HTTP_200_OK, 'ingeschrevenpersoon': obj}
+
+
+def _validate(view: IngeschrevenpersonenFilterView) -> dict:
+    try:
+        return view._validate()
+    except IngeschrevenpersonenFilterView.InvalidQueryParametersException as e:
+        return e.err
+
+
+def _error(search: dict, response: Response) -> dict:
+    return {SEARCH_KEY: search, 'status': response.status_code, 'fout': response.get_json()}
+
+
+EXPORTERS = {
+    BSN_EXPORT: export_bsn,
+    SEARCH_EXPORT: export_search,
+}
@@ -0,0 +1,187 @@
+"""
+Export jobs
+
+An export job is stored on local disk, in a directory per job:
+
+    <EXPORT_DIR>/<job id>/job.json          the specification of the job
+    <EXPORT_DIR>/<job id>/progress.json     the state and progress of the job
+    <EXPORT_DIR>/<job id>/result.ndjson     the exported objects, one JSON document per line
+
+The progress is saved after every processed chunk, together with the size of the result file at that moment.
+A job that is interrupted is resumed from the last saved progress; anything that has been written to
+the result file after that is discarded.
+
+Any process can read the state of a job. The process that executes a job holds a lock on the job.
+
+"""
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from gobstuf.config import EXPORT_DIR
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+FINISHED = (DONE, FAILED)
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ExportJob:
+
+    SPEC_FILE = 'job.json'
+    PROGRESS_FILE = 'progress.json'
+    RESULT_FILE = 'result.ndjson'
+    LOCK_FILE = 'lock'
+
+    def __init__(self, job_id: str, directory: str = None):
+        self.id = job_id
+        self.path = os.path.join(directory or EXPORT_DIR, job_id)
+        self._spec = None
+
+    @classmethod
+    def create(cls, spec: dict, total: int, directory: str = None) -> 'ExportJob':
+        """
+        Create a new job
+
+        :param spec: the specification of the job
+        :param total: the number of items in the job
+        :param directory: the directory of the jobs, default EXPORT_DIR
+        :return:
+        """
+        job = cls(uuid.uuid4().hex, directory)
+        os.makedirs(job.path)
+        job._write(cls.SPEC_FILE, spec)
+        job._write(cls.PROGRESS_FILE, {
+            'state': QUEUED,
+            'total': total,
+            'processed': 0,
+            'lines': 0,
+            'size': 0,
+            'created': time.time(),
+        })
+        return job
+
+    @classmethod
+    def get(cls, job_id: str, directory: str = None) -> Optional['ExportJob']:
+        """
+        Returns the job with the given id, or None if no such job exists
+
+        :param job_id:
+        :param directory:
+        :return:
+        """
+        if not _JOB_ID_PATTERN.match(job_id):
+            return None
+        job = cls(job_id, directory)
+        return job if os.path.isfile(os.path.join(job.path, cls.PROGRESS_FILE)) else None
+
+    @classmethod
+    def all(cls, directory: str = None) -> Iterator['ExportJob']:
+        """
+        Returns all jobs
+
+        :param directory:
+        :return:
+        """
+        directory = directory or EXPORT_DIR
+        if not os.path.isdir(directory):
+            return
+        for job_id in sorted(os.listdir(directory)):
+            if job := cls.get(job_id, directory):
+                yield job
+
+    @property
+    def spec(self) -> dict:
+        if self._spec is None:
+            self._spec = self._read(self.SPEC_FILE)
+        return self._spec
+
+    @property
+    def progress(self) -> dict:
+        return self._read(self.PROGRESS_FILE)
+
+    @property
+    def state(self) -> str:
+        return self.progress['state']
+
+    @property
+    def result_path(self) -> str:
+        return os.path.join(self.path, self.RESULT_FILE)
+
+    def save_progress(self, **changes) -> dict:
+        """
+        Update the progress of the job
+
+        :param changes: eg state=DONE
+        :return: the updated progress
+        """
+        progress = {**self.progress, **changes, 'updated': time.time()}
+        self._write(self.PROGRESS_FILE, progress)
+        return progress
+
+    @contextmanager
+    def lock(self):
+        """
+        Lock the job for execution
+
+        Yields True if the lock is acquired, False if the job is locked by another thread or process.
+        The lock is released when the process ends.
+
+        :return:
+        """
+        with open(os.path.join(self.path, self.LOCK_FILE), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def delete(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _read(self, filename: str) -> dict:
+        with open(os.path.join(self.path, filename)) as f:
+            return json.load(f)
+
+    def _write(self, filename: str, data: dict):
+        # Write to a temporary file and replace the file, so readers never see a partially written file
+        path = os.path.join(self.path, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def delete_expired_jobs(max_age: float, directory: str = None):
+    """
+    Delete finished jobs that have not been updated for max_age seconds
+
+    :param max_age: in seconds
+    :param directory:
+    :return:
+    """
+    expired = time.time() - max_age
+    for job in ExportJob.all(directory):
+        try:
+            progress = job.progress
+        except FileNotFoundError:
+            # Deleted by another process
+            continue
+        if progress['state'] in FINISHED and progress.get('updated', progress['created']) < expired:
+            job.delete()
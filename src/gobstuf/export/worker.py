@@ -0,0 +1,163 @@
+"""
+Execution of export jobs
+
+Jobs are executed by a pool of background threads. The queue of the pool is bounded; when it is full no new
+jobs are accepted (backpressure), the client should retry later.
+
+A job is processed in chunks of items. Each chunk is exported with the same views that serve the REST requests,
+in a request context that is equal to that of the request that submitted the job. After every chunk the lines
+are written to the result file and the progress is saved, so an interrupted job resumes at the last chunk.
+
+The MKS requests of a job are limited to EXPORT_RATE requests per second.
+
+"""
+import logging
+import os
+import queue
+import threading
+import traceback
+
+from flask import Flask, g, request
+
+from gobstuf.auth.routes import MKS_USER_KEY, MKS_APPLICATION_KEY
+from gobstuf.config import EXPORT_WORKERS, EXPORT_MAX_QUEUED, EXPORT_CHUNK_SIZE, EXPORT_RATE
+from gobstuf.export.jobs import ExportJob, RUNNING, DONE, FAILED, FINISHED, QUEUED
+from gobstuf.lib.rate_limit import RateLimiter
+from gobstuf.rest.brp.serializer import get_serializer
+
+
+def run_job(app: Flask, job: ExportJob, exporter):
+    """
+    Execute a job, unless it is executed by another thread or process or has finished already
+
+    :param app: the Flask app that serves the REST requests
+    :param job:
+    :param exporter: returns the lines for a chunk of items
+    :return:
+    """
+    with job.lock() as locked:
+        if not locked or job.state in FINISHED:
+            return
+
+        try:
+            _run_job(app, job, exporter)
+        except Exception as e:
+            logging.error(f"ERROR: Export job {job.id} failed:")
+            logging.error(traceback.format_exc())
+            job.save_progress(state=FAILED, error=str(e))
+
+
+def _run_job(app: Flask, job: ExportJob, exporter):
+    spec = job.spec
+    items = spec['items']
+    progress = job.save_progress(state=RUNNING)
+    processed, lines = progress['processed'], progress['lines']
+    rate_limiter = RateLimiter(EXPORT_RATE)
+    serializer = get_serializer()
+
+    # Create the result file if it does not exist yet
+    open(job.result_path, 'ab').close()
+
+    with open(job.result_path, 'r+b') as f:
+        # Discard any lines that have been written after the last saved progress
+        f.truncate(progress['size'])
+        f.seek(progress['size'])
+
+        while processed < len(items):
+            chunk = items[processed:processed + EXPORT_CHUNK_SIZE]
+
+            with app.test_request_context(spec['path'], base_url=spec['base_url'], method='POST'):
+                # The views build their links for the blueprint of the request, it must resolve to the same endpoint
+                if request.endpoint != spec['endpoint']:
+                    raise RuntimeError(f"Export path {spec['path']} resolves to {request.endpoint}, "
+                                       f"{spec['endpoint']} expected")
+                setattr(g, MKS_USER_KEY, spec['user'])
+                setattr(g, MKS_APPLICATION_KEY, spec['application'])
+                chunk_lines = [serializer.dumps(line) + b'\n' for line in exporter(spec, chunk, rate_limiter)]
+
+            f.writelines(chunk_lines)
+            f.flush()
+
+            processed += len(chunk)
+            lines += len(chunk_lines)
+            job.save_progress(processed=processed, lines=lines, size=f.tell())
+
+    job.save_progress(state=DONE)
+
+
+class ExportWorkerPool:
+
+    def __init__(self, app: Flask, exporters: dict, workers: int = EXPORT_WORKERS,
+                 max_queued: int = EXPORT_MAX_QUEUED):
+        """
+        :param app: the Flask app that serves the REST requests
+        :param exporters: the exporter for every type of job
+        :param workers: the number of threads
+        :param max_queued: the maximum number of jobs that wait to be executed
+        """
+        self.app = app
+        self.exporters = exporters
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.pid = os.getpid()
+
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"export-worker-{n}", daemon=True).start()
+
+    def submit(self, job: ExportJob) -> bool:
+        """
+        Queue the job for execution
+
+        :param job:
+        :return: False if the queue is full
+        """
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except queue.Full:
+            return False
+
+    def resume(self):
+        """
+        Queue all unfinished jobs, eg after a restart
+
+        Jobs that are executed by another process are skipped when their turn comes
+
+        :return:
+        """
+        for job in ExportJob.all():
+            if job.state in (QUEUED, RUNNING) and not self.submit(job):
+                break
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                run_job(self.app, job, self.exporters[job.spec['type']])
+            except Exception:
+                # Eg the job has been deleted
+                logging.error(f"ERROR: Export job {job.id} could not be executed:")
+                logging.error(traceback.format_exc())
+            self.queue.task_done()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(app: Flask, exporters: dict) -> ExportWorkerPool:
+    """
+    Returns the worker pool of the current process
+
+    The pool is started on first use. Threads do not survive a fork, so every (uWSGI) worker process starts
+    its own pool. Unfinished jobs, eg from before a restart, are resumed when the pool starts.
+
+    :param app: the Flask app that serves the REST requests
+    :param exporters: the exporter for every type of job
+    :return:
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ExportWorkerPool(app, exporters)
+            _pool.resume()
+        return _pool
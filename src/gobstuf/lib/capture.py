@@ -0,0 +1,278 @@
+"""
+Capture of MKS traffic
+
+When CAPTURE_ENABLED, every MKS request and its response are captured with their timing, for offline benchmarks and
+debugging with real response shapes (see gobstuf.benchmarks.replay).
+
+The captures are written to a file per process in CAPTURE_DIR, one record per line. Every record is encrypted with
+CAPTURE_KEY (Fernet: AES with an HMAC). A process captures at most CAPTURE_MAX_RECORDS requests.
+
+Unless CAPTURE_PSEUDONYMISE is false, BSNs, A-numbers, names, addresses, contact details and the user names of the
+employees in the requests are pseudonymised before they are written. A value is replaced by a value of the same
+shape (digits by digits, letters by letters), derived from the value with a keyed hash. The same value always gets
+the same pseudonym for the same key, so a pseudonymised request still matches its response. Pseudonymised BSNs pass
+the 11-proef.
+
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import string
+import threading
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape, unescape
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from gobstuf.config import CAPTURE_ENABLED, CAPTURE_DIR, CAPTURE_KEY, CAPTURE_PSEUDONYMISE, CAPTURE_MAX_RECORDS
+from gobstuf.logger import get_default_logger
+
+logger = get_default_logger()
+
+BSN = 'bsn'
+SHAPE = 'shape'
+
+# The personal data in StUF messages, by the local name of the element, and how it is pseudonymised
+PERSONAL_ELEMENTS = {
+    'inp.bsn': BSN,
+    **{name: SHAPE for name in [
+        # Identifiers
+        'inp.a-nummer', 'inp.anummer',
+        # Names
+        'geslachtsnaam', 'voornamen', 'voorletters', 'voorvoegselGeslachtsnaam', 'geslachtsnaamPartner',
+        'voorvoegselGeslachtsnaamPartner', 'geslachtsnaamAanschrijving', 'voornamenAanschrijving',
+        # Addresses
+        'gor.openbareRuimteNaam', 'gor.straatnaam', 'gor.identificatie', 'aoa.identificatie', 'aoa.postcode',
+        'postcode', 'aoa.huisnummer', 'aoa.huisletter', 'aoa.huisnummertoevoeging', 'wpl.woonplaatsNaam',
+        'inp.locatiebeschrijving', 'ogo.locatieAanduiding', 'sub.adresBuitenland1', 'sub.adresBuitenland2',
+        'sub.adresBuitenland3', 'sub.adresBuitenland4', 'sub.adresBuitenland5', 'sub.adresBuitenland6',
+        # Contact details
+        'sub.telefoonnummer', 'sub.faxnummer', 'sub.emailadres', 'sub.rekeningnummerBankGiro',
+        # The user name of the employee that requests the data (StUF:gebruiker in the stuurgegevens of a request)
+        'gebruiker',
+    ]},
+}
+
+# StUF:extraElement elements with personal data, by their naam attribute
+PERSONAL_EXTRA_ELEMENTS = {'opgemaakteNaam', 'terAttentieVan', 'iban', 'CBR-nummer'}
+
+# An element with a text value, eg <BG:inp.bsn>123456789</BG:inp.bsn>
+_ELEMENT = re.compile(
+    r'<(?P<tag>(?:[\w.-]+:)?(?P<name>[\w.-]+))(?P<attrs>\s[^>]*?)?(?<!/)>(?P<value>[^<]+)</(?P=tag)>')
+_NAAM = re.compile(r'\snaam="([^"]*)"')
+
+
+class Pseudonymiser:
+
+    def __init__(self, key: bytes):
+        """
+        :param key: the pseudonyms are derived from the value and the key
+        """
+        self._key = hashlib.sha256(b'gobstuf pseudonym:' + key).digest()
+
+    def _stream(self, kind: str, value: str) -> Iterator[int]:
+        """An endless stream of bytes, derived from the value"""
+        block = 0
+        while True:
+            yield from hmac.new(self._key, f'{kind}:{block}:{value}'.encode('utf-8'), hashlib.sha256).digest()
+            block += 1
+
+    def shape(self, value: str) -> str:
+        """
+        Example: 'Jansen-de Vries 12a' => 'Qkrwzo-bx Gnemt 85p'
+
+        :param value:
+        :return: a pseudonym with the same shape, digits, upper and lower case letters are replaced by their kind
+        """
+        stream = self._stream(SHAPE, value)
+        result = []
+        for char in value:
+            if char.isdigit():
+                char = string.digits[next(stream) % 10]
+            elif char.isupper():
+                char = string.ascii_uppercase[next(stream) % 26]
+            elif char.isalpha():
+                char = string.ascii_lowercase[next(stream) % 26]
+            result.append(char)
+        return ''.join(result)
+
+    def bsn(self, value: str) -> str:
+        """
+        :param value: a BSN
+        :return: a pseudonym that passes the 11-proef
+        """
+        stream = self._stream(BSN, value.strip())
+        while True:
+            digits = [next(stream) % 10 for _ in range(8)]
+            check = sum(digit * weight for digit, weight in zip(digits, range(9, 1, -1))) % 11
+            # The last digit has weight -1
+            if check < 10:
+                return ''.join(map(str, digits + [check]))
+
+    def _replace(self, match: re.Match) -> str:
+        name, attrs = match['name'], match['attrs'] or ''
+        kind = PERSONAL_ELEMENTS.get(name)
+        if name == 'extraElement' and (naam := _NAAM.search(attrs)) and naam[1] in PERSONAL_EXTRA_ELEMENTS:
+            kind = SHAPE
+        if kind is None or not match['value'].strip():
+            return match[0]
+
+        value = unescape(match['value'])
+        pseudonym = self.bsn(value) if kind == BSN else self.shape(value)
+        return f"<{match['tag']}{attrs}>{escape(pseudonym)}</{match['tag']}>"
+
+    def pseudonymise(self, text: str) -> str:
+        """
+        :param text: a StUF message
+        :return: the message with the personal data replaced by pseudonyms
+        """
+        return _ELEMENT.sub(self._replace, text)
+
+    def record(self, record: dict) -> dict:
+        """
+        :param record: a captured request, see Capture.record
+        :return: the record with a pseudonymised request and response
+        """
+        return {**record, 'request': self.pseudonymise(record['request']),
+                'response': self.pseudonymise(record['response']), 'pseudonymised': True}
+
+
+class CaptureStore:
+    """Encrypted capture files, one record per line"""
+
+    def __init__(self, key: bytes):
+        """
+        :param key: a Fernet key, see Fernet.generate_key
+        """
+        self._fernet = Fernet(key)
+
+    def append(self, path: str, record: dict):
+        """
+        Appends the record to the file, the file is only readable by its owner
+
+        :param path:
+        :param record:
+        :return:
+        """
+        token = self._fernet.encrypt(json.dumps(record).encode('utf-8'))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'ab') as f:
+            f.write(token + b'\n')
+
+    def read(self, path: str) -> Iterator[dict]:
+        """
+        :param path:
+        :raises ValueError: when the file is not encrypted with the key of the store
+        :return: the records in the file
+        """
+        with open(path, 'rb') as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(self._fernet.decrypt(line.strip()))
+                except InvalidToken:
+                    raise ValueError(f"{path}:{number} cannot be decrypted with the key")
+
+
+def _text(data) -> str:
+    if data is None:
+        return ''
+    return data.decode('utf-8', errors='replace') if isinstance(data, bytes) else data
+
+
+class Capture:
+
+    def __init__(self, directory: str, key: Optional[str], pseudonymise: bool = True, max_records: int = 10000,
+                 enabled: bool = True):
+        """
+        :param directory: the directory of the capture files
+        :param key: a Fernet key, required when enabled
+        :param pseudonymise: pseudonymise the records before they are written
+        :param max_records: the maximum number of records of this process
+        :param enabled:
+        """
+        self.enabled = enabled
+        self.directory = directory
+        self.max_records = max_records
+        self.records = 0
+        self.dropped = 0
+        self.errors = 0
+        self._store = CaptureStore(key.encode()) if enabled else None
+        self._pseudonymiser = Pseudonymiser(key.encode()) if enabled and pseudonymise else None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        """The capture file of this process"""
+        return os.path.join(self.directory, f'mks-{os.getpid()}.capture')
+
+    def record(self, url: str, headers: Optional[dict], data, response, start: float, duration: float):
+        """
+        Captures an MKS request, a failure to capture the request is logged and does not affect the request
+
+        :param url: the url of the request
+        :param headers: the headers of the request
+        :param data: the StUF message
+        :param response: the requests response
+        :param start: the time of the request, seconds since the epoch
+        :param duration: seconds
+        :return:
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self.records >= self.max_records:
+                self.dropped += 1
+                return
+            self.records += 1
+
+        try:
+            request = _text(data)
+            record = {
+                'time': start,
+                'path': urlsplit(url).path,
+                'soap_action': (headers or {}).get('Soapaction', ''),
+                'status': response.status_code,
+                'duration': duration,
+                'request_bytes': len(request.encode('utf-8')),
+                'response_bytes': len(response.content),
+                'request': request,
+                'response': response.text,
+                'pseudonymised': False,
+            }
+            if self._pseudonymiser:
+                record = self._pseudonymiser.record(record)
+
+            with self._lock:
+                os.makedirs(self.directory, mode=0o700, exist_ok=True)
+                self._store.append(self.path, record)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"MKS capture not written: {e}")
+
+    def metrics(self) -> dict:
+        """
+        :return: the number of captured, dropped (over the maximum) and failed records
+        """
+        return {
+            'enabled': self.enabled,
+            'records': self.records,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+
+# The capture of all MKS requests of this process
+mks_capture = Capture(
+    CAPTURE_DIR,
+    CAPTURE_KEY,
+    pseudonymise=CAPTURE_PSEUDONYMISE,
+    max_records=CAPTURE_MAX_RECORDS,
+    enabled=CAPTURE_ENABLED,
+)
@@ -0,0 +1,120 @@
+"""
+Deadlines of requests
+
+Every request gets a time budget when it arrives: REQUEST_TIMEOUT seconds, or the timeout that is configured for
+its endpoint in REQUEST_TIMEOUTS. A client can shorten the budget with the REQUEST_TIMEOUT_HEADER header.
+
+The deadline is checked between the phases of the request (validation, MKS request, mapping and serialisation).
+When it has passed, DeadlineExceeded is raised so the request stops early. The connect and read timeouts of the
+MKS request are limited to the remaining time.
+
+"""
+import time
+from typing import Callable, Optional
+
+from flask import Flask, g, has_app_context, request
+
+from gobstuf.config import REQUEST_TIMEOUT, REQUEST_TIMEOUTS, REQUEST_TIMEOUT_HEADER, MKS_CONNECT_TIMEOUT, \
+    MKS_READ_TIMEOUT
+
+DEADLINE_KEY = 'deadline'
+
+
+class DeadlineExceeded(Exception):
+
+    def __init__(self, phase: str):
+        super().__init__(f"Deadline exceeded before {phase}")
+        self.phase = phase
+
+
+class Deadline:
+
+    def __init__(self, timeout: float, clock: Callable[[], float] = time.monotonic):
+        """
+        :param timeout: the time budget in seconds
+        :param clock:
+        """
+        self.clock = clock
+        self.expires_at = clock() + timeout
+
+    def remaining(self) -> float:
+        """
+        :return: the remaining time in seconds, negative when the deadline has passed
+        """
+        return self.expires_at - self.clock()
+
+    def check(self, phase: str):
+        """
+        Raise DeadlineExceeded when the deadline has passed
+
+        :param phase: the phase that is about to start, eg map
+        :return:
+        """
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(phase)
+
+
+def get_deadline() -> Optional[Deadline]:
+    """
+    Get the deadline of the current request
+
+    :return: the deadline, or None if the request has no deadline or there is no request
+    """
+    return g.get(DEADLINE_KEY) if has_app_context() else None
+
+
+def upstream_timeout(deadline: Optional[Deadline]) -> tuple[float, float]:
+    """
+    Returns the connect and read timeout for an MKS request, limited to the remaining time of the deadline
+
+    :param deadline:
+    :raises DeadlineExceeded: when the deadline has passed
+    :return: (connect timeout, read timeout)
+    """
+    if deadline is None:
+        return MKS_CONNECT_TIMEOUT, MKS_READ_TIMEOUT
+
+    deadline.check('mks')
+    remaining = deadline.remaining()
+    return min(MKS_CONNECT_TIMEOUT, remaining), min(MKS_READ_TIMEOUT, remaining)
+
+
+def request_timeout(endpoint: Optional[str], header: Optional[str]) -> float:
+    """
+    Returns the time budget for a request
+
+    :param endpoint: the endpoint of the request, eg hc.brp_ingeschrevenpersonen_bsn
+    :param header: the value of the timeout header of the request, if any
+    :return: the timeout in seconds, 0 for no timeout
+    """
+    timeout = REQUEST_TIMEOUTS.get((endpoint or '').rsplit('.', 1)[-1], REQUEST_TIMEOUT)
+
+    try:
+        requested = float(header)
+    except (TypeError, ValueError):
+        return timeout
+
+    if requested > 0:
+        return min(timeout, requested) if timeout else requested
+    return timeout
+
+
+def _start_deadline():
+    """
+    Start the deadline of the current request
+
+    :return:
+    """
+    timeout = request_timeout(request.endpoint, request.headers.get(REQUEST_TIMEOUT_HEADER))
+    if timeout:
+        setattr(g, DEADLINE_KEY, Deadline(timeout))
+
+
+def init_deadlines(app: Flask):
+    """
+    Start a deadline for every request of the app
+
+    :param app:
+    :return:
+    """
+    app.before_request(_start_deadline)
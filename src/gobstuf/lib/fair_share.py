@@ -0,0 +1,299 @@
+"""
+Fair share of the MKS capacity
+
+All applications (the fp_ role of the request, see gobstuf.auth.routes) share the same MKS capacity. Without
+scheduling, one application with many (batch) requests can take every slot, and the requests of other applications
+time out.
+
+The scheduler admits at most FAIR_SHARE_CAPACITY concurrent MKS queries per process, and at most
+FAIR_SHARE_APP_LIMIT per application. Queries that cannot be admitted wait in a queue per application. When a slot
+becomes available it is given to the application with the lowest virtual time. Every admitted query advances the
+virtual time of its application by 1 / weight, so the slots are shared in proportion to the weights in
+FAIR_SHARE_WEIGHTS (default weight 1). An application that becomes active starts at the current virtual time, it
+does not get credit for the time it was idle.
+
+A query that is not admitted within FAIR_SHARE_MAX_WAIT seconds, or that finds the queue of its application full,
+is refused with UpstreamUnavailable. When the deadline of the request passes first, DeadlineExceeded is raised.
+
+The state of the scheduler is kept per process. Under uWSGI without threads every worker process handles one
+request at a time, so the scheduler of a process cannot prevent one application from taking every worker. With
+FAIR_SHARE_DIR the per-application limit applies to all processes that share the directory: a query first takes
+one of the FAIR_SHARE_APP_LIMIT slots of its application in the directory (see SharedSlots). A query that cannot get
+a slot within FAIR_SHARE_MAX_WAIT seconds is refused, which frees the worker for the requests of other applications.
+The capacity and the weights still apply per process.
+
+"""
+import fcntl
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from gobstuf.config import FAIR_SHARE_ENABLED, FAIR_SHARE_CAPACITY, FAIR_SHARE_APP_LIMIT, FAIR_SHARE_WEIGHTS, \
+    FAIR_SHARE_QUEUE_SIZE, FAIR_SHARE_MAX_WAIT, FAIR_SHARE_DIR
+from gobstuf.lib.deadline import Deadline, DeadlineExceeded
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+
+# The application of queries without an fp_ role
+UNKNOWN_APPLICATION = 'unknown'
+
+# Seconds after which a refused query can be retried
+RETRY_AFTER = 1
+
+# Seconds between the attempts to take a shared slot
+POLL_INTERVAL = 0.01
+
+
+class SharedSlots:
+    """
+    Slots per application, shared by all processes that use the same directory
+
+    A slot is a file in the directory. It is held by the process that holds the (flock) lock on the file, the lock is
+    released when the process stops, also when it is killed.
+    """
+
+    def __init__(self, directory: str, limit: int):
+        """
+        :param directory:
+        :param limit: the number of slots per application
+        """
+        self.directory = directory
+        self.limit = limit
+
+    def _path(self, application: str, number: int) -> str:
+        name = re.sub(r'[^\w.-]', '_', application)
+        return os.path.join(self.directory, f'{name}-{number}.lock')
+
+    def acquire(self, application: str) -> Optional[int]:
+        """
+        :param application:
+        :return: the file descriptor of a free slot of the application, that is now held, None if all slots are held
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        for number in range(self.limit):
+            fd = os.open(self._path(application, number), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release(self, fd: int):
+        """
+        :param fd: a slot that was acquired
+        :return:
+        """
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class _Waiter:
+
+    def __init__(self, enqueued_at: float):
+        self.enqueued_at = enqueued_at
+        self.admitted = threading.Event()
+
+
+class _Application:
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.queue = deque()
+        self.running = 0
+        self.virtual_time = 0.0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.shared_timeouts = 0
+        self.wait_time = 0.0
+
+    def metrics(self) -> dict:
+        return {
+            'weight': self.weight,
+            'queued': len(self.queue),
+            'running': self.running,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'shared_timeouts': self.shared_timeouts,
+            'wait_time': self.wait_time,
+        }
+
+
+class FairShareScheduler:
+
+    def __init__(self, capacity: int, app_limit: int, weights: dict, queue_size: int, max_wait: float,
+                 enabled: bool = True, clock: Callable[[], float] = time.monotonic,
+                 shared: Optional[SharedSlots] = None):
+        """
+        :param capacity: the maximum number of concurrent queries
+        :param app_limit: the maximum number of concurrent queries per application
+        :param weights: the weight per application, 1 for applications that are not in weights
+        :param queue_size: the maximum number of waiting queries per application
+        :param max_wait: the maximum time in seconds that a query waits to be admitted
+        :param enabled:
+        :param clock:
+        :param shared: the slots per application that are shared with other processes, if any
+        """
+        self.capacity = capacity
+        self.app_limit = app_limit
+        self.weights = weights
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self.clock = clock
+        self.shared = shared
+
+        self.in_use = 0
+        self.applications = {}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, application: Optional[str], func: Callable, deadline: Optional[Deadline] = None):
+        """
+        Execute func() when the query of the application is admitted
+
+        :param application: the application (fp_ role) of the query
+        :param func: executes the query
+        :param deadline: the deadline of the request, if any
+        :raises UpstreamUnavailable: when the query is not admitted
+        :raises DeadlineExceeded: when the deadline passes before the query is admitted
+        :return: the result of func
+        """
+        if not self.enabled:
+            return func()
+
+        name = application or UNKNOWN_APPLICATION
+        wait_until = self.clock() + self.max_wait
+        with self._shared_slot(name, deadline, wait_until):
+            app = self._admit(name, deadline, wait_until - self.clock())
+            try:
+                return func()
+            finally:
+                self._release(app)
+
+    def metrics(self) -> dict:
+        """
+        :return: the number of used slots and the queue depth, wait time (seconds) and counters per application
+        """
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'in_use': self.in_use,
+                'applications': {name: app.metrics() for name, app in self.applications.items()},
+            }
+
+    def _application(self, name: str) -> _Application:
+        # Must be called with the lock held
+        return self.applications.setdefault(name, _Application(self.weights.get(name, 1)))
+
+    def _timeout(self, max_wait: float, deadline: Optional[Deadline]) -> float:
+        return max_wait if deadline is None else max(0.0, min(max_wait, deadline.remaining()))
+
+    @contextmanager
+    def _shared_slot(self, name: str, deadline: Optional[Deadline], wait_until: float) -> Iterator[None]:
+        """
+        Holds a slot of the application that is shared with the other processes, if slots are shared
+
+        :param name: the application
+        :param deadline: the deadline of the request, if any
+        :param wait_until: the time until which the query may wait for a slot
+        :raises UpstreamUnavailable: when no slot is free before wait_until
+        :raises DeadlineExceeded: when the deadline passes first
+        :return:
+        """
+        if self.shared is None:
+            yield
+            return
+
+        start = self.clock()
+        while (fd := self.shared.acquire(name)) is None:
+            timeout = self._timeout(wait_until - self.clock(), deadline)
+            if timeout <= 0:
+                with self._lock:
+                    self._application(name).shared_timeouts += 1
+                if deadline is not None and deadline.remaining() <= 0:
+                    raise DeadlineExceeded('mks')
+                raise UpstreamUnavailable(f"No MKS capacity for {name} in any process", retry_after=RETRY_AFTER)
+            time.sleep(min(POLL_INTERVAL, timeout))
+
+        with self._lock:
+            self._application(name).wait_time += self.clock() - start
+        try:
+            yield
+        finally:
+            self.shared.release(fd)
+
+    def _admit(self, name: str, deadline: Optional[Deadline], max_wait: float = None) -> _Application:
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            app = self._application(name)
+            if len(app.queue) >= self.queue_size:
+                app.rejected += 1
+                raise UpstreamUnavailable(f"MKS queue of {name} is full", retry_after=RETRY_AFTER)
+
+            waiter = _Waiter(self.clock())
+            app.queue.append(waiter)
+            self._dispatch()
+
+        timeout = self._timeout(max_wait, deadline)
+        if waiter.admitted.wait(timeout):
+            return app
+
+        with self._lock:
+            # The query may have been admitted just after the wait timed out
+            if waiter.admitted.is_set():
+                return app
+            app.queue.remove(waiter)
+            app.timeouts += 1
+
+        if timeout < max_wait:
+            raise DeadlineExceeded('mks')
+        raise UpstreamUnavailable(f"No MKS capacity for {name}", retry_after=RETRY_AFTER)
+
+    def _release(self, app: _Application):
+        with self._lock:
+            app.running -= 1
+            self.in_use -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """
+        Admit waiting queries while there are free slots, in the order of the virtual time of their applications
+
+        Must be called with the lock held
+
+        :return:
+        """
+        while self.in_use < self.capacity:
+            candidates = [app for app in self.applications.values() if app.queue and app.running < self.app_limit]
+            if not candidates:
+                return
+
+            app = min(candidates, key=lambda candidate: max(candidate.virtual_time, self._virtual_time))
+            self._virtual_time = max(app.virtual_time, self._virtual_time)
+            app.virtual_time = self._virtual_time + 1 / app.weight
+
+            waiter = app.queue.popleft()
+            app.running += 1
+            app.admitted += 1
+            app.wait_time += self.clock() - waiter.enqueued_at
+            self.in_use += 1
+            waiter.admitted.set()
+
+
+# The scheduler for all MKS queries of this process
+mks_fair_share = FairShareScheduler(
+    FAIR_SHARE_CAPACITY,
+    app_limit=FAIR_SHARE_APP_LIMIT,
+    weights=FAIR_SHARE_WEIGHTS,
+    queue_size=FAIR_SHARE_QUEUE_SIZE,
+    max_wait=FAIR_SHARE_MAX_WAIT,
+    enabled=FAIR_SHARE_ENABLED,
+    shared=SharedSlots(FAIR_SHARE_DIR, FAIR_SHARE_APP_LIMIT) if FAIR_SHARE_DIR else None,
+)
@@ -0,0 +1,278 @@
+"""
+Hedged upstream requests
+
+MKS latency has a long tail. For idempotent queries a second, identical request (a hedge) is sent when the first
+request has not been answered within a percentile (HEDGE_PERCENTILE) of the recent latency of the query.
+The first answer is used, the other request is left to complete in the background.
+
+Hedges are limited by a budget: every request earns HEDGE_BUDGET tokens and every hedge costs one token, so at
+most HEDGE_BUDGET (eg 5%) extra requests are sent.
+
+Only the soap actions in HEDGE_SOAP_ACTIONS (eg npsLv01, npsLv07) are hedged, and only when HEDGING_ENABLED.
+
+A request is only executed by a thread pool when a hedge can be sent for it: the hedge delay of the query is known,
+the budget holds a token and a thread (HEDGE_WORKERS) is free. Otherwise the request is executed by the thread of
+the caller, so the pool never limits the number of concurrent MKS requests and requests are never queued.
+The hedge delay starts when the first request starts. The pool executes the requests in a copy of the context of the
+caller. The Flask request and application context, and so the deadline, timings and metrics of the request, are
+available to every attempt.
+
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from gobstuf.config import HEDGING_ENABLED, HEDGE_SOAP_ACTIONS, HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_WINDOW, \
+    HEDGE_MIN_SAMPLES, HEDGE_WORKERS
+
+# The unused budget is limited to the tokens for this number of hedges
+MAX_TOKENS = 10.0
+
+
+def soap_action_name(soap_action: str) -> str:
+    """
+    Returns the name of the soap action, eg '"http://www.egem.nl/StUF/sector/bg/0310/npsLv01"' => npsLv01
+
+    :param soap_action:
+    :return:
+    """
+    return soap_action.strip('"').rsplit('/', 1)[-1]
+
+
+class LatencyTracker:
+
+    def __init__(self, percentile: float, window: int, min_samples: int):
+        """
+        :param percentile: eg 95
+        :param window: the number of recent latencies
+        :param min_samples: the minimum number of latencies before a percentile is determined
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        # The percentile is recomputed after every 10% of the window
+        self._recompute_after = max(1, window // 10)
+        self._new_samples = 0
+        self._value = None
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._new_samples += 1
+
+    def value(self) -> Optional[float]:
+        """
+        :return: the percentile of the recent latencies, None if there are not enough latencies yet
+        """
+        with self._lock:
+            n = len(self._latencies)
+            if n < self.min_samples:
+                return None
+
+            if self._value is None or self._new_samples >= self._recompute_after:
+                latencies = sorted(self._latencies)
+                self._value = latencies[min(n - 1, int(n * self.percentile / 100))]
+                self._new_samples = 0
+            return self._value
+
+
+class HedgingPolicy:
+
+    def __init__(self, soap_actions: list, percentile: float, budget: float, window: int, min_samples: int,
+                 workers: int, enabled: bool = True):
+        """
+        :param soap_actions: the names of the soap actions that are hedged, eg npsLv01
+        :param percentile: a hedge is sent after this percentile of the recent latency
+        :param budget: the maximum fraction of extra requests, eg 0.05
+        :param window: the number of recent latencies per soap action
+        :param min_samples: the minimum number of latencies before hedges are sent
+        :param workers: the maximum number of threads that execute hedged requests
+        :param enabled:
+        """
+        self.budget = budget
+        self.workers = workers
+        self.enabled = enabled
+        self.trackers = {name: LatencyTracker(percentile, window, min_samples) for name in soap_actions}
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+        # Start with a full budget for one hedge
+        self._tokens = 1.0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # The number of attempts that are executed by the executor
+        self._running = 0
+
+    def call(self, soap_action: str, attempt: Callable):
+        """
+        Execute the request attempt(), hedged if the soap action is hedged
+
+        :param soap_action: the soap action of the request
+        :param attempt: makes the request and returns the response
+        :return: the first response
+        """
+        tracker = self.trackers.get(soap_action_name(soap_action)) if self.enabled else None
+        if tracker is None:
+            return attempt()
+
+        self._start_request()
+        delay = tracker.value()
+        if delay is None or not self._has_token() or not self._reserve_worker():
+            return self._call_inline(tracker, attempt, delay)
+
+        started = threading.Event()
+        first = self._submit(tracker, attempt, started)
+        # The hedge delay starts when the request starts
+        started.wait()
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        if not self._reserve_hedge():
+            self._count(hedges_skipped=1)
+            return first.result()
+
+        self._count(hedges=1)
+        hedge = self._submit(tracker, attempt, threading.Event())
+        winner = self._first_answer(first, hedge)
+        if winner is hedge:
+            self._count(hedges_won=1)
+        return winner.result()
+
+    def metrics(self) -> dict:
+        """
+        :return: the counters of the policy and the current hedge delay per soap action
+        """
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedges_won': self.hedges_won,
+            'hedges_skipped': self.hedges_skipped,
+            'delays': {name: tracker.value() for name, tracker in self.trackers.items()},
+        }
+
+    def _first_answer(self, first: Future, hedge: Future) -> Future:
+        """
+        Returns the first request that completes without an exception, or the first request if both fail
+
+        :param first:
+        :param hedge:
+        :return:
+        """
+        done, pending = wait([first, hedge], return_when=FIRST_COMPLETED)
+        winner = first if first in done else hedge
+        if winner.exception() is not None and pending:
+            wait(pending)
+            other = pending.pop()
+            return other if other.exception() is None else first
+        return winner
+
+    def _call_inline(self, tracker: LatencyTracker, attempt: Callable, delay: Optional[float]):
+        """
+        Execute the request attempt() in the thread of the caller, without a hedge
+
+        :param tracker: the latency tracker of the soap action
+        :param attempt: makes the request and returns the response
+        :param delay: the hedge delay, None if not yet known
+        :return: the response
+        """
+        start = time.perf_counter()
+        response = attempt()
+        latency = time.perf_counter() - start
+        tracker.add(latency)
+        if delay is not None and latency > delay:
+            # A hedge would have been sent if a token and a thread had been available
+            self._count(hedges_skipped=1)
+        return response
+
+    def _submit(self, tracker: LatencyTracker, attempt: Callable, started: threading.Event) -> Future:
+        """
+        Execute the request attempt() by the executor, a worker must have been reserved for it
+
+        :param tracker: the latency tracker of the soap action
+        :param attempt: makes the request and returns the response
+        :param started: is set when the request starts
+        :return:
+        """
+        def timed_attempt():
+            started.set()
+            try:
+                start = time.perf_counter()
+                response = attempt()
+                tracker.add(time.perf_counter() - start)
+                return response
+            finally:
+                self._release_worker()
+
+        # A context can be entered by one thread at a time, every attempt runs in its own copy
+        return self._get_executor().submit(contextvars.copy_context().run, timed_attempt)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork, every (uWSGI) worker process starts its own executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hedging')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _start_request(self):
+        # Every request earns a part of a hedge
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(MAX_TOKENS, self._tokens + self.budget)
+
+    def _reserve_worker(self) -> bool:
+        # An attempt is only submitted when a thread is free to execute it, it is never queued
+        with self._lock:
+            if self._running < self.workers:
+                self._running += 1
+                return True
+            return False
+
+    def _release_worker(self):
+        with self._lock:
+            self._running -= 1
+
+    def _reserve_hedge(self) -> bool:
+        # A hedge needs a thread and a token
+        if not self._reserve_worker():
+            return False
+        if not self._take_token():
+            self._release_worker()
+            return False
+        return True
+
+    def _has_token(self) -> bool:
+        with self._lock:
+            return self._tokens >= 1
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+# The hedging policy for all MKS requests of this process
+mks_hedging = HedgingPolicy(
+    HEDGE_SOAP_ACTIONS,
+    percentile=HEDGE_PERCENTILE,
+    budget=HEDGE_BUDGET,
+    window=HEDGE_WINDOW,
+    min_samples=HEDGE_MIN_SAMPLES,
+    workers=HEDGE_WORKERS,
+    enabled=HEDGING_ENABLED,
+)
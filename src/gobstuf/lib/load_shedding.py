@@ -0,0 +1,155 @@
+"""
+Load shedding
+
+When the service is overloaded, requests wait in the listen queue before a worker picks them up. A request that has
+waited longer than the client is willing to wait is better refused immediately than processed for nothing.
+
+The proxy in front of the service registers the time it received the request in the REQUEST_START_HEADER header,
+eg X-Request-Start: t=1700000000.123 (seconds, milliseconds or microseconds since the epoch). A request that has
+waited more than LOAD_SHEDDING_MAX_QUEUE_DELAY seconds, or that arrives while LOAD_SHEDDING_MAX_IN_FLIGHT requests
+are being processed by the process, is answered with 503 Service Unavailable and a Retry-After header. This is
+done before the request is validated or sent to MKS.
+
+Health checks and metrics are never refused. The queue delay is reported in the Server-Timing header (queue).
+
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+from flask import Flask, g, request
+
+from gobstuf.config import LOAD_SHEDDING_ENABLED, LOAD_SHEDDING_MAX_QUEUE_DELAY, LOAD_SHEDDING_MAX_IN_FLIGHT, \
+    LOAD_SHEDDING_RETRY_AFTER, REQUEST_START_HEADER
+from gobstuf.lib.timing import record_timing
+from gobstuf.rest.brp.rest_response import RESTResponse
+
+# The endpoints that are never refused
+EXEMPT_ENDPOINTS = {'_health', '_metrics'}
+
+# Set on the request globals when the request is counted as in flight
+IN_FLIGHT_KEY = 'load_shedding_in_flight'
+
+
+def queue_delay(header: Optional[str], clock: Callable[[], float] = time.time) -> Optional[float]:
+    """
+    Returns the time that a request has waited since the proxy received it
+
+    :param header: the value of the request start header, eg t=1700000000.123
+    :param clock:
+    :return: the delay in seconds, or None if the header is missing or invalid
+    """
+    try:
+        start = float((header or '').strip().removeprefix('t='))
+    except ValueError:
+        return None
+
+    # Proxies register the start in seconds (nginx), milliseconds or microseconds
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return max(0.0, clock() - start)
+
+
+class LoadShedder:
+
+    def __init__(self, max_queue_delay: float, max_in_flight: int, retry_after: int, enabled: bool = True):
+        """
+        :param max_queue_delay: the maximum queue delay in seconds, 0 for no maximum
+        :param max_in_flight: the maximum number of requests in flight, 0 for no maximum
+        :param retry_after: the number of seconds after which a refused client can retry
+        :param enabled:
+        """
+        self.max_queue_delay = max_queue_delay
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.enabled = enabled
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed_queue_delay = 0
+        self.shed_in_flight = 0
+        self._lock = threading.Lock()
+
+    def admit(self, delay: Optional[float]) -> bool:
+        """
+        Tells if a request is admitted. An admitted request is in flight until it is finished
+
+        :param delay: the queue delay of the request, if known
+        :return:
+        """
+        with self._lock:
+            if self.enabled and self.max_queue_delay and delay is not None and delay > self.max_queue_delay:
+                self.shed_queue_delay += 1
+                return False
+
+            if self.enabled and self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.shed_in_flight += 1
+                return False
+
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def metrics(self) -> dict:
+        """
+        :return: the number of requests in flight and the counters of the shedder
+        """
+        return {
+            'in_flight': self.in_flight,
+            'admitted': self.admitted,
+            'shed_queue_delay': self.shed_queue_delay,
+            'shed_in_flight': self.shed_in_flight,
+        }
+
+
+def _shed_load():
+    """
+    Refuse the current request if the service is overloaded
+
+    :return: 503 Service Unavailable if the request is refused, else None to continue
+    """
+    if request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+
+    delay = queue_delay(request.headers.get(REQUEST_START_HEADER))
+    if delay is not None:
+        record_timing('queue', delay)
+
+    if not load_shedder.admit(delay):
+        return RESTResponse.service_unavailable(retry_after=load_shedder.retry_after)
+
+    setattr(g, IN_FLIGHT_KEY, True)
+    return None
+
+
+def _finish_request(exception=None):
+    if g.pop(IN_FLIGHT_KEY, False):
+        load_shedder.finish()
+
+
+def init_load_shedding(app: Flask):
+    """
+    Refuse requests of the app when the service is overloaded
+
+    Should be initialised before any other request processing
+
+    :param app:
+    :return:
+    """
+    app.before_request(_shed_load)
+    app.teardown_request(_finish_request)
+
+
+# The load shedder of this process
+load_shedder = LoadShedder(
+    LOAD_SHEDDING_MAX_QUEUE_DELAY,
+    max_in_flight=LOAD_SHEDDING_MAX_IN_FLIGHT,
+    retry_after=LOAD_SHEDDING_RETRY_AFTER,
+    enabled=LOAD_SHEDDING_ENABLED,
+)
@@ -0,0 +1,334 @@
+"""
+Metrics
+
+Prometheus metrics of the service, served in the text exposition format at METRICS_PATH. Like the health check the
+path is not protected (see oauth2-proxy.cfg).
+
+- gobstuf_requests_total, gobstuf_request_duration_seconds: requests per route (REST_ROUTES and XML_ROUTES), method
+  and status
+- gobstuf_phase_duration_seconds: the time spent in every phase of the requests of a route (queue, validate, mks,
+  parse, map, filter, serialise and compress, see gobstuf.lib.timing). Filter is part of map
+- gobstuf_mapped_objects: the number of objects that is mapped for a response, including the related (embedded)
+  objects
+- gobstuf_mks_requests_total, gobstuf_mks_request_duration_seconds: MKS calls per soap action and status (error when
+  no response was received)
+- gobstuf_mks_faults_total: StUF faults per soap action and code
+- gobstuf_mks_request_bytes, gobstuf_mks_response_bytes: the size of the MKS messages
+- gobstuf_<component>_<name>: the metrics() of the MKS guard, hedging, retry, fair share, load shedder and capture
+
+When the service is served by multiple worker processes (uWSGI), PROMETHEUS_MULTIPROC_DIR must be set to an existing
+directory that is emptied when the service starts. Every process writes its metrics to memory mapped files in that
+directory and the metrics endpoint aggregates the files of all processes, including the processes that have stopped.
+Without it the endpoint reports the metrics of the process that handles the scrape.
+
+The metrics() of the components are kept per process. A process copies them to gauges at most once every
+SYNC_INTERVAL seconds, after a request. Counters are summed over all processes, current values (eg in_flight) over the
+live processes.
+
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+from flask import Flask, Response, g, has_app_context, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, \
+    multiprocess
+
+from gobstuf.config import METRICS_ENABLED, PROMETHEUS_MULTIPROC_DIR
+from gobstuf.lib.hedging import soap_action_name
+from gobstuf.lib.timing import get_timings
+from gobstuf.stuf.fault import parse_fault
+
+METRICS_PATH = '/brp/status/metrics'
+
+# Set on the request globals
+START_KEY = 'metrics_start'
+STATUS_KEY = 'metrics_status'
+MAPPED_OBJECTS_KEY = 'mapped_objects'
+
+# Label values
+UNMATCHED = 'unmatched'
+UNKNOWN = 'unknown'
+ERROR = 'error'
+OTHER = 'other'
+
+# The maximum number of values of a label that comes from a request (eg the soap action), further values are OTHER
+MAX_LABEL_VALUES = 50
+
+SYNC_INTERVAL = 1.0
+
+# How the values of the components are aggregated over the processes. Counters (the default) are summed over all
+# processes, current values over the live processes. Settings and estimates are the maximum of the live processes
+AGGREGATION = {
+    'state': 'livesum',
+    'limit': 'livesum',
+    'in_flight': 'livesum',
+    'capacity': 'livesum',
+    'in_use': 'livesum',
+    'queued': 'livesum',
+    'running': 'livesum',
+    'enabled': 'livemax',
+    'weight': 'livemax',
+    'delays': 'livemax',
+}
+
+# The label of the nested values of a component, eg the hedge delays per soap action
+NESTED_LABELS = {
+    'delays': 'soap_action',
+    'applications': 'application',
+}
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+PHASE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+MKS_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** n for n in range(9))
+OBJECT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+REGISTRY = CollectorRegistry()
+
+REQUESTS = Counter('gobstuf_requests', "Requests", ['route', 'method', 'status'], registry=REGISTRY)
+REQUEST_DURATION = Histogram('gobstuf_request_duration_seconds', "Duration of requests", ['route', 'method'],
+                             buckets=DURATION_BUCKETS, registry=REGISTRY)
+PHASE_DURATION = Histogram('gobstuf_phase_duration_seconds', "Time spent in a phase of a request", ['route', 'phase'],
+                           buckets=PHASE_BUCKETS, registry=REGISTRY)
+MAPPED_OBJECTS = Histogram('gobstuf_mapped_objects', "Objects mapped for a response", ['route'],
+                           buckets=OBJECT_BUCKETS, registry=REGISTRY)
+
+MKS_REQUESTS = Counter('gobstuf_mks_requests', "MKS requests", ['soap_action', 'status'], registry=REGISTRY)
+MKS_DURATION = Histogram('gobstuf_mks_request_duration_seconds', "Duration of MKS requests", ['soap_action'],
+                         buckets=MKS_BUCKETS, registry=REGISTRY)
+MKS_FAULTS = Counter('gobstuf_mks_faults', "StUF faults of MKS", ['soap_action', 'code'], registry=REGISTRY)
+MKS_REQUEST_BYTES = Histogram('gobstuf_mks_request_bytes', "Size of MKS requests", ['soap_action'],
+                              buckets=SIZE_BUCKETS, registry=REGISTRY)
+MKS_RESPONSE_BYTES = Histogram('gobstuf_mks_response_bytes', "Size of MKS responses", ['soap_action'],
+                               buckets=SIZE_BUCKETS, registry=REGISTRY)
+
+_label_values = defaultdict(set)
+
+
+def _bounded(label: str, value: str) -> str:
+    """
+    :param label: eg soap_action
+    :param value:
+    :return: the value, or OTHER when the label has reached MAX_LABEL_VALUES values
+    """
+    values = _label_values[label]
+    if value not in values:
+        if len(values) >= MAX_LABEL_VALUES:
+            return OTHER
+        values.add(value)
+    return value
+
+
+def _size(data) -> int:
+    if data is None:
+        return 0
+    return len(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+def count_mapped_objects(count: int = 1):
+    """
+    Register objects that are mapped for the current request
+
+    :param count: 0 to register that the request maps objects
+    :return:
+    """
+    if METRICS_ENABLED and has_app_context():
+        setattr(g, MAPPED_OBJECTS_KEY, g.get(MAPPED_OBJECTS_KEY, 0) + count)
+
+
+def record_mks_call(headers: Optional[dict], data, response, duration: float):
+    """
+    Register an MKS request
+
+    :param headers: the headers of the request
+    :param data: the StUF message
+    :param response: the requests response, None when no response was received
+    :param duration: seconds
+    :return:
+    """
+    if not METRICS_ENABLED:
+        return
+
+    action = _bounded('soap_action', soap_action_name((headers or {}).get('Soapaction', '')) or UNKNOWN)
+    MKS_REQUESTS.labels(action, ERROR if response is None else str(response.status_code)).inc()
+    MKS_DURATION.labels(action).observe(duration)
+    MKS_REQUEST_BYTES.labels(action).observe(_size(data))
+    if response is None:
+        return
+
+    MKS_RESPONSE_BYTES.labels(action).observe(len(response.content))
+    if response.status_code >= 500 and (fault := parse_fault(response.text)):
+        MKS_FAULTS.labels(action, _bounded('code', fault.code or UNKNOWN)).inc()
+
+
+def record_request(route: str, method: str, status: int, duration: float, phases: dict,
+                   mapped_objects: Optional[int]):
+    """
+    Register a request
+
+    :param route: the url rule, eg /brp/ingeschrevenpersonen/<bsn>
+    :param method:
+    :param status:
+    :param duration: seconds
+    :param phases: the time spent in each phase, see gobstuf.lib.timing
+    :param mapped_objects: the number of mapped objects, None when the request does not map objects
+    :return:
+    """
+    method = _bounded('method', method)
+    REQUESTS.labels(route, method, str(status)).inc()
+    REQUEST_DURATION.labels(route, method).observe(duration)
+    for phase, phase_duration in phases.items():
+        PHASE_DURATION.labels(route, phase).observe(phase_duration)
+    if mapped_objects is not None:
+        MAPPED_OBJECTS.labels(route).observe(mapped_objects)
+
+
+class ComponentMetrics:
+    """Copies the metrics() of components to gauges"""
+
+    def __init__(self, components: dict, registry: CollectorRegistry, interval: float = SYNC_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param components: the components by name, eg {'mks_guard': mks_guard}
+        :param registry:
+        :param interval: the minimal number of seconds between two copies, see sync
+        :param clock:
+        """
+        self.components = components
+        self.registry = registry
+        self.interval = interval
+        self.clock = clock
+        self._gauges = {}
+        self._states = {}
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def _gauge(self, component: str, key: str, labelnames: tuple = ()) -> Gauge:
+        name = f"gobstuf_{component}_{key}"
+        if name not in self._gauges:
+            self._gauges[name] = Gauge(name, f"{key} of {component}", labelnames,
+                                       multiprocess_mode=AGGREGATION.get(key, 'sum'), registry=self.registry)
+        return self._gauges[name]
+
+    def _set(self, component: str, key: str, value):
+        if value is None:
+            # Not known yet, eg the hedge delay before enough latencies are known
+            return
+        if isinstance(value, str):
+            self._set_state(component, key, value)
+        elif isinstance(value, dict):
+            self._set_nested(component, key, value)
+        else:
+            self._gauge(component, key).set(value)
+
+    def _set_state(self, component: str, key: str, value: str):
+        """One value per state, 1 for the current state"""
+        gauge = self._gauge(component, key, (key,))
+        if (previous := self._states.get((component, key))) not in (None, value):
+            gauge.labels(previous).set(0)
+        gauge.labels(value).set(1)
+        self._states[(component, key)] = value
+
+    def _set_nested(self, component: str, key: str, values: dict):
+        """eg {'npsLv01': 0.2} or {'fp_balie': {'queued': 1, ...}}"""
+        label = NESTED_LABELS.get(key, 'key')
+        for label_value, nested in values.items():
+            if isinstance(nested, dict):
+                for nested_key, nested_value in nested.items():
+                    self._gauge(component, nested_key, (label,)).labels(label_value).set(nested_value)
+            elif nested is not None:
+                self._gauge(component, key, (label,)).labels(label_value).set(nested)
+
+    def sync(self):
+        """
+        Copies the metrics of the components
+
+        :return:
+        """
+        with self._lock:
+            self._synced_at = self.clock()
+            for component, instance in self.components.items():
+                for key, value in instance.metrics().items():
+                    self._set(component, key, value)
+
+    def sync_if_due(self):
+        """
+        Copies the metrics of the components if the last copy is more than interval seconds ago
+
+        :return:
+        """
+        if self._synced_at is None or self.clock() - self._synced_at >= self.interval:
+            self.sync()
+
+
+component_metrics = ComponentMetrics({}, REGISTRY)
+
+
+def _start_request():
+    if request.endpoint != _metrics.__name__:
+        setattr(g, START_KEY, time.perf_counter())
+
+
+def _register_status(response):
+    setattr(g, STATUS_KEY, response.status_code)
+    return response
+
+
+def _finish_request(exception=None):
+    """Register the request when it has finished, after a streamed response has been sent"""
+    start = g.pop(START_KEY, None)
+    if start is None:
+        return
+
+    record_request(
+        request.url_rule.rule if request.url_rule else UNMATCHED,
+        request.method,
+        g.pop(STATUS_KEY, 500),
+        time.perf_counter() - start,
+        get_timings(),
+        g.pop(MAPPED_OBJECTS_KEY, None),
+    )
+    component_metrics.sync_if_due()
+
+
+def _metrics() -> Response:
+    """The metrics of all processes in the Prometheus text format"""
+    component_metrics.sync()
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, PROMETHEUS_MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def _mark_process_dead():
+    """The current values of a stopped process are no longer reported"""
+    multiprocess.mark_process_dead(os.getpid(), PROMETHEUS_MULTIPROC_DIR)
+
+
+def init_metrics(app: Flask, components: dict):
+    """
+    Register the requests of the app and serve the metrics at METRICS_PATH
+
+    Should be initialised before any other request processing, so that refused requests are registered as well
+
+    :param app:
+    :param components: the components with metrics() by name, eg {'mks_guard': mks_guard}
+    :return:
+    """
+    if not METRICS_ENABLED:
+        return
+
+    component_metrics.components.update(components)
+    app.before_request(_start_request)
+    app.after_request(_register_status)
+    app.teardown_request(_finish_request)
+    app.route(rule=METRICS_PATH)(_metrics)
+
+    if PROMETHEUS_MULTIPROC_DIR:
+        atexit.register(_mark_process_dead)
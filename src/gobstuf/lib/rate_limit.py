@@ -0,0 +1,38 @@
+"""
+Rate limiting
+
+Spaces calls evenly over time, eg to cap the number of MKS requests per second of a long running job.
+
+"""
+import time
+from threading import Lock
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float):
+        """
+        :param rate: maximum number of calls per second, no limit if 0
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        Waits until the next call is allowed
+
+        Calls from multiple threads are given consecutive slots
+
+        :return:
+        """
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
@@ -0,0 +1,74 @@
+"""
+Running the synchronous parts of an asynchronous request
+
+Flask keeps the current request and its globals in context variables. The request runner pushes the request context
+of a request in its own copy of the context variables, and executes all synchronous work of the request (validation,
+mapping, serialisation) in that copy. Work that takes some time is executed in a thread pool, so the event loop is
+not blocked.
+
+The work of a request is executed one function at a time.
+
+"""
+import asyncio
+import contextvars
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, Optional
+
+from flask import Flask, Response
+
+
+class RequestRunner:
+
+    def __init__(self, app: Flask, environ: dict, executor: Executor):
+        """
+        :param app:
+        :param environ: the WSGI environment of the request
+        :param executor: the thread pool
+        """
+        self.executor = executor
+        self._context = contextvars.copy_context()
+        self._request_context = app.request_context(environ)
+        self._pending: Optional[asyncio.Future] = None
+
+    def push(self):
+        """
+        Push the request context, before any other work of the request
+
+        :return:
+        """
+        self._context.run(self._request_context.push)
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """
+        Execute func(*args, **kwargs) in the thread pool
+
+        When the request is cancelled the function is not interrupted, see close
+
+        :return: the result of func
+        """
+        self._pending = asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self._context.run, func, *args, **kwargs))
+        return await asyncio.shield(self._pending)
+
+    def sync(self, func: Callable, *args, **kwargs):
+        """
+        Execute func(*args, **kwargs) immediately, for functions that take hardly any time
+
+        :return: the result of func
+        """
+        return self._context.run(func, *args, **kwargs)
+
+    async def close(self, response: Optional[Response] = None):
+        """
+        Close the response and pop the request context, after the function that is executed in the thread pool
+        (if any) has finished
+
+        :param response: the response of the request, if any
+        :return:
+        """
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        if response is not None:
+            self._context.run(response.close)
+        self._context.run(self._request_context.pop)
@@ -0,0 +1,121 @@
+"""
+Retries of upstream requests
+
+MKS answers with a transient fault (StUF002, StUF005 or StUF008, see gobstuf.stuf.fault) when it is temporarily
+not able to answer a query. These requests are retried, at most RETRY_ATTEMPTS attempts in total.
+
+Between attempts the policy waits a random time between 0 and an exponentially growing delay (full jitter), so
+retries of concurrent requests are spread. No retry is done when the wait would not end before the deadline of the
+request. Permanent faults and other responses are returned immediately.
+
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from gobstuf.config import RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from gobstuf.lib.deadline import Deadline
+from gobstuf.stuf.fault import is_transient_fault
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts: int, base_delay: float, max_delay: float, sleep: Callable[[float], None] = time.sleep):
+        """
+        :param attempts: the maximum number of attempts, 1 for no retries
+        :param base_delay: the maximum wait in seconds before the first retry, doubled for every next retry
+        :param max_delay: the maximum wait in seconds before any retry
+        :param sleep:
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+        self.retries = 0
+        self.retries_succeeded = 0
+        self.retries_exhausted = 0
+        self.retries_skipped = 0
+        self._lock = threading.Lock()
+
+    def call(self, attempt: Callable, deadline: Optional[Deadline] = None):
+        """
+        Execute the request attempt(), retry it as long as it is answered with a transient fault
+
+        :param attempt: makes the request and returns the response
+        :param deadline: the deadline of the request, if any
+        :return: the last response
+        """
+        response = attempt()
+        retry = 0
+        while (delay := self._next_delay(retry, response, deadline)) is not None:
+            self.sleep(delay)
+            response = attempt()
+            retry += 1
+
+        self._finish(retry, response)
+        return response
+
+    async def call_async(self, attempt: Callable, deadline: Optional[Deadline] = None):
+        """
+        Execute the asynchronous request await attempt(), retry it as long as it is answered with a transient fault
+
+        :param attempt: makes the request and returns the response
+        :param deadline: the deadline of the request, if any
+        :return: the last response
+        """
+        response = await attempt()
+        retry = 0
+        while (delay := self._next_delay(retry, response, deadline)) is not None:
+            await asyncio.sleep(delay)
+            response = await attempt()
+            retry += 1
+
+        self._finish(retry, response)
+        return response
+
+    def _next_delay(self, retry: int, response, deadline: Optional[Deadline]) -> Optional[float]:
+        """
+        Returns the time to wait before the next attempt, None if the response should not be retried
+
+        :param retry: the number of retries so far
+        :param response: the last response
+        :param deadline:
+        :return:
+        """
+        if retry >= self.attempts - 1 or not is_transient_fault(response):
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if deadline is not None and deadline.remaining() <= delay:
+            self._count(retries_skipped=1)
+            return None
+
+        self._count(retries=1)
+        return delay
+
+    def _finish(self, retries: int, response):
+        if retries:
+            self._count(**{'retries_exhausted' if is_transient_fault(response) else 'retries_succeeded': 1})
+
+    def metrics(self) -> dict:
+        """
+        :return: the counters of the policy
+        """
+        return {
+            'retries': self.retries,
+            'retries_succeeded': self.retries_succeeded,
+            'retries_exhausted': self.retries_exhausted,
+            'retries_skipped': self.retries_skipped,
+        }
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+# The retry policy for all MKS queries of this process
+mks_retry = RetryPolicy(RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY)
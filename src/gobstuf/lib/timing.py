@@ -0,0 +1,70 @@
+"""
+Timing of the phases of a request
+
+The time spent in each phase (for example serialise) is registered on the request globals,
+so it can be reported once the response has been built.
+
+"""
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+
+TIMINGS_KEY = 'phase_timings'
+
+
+def record_timing(phase: str, duration: float):
+    """
+    Register the duration of a phase for the current request
+
+    Multiple registrations of the same phase are summed
+
+    :param phase: name of the phase, eg serialise
+    :param duration: duration in seconds
+    :return: None
+    """
+    if not has_app_context():
+        return
+
+    timings = g.setdefault(TIMINGS_KEY, {})
+    timings[phase] = timings.get(phase, 0.0) + duration
+
+
+def get_timings() -> dict:
+    """
+    Get the phase timings of the current request
+
+    :return: dict with phase name -> duration in seconds
+    """
+    return g.get(TIMINGS_KEY, {}) if has_app_context() else {}
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    Time the wrapped block and register its duration for the given phase
+
+    Example:
+        with timed('serialise'):
+            body = serializer.dumps(data)
+
+    :param phase: name of the phase
+    :return:
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+def server_timing_header(timings: dict) -> str:
+    """
+    Format phase timings as a Server-Timing header value
+
+    Example: {'serialise': 0.0012} => 'serialise;dur=1.200'
+
+    :param timings: dict with phase name -> duration in seconds
+    :return: the header value
+    """
+    return ', '.join(f"{phase};dur={duration * 1000:.3f}" for phase, duration in timings.items())
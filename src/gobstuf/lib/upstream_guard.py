@@ -0,0 +1,365 @@
+"""
+Upstream guard
+
+Protects the service and MKS when MKS slows down or fails. Every MKS call passes the guard, which combines:
+
+- An adaptive limit on the number of concurrent calls (AIMD). The limit grows by one per round of successful
+  calls and is multiplied by a backoff factor on a failed or slow call. A call that does not get a slot within
+  a short time is refused.
+- A circuit breaker. It opens when the rate of failed or slow calls in a window of recent calls exceeds a
+  threshold. While open, calls are refused immediately. After some time the breaker is half-open: a limited
+  number of probe calls is let through, the breaker closes when they succeed and opens again when one fails.
+
+A refused call raises UpstreamUnavailable, with the number of seconds after which the client can retry.
+
+A call has failed when it raises an exception (eg a connection error or time-out), when the response is a
+gateway error or when MKS answers with a transient StUF fault (see gobstuf.stuf.fault). Other StUF faults
+(eg not found) are answers and count as successful calls.
+
+The state of the guard is kept per process.
+
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from gobstuf.config import UPSTREAM_GUARD_ENABLED, UPSTREAM_LIMIT_INITIAL, UPSTREAM_LIMIT_MIN, UPSTREAM_LIMIT_MAX, \
+    UPSTREAM_LIMIT_TIMEOUT, UPSTREAM_SLOW_CALL, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATE, \
+    BREAKER_SLOW_RATE, BREAKER_OPEN_SECONDS, BREAKER_PROBES
+from gobstuf.logger import get_default_logger
+from gobstuf.stuf.fault import is_transient_fault
+
+logger = get_default_logger()
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Seconds between attempts of an asynchronous call to get a slot
+ASYNC_POLL_INTERVAL = 0.01
+
+# Gateway errors that indicate that MKS is not available
+FAILURE_STATUS_CODES = (502, 503, 504)
+
+
+class UpstreamUnavailable(Exception):
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def is_failure(response) -> bool:
+    """
+    Tells if the response of an upstream call indicates that the upstream service fails
+
+    :param response:
+    :return:
+    """
+    if response.status_code in FAILURE_STATUS_CODES:
+        return True
+    return is_transient_fault(response)
+
+
+class AdaptiveLimit:
+
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.75):
+        """
+        :param initial: the initial number of concurrent calls
+        :param minimum: the limit never drops below minimum
+        :param maximum: the limit never exceeds maximum
+        :param backoff: the factor to apply to the limit on a failed or slow call
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        """
+        Wait at most timeout seconds for a slot
+
+        :param timeout:
+        :return: True if a slot is acquired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, success: bool):
+        """
+        Release a slot and adapt the limit to the outcome of the call
+
+        :param success: False if the call has failed or was slow
+        :return:
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if success:
+                # Additive increase, about one per round of calls at the limit
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                # Multiplicative decrease
+                self.limit = max(self.minimum, self.limit * self.backoff)
+            self._condition.notify()
+
+
+class CircuitBreaker:
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, slow_rate: float, open_seconds: float,
+                 probes: int, clock: Callable[[], float] = time.monotonic):
+        """
+        :param window: the number of recent calls on which the failure and slow rates are determined
+        :param min_calls: the minimum number of calls in the window before the breaker can open
+        :param failure_rate: the breaker opens when this fraction of the calls has failed
+        :param slow_rate: the breaker opens when this fraction of the calls was slow
+        :param open_seconds: the time the breaker stays open before it lets probe calls through
+        :param probes: the number of successful probe calls that close the breaker
+        :param clock:
+        """
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.clock = clock
+
+        self.state = CLOSED
+        self.state_changes = 0
+        self._calls = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._succeeded_probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> tuple[bool, bool]:
+        """
+        Tells if a call is allowed
+
+        In the half-open state one probe call at a time is allowed
+
+        :return: (allowed, is_probe)
+        """
+        with self._lock:
+            if self.state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+
+            if self.state == CLOSED:
+                return True, False
+            elif self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True, True
+            return False, False
+
+    def retry_after(self) -> int:
+        """
+        :return: the number of seconds until the breaker lets probe calls through
+        """
+        return max(1, math.ceil(self.open_seconds - (self.clock() - self._opened_at)))
+
+    def record(self, failed: bool, slow: bool, is_probe: bool):
+        """
+        Register the outcome of an allowed call
+
+        :param failed:
+        :param slow:
+        :param is_probe:
+        :return:
+        """
+        with self._lock:
+            if is_probe:
+                self._record_probe(failed or slow)
+            elif self.state == CLOSED:
+                self._calls.append((failed, slow))
+                if self._should_open():
+                    self._open()
+
+    def cancel(self, is_probe: bool):
+        """
+        An allowed call has not been made
+
+        :param is_probe:
+        :return:
+        """
+        if is_probe:
+            with self._lock:
+                self._probing = False
+
+    def _record_probe(self, failed: bool):
+        self._probing = False
+        if failed:
+            self._open()
+            return
+
+        self._succeeded_probes += 1
+        if self._succeeded_probes >= self.probes:
+            self._calls.clear()
+            self._set_state(CLOSED)
+
+    def _should_open(self) -> bool:
+        n = len(self._calls)
+        if n < self.min_calls:
+            return False
+        failures = sum(failed for failed, _ in self._calls)
+        slow = sum(slow for _, slow in self._calls)
+        return failures >= self.failure_rate * n or slow >= self.slow_rate * n
+
+    def _open(self):
+        self._opened_at = self.clock()
+        self._succeeded_probes = 0
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Upstream circuit breaker {self.state} => {state}")
+            self.state = state
+            self.state_changes += 1
+
+
+class UpstreamGuard:
+
+    def __init__(self, limit: AdaptiveLimit, breaker: CircuitBreaker, limit_timeout: float, slow_call: float,
+                 enabled: bool = True):
+        """
+        :param limit: the limit on concurrent calls
+        :param breaker:
+        :param limit_timeout: the maximum time in seconds to wait for a slot
+        :param slow_call: a call that takes more than slow_call seconds is slow
+        :param enabled: when not enabled calls are made without any limit
+        """
+        self.limit = limit
+        self.breaker = breaker
+        self.limit_timeout = limit_timeout
+        self.slow_call = slow_call
+        self.enabled = enabled
+
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejected_open = 0
+        self.rejected_limit = 0
+        self._lock = threading.Lock()
+
+    def call(self, func: Callable, *args, **kwargs):
+        """
+        Make the upstream call func(*args, **kwargs)
+
+        :param func: eg cert_post
+        :raises UpstreamUnavailable: when the call is refused
+        :return: the response
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        is_probe = self._allow()
+        self._check_slot(self.limit.acquire(self.limit_timeout), is_probe)
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = func(*args, **kwargs)
+            failed = is_failure(response)
+            return response
+        finally:
+            self._record(failed, time.perf_counter() - start, is_probe)
+
+    async def call_async(self, func: Callable, *args, **kwargs):
+        """
+        Make the asynchronous upstream call await func(*args, **kwargs)
+
+        A call that is cancelled (eg because the client went away) is not counted
+
+        :param func: eg async_cert_post
+        :raises UpstreamUnavailable: when the call is refused
+        :return: the response
+        """
+        if not self.enabled:
+            return await func(*args, **kwargs)
+
+        is_probe = self._allow()
+        self._check_slot(await self._acquire_async(), is_probe)
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await func(*args, **kwargs)
+            failed = is_failure(response)
+            return response
+        except asyncio.CancelledError:
+            self.limit.release(True)
+            self.breaker.cancel(is_probe)
+            start = None
+            raise
+        finally:
+            if start is not None:
+                self._record(failed, time.perf_counter() - start, is_probe)
+
+    def metrics(self) -> dict:
+        """
+        :return: the current state, limit and counters of the guard
+        """
+        return {
+            'state': self.breaker.state,
+            'state_changes': self.breaker.state_changes,
+            'limit': int(self.limit.limit),
+            'in_flight': self.limit.in_flight,
+            'calls': self.calls,
+            'failures': self.failures,
+            'slow_calls': self.slow_calls,
+            'rejected_open': self.rejected_open,
+            'rejected_limit': self.rejected_limit,
+        }
+
+    def _allow(self) -> bool:
+        """
+        Returns if the call is a probe, raises UpstreamUnavailable if the breaker does not allow the call
+        """
+        allowed, is_probe = self.breaker.allow()
+        if not allowed:
+            self._count(rejected_open=1)
+            raise UpstreamUnavailable("Circuit breaker is open", self.breaker.retry_after())
+        return is_probe
+
+    def _check_slot(self, acquired: bool, is_probe: bool):
+        if not acquired:
+            self.breaker.cancel(is_probe)
+            self._count(rejected_limit=1)
+            raise UpstreamUnavailable("Concurrency limit reached", 1)
+
+    async def _acquire_async(self) -> bool:
+        # Waiting for the condition of the limit would block the event loop, poll instead
+        expires_at = time.monotonic() + self.limit_timeout
+        while not self.limit.acquire(0):
+            if time.monotonic() >= expires_at:
+                return False
+            await asyncio.sleep(ASYNC_POLL_INTERVAL)
+        return True
+
+    def _record(self, failed: bool, duration: float, is_probe: bool):
+        slow = duration > self.slow_call
+        self.limit.release(not (failed or slow))
+        self.breaker.record(failed, slow, is_probe)
+        self._count(calls=1, failures=failed, slow_calls=slow)
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+# The guard for all MKS calls of this process
+mks_guard = UpstreamGuard(
+    AdaptiveLimit(UPSTREAM_LIMIT_INITIAL, UPSTREAM_LIMIT_MIN, UPSTREAM_LIMIT_MAX),
+    CircuitBreaker(BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATE, BREAKER_SLOW_RATE,
+                   BREAKER_OPEN_SECONDS, BREAKER_PROBES),
+    limit_timeout=UPSTREAM_LIMIT_TIMEOUT,
+    slow_call=UPSTREAM_SLOW_CALL,
+    enabled=UPSTREAM_GUARD_ENABLED,
+)
@@ -0,0 +1,104 @@
+"""
+URL templates
+
+Building a URL with flask.url_for matches the url rules for every link. Responses with many persons
+and relations contain hundreds of links that are built from the same few rules.
+
+The templates are computed once for every rule of the app, eg:
+
+    hc.brp_ingeschrevenpersonen_bsn => /brp/ingeschrevenpersonen/{bsn}
+
+Building a link then only substitutes the values in the template. The scheme and host prefix
+is computed once per request.
+
+"""
+import re
+from urllib.parse import quote
+
+from flask import Flask, current_app, g, request
+
+EXTENSION_KEY = 'url_templates'
+URL_PREFIX_KEY = 'url_prefix'
+
+# Same characters as werkzeug leaves unquoted in a path segment
+SAFE_CHARS = "!$&'()*+,/:;=@"
+
+# Placeholder that is passed through any url converter unchanged
+_PLACEHOLDER = "URLTEMPLATEARG{}"
+_PLACEHOLDER_PATTERN = re.compile(r"URLTEMPLATEARG(\d+)")
+
+
+class URLTemplate:
+
+    def __init__(self, path: str):
+        """
+        :param path: the path with a placeholder {name} for each argument, eg /brp/ingeschrevenpersonen/{bsn}
+        """
+        self.path = path
+
+    def expand(self, **values) -> str:
+        """
+        Returns the path with the values substituted
+
+        :param values: the value for every argument in the path
+        :return:
+        """
+        return self.path.format_map({k: quote(str(v), safe=SAFE_CHARS) for k, v in values.items()})
+
+    @classmethod
+    def from_rule(cls, rule) -> 'URLTemplate':
+        """
+        Create the template for a url rule
+
+        The rule is built with placeholders for its arguments, so that the path is exactly as url_for builds it
+
+        :param rule: werkzeug url rule
+        :return:
+        """
+        arguments = sorted(rule.arguments)
+        _, path = rule.build({arg: _PLACEHOLDER.format(n) for n, arg in enumerate(arguments)}, append_unknown=False)
+        # Escape any braces in the path itself, they are not placeholders
+        path = path.replace('{', '{{').replace('}', '}}')
+        return cls(_PLACEHOLDER_PATTERN.sub(lambda m: f"{{{arguments[int(m.group(1))]}}}", path))
+
+
+def init_url_templates(app: Flask):
+    """
+    Compute the url templates for all routes of the given app
+
+    Should be called after all blueprints have been registered.
+    Rules with typed arguments (eg <int:id>) get no template.
+
+    :param app:
+    :return:
+    """
+    templates = {}
+    for rule in app.url_map.iter_rules():
+        try:
+            templates[rule.endpoint] = URLTemplate.from_rule(rule)
+        except ValueError:
+            # The rule has a converter that does not accept the placeholder, eg int. Links are built by url_for
+            pass
+    app.extensions[EXTENSION_KEY] = templates
+
+
+def url_prefix() -> str:
+    """
+    Returns the scheme, host and script root of the current request, eg https://acc.api.data.amsterdam.nl
+
+    :return:
+    """
+    if (prefix := g.get(URL_PREFIX_KEY)) is None:
+        prefix = f"{request.scheme}://{request.host}{request.script_root}"
+        setattr(g, URL_PREFIX_KEY, prefix)
+    return prefix
+
+
+def get_url_template(endpoint: str):
+    """
+    Returns the url template for the given endpoint, or None if no template has been computed
+
+    :param endpoint: eg hc.brp_ingeschrevenpersonen_bsn
+    :return:
+    """
+    return current_app.extensions.get(EXTENSION_KEY, {}).get(endpoint)
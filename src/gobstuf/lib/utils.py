@@ -20,3 +20,50 @@ def get_value(dict, *args):
         return reduce(getitem, args, dict)
     except (KeyError, TypeError):
         pass
+
+
+def prune_none_values(obj: dict) -> dict:
+    """
+    Recursively remove None values from a dictionary, in place.
+
+    Nested dictionaries that become empty are removed as well. Lists are kept, but their empty items are removed.
+    The order of the remaining keys is unchanged.
+
+    Example:
+        {'a': None, 'b': {'c': None}, 'd': [{'e': None}, {'f': 1}], 'g': 0} => {'d': [{'f': 1}], 'g': 0}
+
+    :param obj: dictionary, the values in lists should be dictionaries as well
+    :return: the pruned dictionary
+    """
+    empty_keys = [key for key, value in obj.items() if _is_empty_after_prune(value)]
+    for key in empty_keys:
+        del obj[key]
+    return obj
+
+
+def _is_empty_after_prune(value) -> bool:
+    """
+    Prune the value if it is a dictionary or a list and tell if the value should be removed
+
+    :param value:
+    :return: True for None and empty dictionaries
+    """
+    if isinstance(value, dict):
+        return not prune_none_values(value)
+    elif isinstance(value, list):
+        _prune_list(value)
+        return False
+    return value is None
+
+
+def _prune_list(values: list):
+    """
+    Prune the dictionaries in a list and remove the items that become empty, in place.
+
+    :param values:
+    :return:
+    """
+    # Iterate backwards so that items can be deleted while iterating
+    for i in range(len(values) - 1, -1, -1):
+        if not prune_none_values(values[i]):
+            del values[i]
@@ -0,0 +1,88 @@
+"""
+Asynchronous handling of StufRestView requests
+
+Used by the ASGI app (see gobstuf.async_api). The request is handled by the StufRestView with the same request and
+response templates, but the MKS request is made with an asynchronous client. While waiting for MKS no thread is
+used, so one process can have many MKS requests in flight.
+
+Validation, building the MKS request and mapping the MKS response are executed in a thread pool by the request
+runner (see gobstuf.lib.request_runner), in the Flask request context of the request.
+
+"""
+import time
+
+import httpx
+from flask import Response
+
+from gobstuf.certrequest import async_cert_post
+from gobstuf.config import ROUTE_SCHEME, ROUTE_NETLOC, ROUTE_PATH_310
+from gobstuf.lib.deadline import upstream_timeout
+from gobstuf.lib.request_runner import RequestRunner
+from gobstuf.lib.retry import mks_retry
+from gobstuf.lib.timing import record_timing, timed
+from gobstuf.lib.upstream_guard import mks_guard
+from gobstuf.rest.brp.base_view import StufRestView
+from gobstuf.rest.brp.rest_response import RESTResponse
+from gobstuf.stuf.brp.base_request import StufRequest
+
+
+class AsyncStufRestView:
+
+    def __init__(self, view: StufRestView, client: httpx.AsyncClient, runner: RequestRunner):
+        """
+        :param view: the view that handles the request
+        :param client: the client for MKS requests
+        :param runner: executes the view methods in the request context
+        """
+        self.view = view
+        self.client = client
+        self.runner = runner
+
+    async def get(self, **kwargs) -> Response:
+        """Handles the GET request, see StufRestView.get
+
+        :param kwargs: Dictionary with URL parameters
+        :return:
+        """
+        errors = await self.runner.run(self._get_validation_errors, **kwargs)
+        if errors:
+            return self.runner.sync(RESTResponse.bad_request, **errors)
+
+        try:
+            request_template = await self.runner.run(self.view._get_request_template, **kwargs)
+            response = await self._make_request(request_template)
+            return await self.runner.run(self.view._handle_response, response, **kwargs)
+        except Exception as e:
+            return self.runner.sync(self.view._exception_response, e)
+
+    def _get_validation_errors(self, **kwargs) -> dict:
+        with timed('validate'):
+            return self.view._get_validation_errors(**kwargs)
+
+    async def _make_request(self, request_template: StufRequest):
+        """Posts the MKS request, see StufRestView._post
+
+        The request passes the upstream guard and is retried on transient faults.
+        Hedging and the fair share scheduler of the threaded views are not used
+
+        :param request_template:
+        :return:
+        """
+        soap_headers = {
+            'Soapaction': request_template.soap_action,
+            'Content-Type': 'text/xml'
+        }
+        url = f'{ROUTE_SCHEME}://{ROUTE_NETLOC}{ROUTE_PATH_310}'
+        data = request_template.to_string()
+        deadline = self.runner.sync(lambda: self.view.deadline)
+
+        async def attempt():
+            # Every attempt gets the time that remains before the deadline
+            return await mks_guard.call_async(async_cert_post, self.client, url, data=data, headers=soap_headers,
+                                              timeout=upstream_timeout(deadline))
+
+        start = time.perf_counter()
+        try:
+            return await mks_retry.call_async(attempt, deadline)
+        finally:
+            self.runner.sync(record_timing, 'mks', time.perf_counter() - start)
@@ -1,21 +1,48 @@
+import re
 import traceback
 import logging
+from itertools import chain
+from typing import Iterator, Optional
 
 from flask.views import MethodView
 from flask import g, request, Response
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, Timeout
 from abc import abstractmethod
 
+from gobstuf.audit_log import log_incomplete_response
 from gobstuf.certrequest import cert_post
+from gobstuf.lib.deadline import Deadline, DeadlineExceeded, get_deadline, upstream_timeout
+from gobstuf.lib.fair_share import mks_fair_share
+from gobstuf.lib.hedging import mks_hedging
+from gobstuf.lib.retry import mks_retry
+from gobstuf.lib.timing import timed
+from gobstuf.lib.upstream_guard import mks_guard, UpstreamUnavailable
 from gobstuf.auth.routes import MKS_USER_KEY, MKS_APPLICATION_KEY
 from gobstuf.stuf.brp.base_request import StufRequest
 from gobstuf.stuf.brp.base_response import StufMappedResponse
 from gobstuf.stuf.exception import NoStufAnswerException, NoStufAnswerFilterException
 from gobstuf.stuf.brp.error_response import StufErrorResponse, UnknownErrorCode
-from gobstuf.rest.brp.rest_response import RESTResponse
-from gobstuf.config import ROUTE_SCHEME, ROUTE_NETLOC, ROUTE_PATH_310, CORRELATION_ID_HEADER
+from gobstuf.rest.brp.rest_response import RESTResponse, ETAG_VERSION
+from gobstuf.stuf.brp.compact import to_compact
+from gobstuf.config import ROUTE_SCHEME, ROUTE_NETLOC, ROUTE_PATH_310, CORRELATION_ID_HEADER, STREAM_LIST_RESPONSES, \
+    COMPACT_LIST_RESULTS
 from gobstuf.rest.brp.argument_checks import ArgumentCheck
 
+# The stuurgegevens of a StUF message, eg <BG:stuurgegevens>...</BG:stuurgegevens>
+_STUURGEGEVENS = re.compile(rb'<(?P<tag>(?:[\w.-]+:)?stuurgegevens)(?:\s[^>]*)?>.*?</(?P=tag)>', re.DOTALL)
+
+
+def answer_content(content: bytes) -> bytes:
+    """Returns the MKS response without its stuurgegevens
+
+    The stuurgegevens differ for every call (referentienummer, tijdstipBericht and crossRefnummer), the REST
+    response does not depend on them.
+
+    :param content: the MKS response
+    :return:
+    """
+    return _STUURGEGEVENS.sub(b'', content)
+
 
 class StufRestView(MethodView):
     """StufRestView.
@@ -35,7 +62,77 @@ class StufRestView(MethodView):
 
     WILDCARD_CHECKS = [ArgumentCheck.has_min_wildcard_length, ArgumentCheck.is_valid_wildcard_position]
 
+    # Stream list responses to the client while the objects are mapped
+    stream_response = STREAM_LIST_RESPONSES
+
+    # Hold the objects of list responses in the compact representation
+    compact_results = COMPACT_LIST_RESULTS
+
+    # The query parameters of the request, see args
+    _args = None
+
+    @property
+    def args(self):
+        """The query parameters, the request args by default.
+
+        Can be set when the view handles a request that is not given by the url, eg an item of a batch request
+
+        :return:
+        """
+        return request.args if self._args is None else self._args
+
+    @args.setter
+    def args(self, value):
+        self._args = value
+
+    # The deadline of the request, see deadline
+    _deadline = None
+
+    @property
+    def deadline(self) -> Optional[Deadline]:
+        """The deadline, the deadline of the current request by default.
+
+        Can be set when the view is used outside the request thread, eg for the items of a batch request
+
+        :return:
+        """
+        return get_deadline() if self._deadline is None else self._deadline
+
+    @deadline.setter
+    def deadline(self, value):
+        self._deadline = value
+
     def get(self, **kwargs):
+        with timed('validate'):
+            errors = self._get_validation_errors(**kwargs)
+        if errors:
+            return RESTResponse.bad_request(**errors)
+
+        try:
+            return self._get(**kwargs)
+        except Exception as e:
+            return self._exception_response(e)
+
+    def _exception_response(self, exception: Exception) -> Response:
+        """Returns the response for an exception that occurred while handling the request
+
+        Must be called while the exception is handled
+
+        :param exception:
+        :return:
+        """
+        if isinstance(exception, UpstreamUnavailable):
+            logging.warning(f"MKS unavailable: {exception}")
+            return RESTResponse.service_unavailable(retry_after=exception.retry_after)
+        if isinstance(exception, (DeadlineExceeded, Timeout)):
+            logging.warning(f"Request timed out: {exception}")
+            return RESTResponse.gateway_timeout()
+
+        logging.error("ERROR: Request failed:")
+        logging.error(traceback.format_exc())
+        return RESTResponse.internal_server_error()
+
+    def _get_validation_errors(self, **kwargs) -> dict:
         try:
             errors = self._validate(**kwargs)
         except StufRestFilterView.InvalidQueryParametersException as e:
@@ -43,16 +140,7 @@ class StufRestView(MethodView):
 
         assert getattr(self, '_validate_called', False), \
             f"Make sure to call super()._validate() from children of {self.__class__}"
-
-        if errors:
-            return RESTResponse.bad_request(**errors)
-
-        try:
-            return self._get(**kwargs)
-        except Exception:
-            logging.error("ERROR: Request failed:")
-            logging.error(traceback.format_exc())
-            return RESTResponse.internal_server_error()
+        return errors
 
     def _validate_request_args(self, **kwargs):
         """
@@ -64,7 +152,7 @@ class StufRestView(MethodView):
         args = {**self._request_template_parameters(**kwargs)}
 
         # Add other request args (such as functional query parameters)
-        args.update({k: v for k, v in request.args.items() if k not in args})
+        args.update({k: v for k, v in self.args.items() if k not in args})
 
         invalid_params = []
         for arg, value in args.items():
@@ -95,11 +183,9 @@ class StufRestView(MethodView):
         checks = self.request_template.parameter_checks.get(arg)
 
         # If the argument is allowed to have a wildcard, check if the wildcard search is valid
+        # The checks of the request template are shared by all requests, a new list is made
         if arg in self.request_template.parameter_wildcards:
-            if checks:
-                checks.extend(self.WILDCARD_CHECKS)
-            else:
-                checks = self.WILDCARD_CHECKS
+            checks = (checks or []) + self.WILDCARD_CHECKS
 
         if not checks:
             return
@@ -155,13 +241,13 @@ class StufRestView(MethodView):
         return {}
 
     def _get_functional_query_parameters(self):
-        return {k: self._transform_query_parameter_value(request.args.get(k, v))
+        return {k: self._transform_query_parameter_value(self.args.get(k, v))
                 for k, v in self.functional_query_parameters.items()}
 
     def _get_wildcard_query_parameters(self):
-        wildcards = {wildcard_mapping: request.args.get(wildcard_arg)
+        wildcards = {wildcard_mapping: self.args.get(wildcard_arg)
                      for wildcard_arg, wildcard_mapping in self.request_template.parameter_wildcards.items()
-                     if wildcard_arg in request.args}
+                     if wildcard_arg in self.args}
         return {'wildcards': wildcards}
 
     def _get(self, **kwargs):
@@ -173,15 +259,18 @@ class StufRestView(MethodView):
         """
 
         # Request MKS with given request_template
-        request_template = self.request_template(
-            g.get(MKS_USER_KEY),
-            g.get(MKS_APPLICATION_KEY),
-            correlation_id=request.headers.get(CORRELATION_ID_HEADER)
-        )
-        request_template.set_values(self._request_template_parameters(**kwargs))
+        with timed('mks'):
+            response = self._make_request(self._get_request_template(**kwargs))
 
-        response = self._make_request(request_template)
+        return self._handle_response(response, **kwargs)
 
+    def _handle_response(self, response, **kwargs) -> Response:
+        """Returns the REST response for the MKS response
+
+        :param response: the MKS response
+        :param kwargs: Dictionary with URL parameters
+        :return:
+        """
         try:
             response.raise_for_status()
         except HTTPError:
@@ -189,30 +278,122 @@ class StufRestView(MethodView):
             response_obj = StufErrorResponse(response.text)
             return self._error_response(response_obj)
 
-        # Map MKS response back to REST response. Include the path parameters to the response
-        response_obj = self.response_template(response.text,
-                                              **self._get_functional_query_parameters(),
-                                              **self._get_wildcard_query_parameters(),
-                                              **kwargs)
+        # The REST response is determined by the request url, the answer of MKS and the code that maps the answer
+        etag = RESTResponse.etag(ETAG_VERSION, request.url.encode('utf-8'), answer_content(response.content))
+        if tag := RESTResponse.matching_etag(etag):
+            # The client holds the response already, no need to map and serialise it
+            return RESTResponse.not_modified(tag)
+
+        # Map MKS response back to REST response
+        self._check_deadline('parse')
+        with timed('parse'):
+            response_obj = self._get_response_object(response.text, **kwargs)
+
+        return self._build_response(response_obj, etag=etag, **kwargs)
+
+    def _get_request_template(self, **kwargs) -> StufRequest:
+        """Returns the MKS request for the given URL parameters, on behalf of the user of the current request
 
-        return self._build_response(response_obj, **kwargs)
+        :param kwargs: Dictionary with URL parameters
+        :return:
+        """
+        request_template = self.request_template(
+            g.get(MKS_USER_KEY),
+            g.get(MKS_APPLICATION_KEY),
+            correlation_id=request.headers.get(CORRELATION_ID_HEADER)
+        )
+        request_template.set_values(self._request_template_parameters(**kwargs))
+        return request_template
 
-    def _build_response(self, response_obj: StufMappedResponse, **kwargs):
+    def _get_response_object(self, text: str, **kwargs) -> StufMappedResponse:
+        """Returns the mapped MKS response. Includes the path parameters to the response
+
+        :param text: the MKS response
+        :param kwargs: Dictionary with URL parameters
+        :return:
+        """
+        return self.response_template(text,
+                                      **self._get_functional_query_parameters(),
+                                      **self._get_wildcard_query_parameters(),
+                                      **kwargs)
+
+    def _build_response(self, response_obj: StufMappedResponse, etag: str = None, **kwargs):
         """Return single object response by default
 
         Overridden by StufRestFilterView to create a list of objects
 
         :param response_obj:
+        :param etag: identifies the response
         :param kwargs:
         :return:
         """
         try:
-            data = response_obj.get_answer_object()
+            self._check_deadline('map')
+            with timed('map'):
+                data = response_obj.get_answer_object()
         except (NoStufAnswerException, NoStufAnswerFilterException):
             # Return 404, answer section is empty
             return RESTResponse.not_found(detail=self.get_not_found_message(**kwargs))
         else:
-            return RESTResponse.ok(data)
+            self._check_deadline('serialise')
+            return RESTResponse.ok(data, etag=etag)
+
+    def _get_all_answer_objects(self, response_obj: StufMappedResponse) -> list:
+        """Returns all answer objects for a list response
+
+        When compact_results is set, every object is converted to its compact representation as soon as it is
+        produced. Only one object at a time is held as dict.
+
+        :param response_obj:
+        :return:
+        """
+        self._check_deadline('map')
+        with timed('map'):
+            if self.compact_results:
+                return [to_compact(obj) for obj in response_obj.iter_answer_objects()]
+            return response_obj.get_all_answer_objects()
+
+    def _stream_response(self, objects: Iterator[dict], etag: str = None) -> Response:
+        """Returns a streamed list response for the objects, of the format {'_embedded': {self.name: [objects]}}
+
+        The first object is produced before the response is started. Any exception up to that point results
+        in a regular (error) response.
+
+        :param objects: the objects, produced one by one
+        :param etag: identifies the response
+        :return:
+        """
+        objects = iter(objects)
+        first = next(objects, None)
+
+        if first is None:
+            return RESTResponse.ok({'_embedded': {self.name: []}}, {}, etag=etag)
+
+        return RESTResponse.ok_stream(self.name, chain([first], objects), {}, on_error=self._stream_error,
+                                      etag=etag)
+
+    def _stream_error(self, exception: Exception):
+        """Handles an exception that occurs while the response is streamed.
+
+        The status and the first part of the response have already been sent, so the only thing left to do is to
+        register the failure. The response is aborted after this method returns.
+
+        :param exception:
+        :return:
+        """
+        logging.error("ERROR: Request failed while streaming the response:")
+        logging.error(traceback.format_exc())
+        log_incomplete_response(exception)
+
+    def _check_deadline(self, phase: str):
+        """Stops the request if its deadline has passed
+
+        :param phase: the phase that is about to start
+        :raises DeadlineExceeded:
+        :return:
+        """
+        if self.deadline:
+            self.deadline.check(phase)
 
     def _make_request(self, request_template: StufRequest):
         """Makes the MKS request
@@ -220,13 +401,36 @@ class StufRestView(MethodView):
         :param request_template:
         :return:
         """
+        return self._post(request_template.soap_action, request_template.to_string(), request_template.applicatie)
+
+    def _post(self, soap_action: str, data: str, application: str = None):
+        """Posts the StUF message to MKS
+
+        The query is admitted within the fair share of its application, see mks_fair_share.
+        The request passes the upstream guard, which raises UpstreamUnavailable if MKS should not be called.
+        The connect and read timeouts are limited by the deadline. Slow queries may be hedged, see mks_hedging.
+        Queries that are answered with a transient fault are retried, see mks_retry
+
+        :param soap_action:
+        :param data: the StUF message
+        :param application: the MKS application (fp_ role) on whose behalf the message is posted
+        :return:
+        """
         soap_headers = {
-            'Soapaction': request_template.soap_action,
+            'Soapaction': soap_action,
             'Content-Type': 'text/xml'
         }
         url = f'{ROUTE_SCHEME}://{ROUTE_NETLOC}{ROUTE_PATH_310}'
 
-        return cert_post(url, data=request_template.to_string(), headers=soap_headers)
+        def attempt():
+            # Every attempt gets the time that remains before the deadline
+            return mks_guard.call(cert_post, url, data=data, headers=soap_headers,
+                                  timeout=upstream_timeout(self.deadline))
+
+        def query():
+            return mks_retry.call(lambda: mks_hedging.call(soap_action, attempt), self.deadline)
+
+        return mks_fair_share.call(application, query, self.deadline)
 
     def _error_response(self, response_obj: StufErrorResponse):
         """Builds the error response based on the error response received from MKS
@@ -358,7 +562,7 @@ class StufRestFilterView(StufRestView):
             "code": "paramsRequired",
         }
 
-    def _build_response(self, response_obj: StufMappedResponse, **kwargs):
+    def _build_response(self, response_obj: StufMappedResponse, etag: str = None, **kwargs):
         """Returns the REST response, of the format:
 
         _embedded: {
@@ -370,15 +574,20 @@ class StufRestFilterView(StufRestView):
         }
 
         :param response_obj:
+        :param etag: identifies the response
         :param kwargs:
         :return:
         """
-        data = response_obj.get_all_answer_objects()
+        if self.stream_response:
+            return self._stream_response(response_obj.iter_answer_objects(), etag=etag)
+
+        data = self._get_all_answer_objects(response_obj)
+        self._check_deadline('serialise')
         return RESTResponse.ok({
             '_embedded': {
                 self.name: data,
             }
-        }, {})
+        }, {}, etag=etag)
 
     def _get_query_parameters(self) -> dict:
         """Returns the query parameters as k:v pairs. Returns only the parameters that are in the first matching
@@ -397,11 +606,11 @@ class StufRestFilterView(StufRestView):
         :return:
         """
         for combination in self.query_parameter_combinations:
-            args = {arg: self._transform_query_parameter_value(request.args.get(arg)) for arg in combination}
+            args = {arg: self._transform_query_parameter_value(self.args.get(arg)) for arg in combination}
             if all(args.values()):
                 # Get all optional query parameters with their values
                 optional_args = {k: v for k, v in {
-                    arg: self._transform_query_parameter_value(request.args.get(arg))
+                    arg: self._transform_query_parameter_value(self.args.get(arg))
                     for arg in self.optional_query_parameters
                 }.items() if v}
 
@@ -463,12 +672,16 @@ class StufRestViewAsList(StufRestView):
         """
         pass
 
-    def _build_response(self, response_obj: StufMappedResponse, **kwargs) -> Response:
+    def _build_response(self, response_obj: StufMappedResponse, etag: str = None, **kwargs) -> Response:
         try:
-            data = response_obj.get_all_answer_objects()
+            if self.stream_response:
+                return self._stream_response(response_obj.iter_answer_objects(), etag=etag)
+
+            data = self._get_all_answer_objects(response_obj)
         except NoStufAnswerException:
             return RESTResponse.not_found(detail=self.get_not_found_message(**kwargs))
         except NoStufAnswerFilterException:
             data = []
 
-        return RESTResponse.ok(data={"_embedded": {self.name: data}}, links={})
+        self._check_deadline('serialise')
+        return RESTResponse.ok(data={"_embedded": {self.name: data}}, links={}, etag=etag)
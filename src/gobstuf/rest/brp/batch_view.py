@@ -0,0 +1,305 @@
+"""
+Batch requests
+
+Looks up many objects in one request, eg:
+
+    POST /brp/ingeschrevenpersonen/batch
+    {
+        "burgerservicenummers": ["999999990", "999999991", ...],
+        "expand": "partners,ouders"
+    }
+
+Every object is requested by the item view (eg IngeschrevenpersonenBsnView) that serves the single
+object requests. The item view validates the parameters and maps the MKS response, exactly as for
+a single request. Only the MKS requests are executed concurrently, at most BATCH_CONCURRENCY at a time.
+
+The response contains a result for every requested object, in the requested order:
+
+    {
+        "_embedded": {
+            "ingeschrevenpersonen": [
+                {"burgerservicenummer": "999999990", "status": 200, "ingeschrevenpersoon": {...}},
+                {"burgerservicenummer": "999999991", "status": 404, "fout": {...}},
+            ]
+        },
+        "_links": {...}
+    }
+
+"""
+import logging
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from abc import abstractmethod
+from flask import request, Response
+from flask.views import MethodView
+from requests.exceptions import HTTPError, Timeout
+
+from gobstuf.config import BATCH_CONCURRENCY, BATCH_MAX_SIZE
+from gobstuf.lib.deadline import DeadlineExceeded, get_deadline
+from gobstuf.lib.timing import timed
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+from gobstuf.rest.brp.base_view import StufRestView
+from gobstuf.rest.brp.rest_response import RESTResponse, HTTP_200_OK
+from gobstuf.stuf.brp.error_response import StufErrorResponse
+from gobstuf.stuf.exception import NoStufAnswerException, NoStufAnswerFilterException
+
+
+def query_parameter_value(value) -> str:
+    """Returns the query string representation of a JSON value, eg true => 'true', ['a', 'b'] => 'a,b'
+
+    :param value:
+    :return:
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, list):
+        return ','.join(query_parameter_value(v) for v in value)
+    return str(value)
+
+
+class StufRestBatchView(MethodView):
+    """StufRestBatchView
+
+    Requests a list of objects with an item view, one MKS request per object.
+
+    Should be extended with an item_view, the name of the key in the request (keys),
+    the url parameter of the item view (key) and the name of the item in the result (item_name).
+    """
+
+    # Maximum number of concurrent MKS requests for one batch
+    concurrency = BATCH_CONCURRENCY
+
+    # Maximum number of objects in one batch
+    max_size = BATCH_MAX_SIZE
+
+    # Optional RateLimiter for the MKS requests
+    rate_limiter = None
+
+    def post(self):
+        body = request.get_json(silent=True)
+
+        errors = self._validate(body)
+        if errors:
+            return RESTResponse.bad_request(**errors)
+
+        try:
+            return self._batch(body)
+        except Exception:
+            logging.error("ERROR: Batch request failed:")
+            logging.error(traceback.format_exc())
+            return RESTResponse.internal_server_error()
+
+    def _validate(self, body) -> dict:
+        """Validates the batch request
+
+        The keys should be a non-empty list of at most max_size strings.
+        The other parameters are the query parameters for every item, they are validated by the item view.
+
+        :param body: the JSON request body
+        :return: the errors, or an empty dict when the request is valid
+        """
+        keys = body.get(self.keys) if isinstance(body, dict) else None
+        if not (isinstance(keys, list) and keys and all(isinstance(key, str) for key in keys)):
+            return {
+                'invalid-params': self.keys,
+                'title': 'De opgegeven batch is niet correct.',
+                'detail': f'Geef een lijst van {self.keys} op.',
+                'code': 'paramsRequired',
+            }
+
+        if len(keys) > self.max_size:
+            return {
+                'invalid-params': self.keys,
+                'title': 'De opgegeven batch is te groot.',
+                'detail': f'Geef maximaal {self.max_size} {self.keys} op.',
+                'code': 'paramsValidation',
+            }
+
+        view = self._get_item_view(self._get_args(body))
+        return view._validate()
+
+    def _get_args(self, body: dict) -> dict:
+        """Returns the query parameters for every item, as they would be given in the query string
+
+        :param body:
+        :return:
+        """
+        return {k: query_parameter_value(v) for k, v in body.items() if k != self.keys and v is not None}
+
+    def _get_item_view(self, args: dict) -> StufRestView:
+        view = self.item_view()
+        view.args = args
+        # The MKS requests are made in other threads, outside the request context
+        view.deadline = get_deadline()
+        return view
+
+    def _batch(self, body: dict) -> Response:
+        """Requests all items and returns the list of results
+
+        :param body: the validated JSON request body
+        :return:
+        """
+        return RESTResponse.ok({
+            '_embedded': {
+                self.name: self._get_results(self._get_args(body), body[self.keys])
+            }
+        })
+
+    def _get_results(self, args: dict, keys: list) -> list:
+        """Requests all items and returns the results, in the order of the keys
+
+        Duplicate keys are requested once
+
+        :param args: the query parameters for every item
+        :param keys:
+        :return:
+        """
+        keys = list(dict.fromkeys(keys))
+        views = {key: self._get_item_view(args) for key in keys}
+
+        # Validate every item and build the MKS requests in the request context
+        results = {}
+        messages = {}
+        for key, view in views.items():
+            if errors := view._validate(**{self.key: key}):
+                results[key] = RESTResponse.bad_request(**errors)
+            else:
+                request_template = view._get_request_template(**{self.key: key})
+                messages[key] = (request_template.soap_action, request_template.to_string(),
+                                 request_template.applicatie)
+
+        responses = self._make_requests(views, messages)
+
+        # Map the MKS responses in the request context
+        for key, future in responses.items():
+            results[key] = self._get_result(views[key], key, future)
+
+        return [self._format_result(key, results[key]) for key in keys]
+
+    def _make_requests(self, views: dict, messages: dict) -> dict:
+        """Posts the messages to MKS, at most concurrency requests at a time
+
+        :param views: the item view for every key
+        :param messages: the soap action, message and application for every key
+        :return: the completed MKS request (future) for every key
+        """
+        if not messages:
+            return {}
+
+        with timed('mks'), ThreadPoolExecutor(max_workers=min(self.concurrency, len(messages))) as executor:
+            return {key: executor.submit(self._post_item, views[key], message) for key, message in messages.items()}
+
+    def _post_item(self, view: StufRestView, message: tuple):
+        """Posts the message for an item to MKS, within the rate limit if any
+
+        :param view: the item view
+        :param message: the soap action, message and application
+        :return:
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        return view._post(*message)
+
+    def _get_result(self, view: StufRestView, key: str, future: Future):
+        """Returns the mapped object for the MKS request, or the error response
+
+        :param view: the item view
+        :param key:
+        :param future: the completed MKS request
+        :return:
+        """
+        try:
+            return self._get_answer_object(view, key, future.result())
+        except UpstreamUnavailable as e:
+            return RESTResponse.service_unavailable(retry_after=e.retry_after)
+        except (DeadlineExceeded, Timeout):
+            return RESTResponse.gateway_timeout()
+        except Exception:
+            logging.error(f"ERROR: Batch item {key} failed:")
+            logging.error(traceback.format_exc())
+            return RESTResponse.internal_server_error()
+
+    def _get_answer_object(self, view: StufRestView, key: str, response):
+        """Returns the mapped object for the MKS response, or the error response
+
+        :param view: the item view
+        :param key:
+        :param response: the MKS response
+        :return:
+        """
+        try:
+            response.raise_for_status()
+        except HTTPError:
+            # Received error status code from MKS
+            return view._error_response(StufErrorResponse(response.text))
+
+        try:
+            return view._get_response_object(response.text, **{self.key: key}).get_answer_object()
+        except (NoStufAnswerException, NoStufAnswerFilterException):
+            return RESTResponse.not_found(detail=view.get_not_found_message(**{self.key: key}))
+
+    def _format_result(self, key: str, result) -> dict:
+        """Formats the result for a key
+
+        :param key:
+        :param result: the mapped object or the error response
+        :return:
+        """
+        if isinstance(result, Response):
+            return {self.key_name: key, 'status': result.status_code, 'fout': result.get_json()}
+        return {self.key_name: key, 'status': HTTP_200_OK, self.item_name: result}
+
+    @property
+    @abstractmethod
+    def item_view(self) -> type:
+        """The view class that requests a single object, eg IngeschrevenpersonenBsnView
+
+        :return:
+        """
+        pass  # pragma: no cover
+
+    @property
+    @abstractmethod
+    def keys(self) -> str:
+        """The name of the list of keys in the request body, eg burgerservicenummers
+
+        :return:
+        """
+        pass  # pragma: no cover
+
+    @property
+    @abstractmethod
+    def key(self) -> str:
+        """The URL parameter of the item view, eg bsn
+
+        :return:
+        """
+        pass  # pragma: no cover
+
+    @property
+    @abstractmethod
+    def key_name(self) -> str:
+        """The name of the key in a result, eg burgerservicenummer
+
+        :return:
+        """
+        pass  # pragma: no cover
+
+    @property
+    @abstractmethod
+    def item_name(self) -> str:
+        """The name of the object in a result, eg ingeschrevenpersoon
+
+        :return:
+        """
+        pass  # pragma: no cover
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """The name of the list of results, eg ingeschrevenpersonen
+
+        :return:
+        """
+        pass  # pragma: no cover
@@ -0,0 +1,215 @@
+"""
+Export jobs
+
+Exports large numbers of persons asynchronously:
+
+    POST /brp/ingeschrevenpersonen/exports
+    {
+        "burgerservicenummers": ["999999990", "999999991", ...],
+        "expand": "partners"
+    }
+
+or with a list of searches, each with the query parameters of a search request:
+
+    POST /brp/ingeschrevenpersonen/exports
+    {
+        "zoekvragen": [{"verblijfplaats__postcode": "1011PN", "verblijfplaats__huisnummer": 1}, ...]
+    }
+
+The response (202 Accepted) contains the status of the job. The status can be requested at
+/brp/ingeschrevenpersonen/exports/<job_id>. Once the job is done, the result can be downloaded as NDJSON
+(one JSON document per line) from /brp/ingeschrevenpersonen/exports/<job_id>/resultaat.
+
+Jobs can only be requested by the application (functieprofiel) that has submitted the job.
+
+"""
+from flask import current_app, g, request, send_file
+from flask.views import MethodView
+
+from gobstuf.auth.routes import MKS_USER_KEY, MKS_APPLICATION_KEY, get_auth_url
+from gobstuf.config import EXPORT_MAX_SIZE, EXPORT_RETENTION_HOURS
+from gobstuf.export.exporters import EXPORTERS, BSN_EXPORT, SEARCH_EXPORT
+from gobstuf.export.jobs import ExportJob, DONE, delete_expired_jobs
+from gobstuf.export.worker import get_worker_pool
+from gobstuf.rest.brp.batch_view import query_parameter_value
+from gobstuf.rest.brp.rest_response import RESTResponse
+from gobstuf.rest.brp.views import IngeschrevenpersonenBsnView
+
+# Seconds after which a client can retry a job that is not accepted because too many jobs are queued
+RETRY_AFTER = 60
+
+
+def _worker_pool():
+    return get_worker_pool(current_app._get_current_object(), EXPORTERS)
+
+
+def _job_status(job: ExportJob) -> tuple[dict, dict]:
+    """
+    Returns the status of a job and its links
+
+    :param job:
+    :return:
+    """
+    progress = job.progress
+    status = {
+        'id': job.id,
+        'status': progress['state'],
+        'totaal': progress['total'],
+        'verwerkt': progress['processed'],
+        'regels': progress['lines'],
+    }
+    if error := progress.get('error'):
+        status['fout'] = error
+
+    links = {'self': {'href': get_auth_url('brp_ingeschrevenpersonen_export', job_id=job.id)}}
+    if progress['state'] == DONE:
+        links['resultaat'] = {'href': get_auth_url('brp_ingeschrevenpersonen_export_resultaat', job_id=job.id)}
+    return status, links
+
+
+class ExportJobsView(MethodView):
+    """ExportJobsView
+
+    Submits export jobs
+    """
+
+    # Maximum number of items in one job
+    max_size = EXPORT_MAX_SIZE
+
+    def post(self):
+        body = request.get_json(silent=True)
+
+        errors = self._validate(body)
+        if errors:
+            return RESTResponse.bad_request(**errors)
+
+        delete_expired_jobs(EXPORT_RETENTION_HOURS * 3600)
+
+        export_type = BSN_EXPORT if BSN_EXPORT in body else SEARCH_EXPORT
+        job = ExportJob.create(self._get_spec(export_type, body), total=len(body[export_type]))
+
+        if not _worker_pool().submit(job):
+            job.delete()
+            return RESTResponse.service_unavailable(
+                retry_after=RETRY_AFTER,
+                detail='Er staan te veel exports klaar om te worden uitgevoerd. Probeer het later opnieuw.'
+            )
+
+        status, links = _job_status(job)
+        return RESTResponse.accepted(status, links, location=links['self']['href'])
+
+    def _validate(self, body) -> dict:
+        """Validates the export request
+
+        Either a non-empty list of burgerservicenummers or a non-empty list of searches should be given.
+        The other parameters are validated as for a single person request.
+
+        :param body: the JSON request body
+        :return: the errors, or an empty dict when the request is valid
+        """
+        if not isinstance(body, dict) or not self._is_valid_items(body):
+            return {
+                'invalid-params': f'{BSN_EXPORT}, {SEARCH_EXPORT}',
+                'title': 'De opgegeven export is niet correct.',
+                'detail': f'Geef een lijst van {BSN_EXPORT} of een lijst van {SEARCH_EXPORT} op.',
+                'code': 'paramsRequired',
+            }
+
+        if len(body.get(BSN_EXPORT) or body[SEARCH_EXPORT]) > self.max_size:
+            return {
+                'invalid-params': f'{BSN_EXPORT}, {SEARCH_EXPORT}',
+                'title': 'De opgegeven export is te groot.',
+                'detail': f'Geef maximaal {self.max_size} {BSN_EXPORT} of {SEARCH_EXPORT} op.',
+                'code': 'paramsValidation',
+            }
+
+        view = IngeschrevenpersonenBsnView()
+        view.args = self._get_args(body)
+        return view._validate()
+
+    def _is_valid_items(self, body: dict) -> bool:
+        bsns, searches = body.get(BSN_EXPORT), body.get(SEARCH_EXPORT)
+        if (bsns is None) == (searches is None):
+            return False
+        elif bsns is not None:
+            return isinstance(bsns, list) and bool(bsns) and all(isinstance(bsn, str) for bsn in bsns)
+        return isinstance(searches, list) and bool(searches) and all(isinstance(search, dict) for search in searches)
+
+    def _get_args(self, body: dict) -> dict:
+        """Returns the query parameters for every item
+
+        :param body:
+        :return:
+        """
+        return {k: query_parameter_value(v) for k, v in body.items()
+                if k not in (BSN_EXPORT, SEARCH_EXPORT) and v is not None}
+
+    def _get_spec(self, export_type: str, body: dict) -> dict:
+        """Returns the specification of the job
+
+        The job is executed in the context of this request: the same user, application and url
+
+        :param export_type:
+        :param body:
+        :return:
+        """
+        items = body[export_type]
+        if export_type == SEARCH_EXPORT:
+            items = [{k: query_parameter_value(v) for k, v in search.items() if v is not None} for search in items]
+
+        return {
+            'type': export_type,
+            'items': items,
+            'args': self._get_args(body),
+            'user': g.get(MKS_USER_KEY),
+            'application': g.get(MKS_APPLICATION_KEY),
+            'base_url': request.url_root,
+            'path': request.path,
+            'endpoint': request.endpoint,
+        }
+
+
+class ExportJobView(MethodView):
+    """ExportJobView
+
+    Returns the status of an export job
+    """
+
+    def get(self, job_id: str):
+        job = self._get_job(job_id)
+        if not job:
+            return RESTResponse.not_found(detail=f"Export niet gevonden met id {job_id}.")
+
+        status, links = _job_status(job)
+        return RESTResponse.ok(status, links)
+
+    def _get_job(self, job_id: str):
+        """Returns the job, if it exists and has been submitted by the application of the current request
+
+        Starts the worker pool if it has not been started yet, so that jobs are resumed after a restart
+
+        :param job_id:
+        :return:
+        """
+        _worker_pool()
+        job = ExportJob.get(job_id)
+        if job and job.spec['application'] == g.get(MKS_APPLICATION_KEY):
+            return job
+
+
+class ExportJobResultView(ExportJobView):
+    """ExportJobResultView
+
+    Returns the result of an export job as NDJSON
+    """
+
+    def get(self, job_id: str):
+        job = self._get_job(job_id)
+        if not job:
+            return RESTResponse.not_found(detail=f"Export niet gevonden met id {job_id}.")
+
+        if job.state != DONE:
+            return RESTResponse.conflict(detail=f"Het resultaat van export {job_id} is nog niet beschikbaar.")
+
+        return send_file(job.result_path, mimetype='application/x-ndjson', as_attachment=True,
+                         download_name=f'{job.id}.ndjson')
@@ -2,20 +2,62 @@
 Formatting of all REST responses
 
 """
-import json
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Optional
 
-from flask import Response, request
+from flask import Response, request, stream_with_context
+
+from gobstuf.compression import decode_etag
+from gobstuf.lib.timing import timed
+from gobstuf.rest.brp.serializer import get_serializer
 
 
 HTTP_200_OK = 200
+HTTP_202_ACCEPTED = 202
+HTTP_304_NOT_MODIFIED = 304
 HTTP_400_BAD_REQUEST = 400
 HTTP_403_FORBIDDEN = 403
 HTTP_404_NOT_FOUND = 404
+HTTP_409_CONFLICT = 409
 HTTP_500_INTERNAL_SERVER_ERROR = 500
+HTTP_503_SERVICE_UNAVAILABLE = 503
+HTTP_504_GATEWAY_TIMEOUT = 504
+
+# Not Modified is only a valid response to these methods
+CONDITIONAL_METHODS = {'GET', 'HEAD'}
+
+
+def representation_version(directory: str) -> bytes:
+    """
+    Returns the version of the representation of the responses: a hash of the code that maps and formats them
+
+    Mappings, filters, link templates and their configuration (eg BAG_API_URL) are all part of the code. A deploy
+    that changes the code therefore changes the entity tags of all responses.
+
+    :param directory: the directory of the code, eg the gobstuf package
+    :return:
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(Path(directory).rglob('*.py')):
+        digest.update(os.fsencode(path.relative_to(directory)))
+        digest.update(path.read_bytes())
+    return digest.hexdigest().encode('ascii')
+
+
+# The version of the representation, part of every entity tag that is derived from an MKS answer
+ETAG_VERSION = representation_version(str(Path(__file__).parents[2]))
 
 
 class RESTResponse():
 
+    # The serializer that is used to serialise all JSON responses
+    serializer = get_serializer()
+
+    # Responses contain personal data and should only be stored by the client, after revalidation
+    cache_control = 'private, no-cache'
+
     @classmethod
     def _json_response(cls, data, **kwargs):
         """
@@ -25,7 +67,9 @@ class RESTResponse():
         :param kwargs:
         :return:
         """
-        return Response(response=json.dumps(data), **kwargs)
+        with timed('serialise'):
+            body = cls.serializer.dumps(data)
+        return Response(response=body, **kwargs)
 
     @classmethod
     def _client_error_response(cls, data, status, **kwargs):
@@ -44,7 +88,10 @@ class RESTResponse():
             401: {'code': 'authentication', 'description': 'Unauthorized',          'sec': '10.4.2'},
             403: {'code': 'autorisation',   'description': 'Forbidden',             'sec': '10.4.4'},
             404: {'code': 'notFound',       'description': 'Not Found',             'sec': '10.4.5'},
+            409: {'code': 'conflict',       'description': 'Conflict',              'sec': '10.4.10'},
             500: {'code': 'serverError',    'description': 'Internal Server Error', 'sec': '10.5.1'},
+            503: {'code': 'notAvailable',   'description': 'Service Unavailable',   'sec': '10.5.4'},
+            504: {'code': 'timeout',        'description': 'Gateway Timeout',       'sec': '10.5.5'},
         }[status]
 
         sec = f'{status_info["sec"]} {status} {status_info["description"]}'
@@ -64,36 +111,166 @@ class RESTResponse():
                                   **kwargs)
 
     @classmethod
-    def _hal(cls, data, links=None):
+    def _hal_links(cls, links=None):
         """
-        Add Hypertext Application Language links to the given data
+        Hypertext Application Language links for the given data, including the link to self
 
-        :param data:
+        :param links:
         :return:
         """
-        data = {
-            '_links': {
-                'self': {
-                    'href': request.url
-                },
-                **(links or {})
+        return {
+            'self': {
+                'href': request.url
             },
-            **data
+            **(links or {})
         }
-        return data
 
     @classmethod
-    def ok(cls, data, links=None):
+    def etag(cls, *parts: bytes) -> str:
+        """
+        Strong entity tag for the given parts, eg the serialised body or the request url and the upstream answer
+
+        :param parts:
+        :return:
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            # Prefix every part with its length so that different parts never give the same hash
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    @classmethod
+    def matching_etag(cls, etag: str) -> Optional[str]:
+        """
+        Returns the entity tag in the If-None-Match request header that matches etag, if any
+
+        Tags of compressed representations match as well, the content of the representations is the same.
+        The header is ignored for other methods than GET and HEAD, eg the POST of a batch.
+
+        :param etag:
+        :return:
+        """
+        if request.method not in CONDITIONAL_METHODS:
+            return None
+        for tag in request.if_none_match.as_set(include_weak=True):
+            if decode_etag(tag) == etag:
+                return tag
+
+    @classmethod
+    def _cacheable(cls, response: Response, etag: str):
+        """
+        Add the validator and caching directives to a response
+
+        :param response:
+        :param etag:
+        :return:
+        """
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cls.cache_control
+        return response
+
+    @classmethod
+    def not_modified(cls, etag: str):
+        """
+        Not Modified: the representation that the client holds, identified by etag, is still valid
+
+        :param etag: the matching tag from the If-None-Match request header
+        :return:
+        """
+        return cls._cacheable(Response(status=HTTP_304_NOT_MODIFIED), etag)
+
+    @classmethod
+    def ok(cls, data, links=None, etag: str = None):
         """
         An OK response returns the data in HAL JSON format
 
+        The HAL envelope is serialised around the data, the data itself is not copied
+
+        The response is identified by etag, or by the hash of the serialised body if no etag is given.
+        If the client already holds the response, Not Modified is returned.
+
+        :param data:
+        :param links:
+        :param etag:
+        :return:
+        """
+        if etag and (tag := cls.matching_etag(etag)):
+            return cls.not_modified(tag)
+
+        with timed('serialise'):
+            body = cls.serializer.dumps_hal(data, cls._hal_links(links))
+
+        if not etag:
+            etag = cls.etag(body)
+            if tag := cls.matching_etag(etag):
+                return cls.not_modified(tag)
+
+        return cls._cacheable(Response(response=body,
+                                       content_type='application/hal+json',
+                                       status=HTTP_200_OK), etag)
+
+    @classmethod
+    def accepted(cls, data, links=None, location: str = None):
+        """
+        Accepted: the request has been accepted for processing, the data describes its status
+
         :param data:
+        :param links:
+        :param location: the url where the status can be requested
         :return:
         """
-        hal_data = cls._hal(data, links)
-        return cls._json_response(data=hal_data,
-                                  content_type='application/hal+json',
-                                  status=HTTP_200_OK)
+        with timed('serialise'):
+            body = cls.serializer.dumps_hal(data, cls._hal_links(links))
+
+        response = Response(response=body, content_type='application/hal+json', status=HTTP_202_ACCEPTED)
+        if location:
+            response.headers['Location'] = location
+        return response
+
+    @classmethod
+    def ok_stream(cls, name: str, objects: Iterable[dict], links=None, on_error: Callable[[Exception], None] = None,
+                  etag: str = None):
+        """
+        An OK response that returns the objects as embedded list in HAL JSON format:
+
+        {'_links': {...}, '_embedded': {name: [objects]}}
+
+        The response is streamed; each object is serialised and sent as soon as it is produced.
+        If producing an object fails, on_error is called and the response is aborted. As the status
+        has already been sent, the client receives an incomplete (invalid) response.
+
+        :param name: name of the embedded list
+        :param objects: the objects, normally a generator
+        :param links:
+        :param on_error: called with the exception that occurs while streaming
+        :param etag: identifies the response, the body is not known in advance
+        :return:
+        """
+        serializer = cls.serializer
+        # Serialise the envelope around an empty list and write the objects in between
+        envelope = serializer.dumps_hal({'_embedded': {name: []}}, cls._hal_links(links))
+        head, tail = envelope[:-3], envelope[-3:]
+
+        def generate():
+            yield head
+            separator = b''
+            try:
+                for obj in objects:
+                    with timed('serialise'):
+                        chunk = separator + serializer.dumps(obj)
+                    yield chunk
+                    separator = b','
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+                raise
+            yield tail
+
+        response = Response(response=stream_with_context(generate()),
+                            content_type='application/hal+json',
+                            status=HTTP_200_OK)
+        return cls._cacheable(response, etag) if etag else response
 
     @classmethod
     def bad_request(cls, **kwargs):
@@ -141,6 +318,55 @@ class RESTResponse():
         }
         return cls._client_error_response(data=data, status=HTTP_404_NOT_FOUND)
 
+    @classmethod
+    def conflict(cls, **kwargs):
+        """
+        Conflict: The request could not be completed due to the current state of the resource
+
+        :param kwargs:
+        :return:
+        """
+        data = {
+            'title': 'De resource is niet in de juiste toestand.',
+            'detail': 'The request could not be completed due to a conflict with the current state of the resource.',
+            **kwargs
+        }
+        return cls._client_error_response(data=data, status=HTTP_409_CONFLICT)
+
+    @classmethod
+    def service_unavailable(cls, retry_after: int = None, **kwargs):
+        """
+        Service Unavailable: The server is currently unable to handle the request due to a temporary overloading
+
+        :param retry_after: the number of seconds after which the client can retry the request
+        :param kwargs:
+        :return:
+        """
+        data = {
+            'title': 'De service is tijdelijk niet beschikbaar.',
+            'detail': 'The server is currently unable to handle the request due to a temporary overloading.',
+            **kwargs
+        }
+        response = cls._client_error_response(data=data, status=HTTP_503_SERVICE_UNAVAILABLE)
+        if retry_after is not None:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @classmethod
+    def gateway_timeout(cls, **kwargs):
+        """
+        Gateway Timeout: The request could not be completed within its deadline, or MKS did not answer in time
+
+        :param kwargs:
+        :return:
+        """
+        data = {
+            'title': 'De aanvraag kon niet op tijd worden afgehandeld.',
+            'detail': 'The server did not receive a timely response from the upstream server.',
+            **kwargs
+        }
+        return cls._client_error_response(data=data, status=HTTP_504_GATEWAY_TIMEOUT)
+
     @classmethod
     def internal_server_error(cls, **kwargs):
         data = {
@@ -0,0 +1,97 @@
+"""
+JSON serialisation of REST responses
+
+The fastest available encoder is used: orjson if it is installed, the standard library json module otherwise.
+Both encoders produce compact output (no whitespace) and keep the order of the keys.
+
+Compact result objects (see gobstuf.stuf.brp.compact) are written directly by orjson. The json module
+cannot embed raw JSON, it serialises the dict representation of nested compact objects.
+
+"""
+import json
+
+from gobstuf.stuf.brp.compact import CompactObject
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONSerializer:
+    """
+    Serializer based on the standard library json module
+    """
+    name = 'json'
+
+    def dumps(self, data) -> bytes:
+        """
+        Serialise data to compact UTF-8 encoded JSON
+
+        :param data:
+        :return:
+        """
+        if isinstance(data, CompactObject):
+            return data.to_json()
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=self._default).encode('utf-8')
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, CompactObject):
+            return obj.to_dict()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def dumps_hal(self, data: dict, links: dict) -> bytes:
+        """
+        Serialise data in a HAL envelope, equal to dumps({'_links': links, **data})
+
+        The envelope is built from the serialised parts, the data dict itself is not copied.
+        When data contains its own _links, these replace the given links (at the first position).
+
+        :param data:
+        :param links:
+        :return:
+        """
+        if '_links' in data:
+            links = data['_links']
+            data = {k: v for k, v in data.items() if k != '_links'}
+
+        body = self.dumps(data)
+        envelope = b'{"_links":' + self.dumps(links)
+        # body is at least '{}'; append its members to the envelope
+        return envelope + (b',' + body[1:] if len(body) > 2 else b'}')
+
+
+class OrjsonSerializer(JSONSerializer):
+    """
+    Serializer based on the native orjson encoder
+    """
+    name = 'orjson'
+
+    def dumps(self, data) -> bytes:
+        return orjson.dumps(data, default=self._default)
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, CompactObject):
+            return orjson.Fragment(obj.to_json())
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in [JSONSerializer, OrjsonSerializer]}
+
+
+def get_serializer(name: str = None) -> JSONSerializer:
+    """
+    Get a serializer by name, or the fastest available serializer if no name is given
+
+    :param name: 'json' or 'orjson'
+    :return: serializer instance
+    """
+    if name is None:
+        name = OrjsonSerializer.name if orjson else JSONSerializer.name
+
+    if name == OrjsonSerializer.name and not orjson:
+        raise ImportError("orjson serializer requested but orjson is not installed")
+
+    return SERIALIZERS[name]()
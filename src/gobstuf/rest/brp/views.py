@@ -1,4 +1,5 @@
 from gobstuf.rest.brp.base_view import StufRestView, StufRestFilterView, StufRestViewAsList
+from gobstuf.rest.brp.batch_view import StufRestBatchView
 from gobstuf.stuf.brp.request.ingeschrevenpersonen import (
     IngeschrevenpersonenBsnStufRequest,
     IngeschrevenpersonenBsnPartnerStufRequest,
@@ -78,6 +79,16 @@ class IngeschrevenpersonenBsnView(IngeschrevenpersonenView):
         return f"Ingeschreven persoon niet gevonden met burgerservicenummer {kwargs['bsn']}."
 
 
+class IngeschrevenpersonenBatchView(StufRestBatchView):
+    item_view = IngeschrevenpersonenBsnView
+
+    keys = 'burgerservicenummers'
+    key = 'bsn'
+    key_name = 'burgerservicenummer'
+    item_name = 'ingeschrevenpersoon'
+    name = 'ingeschrevenpersonen'
+
+
 class IngeschrevenpersonenBsnPartnerListView(IngeschrevenpersonenBsnView):
     response_template = IngeschrevenpersonenStufPartnersListResponse
 
@@ -1,5 +1,6 @@
 from gobstuf.rest.brp.views import (
     IngeschrevenpersonenBsnView,
+    IngeschrevenpersonenBatchView,
     IngeschrevenpersonenBsnPartnerDetailView,
     IngeschrevenpersonenBsnPartnerListView,
     IngeschrevenpersonenFilterView,
@@ -9,6 +10,7 @@ from gobstuf.rest.brp.views import (
     IngeschrevenpersonenBsnKinderenListView,
     IngeschrevenpersonenBsnVerblijfplaatshistorieListView
 )
+from gobstuf.rest.brp.export_view import ExportJobsView, ExportJobView, ExportJobResultView
 
 REST_ROUTES = [
     (
@@ -16,6 +18,26 @@ REST_ROUTES = [
         IngeschrevenpersonenFilterView.as_view('brp_ingeschrevenpersonen_list'),
         ["GET"]
     ),
+    (
+        '/brp/ingeschrevenpersonen/batch',
+        IngeschrevenpersonenBatchView.as_view('brp_ingeschrevenpersonen_batch'),
+        ["POST"]
+    ),
+    (
+        '/brp/ingeschrevenpersonen/exports',
+        ExportJobsView.as_view('brp_ingeschrevenpersonen_exports'),
+        ["POST"]
+    ),
+    (
+        '/brp/ingeschrevenpersonen/exports/<job_id>',
+        ExportJobView.as_view('brp_ingeschrevenpersonen_export'),
+        ["GET"]
+    ),
+    (
+        '/brp/ingeschrevenpersonen/exports/<job_id>/resultaat',
+        ExportJobResultView.as_view('brp_ingeschrevenpersonen_export_resultaat'),
+        ["GET"]
+    ),
     (
         '/brp/ingeschrevenpersonen/<bsn>',
         IngeschrevenpersonenBsnView.as_view('brp_ingeschrevenpersonen_bsn'),
@@ -0,0 +1,432 @@
+"""
+MKS stand-in
+
+A local service that answers the StUF requests of the gateway like MKS does, to exercise the gateway without MKS,
+eg in load tests or on a laptop.
+
+- npsLv01 and npsLv07 requests are answered with npsLa01 and npsLa07 responses from fixture files.
+  A request for a BSN is answered with the fixture of that person. Other requests are answered with one of the
+  fixtures, always the same for the same search parameters, with the requested BSN (if any) filled in.
+  With --generate SIZE the responses are generated instead (see gobstuf.benchmarks.responses), of the given size,
+  eg production or worst, again the same for the same search parameters.
+- GET requests for the WSDL (?wsdl) are answered with a WSDL of the npsLv01 and npsLv07 operations
+- Every answer is delayed by a random latency, eg lognormal:0.05,0.5 for a median latency of 50 ms.
+  The distributions are fixed:SECONDS, uniform:LOW,HIGH, exponential:MEAN and lognormal:MEDIAN,SIGMA.
+  A latency can be given per soap action, eg npsLv07=fixed:0.2
+- Faults are injected at the given rates: StUF faults (eg StUF005=0.01), slow bodies (the second half of the body is
+  sent after a delay) and connection resets
+
+Usage:
+    python -m gobstuf.stand_in.mks [--port 8166] [--fixtures tests/fixtures | --generate SIZE]
+                                   [--latency [ACTION=]SPEC ...] [--fault CODE=RATE ...]
+                                   [--slow-body RATE] [--reset RATE] [--seed SEED]
+
+The gateway is pointed at the stand-in with ROUTE_SCHEME=http, ROUTE_NETLOC=localhost:8166 and without PKCS12_FILENAME
+
+"""
+import argparse
+import logging
+import math
+import random
+import socket
+import string
+import struct
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from gobstuf.benchmarks.responses import GENERATORS, SIZES, Size
+
+logger = logging.getLogger(__name__)
+
+WSDL_TEMPLATE = Path(__file__).parent / 'mks.wsdl'
+
+# The answer code for every supported soap action
+ANSWER_CODES = {
+    'npsLv01': 'npsLa01',
+    'npsLv07': 'npsLa07',
+}
+
+# The soap action to use when no latency is given for a specific soap action
+DEFAULT = 'default'
+
+# Latency distributions, all values in seconds
+DISTRIBUTIONS = {
+    'fixed': lambda rng, seconds: seconds,
+    'uniform': lambda rng, low, high: rng.uniform(low, high),
+    'exponential': lambda rng, mean: rng.expovariate(1 / mean),
+    'lognormal': lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma),
+}
+
+# Behaviours of an answer
+SLOW_BODY = 'slow_body'
+RESET = 'reset'
+
+STUF_FAULT = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <soapenv:Fault>
+      <faultcode>soapenv:Server</faultcode>
+      <faultstring>{omschrijving}</faultstring>
+      <detail>
+        <StUF:Fo02Bericht xmlns:StUF="http://www.egem.nl/StUF/StUF0301">
+          <StUF:stuurgegevens>
+            <StUF:berichtcode>Fo02</StUF:berichtcode>
+          </StUF:stuurgegevens>
+          <StUF:body>
+            <StUF:code>{code}</StUF:code>
+            <StUF:plek>server</StUF:plek>
+            <StUF:omschrijving>{omschrijving}</StUF:omschrijving>
+          </StUF:body>
+        </StUF:Fo02Bericht>
+      </detail>
+    </soapenv:Fault>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+SOAP_FAULT = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <soapenv:Fault>
+      <faultcode>soapenv:Client</faultcode>
+      <faultstring>{faultstring}</faultstring>
+    </soapenv:Fault>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class Answer(NamedTuple):
+    status: int
+    body: str
+    delay: float = 0.0
+    behaviour: Optional[str] = None
+
+
+class Latency(NamedTuple):
+    distribution: str
+    params: tuple
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Latency':
+        """
+        :param spec: eg lognormal:0.05,0.5
+        :raises ValueError: when the spec is not valid
+        :return:
+        """
+        distribution, _, params = spec.partition(':')
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution}, use one of {', '.join(DISTRIBUTIONS)}")
+        latency = cls(distribution, tuple(float(param) for param in params.split(',') if param))
+        try:
+            latency.sample(random.Random())
+        except (TypeError, ArithmeticError):
+            raise ValueError(f"Invalid parameters for latency distribution {distribution}: {params}")
+        return latency
+
+    def sample(self, rng: random.Random) -> float:
+        return max(0.0, DISTRIBUTIONS[self.distribution](rng, *self.params))
+
+
+class FaultInjection(NamedTuple):
+    # StUF code -> rate, eg {'StUF005': 0.01}, None for no faults
+    faults: Optional[dict] = None
+    slow_body: float = 0.0
+    reset: float = 0.0
+    slow_body_seconds: float = 5.0
+
+    def draw(self, rng: random.Random) -> tuple[Optional[str], Optional[str]]:
+        """
+        Draws the fault of a request, if any
+
+        :param rng:
+        :return: (behaviour, StUF code), both None when the request should be answered normally
+        """
+        value = rng.random()
+        for code, rate in (self.faults or {}).items():
+            if value < rate:
+                return None, code
+            value -= rate
+        if value < self.slow_body:
+            return SLOW_BODY, None
+        if value - self.slow_body < self.reset:
+            return RESET, None
+        return None, None
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(elm: ET.Element, name: str) -> list[ET.Element]:
+    return [child for child in elm if _local_name(child.tag) == name]
+
+
+def request_parameters(body: bytes) -> dict:
+    """
+    Returns the search parameters of a StUF request, eg {'inp.bsn': '999991619'}
+
+    :param body: the request
+    :raises ET.ParseError: when the request is not valid XML
+    :return: the value of every element in BG:gelijk, by its name without namespace
+    """
+    root = ET.fromstring(body)
+    gelijk = next((elm for elm in root.iter() if _local_name(elm.tag) == 'gelijk'), None)
+    if gelijk is None:
+        return {}
+    return {
+        _local_name(elm.tag): elm.text.strip()
+        for elm in gelijk.iter() if len(elm) == 0 and elm.text and elm.text.strip()
+    }
+
+
+class FixtureAnswers:
+    """
+    Answers from StUF response files
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: directory with npsLa01 and npsLa07 XML files
+        """
+        # answer code -> [(bsn, text), ...]
+        self.fixtures = {}
+        # answer code -> {bsn: text}
+        self.by_bsn = {}
+        for path in sorted(Path(directory).glob('*.xml')):
+            self._add(path.read_text())
+
+    def _add(self, text: str):
+        root = ET.fromstring(text)
+        answer = next((elm for elm in root.iter() if _local_name(elm.tag) in ANSWER_CODES.values()), None)
+        if answer is None:
+            return
+
+        answer_code = _local_name(answer.tag)
+        objects = [obj for antwoord in _children(answer, 'antwoord') for obj in _children(antwoord, 'object')]
+        if not objects:
+            return
+
+        bsns = [elm.text for obj in objects for elm in _children(obj, 'inp.bsn') if elm.text]
+        self.fixtures.setdefault(answer_code, []).append((bsns[0] if bsns else None, text))
+        for bsn in bsns:
+            self.by_bsn.setdefault(answer_code, {}).setdefault(bsn, text)
+
+    def answer(self, answer_code: str, parameters: dict) -> Optional[str]:
+        """
+        :param answer_code: eg npsLa01
+        :param parameters: the search parameters of the request
+        :return: the response, or None if there is no fixture for the answer code
+        """
+        bsn = parameters.get('inp.bsn')
+        if text := self.by_bsn.get(answer_code, {}).get(bsn):
+            return text
+
+        fixtures = self.fixtures.get(answer_code)
+        if not fixtures:
+            return None
+
+        # The same parameters always result in the same fixture
+        key = repr(sorted(parameters.items())).encode('utf-8')
+        fixture_bsn, text = fixtures[zlib.crc32(key) % len(fixtures)]
+        if bsn and fixture_bsn:
+            text = text.replace(f'>{fixture_bsn}<', f'>{bsn}<', 1)
+        return text
+
+
+class GeneratedAnswers:
+    """
+    Synthetic answers of a fixed size
+    """
+
+    def __init__(self, size: Size, seed: int = 0):
+        """
+        :param size: eg SIZES['production']
+        :param seed:
+        """
+        self.size = size
+        self.seed = seed
+
+    def answer(self, answer_code: str, parameters: dict) -> Optional[str]:
+        """
+        :param answer_code: eg npsLa01
+        :param parameters: the search parameters of the request
+        :return: the response, or None if no response can be generated for the answer code
+        """
+        generator = GENERATORS.get(answer_code)
+        if generator is None:
+            return None
+
+        # The same parameters always result in the same response
+        key = repr(sorted(parameters.items())).encode('utf-8')
+        return generator(self.size, self.seed + zlib.crc32(key), parameters.get('inp.bsn'))
+
+
+class StandInMKS:
+
+    def __init__(self, answers, latencies: dict = None, faults: FaultInjection = FaultInjection(),
+                 rng: random.Random = None):
+        """
+        :param answers: eg FixtureAnswers or GeneratedAnswers
+        :param latencies: the latency for every soap action (eg npsLv01) or DEFAULT
+        :param faults:
+        :param rng:
+        """
+        self.answers = answers
+        self.latencies = latencies or {}
+        self.faults = faults
+        self.rng = rng or random.Random()
+
+    def answer(self, soap_action: str, body: bytes) -> Answer:
+        """
+        Answers a StUF request
+
+        :param soap_action: eg http://www.egem.nl/StUF/sector/bg/0310/npsLv01
+        :param body: the request
+        :return:
+        """
+        action = soap_action.strip('"').rsplit('/', 1)[-1]
+        latency = self.latencies.get(action, self.latencies.get(DEFAULT))
+        delay = latency.sample(self.rng) if latency else 0.0
+
+        if action not in ANSWER_CODES:
+            return Answer(500, SOAP_FAULT.format(faultstring=f"Unknown Soapaction {soap_action}"), delay)
+
+        behaviour, code = self.faults.draw(self.rng)
+        if code:
+            return Answer(500, STUF_FAULT.format(code=code, omschrijving="Injected fault"), delay)
+
+        try:
+            parameters = request_parameters(body)
+        except ET.ParseError as e:
+            return Answer(500, STUF_FAULT.format(code='StUF011', omschrijving=f"Invalid request: {e}"), delay)
+
+        text = self.answers.answer(ANSWER_CODES[action], parameters)
+        if text is None:
+            return Answer(500, STUF_FAULT.format(code='StUF003', omschrijving="Geen gegevens"), delay)
+        return Answer(200, text, delay, behaviour)
+
+    def wsdl(self, address: str) -> str:
+        """
+        :param address: the address of the service
+        :return:
+        """
+        return string.Template(WSDL_TEMPLATE.read_text()).substitute(address=address)
+
+
+class MKSRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MKSStandIn'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.query.lower() != 'wsdl':
+            self._send(Answer(404, SOAP_FAULT.format(faultstring=f"Not found: {self.path}")))
+            return
+
+        address = f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address[:2])}{url.path}"
+        self._send(Answer(200, self.server.stand_in.wsdl(address)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        answer = self.server.stand_in.answer(self.headers.get('Soapaction', ''), body)
+        time.sleep(answer.delay)
+
+        if answer.behaviour == RESET:
+            # Close the connection without answer, the client receives a reset
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = True
+            return
+        self._send(answer)
+
+    def _send(self, answer: Answer):
+        data = answer.body.encode('utf-8')
+        self.send_response(answer.status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        if answer.behaviour == SLOW_BODY:
+            half = len(data) // 2
+            self.wfile.write(data[:half])
+            self.wfile.flush()
+            time.sleep(self.server.stand_in.faults.slow_body_seconds)
+            data = data[half:]
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args):
+        logger.debug(format, *args)
+
+
+def create_server(stand_in: StandInMKS, host: str = 'localhost', port: int = 8166) -> ThreadingHTTPServer:
+    """
+    Returns the HTTP server for the stand-in, every request is handled in its own thread
+
+    :param stand_in:
+    :param host:
+    :param port: 0 for any free port
+    :return:
+    """
+    server = ThreadingHTTPServer((host, port), MKSRequestHandler)
+    server.daemon_threads = True
+    server.stand_in = stand_in
+    return server
+
+
+def _latency_arg(value: str) -> tuple[str, Latency]:
+    action, _, spec = value.rpartition('=')
+    try:
+        return action or DEFAULT, Latency.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _fault_arg(value: str) -> tuple[str, float]:
+    code, _, rate = value.partition('=')
+    try:
+        return code, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid fault {value}, use CODE=RATE, eg StUF005=0.01")
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="MKS stand-in: answers npsLv01 and npsLv07 requests")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8166)
+    answers = parser.add_mutually_exclusive_group()
+    answers.add_argument('--fixtures', default='tests/fixtures', help="Directory with npsLa01 and npsLa07 files")
+    answers.add_argument('--generate', choices=SIZES, help="Answer with generated responses of this size")
+    parser.add_argument('--latency', type=_latency_arg, action='append', default=[],
+                        help="[ACTION=]DISTRIBUTION:PARAMS, eg lognormal:0.05,0.5 or npsLv07=fixed:0.2")
+    parser.add_argument('--fault', type=_fault_arg, action='append', default=[],
+                        help="Rate of a StUF fault, eg StUF005=0.01")
+    parser.add_argument('--slow-body', type=float, default=0.0, help="Rate of responses with a slow body")
+    parser.add_argument('--slow-body-seconds', type=float, default=5.0)
+    parser.add_argument('--reset', type=float, default=0.0, help="Rate of connection resets")
+    parser.add_argument('--seed', type=int, help="Seed for the latencies, faults and generated responses")
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        answers = GeneratedAnswers(SIZES[args.generate], args.seed or 0)
+    else:
+        answers = FixtureAnswers(args.fixtures)
+    stand_in = StandInMKS(
+        answers,
+        latencies=dict(args.latency),
+        faults=FaultInjection(dict(args.fault), args.slow_body, args.reset, args.slow_body_seconds),
+        rng=random.Random(args.seed),
+    )
+    server = create_server(stand_in, args.host, args.port)
+    print(f"MKS stand-in listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
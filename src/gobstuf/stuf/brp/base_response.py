@@ -3,9 +3,11 @@ import re
 from abc import ABC, abstractmethod
 from datetime import date
 from flask import request
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from xml.etree.ElementTree import Element
 
+from gobstuf.lib.metrics import count_mapped_objects
+from gobstuf.lib.timing import timed
 from gobstuf.lib.utils import get_value
 from gobstuf.rest.brp.argument_checks import WILDCARD_CHARS
 from gobstuf.stuf.message import StufMessage
@@ -64,7 +66,8 @@ class MappedObjectWrapper:
         # (This case is handled in the tests)
         links = self.mapping_class.get_links(self.mapped_object)
 
-        filtered = self.mapping_class.filter(self.mapped_object, **kwargs)
+        with timed('filter'):
+            filtered = self.mapping_class.filter(self.mapped_object, **kwargs)
         if filtered is not None:
             filtered['_links'] = links
         return filtered
@@ -80,7 +83,6 @@ class StufMappedResponse(StufResponse):
     filter_kwargs = []
 
     response_filters = []
-    response_filters_instances = []
 
     def __init__(self, msg: str, **kwargs):
         if 'expand' in kwargs:
@@ -101,6 +103,9 @@ class StufMappedResponse(StufResponse):
 
         super().__init__(msg, **kwargs)
 
+        # The request maps objects, possibly none
+        count_mapped_objects(0)
+
     def get_object_elm(self):
         """Returns the object wrapper element from the response message.
 
@@ -207,8 +212,7 @@ class StufMappedResponse(StufResponse):
 
         # Filter the response if a response type is defined
         if answer_object is not None:
-            for filter in self.response_filters_instances:
-                answer_object = filter.filter_response(answer_object)
+            answer_object = self._filter_answer_object(answer_object)
 
         if not answer_object:
             raise NoStufAnswerFilterException()
@@ -224,6 +228,7 @@ class StufMappedResponse(StufResponse):
         mapped_object = self.get_mapped_object(element)
         if not mapped_object:
             return None
+        count_mapped_objects()
         self._add_embedded_objects(mapped_object)
         return mapped_object.get_filtered_object(**self._get_filter_kwargs())
 
@@ -252,14 +257,41 @@ class StufMappedResponse(StufResponse):
 
         filtered_answer_objects = []
         for answer_object in answer_objects:
-            # Filter the response if a response type is defined
-            for filter in self.response_filters_instances:
-                answer_object = filter.filter_response(answer_object)
-
+            answer_object = self._filter_answer_object(answer_object)
             filtered_answer_objects += [answer_object] if answer_object is not None else []
 
         return filtered_answer_objects
 
+    def iter_answer_objects(self) -> Iterator[dict]:
+        """
+        Yields all objects from the StUF response. Works like get_all_answer_objects, but maps and filters the
+        objects one by one, when they are requested.
+
+        :return:
+        """
+        for element in self.get_all_object_elms():
+            answer_object = self.create_object_from_element(element)
+
+            if answer_object:
+                answer_object = self._filter_answer_object(answer_object)
+
+                if answer_object is not None:
+                    yield answer_object
+
+    def _filter_answer_object(self, answer_object: dict) -> Optional[dict]:
+        """Filter the answer object if a response type is defined
+
+        :param answer_object:
+        :return: the filtered object or None if the object is filtered out
+        """
+        if not self.response_filters_instances:
+            return answer_object
+
+        with timed('filter'):
+            for filter in self.response_filters_instances:
+                answer_object = filter.filter_response(answer_object)
+        return answer_object
+
     def _get_mapping(self, element: Element) -> Mapping:
         """Finds the mapping for the given XML Element, based on the value of StUF:entiteittype
 
@@ -0,0 +1,192 @@
+"""
+Compact result model
+
+A mapped person is a deep tree of small dicts (naam, geboorte.datum, plaats, land, ...). Every dict
+has its own hash table. For large result sets the dicts can be converted to compact objects:
+
+- every dict is converted to an instance of a class with __slots__ for its keys
+- every list is converted to a tuple
+
+Objects with the same keys, in the same order, share the same class. The classes are generated
+on first use from the shapes that the mappings produce, eg ('code', 'omschrijving') for a land.
+The key order is part of the shape, so the JSON representation is exactly the same as that of
+the dict.
+
+Compact objects are serialised by writing the JSON directly, without intermediate dicts.
+
+"""
+import keyword
+from json.encoder import encode_basestring
+from typing import Any
+
+# Maximum number of generated classes. Dicts with other shapes are kept as dict.
+MAX_SHAPES = 4096
+
+_CLASSES = {}
+
+
+class CompactObject:
+    """
+    Base class of the generated classes. Each generated class has a slot for every key of its shape
+    """
+    __slots__ = ()
+
+    # The JSON prefix of every key, eg ('{"code":', ',"omschrijving":')
+    _json_keys = ()
+
+    @classmethod
+    def _make(cls, values):
+        obj = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(obj, name, value)
+        return obj
+
+    def items(self):
+        return ((name, getattr(self, name)) for name in self.__slots__)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the dict representation of this object, including all nested values
+
+        :return:
+        """
+        return to_dict(self)
+
+    def to_json(self) -> bytes:
+        """
+        Returns the compact UTF-8 encoded JSON representation, equal to the serialised dict representation
+
+        :return:
+        """
+        return dumps(self)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.__slots__)
+
+    def __repr__(self):
+        return f"CompactObject({', '.join(f'{name}={value!r}' for name, value in self.items())})"
+
+
+def _is_valid_slot(key) -> bool:
+    # Names that start with two underscores would be mangled
+    return isinstance(key, str) and key.isidentifier() and not keyword.iskeyword(key) and not key.startswith('__')
+
+
+def compact_class(keys: tuple):
+    """
+    Returns the class for objects with the given keys, or None if the keys cannot be slots
+
+    :param keys: the keys of the object, in order
+    :return:
+    """
+    if (cls := _CLASSES.get(keys)) is not None:
+        return cls
+
+    if len(_CLASSES) >= MAX_SHAPES or not all(_is_valid_slot(key) for key in keys):
+        return None
+
+    cls = type('CompactObject', (CompactObject,), {
+        '__slots__': keys,
+        '_json_keys': tuple(f'{"{" if n == 0 else ","}{encode_basestring(key)}:' for n, key in enumerate(keys)),
+    })
+    # Another thread may have created the class in the meantime, use the one that has been registered
+    return _CLASSES.setdefault(keys, cls)
+
+
+def to_compact(value: Any) -> Any:
+    """
+    Returns the compact representation of value
+
+    Dicts are converted to compact objects, lists to tuples. Other values are returned unchanged.
+
+    :param value: a mapped object, or any value in it
+    :return:
+    """
+    if isinstance(value, dict):
+        values = [to_compact(v) for v in value.values()]
+        if value and (cls := compact_class(tuple(value))):
+            return cls._make(values)
+        return dict(zip(value, values))
+    elif isinstance(value, list):
+        return tuple(to_compact(item) for item in value)
+    return value
+
+
+def to_dict(value: Any) -> Any:
+    """
+    Returns the dict representation of a compact value, the inverse of to_compact
+
+    :param value:
+    :return:
+    """
+    if isinstance(value, (CompactObject, dict)):
+        return {k: to_dict(v) for k, v in value.items()}
+    elif isinstance(value, (tuple, list)):
+        return [to_dict(item) for item in value]
+    return value
+
+
+def _write(value: Any, parts: list):  # noqa: C901
+    """
+    Append the JSON representation of value to parts
+
+    :param value:
+    :param parts:
+    :return:
+    """
+    if isinstance(value, str):
+        parts.append(encode_basestring(value))
+    elif isinstance(value, CompactObject):
+        _write_object(value, parts)
+    elif value is None:
+        parts.append('null')
+    elif value is True:
+        parts.append('true')
+    elif value is False:
+        parts.append('false')
+    elif isinstance(value, (int, float)):
+        parts.append(repr(value))
+    elif isinstance(value, (tuple, list)):
+        _write_sequence(value, parts)
+    elif isinstance(value, dict):
+        _write_dict(value, parts)
+    else:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _write_object(value: CompactObject, parts: list):
+    for prefix, name in zip(value._json_keys, value.__slots__):
+        parts.append(prefix)
+        _write(getattr(value, name), parts)
+    parts.append('}')
+
+
+def _write_sequence(values, parts: list):
+    separator = '['
+    for item in values:
+        parts.append(separator)
+        _write(item, parts)
+        separator = ','
+    parts.append(']' if separator == ',' else '[]')
+
+
+def _write_dict(value: dict, parts: list):
+    separator = '{'
+    for k, v in value.items():
+        parts.append(f'{separator}{encode_basestring(k)}:')
+        _write(v, parts)
+        separator = ','
+    parts.append('}' if separator == ',' else '{}')
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serialise a compact value, or any value containing compact values, to compact UTF-8 encoded JSON
+
+    :param value:
+    :return:
+    """
+    parts = []
+    _write(value, parts)
+    return ''.join(parts).encode('utf-8')
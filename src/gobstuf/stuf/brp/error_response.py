@@ -6,6 +6,42 @@ class UnknownErrorCode(Exception):
     pass
 
 
+# The HTTP response for every MKS error code
+HTTP_RESPONSES = {
+    # De stuurgegevens zijn onjuist gevuld
+    'StUF001': RESTResponse.bad_request,
+    # Het interactieve proces voor het afhandelen van een synchrone vraag is niet actief
+    'StUF002': RESTResponse.internal_server_error,
+    # De gevraagde gegevens zijn niet beschikbaar
+    'StUF003': RESTResponse.not_found,
+    # De gevraagde sortering wordt niet ondersteund
+    'StUF004': RESTResponse.internal_server_error,
+    # Er heeft zich in de StUF-communicatie een time-out voorgedaan
+    'StUF005': RESTResponse.internal_server_error,
+    # Het vraagbericht bevat als selectiecriterium zowel de sleutel in het vragende systeem als het ontvangende
+    # systeem,
+    'StUF006': RESTResponse.internal_server_error,
+    # Het ontvangende systeem ondersteunt niet het bevraagd worden op sleutel in het vragende systeem
+    'StUF007': RESTResponse.internal_server_error,
+    # De beantwoording van het vraagbericht vergt meer systeemresources dan het antwoordende systeem
+    # beschikbaar heeft
+    'StUF008': RESTResponse.internal_server_error,
+    # Het vraagbericht is gericht aan een niet bekend systeem
+    'StUF009': RESTResponse.internal_server_error,
+    # Het vragende systeem is niet geautoriseerd voor de gevraagde gegevens
+    'StUF010': RESTResponse.forbidden,
+    # De syntax van het StUF-vraagbericht is onjuist
+    'StUF011': RESTResponse.internal_server_error,
+    # Het ontvangende systeem ondersteunt niet de afhandeling van asynchrone vraagberichten
+    'StUF012': RESTResponse.internal_server_error,
+    # Het vragende systeem is bij het ontvangende systeem niet bekend
+    'StUF013': RESTResponse.internal_server_error,
+    # Het zendende systeem is niet geautoriseerd voor de gevraagde combinatie van berichtcode,
+    # entiteittype en functie
+    'StUF052': RESTResponse.forbidden,
+}
+
+
 class StufErrorResponse(StufResponse):
     code_path = 'soapenv:Envelope soapenv:Body soapenv:Fault detail'
 
@@ -36,41 +72,8 @@ class StufErrorResponse(StufResponse):
         if self.get_berichtcode() != 'Fo02':
             raise UnknownErrorCode()
 
-        responses = {
-            # De stuurgegevens zijn onjuist gevuld
-            'StUF001': RESTResponse.bad_request(),
-            # Het interactieve proces voor het afhandelen van een synchrone vraag is niet actief
-            'StUF002': RESTResponse.internal_server_error(),
-            # De gevraagde gegevens zijn niet beschikbaar
-            'StUF003': RESTResponse.not_found(),
-            # De gevraagde sortering wordt niet ondersteund
-            'StUF004': RESTResponse.internal_server_error(),
-            # Er heeft zich in de StUF-communicatie een time-out voorgedaan
-            'StUF005': RESTResponse.internal_server_error(),
-            # Het vraagbericht bevat als selectiecriterium zowel de sleutel in het vragende systeem als het ontvangende
-            # systeem,
-            'StUF006': RESTResponse.internal_server_error(),
-            # Het ontvangende systeem ondersteunt niet het bevraagd worden op sleutel in het vragende systeem
-            'StUF007': RESTResponse.internal_server_error(),
-            # De beantwoording van het vraagbericht vergt meer systeemresources dan het antwoordende systeem
-            # beschikbaar heeft
-            'StUF008': RESTResponse.internal_server_error(),
-            # Het vraagbericht is gericht aan een niet bekend systeem
-            'StUF009': RESTResponse.internal_server_error(),
-            # Het vragende systeem is niet geautoriseerd voor de gevraagde gegevens
-            'StUF010': RESTResponse.forbidden(),
-            # De syntax van het StUF-vraagbericht is onjuist
-            'StUF011': RESTResponse.internal_server_error(),
-            # Het ontvangende systeem ondersteunt niet de afhandeling van asynchrone vraagberichten
-            'StUF012': RESTResponse.internal_server_error(),
-            # Het vragende systeem is bij het ontvangende systeem niet bekend
-            'StUF013': RESTResponse.internal_server_error(),
-            # Het zendende systeem is niet geautoriseerd voor de gevraagde combinatie van berichtcode,
-            # entiteittype en functie
-            'StUF052': RESTResponse.forbidden(),
-        }
-
         try:
-            return responses[self.get_error_code()]
+            http_response = HTTP_RESPONSES[self.get_error_code()]
         except KeyError:
             raise UnknownErrorCode()
+        return http_response()
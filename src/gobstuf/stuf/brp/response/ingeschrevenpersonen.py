@@ -1,3 +1,5 @@
+from typing import Iterator
+
 from gobstuf.stuf.brp.base_response import StufMappedResponse, VerblijfplaatsHistorieFilter
 from gobstuf.stuf.brp.response.filters import (
     PartnersDetailResponseFilter,
@@ -53,3 +55,7 @@ class IngeschrevenpersonenStufHistorieResponse(StufMappedResponse):
         """Return a list of verblijfplaatsen from a single response object."""
         answer = super().get_answer_object()
         return [vbl for vbl in [answer.get("verblijfplaats"), *answer.get("historieMaterieel", [])] if vbl]
+
+    def iter_answer_objects(self) -> Iterator[dict]:
+        """The verblijfplaatsen are all taken from the same response object, so they are mapped at once."""
+        yield from self.get_all_answer_objects()
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import datetime
-from collections import defaultdict
 
 from typing import Type, Optional, Union
 from abc import ABC, abstractmethod
@@ -10,7 +9,7 @@ from gobstuf.auth.routes import get_auth_url
 from gobstuf.config import BAG_NAG_ENDPOINT, BAG_VBO_ENDPOINT, BAG_LPS_ENDPOINT, BAG_SPS_ENDPOINT
 from gobstuf.indications import Geslachtsaanduiding
 from gobstuf.mks_utils import MKSConverter
-from gobstuf.lib.utils import get_value
+from gobstuf.lib.utils import get_value, prune_none_values
 
 
 class Mapping(ABC):
@@ -41,7 +40,7 @@ class Mapping(ABC):
     def get_links(self, mapped_object) -> dict:
         return {}
 
-    def filter(self, mapped_object: dict, **kwargs):  # noqa: C901
+    def filter(self, mapped_object: dict, **kwargs):
         """
         Filter the mapped object on the mapped attribute values
         Default implementation is to filter out any null values
@@ -49,35 +48,21 @@ class Mapping(ABC):
         Any derived class that implements this method should call this super method on its result
         super().filter(result)
 
+        The null values are removed from the mapped object itself, no copy is made.
+
         :param mapped_object:
         :return:
         """
-
-        def filter_none_values(obj):
-            """
-            Recursively filter out any None values of the given object
-
-            :param obj:
-            :return:
-            """
-            result = {}
-            for k, v in obj.items():
-                if isinstance(v, dict):
-                    value = filter_none_values(v)
-                    if value:
-                        result[k] = value
-                elif isinstance(v, list):
-                    result[k] = [item for item in [filter_none_values(obj) for obj in v] if item]
-                elif v is not None:
-                    result[k] = v
-            return result
-
-        return filter_none_values(mapped_object) if mapped_object else mapped_object
+        return prune_none_values(mapped_object) if mapped_object else mapped_object
 
 
 class StufObjectMapping:
-    """Class holding all Mapping objects. Call register() with each Mapping to make the mapping available."""
-    mappings = defaultdict(dict)
+    """Class holding all Mapping objects. Call register() with each Mapping to make the mapping available.
+
+    The mappings are shared by all requests. They are only read when handling a request, a registration replaces the
+    mappings by an updated copy.
+    """
+    mappings = {}
 
     @classmethod
     def get_for_entity_type(cls, answer_code: str, entity_type: str) -> Mapping:
@@ -89,7 +74,9 @@ class StufObjectMapping:
     @classmethod
     def register(cls, mapping: Type[Mapping]):
         map_obj = mapping()
-        cls.mappings[map_obj.answer_code] |= {map_obj.entity_type: mapping}
+        cls.mappings = cls.mappings | {
+            map_obj.answer_code: cls.mappings.get(map_obj.answer_code, {}) | {map_obj.entity_type: mapping}
+        }
 
 
 class NPSMapping(Mapping):
@@ -297,20 +284,23 @@ class NPSMapping(Mapping):
                 adres = cur_adres
                 functie = functie_adres
 
-        reordered = {
-            'adresseerbaarObjectIdentificatie': verblijfplaats.pop('adresseerbaarObjectIdentificatie', None),
-            'nummeraanduidingIdentificatie': adres.pop('nummeraanduidingIdentificatie', None),
-            'functieAdres': functie,
-            'indicatieVestigingVanuitBuitenland': verblijfplaats.pop('indicatieVestigingVanuitBuitenland', None),
-            'locatiebeschrijving': adres.pop('locatiebeschrijving', None),
-        }
+        nummeraanduiding = adres.pop('nummeraanduidingIdentificatie', None)
+        locatiebeschrijving = adres.pop('locatiebeschrijving', None)
 
         # dont return datumAanvangAdreshouding when address is foreign, see #66932
         # ie gemeenteVanInschrijving == {"code": "1999","omschrijving": "Registratie Niet Ingezetenen (RNI)"}
         if verblijfplaats["gemeenteVanInschrijving"]["code"] == "1999":
             verblijfplaats.pop("datumAanvangAdreshouding")
 
-        return {**adres, **reordered, **verblijfplaats}
+        # The result is built in the adres dict: the adres attributes, then the reordered attributes,
+        # then the remaining verblijfplaats attributes
+        adres['adresseerbaarObjectIdentificatie'] = verblijfplaats.pop('adresseerbaarObjectIdentificatie', None)
+        adres['nummeraanduidingIdentificatie'] = nummeraanduiding
+        adres['functieAdres'] = functie
+        adres['indicatieVestigingVanuitBuitenland'] = verblijfplaats.pop('indicatieVestigingVanuitBuitenland', None)
+        adres['locatiebeschrijving'] = locatiebeschrijving
+        adres.update(verblijfplaats)
+        return adres
 
     @property
     def related(self):  # pragma: no cover
@@ -632,9 +622,9 @@ class RelatedMapping(Mapping):
         :param kwargs:
         :return:
         """
-        mapped_object = {k: v for k, v in mapped_object.items() if k in
-                         self.include_related + list(self.mapping.keys())
-                         }
+        keep = {*self.include_related, *self.mapping}
+        for key in [key for key in mapped_object if key not in keep]:
+            del mapped_object[key]
 
         return super().filter(mapped_object)
 
@@ -892,22 +882,24 @@ class VerblijfplaatsHistorieMapping(NPSMapping):
 
         return result
 
-    @staticmethod
-    def _get_href_from_objectid(object_id: str) -> str:
-        try:
-            return {"01": BAG_VBO_ENDPOINT, "02": BAG_LPS_ENDPOINT, "03": BAG_SPS_ENDPOINT}[object_id[4:6]]
-        except (KeyError, IndexError):
-            pass
+    # BAG endpoint by object type, the object type is at position 4-6 of the identification
+    BAG_OBJECT_ENDPOINTS = {"01": f"{BAG_VBO_ENDPOINT}/", "02": f"{BAG_LPS_ENDPOINT}/", "03": f"{BAG_SPS_ENDPOINT}/"}
+    BAG_NAG_URL = f"{BAG_NAG_ENDPOINT}/"
+
+    @classmethod
+    def _get_href_from_objectid(cls, object_id: str) -> Optional[str]:
+        if endpoint := cls.BAG_OBJECT_ENDPOINTS.get(object_id[4:6]):
+            return endpoint + object_id
 
     def _add_links(self, verblijfplaats: dict):
         links = {}
 
         if nr_id := verblijfplaats.get("nummeraanduidingIdentificatie"):
-            links["adres"] = {"href": f"{BAG_NAG_ENDPOINT}/{nr_id}"}
+            links["adres"] = {"href": self.BAG_NAG_URL + nr_id}
 
         if adrsobj_id := verblijfplaats.get("adresseerbaarObjectIdentificatie"):
             if href := self._get_href_from_objectid(adrsobj_id):
-                links["adresseerbaarObject"] = {"href": f"{href}/{adrsobj_id}"}
+                links["adresseerbaarObject"] = {"href": href}
 
         if links:
             verblijfplaats["_links"] = links
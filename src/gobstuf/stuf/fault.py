@@ -0,0 +1,55 @@
+"""
+StUF faults
+
+Classifies the faults (Fo02 berichten) of MKS without parsing the complete SOAP message. Only the berichtcode and
+the error code are read from the message text.
+
+A transient fault signals that MKS is temporarily not able to answer, the same request may succeed when it is
+retried. All other faults are permanent: retrying the request gives the same answer.
+
+"""
+import re
+from typing import NamedTuple, Optional
+
+# StUF002 (process not active), StUF005 (time-out), StUF008 (insufficient resources)
+TRANSIENT_FAULT_CODES = frozenset(['StUF002', 'StUF005', 'StUF008'])
+
+_BERICHTCODE = re.compile(r'<(?:\w+:)?berichtcode>\s*(\w+)\s*</')
+_CODE = re.compile(r'<(?:\w+:)?code>\s*(\w+)\s*</')
+
+
+class StufFault(NamedTuple):
+    berichtcode: str
+    code: Optional[str]
+
+    @property
+    def is_transient(self) -> bool:
+        return self.code in TRANSIENT_FAULT_CODES
+
+
+def parse_fault(text: str) -> Optional[StufFault]:
+    """
+    Returns the fault in a StUF message text
+
+    :param text: the text of the MKS response
+    :return: the fault, or None if the text is not a fault message
+    """
+    berichtcode = _BERICHTCODE.search(text)
+    if berichtcode is None or berichtcode.group(1) != 'Fo02':
+        return None
+
+    code = _CODE.search(text, berichtcode.end())
+    return StufFault(berichtcode.group(1), code.group(1) if code else None)
+
+
+def is_transient_fault(response) -> bool:
+    """
+    Tells if an MKS response is a transient fault
+
+    :param response:
+    :return:
+    """
+    if response.status_code < 500:
+        return False
+    fault = parse_fault(response.text)
+    return fault is not None and fault.is_transient
@@ -1,6 +1,7 @@
 from io import StringIO
 import re
 import os
+import threading
 import xml.etree.ElementTree as ET
 
 from xml.dom import minidom
@@ -8,6 +9,35 @@ from xml.dom import minidom
 WILDCARD_CHARS = ['*', '?']
 STUF_WILDCARD_CHAR = '%'
 
+# The prefixes that have been registered with ElementTree by url, see register_namespaces
+_registered_namespaces = {}
+_registered_namespaces_lock = threading.Lock()
+
+
+def register_namespaces(namespaces: dict):
+    """Registers the prefixes of the namespaces for serialisation, eg StUF:tijdstipBericht instead of ns0:...
+
+    The ElementTree registry is global to the process and holds one prefix per url, the last one registered. A message
+    is serialised with its own prefixes, the elements of a serialised message are found with them (see find_elm).
+
+    A prefix is only registered when it differs from the registered prefix of its url. As long as all messages use
+    the same prefix for a url the registry does not change after the first message. When messages use different
+    prefixes for the same url, the prefix flips and is registered again for every such message. A message that is
+    serialised at that moment in another thread may then be written with the other prefix or a generated one (ns0).
+
+    :param namespaces: prefix -> url, for urls with multiple prefixes the last one is used
+    :return:
+    """
+    prefixes = {url: prefix for prefix, url in namespaces.items()}
+    new_prefixes = [(prefix, url) for url, prefix in prefixes.items() if _registered_namespaces.get(url) != prefix]
+    if not new_prefixes:
+        return
+
+    with _registered_namespaces_lock:
+        for prefix, url in new_prefixes:
+            ET.register_namespace(prefix, url)
+            _registered_namespaces[url] = prefix
+
 
 class StufMessage:
     """Workable representation of a StUF message, based on ElementTree.
@@ -28,9 +58,7 @@ class StufMessage:
 
     def set_namespaces(self, msg):
         self.namespaces = dict([node for _, node in ET.iterparse(StringIO(msg), events=['start-ns'])])
-
-        for prefix, url in self.namespaces.items():
-            ET.register_namespace(prefix, url)
+        register_namespaces(self.namespaces)
 
     def find_elm(self, elements_str: str, tree=None):
         """Returns the first element in tree. Tree defaults to the message root.
@@ -55,6 +55,7 @@ class TestSecureRoute:
 
 class TestAuth(TestCase):
 
+    @patch('gobstuf.auth.routes.get_url_template', lambda endpoint: None)
     @patch('gobstuf.auth.routes.url_for')
     def test_get_auth_url(self, mock_url_for):
         mock_request = MagicMock()
@@ -70,3 +71,18 @@ class TestAuth(TestCase):
             result = get_auth_url(view_name)
             self.assertEqual(result, "http(s)://any host/any url")
             mock_url_for.assert_called_with('bp.any view')
+
+    @patch('gobstuf.auth.routes.url_prefix', lambda: 'http(s)://any host')
+    @patch('gobstuf.auth.routes.get_url_template')
+    @patch('gobstuf.auth.routes.url_for')
+    def test_get_auth_url_template(self, mock_url_for, mock_get_url_template):
+        mock_request = MagicMock()
+        mock_request.blueprint = 'bp'
+        mock_get_url_template.return_value.expand.return_value = '/any url/123'
+
+        with patch('gobstuf.auth.routes.request', mock_request):
+            result = get_auth_url('any view', bsn='123')
+            self.assertEqual(result, "http(s)://any host/any url/123")
+            mock_get_url_template.assert_called_with('bp.any view')
+            mock_get_url_template.return_value.expand.assert_called_with(bsn='123')
+            mock_url_for.assert_not_called()
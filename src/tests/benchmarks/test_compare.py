@@ -0,0 +1,191 @@
+import json
+import os
+import random
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from gobstuf.benchmarks.compare import Measurement, FORMAT_VERSION, REGRESSION, IMPROVEMENT, UNCHANGED, \
+    bootstrap_ratio, compare_measurement, compare, save, report, main, _git_commit
+
+
+def pipeline(p50: float, samples: list[float] = None, case: str = 'response.xml') -> dict:
+    return {'benchmark': 'pipeline', 'results': [{'stage': 'parse', 'case': case, 'p50_us': p50,
+                                                  'samples_us': samples}]}
+
+
+def baseline(results: dict) -> dict:
+    return {'version': FORMAT_VERSION, 'created': '2020-01-01T00:00:00+00:00', 'commit': 'abc', 'python': '3.9',
+            **results}
+
+
+def load(p50: float, throughput: float, error_rate: float, samples: list[float] = None) -> dict:
+    return {'benchmark': 'load', 'results': [{'concurrency': 4, 'latency_ms': {'p50': p50, 'p95': p50 * 2},
+                                              'throughput': throughput, 'error_rate': error_rate,
+                                              'samples_ms': samples}]}
+
+
+class TestCompare:
+
+    def test_bootstrap_ratio(self):
+        rng = random.Random(0)
+        low, high = bootstrap_ratio([10, 11, 9, 10, 12, 10], [20, 22, 18, 20, 24, 20], 50, 0.95, 200, rng)
+        assert 1.6 < low <= 2 <= high < 2.5
+
+        low, high = bootstrap_ratio([10] * 10, [10] * 10, 50, 0.95, 100, rng)
+        assert low == high == 1
+
+    def test_compare_measurement(self):
+        rng = random.Random(0)
+        fast = [10, 11, 9, 10, 12, 10, 9, 11]
+        slow = [value * 1.5 for value in fast]
+        noisy = [5, 30, 10, 2, 20, 12, 8, 15]
+
+        result = compare_measurement(Measurement(10, 'us', fast), Measurement(15, 'us', slow), 0.1, 0.95, 200, rng)
+        assert result['verdict'] == REGRESSION
+        assert result['change'] == pytest.approx(0.5)
+        assert result['interval'][0] > 0.1
+
+        result = compare_measurement(Measurement(15, 'us', slow), Measurement(10, 'us', fast), 0.1, 0.95, 200, rng)
+        assert result['verdict'] == IMPROVEMENT
+
+        # The median is 20% slower, but the samples vary too much to tell
+        result = compare_measurement(Measurement(10, 'us', fast), Measurement(12, 'us', noisy), 0.1, 0.95, 200, rng)
+        assert result['verdict'] == UNCHANGED
+
+        # Without samples the ratio is compared
+        assert compare_measurement(Measurement(10, 'us'), Measurement(12, 'us', fast), 0.1, 0.95, 200,
+                                   rng)['verdict'] == REGRESSION
+        assert 'interval' not in compare_measurement(Measurement(10, 'us', fast[:4]), Measurement(10, 'us', fast[:4]),
+                                                     0.1, 0.95, 200, rng)
+        assert compare_measurement(Measurement(0, 'us'), Measurement(1, 'us'), 0.1, 0.95, 200,
+                                   rng)['verdict'] == REGRESSION
+
+        # Higher is better
+        throughput = Measurement(100, 'req/s', higher_is_better=True)
+        assert compare_measurement(throughput, throughput._replace(value=80), 0.1, 0.95, 200,
+                                   rng)['verdict'] == REGRESSION
+        assert compare_measurement(throughput, throughput._replace(value=120), 0.1, 0.95, 200,
+                                   rng)['verdict'] == IMPROVEMENT
+
+        # Compared by difference
+        error_rate = Measurement(0.0, '', tolerance=0.01)
+        assert compare_measurement(error_rate, error_rate._replace(value=0.05), 0.1, 0.95, 200,
+                                   rng)['verdict'] == REGRESSION
+        assert compare_measurement(error_rate._replace(value=0.05), error_rate, 0.1, 0.95, 200,
+                                   rng)['verdict'] == IMPROVEMENT
+        assert compare_measurement(error_rate, error_rate._replace(value=0.005), 0.1, 0.95, 200,
+                                   rng)['verdict'] == UNCHANGED
+
+    def test_compare(self):
+        comparisons = compare(baseline(pipeline(10, [10] * 10)), pipeline(20, [20] * 10))
+        assert comparisons['parse response.xml']['verdict'] == REGRESSION
+
+        comparisons = compare(baseline(pipeline(10, case='old.xml')), pipeline(10, case='new.xml'))
+        assert comparisons == {'parse old.xml': {'verdict': 'only in baseline'}, 'parse new.xml': {'verdict': 'new'}}
+
+        comparisons = compare(baseline(load(10, 100, 0.0, [10] * 10)), load(10, 50, 0.1, [10] * 10))
+        assert {name: c['verdict'] for name, c in comparisons.items()} == {
+            '4 clients p50': UNCHANGED,
+            '4 clients p95': UNCHANGED,
+            '4 clients throughput': REGRESSION,
+            '4 clients error rate': REGRESSION,
+        }
+
+        # A level without requests has no latencies
+        results = load(10, 0, 0)
+        results['results'][0]['latency_ms'] = {}
+        assert list(compare(baseline(results), results)) == ['4 clients throughput', '4 clients error rate']
+
+        for base, results in [
+            ({**baseline(pipeline(10)), 'version': 0}, pipeline(10)),
+            (baseline(pipeline(10)), load(10, 1, 0)),
+            (baseline({'benchmark': 'memory', 'results': []}), {'benchmark': 'memory', 'results': []}),
+        ]:
+            with pytest.raises(ValueError):
+                compare(base, results)
+
+    def test_report(self):
+        base = baseline(load(10, 100, 0.0, [10] * 10))
+        comparisons = compare(base, load(12, 100, 0.0, [12] * 10))
+        comparisons['new'] = {'verdict': 'new'}
+        lines = report(base, comparisons).split('\n')
+
+        assert lines[0] == "Baseline of 2020-01-01T00:00:00+00:00, commit abc, Python 3.9"
+        assert lines[4].split() == ['4', 'clients', 'p50', '10.0', 'ms', '12.0', 'ms', '+20.0%', '+20.0%..+20.0%',
+                                    'regression']
+        assert lines[6].split() == ['4', 'clients', 'throughput', '100.0', 'req/s', '100.0', 'req/s', '+0.0%',
+                                    'unchanged']
+        assert lines[7].split() == ['4', 'clients', 'error', 'rate', '0.000', '0.000', '+0.000', 'unchanged']
+        assert lines[8].split() == ['new', 'new']
+        assert lines[-1] == "2 regressions, 0 improvements, 2 unchanged"
+
+
+class TestBaselines:
+
+    @patch("gobstuf.benchmarks.compare._git_commit", lambda: 'abc')
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = save(pipeline(10), Path(tmpdir, 'baselines'))
+            assert path == Path(tmpdir, 'baselines', 'pipeline.json')
+            with open(path) as f:
+                saved = json.load(f)
+
+        assert saved['version'] == FORMAT_VERSION
+        assert saved['commit'] == 'abc'
+        assert saved['created'] and saved['python'] and saved['platform']
+        assert (saved['benchmark'], saved['results']) == ('pipeline', pipeline(10)['results'])
+
+    @patch("gobstuf.benchmarks.compare.subprocess.run")
+    def test_git_commit(self, mock_run):
+        mock_run.return_value.stdout = 'abc\n'
+        assert _git_commit() == 'abc'
+
+        for exception in [OSError, subprocess.CalledProcessError(1, 'git')]:
+            mock_run.side_effect = exception
+            assert _git_commit() is None
+
+
+@patch("gobstuf.benchmarks.compare._git_commit", lambda: 'abc')
+@patch("gobstuf.benchmarks.compare.print")
+class TestMain:
+
+    def write(self, path: str, results: dict) -> str:
+        with open(path, 'w') as f:
+            json.dump(results, f)
+        return path
+
+    def test_main(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baselines = os.path.join(tmpdir, 'baselines')
+            results = self.write(os.path.join(tmpdir, 'results.json'), pipeline(10, [10] * 10))
+            assert main(['save', results, '--baselines', baselines]) == 0
+            mock_print.assert_called_with(f"Saved baseline {os.path.join(baselines, 'pipeline.json')}")
+
+            assert main(['check', results, '--baselines', baselines]) == 0
+
+            slower = self.write(os.path.join(tmpdir, 'slower.json'), pipeline(20, [20] * 10))
+            output = os.path.join(tmpdir, 'comparison.json')
+            assert main(['check', slower, '--baselines', baselines, '--output', output, '--resamples', '10']) == 1
+            assert 'regression' in mock_print.call_args[0][0]
+            with open(output) as f:
+                comparison = json.load(f)
+            assert comparison['comparisons']['parse response.xml']['verdict'] == REGRESSION
+
+            # A larger threshold accepts the regression
+            assert main(['check', slower, '--baselines', baselines, '--threshold', '2']) == 0
+
+    def test_errors(self, mock_print):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = self.write(os.path.join(tmpdir, 'results.json'), pipeline(10))
+            with pytest.raises(SystemExit) as e:
+                main(['check', results, '--baselines', tmpdir])
+            assert e.value.code == 2
+
+            self.write(os.path.join(tmpdir, 'pipeline.json'), {**baseline(pipeline(10)), 'version': 0})
+            with pytest.raises(SystemExit) as e:
+                main(['check', results, '--baselines', tmpdir])
+            assert e.value.code == 2
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.benchmarks.compression import generated_payloads, file_payloads, measure, run, report, main, LIST_SIZES
+
+
+class TestCompressionBenchmark(TestCase):
+
+    def test_generated_payloads(self):
+        payloads = generated_payloads()
+        self.assertEqual(len(LIST_SIZES), len(payloads))
+        for size, payload in zip(LIST_SIZES, payloads.values()):
+            self.assertEqual(size, len(json.loads(payload)['_embedded']['ingeschrevenpersonen']))
+
+    def test_file_payloads(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b'<xml/>')
+        try:
+            self.assertEqual({f.name: b'<xml/>'}, file_payloads([f.name]))
+        finally:
+            os.remove(f.name)
+
+    def test_measure(self):
+        data = b'<xml>any data</xml>' * 100
+        result = measure(data, 'gzip', 6, min_duration=0.001)
+        self.assertEqual(len(data), result['size'])
+        self.assertEqual(len(data) - result['compressed_size'], result['bytes_saved'])
+        self.assertGreater(result['cpu_ms'], 0)
+        self.assertGreater(result['bytes_saved_per_cpu_ms'], 0)
+
+    @patch("gobstuf.benchmarks.compression.LEVELS", {'gzip': [1], 'br': [1]})
+    def test_run_report(self):
+        results = run({'any': b'any data' * 100}, min_duration=0.001)
+        self.assertEqual([('any', 'br', 1), ('any', 'gzip', 1)],
+                         [(r['payload'], r['encoding'], r['level']) for r in results])
+        self.assertEqual(4, len(report(results).split('\n')))
+
+    @patch("gobstuf.benchmarks.compression.print")
+    @patch("gobstuf.benchmarks.compression.run")
+    def test_main(self, mock_run, mock_print):
+        mock_run.return_value = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'results.json')
+            main(['--output', output, '--min-duration', '0.01'])
+            with open(output) as f:
+                self.assertEqual({'benchmark': 'compression', 'results': []}, json.load(f))
+        mock_run.assert_called_with(generated_payloads(), 0.01)
+        mock_print.assert_called_once()
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+from gobcore.secure.request import extract_roles, USER_NAME_HEADER
+
+from gobstuf.benchmarks.load import Target, Sample, KINDS, MIXES, role_headers, parse_server_timing, parse_mix, \
+    run_level, summarise, report, serve, server_commands, servers, main, _free_port, _wait_until_up, \
+    ThreadingWSGIServer, QuietWSGIRequestHandler
+from gobstuf.stand_in.mks import StandInMKS, FixtureAnswers, create_server
+
+FIXTURES = Path(__file__).parent.parent / 'fixtures'
+
+
+class TestRequests:
+
+    def test_target(self):
+        target = Target('http://gateway', {'header': 'value'}, hc_base_path='/hc', soap_path='/api/310')
+        rng = random.Random(1)
+
+        method, url, body, headers = target.request('bsn', ['123456789'], rng)
+        assert (method, url, body, headers) == ('GET', 'http://gateway/hc/brp/ingeschrevenpersonen/123456789', None,
+                                                {'header': 'value'})
+
+        method, url, body, headers = target.request('filter_naam', ['123456789'], rng)
+        assert url.startswith('http://gateway/hc/brp/ingeschrevenpersonen?')
+
+        method, url, body, headers = target.request('batch', ['123456789', '123456780'], rng)
+        assert (method, url) == ('POST', 'http://gateway/hc/brp/ingeschrevenpersonen/batch')
+        assert sorted(json.loads(body)['burgerservicenummers']) == ['123456780', '123456789']
+        assert headers == {'header': 'value', 'Content-Type': 'application/json'}
+
+        method, url, body, headers = target.request('soap', ['123456789'], rng)
+        assert (method, url) == ('POST', 'http://gateway/api/310')
+        assert b'123456789' in body
+        assert headers['Soapaction'] == 'http://www.egem.nl/StUF/sector/bg/0310/npsLv01'
+        assert headers['Content-Type'] == 'text/xml'
+
+    def test_role_headers(self):
+        headers = role_headers(['fp_test', 'brp_r'], 'user')
+        assert extract_roles(headers) == ['fp_test', 'brp_r']
+        assert headers[USER_NAME_HEADER] == 'user'
+
+    def test_parse_server_timing(self):
+        assert parse_server_timing('') == {}
+        assert parse_server_timing('mks;dur=12.500, serialise;desc="any";dur=1.2,cache') == {
+            'mks': 12.5, 'serialise': 1.2}
+
+    def test_parse_mix(self):
+        assert parse_mix('realistic') == MIXES['realistic']
+        assert parse_mix('bsn=5,soap=1.5') == {'bsn': 5.0, 'soap': 1.5}
+        assert set(MIXES['rest']) == set(KINDS) - {'soap'}
+
+        for value in ['bsn', 'bsn=a', 'any=1']:
+            with pytest.raises(argparse.ArgumentTypeError):
+                parse_mix(value)
+
+
+class TestSummary:
+
+    def test_summarise(self):
+        samples = [
+            Sample('bsn', 200, 0.010, {'mks': 8.0, 'map': 1.0}),
+            Sample('bsn', 200, 0.030, {'mks': 20.0}),
+            Sample('soap', 500, 0.020, {}),
+            Sample('soap', 0, 0.040, {}),
+        ]
+        summary = summarise(samples, concurrency=2, elapsed=2.0)
+        assert summary['concurrency'] == 2
+        assert summary['requests'] == 4
+        assert summary['throughput'] == 2.0
+        assert summary['errors'] == 2
+        assert summary['error_rate'] == 0.5
+        assert summary['statuses'] == {'0': 1, '200': 2, '500': 1}
+        assert summary['latency_ms']['p50'] == pytest.approx(30)
+        assert summary['latency_ms']['max'] == pytest.approx(40)
+        assert sorted(summary['samples_ms']) == pytest.approx([10, 20, 30, 40])
+        assert summary['kinds']['bsn']['errors'] == 0
+        assert summary['kinds']['soap']['errors'] == 2
+        assert summary['phases_ms'] == {'mks': {'mean': 14.0, 'p95': 20.0}, 'map': {'mean': 1.0, 'p95': 1.0}}
+
+        empty = summarise([], 1, 0)
+        assert (empty['throughput'], empty['error_rate'], empty['latency_ms']) == (0.0, 0.0, {})
+
+    def test_report(self):
+        results = [summarise([Sample('bsn', 200, 0.01, {'mks': 8.0})], 1, 1),
+                   summarise([Sample('bsn', 200, 0.01, {'map': 1.0})], 4, 1)]
+        lines = report(results).split('\n')
+        assert lines[2].split() == ['1', '1.0', '10.0', '10.0', '10.0', '0.0%']
+        assert lines[6].split() == ['clients', 'mks', 'map']
+        assert lines[8].split() == ['1', '8.00']
+        assert lines[9].split() == ['4', '1.00']
+
+        assert len(report([summarise([], 1, 1)]).split('\n')) == 3
+
+
+@pytest.fixture
+def gateway(app):
+    """The app in a WSGI server, pointed at an MKS stand-in"""
+    mks = create_server(StandInMKS(FixtureAnswers(FIXTURES)), port=0)
+    server = ThreadingWSGIServer(('localhost', 0), QuietWSGIRequestHandler)
+    server.set_app(app)
+    threads = [threading.Thread(target=s.serve_forever) for s in [mks, server]]
+    for thread in threads:
+        thread.start()
+
+    netloc = f'localhost:{mks.server_address[1]}'
+    try:
+        with patch("gobstuf.rest.brp.base_view.ROUTE_NETLOC", netloc), \
+                patch("gobstuf.blueprints.secure.ROUTE_NETLOC", netloc), \
+                patch("gobstuf.certrequest.PKCS12_FILENAME", None):
+            yield f'http://localhost:{server.server_address[1]}'
+    finally:
+        for s in [mks, server]:
+            s.shutdown()
+            s.server_close()
+        for thread in threads:
+            thread.join()
+
+
+class TestRun:
+
+    def test_run_level(self, gateway, app_base_path, jwt_header):
+        target = Target(gateway, role_headers(jwt_header['_param']['roles'], 'user'), app_base_path,
+                        f"{os.environ['API_BASE_PATH']}{os.environ['ROUTE_PATH_310']}")
+
+        result = run_level(target, {'bsn': 1, 'soap': 1, 'historie': 1}, ['999991619'], concurrency=2, duration=0.5,
+                           seed=1)
+        assert result['requests'] > 0
+        assert result['statuses'] == {'200': result['requests']}
+        assert set(result['kinds']) <= {'bsn', 'soap', 'historie'}
+        assert {'validate', 'mks', 'map'} <= set(result['phases_ms'])
+
+        # Failed requests and requests within the warm-up
+        target = Target('http://localhost:1', {})
+        result = run_level(target, {'bsn': 1}, ['999991619'], concurrency=1, duration=0.1, warmup=0.1)
+        assert result['statuses'] == {'0': result['requests']}
+
+    @patch("gobstuf.benchmarks.load.make_server")
+    def test_serve(self, mock_make_server):
+        serve(8000)
+        host, port, app, server_class, handler_class = mock_make_server.call_args[0]
+        assert (host, port) == ('localhost', 8000)
+        assert (server_class, handler_class) == (ThreadingWSGIServer, QuietWSGIRequestHandler)
+        assert app.name == 'gobstuf.api'
+        mock_make_server.return_value.serve_forever.assert_called_once()
+
+    def test_free_port(self):
+        assert 0 < _free_port() < 65536
+
+    @patch("gobstuf.benchmarks.load.time.sleep", MagicMock())
+    @patch("gobstuf.benchmarks.load.requests.get")
+    def test_wait_until_up(self, mock_get):
+        process = MagicMock(args=['any', 'command'], returncode=1)
+        process.poll.return_value = None
+        mock_get.side_effect = [requests.ConnectionError, MagicMock()]
+        _wait_until_up('url', process)
+        assert mock_get.call_count == 2
+
+        with pytest.raises(RuntimeError, match='url does not answer'):
+            _wait_until_up('url', process, timeout=0)
+
+        process.poll.return_value = 1
+        with pytest.raises(RuntimeError, match='any command stopped with exit code 1'):
+            _wait_until_up('url', process)
+
+    def test_server_commands(self):
+        args = argparse.Namespace(generate='worst', mks_latency=['fixed:0.1', 'npsLv07=fixed:0.2'], seed=1,
+                                  server='wsgiref', processes=4)
+        mks, app = server_commands(args, 8166, 8165)
+        assert mks[1:] == ['-m', 'gobstuf.stand_in.mks', '--port', '8166', '--generate', 'worst',
+                           '--latency', 'fixed:0.1', '--latency', 'npsLv07=fixed:0.2', '--seed', '1']
+        assert app[1:] == ['-m', 'gobstuf.benchmarks.load', '--serve', '8165']
+
+        args.server, args.seed = 'uwsgi', None
+        mks, app = server_commands(args, 8166, 8165)
+        assert '--seed' not in mks
+        assert app[:3] == ['uwsgi', '--http', 'localhost:8165']
+        assert app[app.index('--processes') + 1] == '4'
+
+    @patch.dict(os.environ, {'PKCS12_FILENAME': 'any'})
+    @patch("gobstuf.benchmarks.load._wait_until_up")
+    @patch("gobstuf.benchmarks.load.subprocess.Popen")
+    def test_servers(self, mock_popen, mock_wait_until_up):
+        args = argparse.Namespace(generate='production', mks_latency=[], seed=None, server='wsgiref', processes=4)
+        with servers(args) as url:
+            assert url.startswith('http://localhost:')
+            assert mock_popen.call_count == 2
+
+        env = mock_popen.call_args[1]['env']
+        assert env['ROUTE_SCHEME'] == 'http'
+        assert env['ROUTE_NETLOC'].startswith('localhost:')
+        assert 'PKCS12_FILENAME' not in env
+        assert mock_wait_until_up.call_args_list[1][0][0] == f'{url}/brp/status/health/'
+        assert mock_popen.return_value.terminate.call_count == 2
+
+        # Started processes are stopped when a process does not start
+        mock_popen.reset_mock()
+        mock_wait_until_up.side_effect = RuntimeError
+        with pytest.raises(RuntimeError):
+            with servers(args):
+                pass  # pragma: no cover
+        mock_popen.return_value.terminate.assert_called_once()
+
+
+class TestMain:
+
+    @patch("gobstuf.benchmarks.load.print")
+    @patch("gobstuf.benchmarks.load.run_level")
+    def test_main(self, mock_run_level, mock_print):
+        mock_run_level.return_value = summarise([], 1, 1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'load.json')
+            main(['--url', 'http://gateway', '--mix', 'bsn=1', '--concurrency', '1', '2', '--persons', '3',
+                  '--seed', '1', '--output', output])
+            with open(output) as f:
+                result = json.load(f)
+        assert result == {'benchmark': 'load', 'mix': {'bsn': 1.0}, 'results': [mock_run_level.return_value] * 2}
+
+        target, mix, bsns, concurrency, duration, warmup, seed, timeout = mock_run_level.call_args[0]
+        assert target.bases['rest'].startswith('http://gateway')
+        assert (mix, len(bsns), concurrency, seed) == ({'bsn': 1.0}, 3, 2, 1)
+        mock_print.assert_called_with(report(result['results']))
+
+        @contextmanager
+        def mock_servers(args):
+            yield 'http://started'
+
+        with patch("gobstuf.benchmarks.load.servers", mock_servers):
+            main(['--concurrency', '1'])
+        target, mix = mock_run_level.call_args[0][:2]
+        assert target.bases['rest'].startswith('http://started')
+        assert mix == MIXES['realistic']
+
+    @patch("gobstuf.benchmarks.load.serve")
+    def test_serve(self, mock_serve):
+        main(['--serve', '8165'])
+        mock_serve.assert_called_with(8165)
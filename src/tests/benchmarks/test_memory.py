@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.benchmarks.memory import build, serialise, measure, run, report, main, SHAPES
+from gobstuf.benchmarks.results import person
+from gobstuf.rest.brp.serializer import get_serializer
+from gobstuf.stuf.brp.compact import CompactObject, to_compact
+
+
+class TestMemoryBenchmark(TestCase):
+
+    def test_build(self):
+        results, allocated = build(person, 10, to_compact)
+        self.assertEqual(10, len(results))
+        self.assertIsInstance(results[0], CompactObject)
+        self.assertGreater(allocated, 0)
+
+    def test_serialise(self):
+        data, duration = serialise([{'a': 1}], get_serializer())
+        self.assertEqual(b'{"_embedded":{"results":[{"a":1}]}}', data)
+        self.assertGreaterEqual(duration, 0)
+
+    def test_measure(self):
+        for serializer in ['json', 'orjson']:
+            results = measure('ingeschrevenpersonen', 10, get_serializer(serializer))
+            self.assertEqual(['dict', 'compact'], [r['representation'] for r in results])
+            dict_result, compact_result = results
+            self.assertLess(compact_result['bytes'], dict_result['bytes'])
+
+    @patch("gobstuf.benchmarks.memory.SHAPES", {'any': lambda n: {'a': n}})
+    @patch("gobstuf.benchmarks.memory.REPRESENTATIONS", {'dict': lambda obj: obj, 'other': lambda obj: {'b': 1}})
+    def test_measure_different(self):
+        with self.assertRaises(AssertionError):
+            measure('any', 1, get_serializer())
+
+    def test_run_report(self):
+        results = run([2], get_serializer())
+        self.assertEqual(len(SHAPES) * 2, len(results))
+        self.assertEqual(2 + len(results), len(report(results).split('\n')))
+
+    @patch("gobstuf.benchmarks.memory.print")
+    @patch("gobstuf.benchmarks.memory.run")
+    def test_main(self, mock_run, mock_print):
+        mock_run.return_value = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'results.json')
+            main(['--sizes', '5', '--serializer', 'json', '--output', output])
+            with open(output) as f:
+                self.assertEqual({'benchmark': 'memory', 'results': []}, json.load(f))
+        self.assertEqual([5], mock_run.call_args[0][0])
+        mock_print.assert_called_once()
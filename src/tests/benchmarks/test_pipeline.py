@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from gobstuf.benchmarks.pipeline import Case, STAGES, measure, run, report, main, file_payloads, \
+    generated_payloads, response_cases, request_cases, _percentile
+from gobstuf.config import HC_BASE_PATH
+
+FIXTURES = Path(__file__).parent.parent / 'fixtures'
+
+
+@pytest.fixture
+def request_context(app):
+    with app.test_request_context(f"{HC_BASE_PATH}/brp/ingeschrevenpersonen"):
+        yield
+
+
+class TestMeasure:
+
+    def test_percentile(self):
+        durations = list(range(100))
+        assert _percentile(durations, 50) == 50
+        assert _percentile(durations, 99) == 99
+        assert _percentile([1], 99) == 1
+
+    def test_measure(self):
+        call = MagicMock(return_value='result')
+        prepare = MagicMock(return_value='arg')
+
+        result = measure(Case('stage', 'name', call, prepare), min_duration=0)
+        # Warm up, the minimal number of calls and the memory measurement
+        assert call.call_count == prepare.call_count == 7
+        call.assert_called_with('arg')
+
+        assert result['stage'] == 'stage'
+        assert result['case'] == 'name'
+        assert result['calls'] == 5
+        assert result['ops_per_sec'] > 0
+        assert result['p50_us'] <= result['p90_us'] <= result['p99_us'] <= result['max_us']
+        assert result['peak_bytes'] >= result['allocated_bytes'] >= 0
+        assert len(result['samples_us']) == 5
+
+    def test_allocations(self):
+        result = measure(Case('stage', 'name', lambda _: bytearray(100000)), min_duration=0)
+        assert result['allocated_bytes'] >= 100000
+
+        result = measure(Case('stage', 'name', lambda _: len(bytearray(100000))), min_duration=0)
+        assert result['peak_bytes'] >= 100000 > result['allocated_bytes']
+
+
+class TestCases:
+
+    def test_payloads(self):
+        payloads = generated_payloads(['minimal', 'worst'], seed=1)
+        assert list(payloads) == ['npsLa01 minimal', 'npsLa07 minimal', 'npsLa01 worst', 'npsLa07 worst']
+        assert payloads == generated_payloads(['minimal', 'worst'], seed=1)
+
+        payloads = file_payloads([str(FIXTURES / 'response_310.xml')])
+        assert payloads == {'response_310.xml': (FIXTURES / 'response_310.xml').read_text()}
+
+    def test_response_cases(self, request_context):
+        payloads = {**generated_payloads(['minimal']), **file_payloads([str(FIXTURES / 'response_310_empty.xml')])}
+        payloads['other'] = '<any/>'
+
+        cases = {name: response_cases(name, text) for name, text in payloads.items()}
+        stages = ['parse', 'find_elm', 'map', 'map', 'map', 'filter', 'serialise']
+        assert [case.stage for case in cases['npsLa01 minimal']] == stages
+        assert [case.stage for case in cases['npsLa07 minimal']] == stages
+        assert [case.stage for case in cases['response_310_empty.xml']] == ['parse', 'find_elm']
+        assert cases['other'] == []
+
+        parse, find_elm, mapped, detail, all_objects, filter, serialise = cases['npsLa01 minimal']
+        assert parse.call(parse.prepare()).find_elm('soapenv:Body BG:npsLa01 BG:antwoord') is not None
+        assert find_elm.call(find_elm.prepare()).tag.endswith('object')
+        assert mapped.call(mapped.prepare()).mapped_object['burgerservicenummer']
+        assert detail.call(detail.prepare())['burgerservicenummer']
+        assert len(all_objects.call(all_objects.prepare())) == 1
+
+        # Every call filters a newly mapped object
+        first, second = filter.prepare(), filter.prepare()
+        assert first[0] is not second[0]
+        assert filter.call(first)['_links']['self']
+
+        response = serialise.call(serialise.prepare())
+        assert response.status_code == 200
+        assert len(json.loads(response.get_data())['_embedded']['ingeschrevenpersonen']) == 1
+
+    def test_request_cases(self):
+        cases = request_cases()
+        assert {case.stage for case in cases} == {'to_string', 'validate', 'code_resolver'}
+
+        for case in cases:
+            result = case.call(case.prepare())
+            if case.stage == 'to_string':
+                assert b'<soapenv:Envelope' in result
+            elif case.stage == 'validate':
+                # The arguments are valid
+                assert all(errors is None for errors in result.values())
+            else:
+                assert result
+
+
+class TestRun:
+
+    def test_run(self, request_context):
+        results = run(generated_payloads(['minimal']), ['parse', 'code_resolver'], min_duration=0)
+        assert {r['stage'] for r in results} == {'parse', 'code_resolver'}
+        assert [r['case'] for r in results][:2] == ['npsLa01 minimal', 'npsLa07 minimal']
+
+        lines = report(results).split('\n')
+        assert len(lines) == len(results) + 2
+        assert lines[2].startswith('parse')
+
+    @patch("gobstuf.benchmarks.pipeline.print")
+    @patch("gobstuf.benchmarks.pipeline.run")
+    def test_main(self, mock_run, mock_print, app):
+        results = [{'stage': 'parse', 'case': 'any', 'ops_per_sec': 1, 'p50_us': 1, 'p99_us': 1, 'peak_bytes': 1}]
+        mock_run.return_value = results
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'pipeline.json')
+            main([str(FIXTURES / 'response_310.xml'), '--sizes', 'minimal', '--min-duration', '0', '--output', output])
+            with open(output) as f:
+                assert json.load(f) == {'benchmark': 'pipeline', 'results': results}
+
+        payloads, stages, min_duration = mock_run.call_args[0]
+        assert list(payloads) == ['response_310.xml', 'npsLa01 minimal', 'npsLa07 minimal']
+        assert stages == STAGES
+        assert min_duration == 0
+        mock_print.assert_called_with(report(results))
+
+        main(['--sizes', '--stages', 'parse'])
+        assert mock_run.call_args[0][:2] == ({}, ['parse'])
@@ -0,0 +1,207 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import pytest
+from cryptography.fernet import Fernet
+
+from gobstuf.benchmarks.replay import read_captures, summary, replay_pipeline, report, ReplayMKS, pseudonymise, \
+    main, STAGES
+from gobstuf.config import HC_BASE_PATH
+from gobstuf.lib.capture import CaptureStore
+
+FIXTURES = Path(__file__).parent.parent / 'fixtures'
+KEY = Fernet.generate_key()
+
+NPS_LV01 = 'http://www.egem.nl/StUF/sector/bg/0310/npsLv01'
+RESPONSE = (FIXTURES / 'response_310.xml').read_text()
+EMPTY = (FIXTURES / 'response_310_empty.xml').read_text()
+
+
+def request(bsn: str) -> str:
+    return (f'<BG:npsLv01 xmlns:BG="http://www.egem.nl/StUF/sector/bg/0310"><BG:gelijk>'
+            f'<BG:inp.bsn>{bsn}</BG:inp.bsn></BG:gelijk></BG:npsLv01>')
+
+
+def capture(time: float, bsn: str = '999991619', response: str = RESPONSE, status: int = 200, **kwargs) -> dict:
+    return {
+        'time': time,
+        'path': '/310',
+        'soap_action': NPS_LV01,
+        'status': status,
+        'duration': 0.5,
+        'request_bytes': len(request(bsn)),
+        'response_bytes': len(response),
+        'request': request(bsn),
+        'response': response,
+        'pseudonymised': False,
+        **kwargs,
+    }
+
+
+@pytest.fixture
+def request_context(app):
+    with app.test_request_context(f"{HC_BASE_PATH}/brp/ingeschrevenpersonen"):
+        yield
+
+
+@pytest.fixture
+def capture_file():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'mks.capture')
+        store = CaptureStore(KEY)
+        store.append(path, capture(2))
+        store.append(path, capture(1, response=EMPTY))
+        yield path
+
+
+class TestCaptures:
+
+    def test_read_captures(self, capture_file):
+        records = read_captures([capture_file], KEY)
+        assert [record['time'] for record in records] == [1, 2]
+
+        with pytest.raises(ValueError):
+            read_captures([capture_file], Fernet.generate_key())
+
+    def test_summary(self):
+        lines = summary([capture(0), capture(0, request='invalid')]).split('\n')
+        assert len(lines) == 4
+        assert 'npsLv01' in lines[2]
+        assert '500.0' in lines[2]
+        assert lines[2].endswith('999991619')
+        assert lines[3].endswith('  ')
+
+    def test_pseudonymise(self, capture_file):
+        records = read_captures([capture_file], KEY) + [capture(3, pseudonymised=True)]
+        path = os.path.join(os.path.dirname(capture_file), 'pseudonymised.capture')
+
+        assert pseudonymise(records, KEY, path) == 2
+
+        result = read_captures([path], KEY)
+        assert [record['pseudonymised'] for record in result] == [True, True, True]
+        assert '999991619' not in result[1]['request'] + result[1]['response']
+        assert '999991619' in result[2]['request']
+
+
+class TestReplayPipeline:
+
+    def test_replay_pipeline(self, request_context):
+        fault = capture(3, response='<fault/>', status=500)
+        results, skipped = replay_pipeline([capture(1), capture(2), fault], STAGES)
+        assert skipped == 1
+
+        stages = {result['stage'] for result in results}
+        assert stages == set(STAGES)
+        for result in results:
+            assert result['calls'] == 2
+            assert 0 < result['p50_us'] <= result['p95_us'] <= result['max_us']
+            assert result['total_ms'] > 0
+        assert [result['case'] for result in results if result['stage'] == 'parse'] == ['']
+
+        results, skipped = replay_pipeline([capture(1)], ['parse'])
+        assert [result['stage'] for result in results] == ['parse']
+        assert skipped == 0
+
+    def test_report(self):
+        results = [{'stage': 'parse', 'case': '', 'calls': 2, 'total_ms': 1.0, 'p50_us': 400.0, 'p95_us': 500.0,
+                    'max_us': 600.0}]
+        lines = report(results, 1).split('\n')
+        assert lines[2].startswith('parse')
+        assert lines[-1] == "1 responses without a mapped answer were skipped"
+
+
+class TestReplayMKS:
+
+    def test_answer(self):
+        other = capture(2, bsn='999990809', response=RESPONSE.replace('999991619', '999990809'), status=200)
+        stand_in = ReplayMKS([capture(1), other], speed=2)
+
+        # The capture of the same request
+        answer = stand_in.answer(NPS_LV01, request('999991619').encode())
+        assert (answer.status, answer.body, answer.delay) == (200, RESPONSE, 0.25)
+
+        # Captures of the same request are answered in turn
+        stand_in = ReplayMKS([capture(1), capture(2, status=500)], speed=0)
+        assert [stand_in.answer(NPS_LV01, request('999991619').encode()).status for _ in range(3)] == [200, 500, 200]
+        assert stand_in.answer(NPS_LV01, request('999991619').encode()).delay == 0
+
+    def test_answer_bsn(self):
+        stand_in = ReplayMKS([capture(1)])
+        body = request('999991619').replace('</BG:gelijk>', '<BG:geslachtsnaam>any</BG:geslachtsnaam></BG:gelijk>')
+        answer = stand_in.answer(NPS_LV01, body.encode())
+        assert answer.body == RESPONSE
+
+    def test_answer_fallback(self):
+        stand_in = ReplayMKS([capture(1)])
+        answer = stand_in.answer(NPS_LV01, request('123456782').encode())
+        assert answer.status == 200
+        assert '<BG:inp.bsn>123456782<' in answer.body
+        assert '999990809' in answer.body
+
+        # Without a BSN the capture is answered as recorded
+        answer = stand_in.answer(NPS_LV01, b'<npsLv01/>')
+        assert answer.body == RESPONSE
+
+    def test_no_capture(self):
+        stand_in = ReplayMKS([capture(1)])
+        answer = stand_in.answer('http://www.egem.nl/StUF/sector/bg/0310/npsLv07', request('999991619').encode())
+        assert answer.status == 500
+        assert 'StUF003' in answer.body
+
+        answer = stand_in.answer(NPS_LV01, b'invalid')
+        assert answer.status == 500
+        assert 'StUF011' in answer.body
+
+
+class TestMain:
+
+    def test_list(self, capture_file, capsys):
+        main(['list', capture_file, '--key', KEY.decode()])
+        assert len(capsys.readouterr().out.split('\n')) == 5
+
+    @patch.dict(os.environ, {'CAPTURE_KEY': KEY.decode()})
+    def test_pipeline(self, capture_file, capsys):
+        output = os.path.join(os.path.dirname(capture_file), 'replay.json')
+        main(['pipeline', capture_file, '--stages', 'parse', '--output', output])
+        assert "0 responses without a mapped answer were skipped" in capsys.readouterr().out
+
+        with open(output) as f:
+            result = json.load(f)
+        assert result['benchmark'] == 'replay'
+        assert result['captures'] == 2
+        assert [r['stage'] for r in result['results']] == ['parse']
+
+        main(['pipeline', capture_file, '--stages', 'parse'])
+
+    @patch("gobstuf.benchmarks.replay.create_server")
+    def test_serve(self, mock_create_server, capture_file, capsys):
+        server = MagicMock()
+        server.server_address = ('localhost', 1234)
+        server.serve_forever.side_effect = KeyboardInterrupt
+        mock_create_server.return_value = server
+
+        main(['serve', capture_file, '--key', KEY.decode(), '--port', '0', '--speed', '0'])
+
+        stand_in, host, port = mock_create_server.call_args[0]
+        assert isinstance(stand_in, ReplayMKS)
+        assert (stand_in.speed, host, port) == (0, 'localhost', 0)
+        server.server_close.assert_called_once()
+        assert "Replaying 2 captures on http://localhost:1234" in capsys.readouterr().out
+
+    def test_pseudonymise(self, capture_file, capsys):
+        path = os.path.join(os.path.dirname(capture_file), 'pseudonymised.capture')
+        main(['pseudonymise', capture_file, '--key', KEY.decode(), '--to', path])
+        assert "Wrote 2 captures" in capsys.readouterr().out
+        assert all(record['pseudonymised'] for record in read_captures([path], KEY))
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_errors(self, capture_file):
+        with pytest.raises(SystemExit):
+            main(['list', capture_file])
+        with pytest.raises(SystemExit):
+            main(['list', capture_file, '--key', Fernet.generate_key().decode()])
+        with pytest.raises(SystemExit):
+            main(['list', '/any/file', '--key', KEY.decode()])
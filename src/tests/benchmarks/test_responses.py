@@ -0,0 +1,116 @@
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+import pytest
+
+from gobstuf.benchmarks.responses import Size, SIZES, npsLa01, npsLa07, main
+
+NAMESPACES = {
+    'BG': 'http://www.egem.nl/StUF/sector/bg/0310',
+    'StUF': 'http://www.egem.nl/StUF/StUF0301',
+}
+
+
+def _count(root: ET.Element, path: str) -> int:
+    return len(root.findall(path, NAMESPACES))
+
+
+class TestResponses:
+
+    def test_deterministic(self):
+        for generator in [npsLa01, npsLa07]:
+            assert generator(SIZES['worst'], 1) == generator(SIZES['worst'], 1)
+            assert generator(SIZES['worst'], 1) != generator(SIZES['worst'], 2)
+
+    def test_size(self):
+        size = Size(objects=3, partners=2, ouders=2, kinderen=4, nationaliteiten=3)
+        root = ET.fromstring(npsLa01(size, bsn='123456789'))
+
+        objects = root.findall('.//BG:antwoord/BG:object', NAMESPACES)
+        assert len(objects) == 3
+        assert objects[0].find('BG:inp.bsn', NAMESPACES).text == '123456789'
+        for obj in objects:
+            assert _count(obj, 'BG:inp.heeftAlsEchtgenootPartner') == 2
+            assert _count(obj, 'BG:inp.heeftAlsOuders') == 2
+            assert _count(obj, 'BG:inp.heeftAlsKinderen') == 4
+            assert _count(obj, 'BG:inp.heeftAlsNationaliteit') == 3
+
+        root = ET.fromstring(npsLa07(Size(historie=5)))
+        assert _count(root, './/BG:antwoord/BG:object') == 1
+        assert _count(root, './/BG:historieMaterieel') == 5
+
+    def test_optional(self):
+        minimal = ET.fromstring(npsLa01(SIZES['minimal']))
+        worst = ET.fromstring(npsLa01(SIZES['worst']))
+
+        # Optional elements are left out or have a value
+        assert minimal.find('.//BG:inp.a-nummer', NAMESPACES) is None
+        assert all(elm.text for elm in worst.findall('.//BG:inp.a-nummer', NAMESPACES))
+
+        # Only the required elements have a noValue
+        no_value = '{%s}noValue' % NAMESPACES['StUF']
+        assert len([elm for elm in minimal.iter() if no_value in elm.attrib]) < \
+               len([elm for elm in ET.fromstring(npsLa01()).iter() if no_value in elm.attrib])
+
+        in_onderzoek = [elm.text for elm in minimal.iter(f"{{{NAMESPACES['BG']}}}inOnderzoek")]
+        assert in_onderzoek and 'J' not in in_onderzoek
+        in_onderzoek = [elm.text for elm in worst.iter(f"{{{NAMESPACES['BG']}}}inOnderzoek")]
+        assert set(in_onderzoek) == {'J'}
+
+
+class TestMappedResponses:
+    """The generated responses are mapped like MKS responses"""
+
+    @pytest.fixture
+    def mks(self, requests_mock):
+        def respond(text):
+            url = f"{os.environ['ROUTE_SCHEME']}://{os.environ['ROUTE_NETLOC']}{os.environ['ROUTE_PATH_310']}"
+            requests_mock.post(url, text=text)
+        return respond
+
+    @pytest.mark.parametrize("size", SIZES)
+    def test_ingeschrevenpersonen(self, size, mks, app_base_path, client, jwt_header):
+        size = SIZES[size]
+        mks(npsLa01(size, bsn='123456789'))
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
+        assert response.status_code == 200
+        assert response.json['burgerservicenummer'] == '123456789'
+        assert len(response.json['_links'].get('partners', [])) == size.partners
+        assert len(response.json['_links'].get('kinderen', [])) == size.kinderen
+        assert len(response.json.get('nationaliteiten') or []) == size.nationaliteiten
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen?burgerservicenummer=123456789",
+                              headers=jwt_header)
+        assert response.status_code == 200
+        assert len(response.json['_embedded']['ingeschrevenpersonen']) == size.objects
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789/ouders", headers=jwt_header)
+        assert len(response.json['_embedded']['ouders']) == size.ouders
+
+    @pytest.mark.parametrize("size", SIZES)
+    def test_verblijfplaatshistorie(self, size, mks, app_base_path, client, jwt_header):
+        size = SIZES[size]
+        mks(npsLa07(size, bsn='123456789'))
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789/verblijfplaatshistorie",
+                              headers=jwt_header)
+        assert response.status_code == 200
+        assert len(response.json['_embedded']['verblijfplaatshistorie']) == size.historie + 1
+
+
+class TestMain:
+
+    @patch("gobstuf.benchmarks.responses.print")
+    def test_main(self, mock_print):
+        main(['--answer', 'npsLa07', '--size', 'minimal', '--historie', '2', '--in-onderzoek', '1'])
+        text = mock_print.call_args[0][0]
+        assert text == npsLa07(SIZES['minimal']._replace(historie=2, in_onderzoek=1.0))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'response.xml')
+            main(['--objects', '2', '--seed', '3', '--bsn', '123456789', '--output', output])
+            with open(output, encoding='utf-8') as f:
+                assert f.read() == npsLa01(SIZES['production']._replace(objects=2), 3, '123456789')
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock, mock_open
+from wsgiref.simple_server import WSGIServer
+
+import pytest
+from werkzeug.test import Client
+
+from gobstuf.benchmarks.load import QuietWSGIRequestHandler, MIXES
+from gobstuf.benchmarks.soak import Profiler, Worker, STATS_PATH, MB, parse_duration, rss, serve, growth_rate, \
+    steady_state, soak, evaluate, is_steady, growing_sites, route_peaks, report, worker_commands, main, _site, \
+    _stats, _run_workload
+
+
+@pytest.fixture
+def profiler(app):
+    """A profiler of the app, tracing is stopped afterwards"""
+    try:
+        yield Profiler(app, frames=5)
+    finally:
+        tracemalloc.stop()
+
+
+def worker_result(pid: int, rss_bytes: list[int], traced_bytes: list[int] = None) -> dict:
+    """The result of a worker that is sampled every hour"""
+    traced_bytes = traced_bytes or [MB] * len(rss_bytes)
+    return {
+        'pid': pid,
+        'samples': [{'elapsed': n * 3600.0, 'rss_bytes': r, 'traced_bytes': t}
+                    for n, (r, t) in enumerate(zip(rss_bytes, traced_bytes))],
+        'routes': {'route': {'requests': 2, 'peak_bytes': 4096, 'mean_peak_bytes': 3072}},
+        'growth': [{'size_diff': 2048, 'count_diff': 2, 'size': 4096,
+                    'traceback': ['/lib/xml.py:10', f'{os.sep}gobstuf{os.sep}message.py:53']}],
+    }
+
+
+class TestWorker:
+
+    def test_parse_duration(self):
+        assert parse_duration('30') == 30
+        assert parse_duration('1.5s') == 1.5
+        assert parse_duration('10m') == 600
+        assert parse_duration(' 4h') == 14400
+
+        for value in ['', 'h', '4d', '-1s']:
+            with pytest.raises(argparse.ArgumentTypeError):
+                parse_duration(value)
+
+    def test_rss(self):
+        assert rss() > 0
+
+        with patch("builtins.open", MagicMock(side_effect=OSError)), \
+                patch("gobstuf.benchmarks.soak.resource.getrusage") as mock_getrusage:
+            mock_getrusage.return_value.ru_maxrss = 1000
+            assert rss() == 1000
+
+        with patch("builtins.open", mock_open(read_data='100 2 3')), \
+                patch("gobstuf.benchmarks.soak.os.sysconf", lambda name: 4096):
+            assert rss() == 8192
+
+    def test_profiler(self, profiler, app_base_path):
+        assert tracemalloc.is_tracing()
+        client = Client(profiler)
+
+        assert client.get('/brp/status/health/').status_code == 200
+        client.get('/brp/status/health/')
+        assert client.get('/any/unknown/path').status_code == 404
+        assert client.get(f'{app_base_path}/brp/ingeschrevenpersonen/123456789').status_code == 403
+
+        assert set(profiler.routes) == {'_health', 'unmatched', 'hc.brp_ingeschrevenpersonen_bsn'}
+        assert profiler.routes['_health']['requests'] == 2
+        assert profiler.routes['_health']['peak_bytes'] > 0
+
+        response = client.get(STATS_PATH, query_string={'top': 5, 'baseline': 1})
+        stats = json.loads(response.get_data())
+        assert stats['pid'] == os.getpid()
+        assert stats['rss_bytes'] > 0 and stats['traced_bytes'] > 0
+        assert stats['routes']['_health']['requests'] == 2
+        assert stats['routes']['_health']['mean_peak_bytes'] <= stats['routes']['_health']['peak_bytes']
+
+        # Allocations after the baseline are reported as growth
+        kept = [bytearray(1000) for _ in range(100)]
+        stats = profiler.stats(top=100)
+        assert any(g['size_diff'] >= 100000 and g['traceback'][0].startswith(__file__) for g in stats['growth'])
+        assert all(len(g['traceback']) <= 5 for g in stats['growth'])
+        del kept
+
+        # The growth is reported since the new baseline
+        profiler.stats(baseline=True)
+        assert not any(g['size_diff'] >= 100000 for g in profiler.stats(top=100)['growth'])
+
+    def test_profiler_tracing(self, profiler):
+        # An app that answers with a plain list, tracing continues when it has started already
+        app = MagicMock(return_value=[b'body'])
+        app.url_map.bind_to_environ.return_value.match.return_value = ('endpoint', {})
+        profiled = Profiler(app, frames=1)
+        assert tracemalloc.get_traceback_limit() == 5
+        assert profiled({'PATH_INFO': '/'}, MagicMock()) == [b'body']
+        assert profiled.routes['endpoint']['requests'] == 1
+
+    def test_stats(self, profiler):
+        server = WSGIServer(('localhost', 0), QuietWSGIRequestHandler)
+        server.set_app(profiler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            worker = Worker(f'http://localhost:{server.server_address[1]}', None)
+            stats = _stats(worker, 5, baseline=True)
+            assert stats['growth'] == []
+            assert _stats(worker, 5)['pid'] == os.getpid()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    @patch("gobstuf.benchmarks.soak.tracemalloc.start", MagicMock())
+    @patch("gobstuf.benchmarks.soak.make_server")
+    def test_serve(self, mock_make_server):
+        serve(8000, 3)
+        host, port, app = mock_make_server.call_args[0]
+        assert (host, port) == ('localhost', 8000)
+        assert isinstance(app, Profiler)
+        assert mock_make_server.call_args[1] == {'handler_class': QuietWSGIRequestHandler}
+        mock_make_server.return_value.serve_forever.assert_called_once()
+
+
+class TestSteadyState:
+
+    def test_growth_rate(self):
+        assert growth_rate([(0, 100), (1, 110), (2, 120)]) == pytest.approx(10)
+        assert growth_rate([(0, 100), (1, 130), (2, 100), (3, 130)]) == pytest.approx(6)
+        assert growth_rate([(5, 100)]) == 0
+
+    def test_steady_state(self):
+        # Growth in the first half only
+        samples = worker_result(1, [10 * MB, 50 * MB, 60 * MB, 60 * MB, 61 * MB, 60 * MB])['samples']
+        state = steady_state(samples, 'rss_bytes', max_growth=1)
+        assert (state['start'], state['end']) == (10 * MB, 60 * MB)
+        assert state['growth_mb_per_hour'] == pytest.approx(0)
+        assert state['steady']
+
+        # Continuous growth
+        samples = worker_result(1, [n * 2 * MB for n in range(6)])['samples']
+        state = steady_state(samples, 'rss_bytes', max_growth=1)
+        assert state['growth_mb_per_hour'] == pytest.approx(2)
+        assert not state['steady']
+
+    def test_evaluate(self):
+        result = {'workers': [worker_result(1, [MB] * 5), worker_result(2, [MB] * 5, [n * 20 * MB for n in range(5)])]}
+        evaluation = evaluate(result, max_growth=10)
+        assert [worker['pid'] for worker in evaluation] == [1, 2]
+        assert evaluation[0]['rss']['steady'] and evaluation[0]['traced']['steady']
+        assert evaluation[1]['rss']['steady'] and not evaluation[1]['traced']['steady']
+
+        assert not is_steady(evaluation)
+        assert is_steady(evaluation[:1])
+
+
+class TestReport:
+
+    def test_site(self):
+        own = f'{os.sep}gobstuf{os.sep}message.py:53'
+        assert _site(['/lib/xml.py:10', '/lib/other.py:1', own]) == f'/lib/xml.py:10 < {own}'
+        assert _site([own, '/lib/xml.py:10']) == own
+        assert _site(['/lib/xml.py:10']) == '/lib/xml.py:10'
+
+    def test_aggregates(self):
+        result = {'workers': [worker_result(1, [MB]), worker_result(2, [MB])]}
+        result['workers'][1]['routes']['route'] = {'requests': 1, 'peak_bytes': 8192, 'mean_peak_bytes': 8192}
+        result['workers'][1]['routes']['other'] = {'requests': 1, 'peak_bytes': 1024, 'mean_peak_bytes': 1024}
+        result['workers'][1]['growth'].append({'size_diff': 1024, 'count_diff': 1, 'size': 1024,
+                                               'traceback': ['/lib/other.py:1']})
+
+        assert route_peaks(result) == {
+            'other': {'requests': 1, 'peak_bytes': 1024, 'mean_peak_bytes': 1024},
+            'route': {'requests': 3, 'peak_bytes': 8192, 'mean_peak_bytes': (2 * 3072 + 8192) / 3},
+        }
+        assert growing_sites(result) == [
+            {'site': f'/lib/xml.py:10 < {os.sep}gobstuf{os.sep}message.py:53', 'size_diff': 4096, 'count_diff': 4},
+            {'site': '/lib/other.py:1', 'size_diff': 1024, 'count_diff': 1},
+        ]
+        assert len(growing_sites(result, top=1)) == 1
+
+    def test_report(self):
+        result = {'workers': [worker_result(1, [MB] * 5), worker_result(2, [n * 20 * MB for n in range(5)])],
+                  'intervals': [{'elapsed': 1, 'requests': 10, 'errors': 1, 'throughput': 10}] * 2}
+        lines = report(result, evaluate(result, max_growth=10)).split('\n')
+        assert lines[0] == '20 requests, 2 errors'
+        assert lines[4].split() == ['1', '1.0', '1.0', '0.00', '1.0', '1.0', '0.00', 'yes']
+        assert lines[5].split() == ['2', '0.0', '80.0', '20.00', '1.0', '1.0', '0.00', 'NO']
+        assert lines[10].split() == ['route', '4', '3.0', '4.0']
+        assert lines[-1].split()[:2] == ['4.0', '4']
+
+
+class TestSoak:
+
+    @patch("gobstuf.benchmarks.soak.run_level")
+    def test_run_workload(self, mock_run_level):
+        mock_run_level.side_effect = [{'requests': 10, 'errors': 1, 'throughput': 5.0},
+                                      {'requests': 20, 'errors': 0, 'throughput': 10.0}]
+        workers = [Worker('url1', 'target1'), Worker('url2', 'target2')]
+        assert _run_workload(workers, {'bsn': 1}, ['1'], 2, 3.0, seed=1, timeout=5) == {
+            'requests': 30, 'errors': 1, 'throughput': 15.0}
+
+        calls = sorted(mock_run_level.call_args_list, key=lambda call: call[0][0])
+        assert [call[0] for call in calls] == [('target1', {'bsn': 1}, ['1'], 2, 3.0),
+                                               ('target2', {'bsn': 1}, ['1'], 2, 3.0)]
+        assert [call[1] for call in calls] == [{'seed': 1, 'timeout': 5}, {'seed': 2, 'timeout': 5}]
+
+        mock_run_level.side_effect = None
+        mock_run_level.return_value = {'requests': 1, 'errors': 0, 'throughput': 1.0}
+        _run_workload(workers[:1], {'bsn': 1}, ['1'], 1, 1.0)
+        assert mock_run_level.call_args[1]['seed'] is None
+
+    @patch("gobstuf.benchmarks.soak._stats")
+    @patch("gobstuf.benchmarks.soak._run_workload")
+    def test_soak(self, mock_run_workload, mock_stats):
+        def run_workload(workers, mix, bsns, concurrency, duration, seed, timeout):
+            time.sleep(duration)
+            return {'requests': 1, 'errors': 0, 'throughput': 1 / duration}
+
+        def stats(worker, top, baseline=False):
+            return {'pid': worker.url, 'rss_bytes': 100, 'traced_bytes': 10, 'routes': {'r': {}}, 'growth': [top]}
+
+        mock_run_workload.side_effect = run_workload
+        mock_stats.side_effect = stats
+        workers = [Worker(1, 'target1'), Worker(2, 'target2')]
+
+        result = soak(workers, {'bsn': 1}, ['1'], 2, duration=0.1, interval=0.03, warmup=0.01, top=3, seed=1)
+        assert [worker['pid'] for worker in result['workers']] == [1, 2]
+        samples = result['workers'][0]['samples']
+        assert len(samples) == len(result['intervals']) + 1 == 5
+        assert samples[0] == {'elapsed': 0.0, 'rss_bytes': 100, 'traced_bytes': 10}
+        assert samples[-1]['elapsed'] >= 0.1
+        assert result['workers'][0]['growth'] == [3]
+        assert result['intervals'][0]['requests'] == 1
+
+        # The warm-up, then the baseline
+        assert mock_run_workload.call_args_list[0][0][4] == 0.01
+        assert mock_stats.call_args_list[0][1] == {'baseline': True}
+
+        mock_run_workload.reset_mock()
+        soak(workers, {'bsn': 1}, ['1'], 2, duration=0.02, interval=0.01, warmup=0)
+        assert all(call[0][4] <= 0.01 for call in mock_run_workload.call_args_list)
+        assert mock_run_workload.call_args[0][5] is None
+
+
+class TestMain:
+
+    def test_worker_commands(self):
+        args = argparse.Namespace(workers=2, frames=3)
+        commands = list(worker_commands(args))
+        assert len(commands) == 2
+        command, url = commands[0]
+        assert command[1:] == ['-m', 'gobstuf.benchmarks.soak', '--serve', url.rsplit(':', 1)[1], '--frames', '3']
+        assert url.startswith('http://localhost:')
+
+    @patch("gobstuf.benchmarks.soak.print")
+    @patch("gobstuf.benchmarks.soak.soak")
+    @patch("gobstuf.benchmarks.soak.processes")
+    def test_main(self, mock_processes, mock_soak, mock_print):
+        commands = []
+
+        @contextmanager
+        def processes(started, env):
+            commands.extend(started)
+            yield
+
+        mock_processes.side_effect = processes
+        steady = {'workers': [worker_result(1, [MB] * 5)], 'intervals': []}
+        mock_soak.return_value = steady
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'soak.json')
+            assert main(['--workers', '2', '--duration', '1m', '--interval', '15s', '--warmup', '5s',
+                         '--mix', 'bsn=1', '--seed', '1', '--output', output]) == 0
+            with open(output) as f:
+                result = json.load(f)
+        assert result['benchmark'] == 'soak'
+        assert result['mix'] == {'bsn': 1.0}
+        assert result['evaluation'][0]['rss']['steady']
+        assert result['routes'] == route_peaks(steady)
+        assert result['workers'] == steady['workers']
+        mock_print.assert_called_with(report(steady, evaluate(steady, 10)))
+
+        # The stand-in and the workers are started, the workers are tested
+        assert len(commands) == 3
+        assert commands[0][0][1:3] == ['-m', 'gobstuf.stand_in.mks']
+        assert commands[1][1].endswith('/brp/status/health/')
+        workers, mix, bsns, concurrency, duration, interval, warmup = mock_soak.call_args[0][:7]
+        assert [worker.url for worker in workers] == [commands[1][1][:-len('/brp/status/health/')],
+                                                      commands[2][1][:-len('/brp/status/health/')]]
+        assert (mix, len(bsns), concurrency, duration, interval, warmup) == ({'bsn': 1.0}, 1000, 2, 60, 15, 5)
+
+        # Memory that keeps growing
+        mock_soak.return_value = {'workers': [worker_result(1, [n * 20 * MB for n in range(5)])], 'intervals': []}
+        assert main(['--duration', '1m', '--interval', '15s']) == 1
+        assert mock_soak.call_args[0][1] == MIXES['realistic']
+
+    def test_main_errors(self):
+        with pytest.raises(SystemExit) as e:
+            main(['--duration', '1m', '--interval', '20s'])
+        assert e.value.code == 2
+
+    @patch("gobstuf.benchmarks.soak.serve")
+    def test_serve(self, mock_serve):
+        assert main(['--serve', '8165', '--frames', '2']) == 0
+        mock_serve.assert_called_with(8165, 2)
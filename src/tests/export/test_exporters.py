@@ -0,0 +1,54 @@
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+from requests.exceptions import HTTPError
+
+from gobstuf.export.exporters import export_bsn, export_search, _search
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+
+
+class TestExporters(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.rate_limiter = MagicMock()
+
+    @patch("gobstuf.export.exporters.IngeschrevenpersonenBatchView")
+    def test_export_bsn(self, mock_view):
+        view = mock_view.return_value
+        self.assertEqual(view._get_results.return_value, export_bsn({'args': {'a': 'b'}}, ['1', '2'], self.rate_limiter))
+        self.assertEqual(self.rate_limiter, view.rate_limiter)
+        view._get_results.assert_called_with({'a': 'b'}, ['1', '2'])
+
+    @patch("gobstuf.export.exporters.logging", MagicMock())
+    @patch("gobstuf.export.exporters._search")
+    def test_export_search(self, mock_search):
+        mock_search.side_effect = [iter([{'any': 'line'}]), Exception('any error'), UpstreamUnavailable('any', 10)]
+
+        with self.app.test_request_context():
+            lines = list(export_search({'args': {}}, [{'a': '1'}, {'a': '2'}, {'a': '3'}], self.rate_limiter))
+
+        self.assertEqual({'any': 'line'}, lines[0])
+        self.assertEqual({'a': '2'}, lines[1]['zoekvraag'])
+        self.assertEqual(500, lines[1]['status'])
+        self.assertEqual({'a': '3'}, lines[2]['zoekvraag'])
+        self.assertEqual(503, lines[2]['status'])
+        self.assertEqual(3, len(lines))
+
+    @patch("gobstuf.export.exporters.StufErrorResponse")
+    @patch("gobstuf.export.exporters.IngeschrevenpersonenFilterView")
+    def test_search_mks_error(self, mock_view, mock_error_response):
+        view = mock_view.return_value
+        view._validate.return_value = {}
+        view._post.return_value.raise_for_status.side_effect = HTTPError
+        with self.app.test_request_context():
+            from gobstuf.rest.brp.rest_response import RESTResponse
+            view._error_response.return_value = RESTResponse.forbidden(detail='any detail')
+            lines = list(_search({'expand': 'x'}, {'a': '1'}, self.rate_limiter))
+
+        self.assertEqual({'expand': 'x', 'a': '1'}, view.args)
+        self.rate_limiter.acquire.assert_called_once()
+        view._error_response.assert_called_with(mock_error_response.return_value)
+        self.assertEqual([{'zoekvraag': {'a': '1'}, 'status': 403, 'fout': lines[0]['fout']}], lines)
+        self.assertEqual('any detail', lines[0]['fout']['detail'])
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.export.jobs import ExportJob, QUEUED, RUNNING, DONE, FAILED, delete_expired_jobs
+
+
+class TestExportJob(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_create_get(self):
+        job = ExportJob.create({'any': 'spec'}, total=5, directory=self.directory)
+
+        self.assertRegex(job.id, r'^[0-9a-f]{32}$')
+        self.assertEqual({'any': 'spec'}, job.spec)
+        self.assertEqual(QUEUED, job.state)
+        self.assertEqual({'state': QUEUED, 'total': 5, 'processed': 0, 'lines': 0, 'size': 0},
+                         {k: v for k, v in job.progress.items() if k != 'created'})
+        self.assertEqual(os.path.join(self.directory, job.id, 'result.ndjson'), job.result_path)
+
+        job = ExportJob.get(job.id, self.directory)
+        self.assertEqual({'any': 'spec'}, job.spec)
+
+        for job_id in ['0' * 32, '../' + job.id, 'any']:
+            self.assertIsNone(ExportJob.get(job_id, self.directory))
+
+    def test_default_directory(self):
+        with patch("gobstuf.export.jobs.EXPORT_DIR", self.directory):
+            job = ExportJob.create({}, total=1)
+            self.assertEqual([job.id], [j.id for j in ExportJob.all()])
+
+    def test_all(self):
+        self.assertEqual([], list(ExportJob.all(os.path.join(self.directory, 'any'))))
+
+        jobs = [ExportJob.create({}, total=1, directory=self.directory) for _ in range(3)]
+        os.makedirs(os.path.join(self.directory, 'any'))
+        self.assertEqual(sorted(job.id for job in jobs), [job.id for job in ExportJob.all(self.directory)])
+
+    def test_save_progress(self):
+        job = ExportJob.create({}, total=5, directory=self.directory)
+        progress = job.save_progress(state=RUNNING, processed=2)
+        self.assertEqual(progress, job.progress)
+        self.assertEqual(RUNNING, job.state)
+        self.assertEqual(2, job.progress['processed'])
+        self.assertEqual(5, job.progress['total'])
+        # No temporary files are left behind
+        self.assertEqual(['job.json', 'progress.json'], sorted(os.listdir(job.path)))
+
+    def test_lock(self):
+        job = ExportJob.create({}, total=1, directory=self.directory)
+        with job.lock() as locked:
+            self.assertTrue(locked)
+            with ExportJob.get(job.id, self.directory).lock() as other:
+                self.assertFalse(other)
+
+        with job.lock() as locked:
+            self.assertTrue(locked)
+
+    def test_delete(self):
+        job = ExportJob.create({}, total=1, directory=self.directory)
+        job.delete()
+        self.assertFalse(os.path.exists(job.path))
+        self.assertIsNone(ExportJob.get(job.id, self.directory))
+
+    def test_delete_expired_jobs(self):
+        jobs = {state: ExportJob.create({}, total=1, directory=self.directory)
+                for state in [QUEUED, RUNNING, DONE, FAILED]}
+        for state, job in jobs.items():
+            job.save_progress(state=state)
+        recent = ExportJob.create({}, total=1, directory=self.directory)
+
+        later = time.time() + 3600
+        with patch("gobstuf.export.jobs.time.time", lambda: later):
+            recent.save_progress(state=DONE)
+            delete_expired_jobs(1800, self.directory)
+
+        self.assertEqual(sorted([jobs[QUEUED].id, jobs[RUNNING].id, recent.id]),
+                         [job.id for job in ExportJob.all(self.directory)])
+
+    def test_delete_expired_jobs_deleted(self):
+        job = ExportJob.create({}, total=1, directory=self.directory)
+        os.remove(os.path.join(job.path, 'progress.json'))
+
+        with patch("gobstuf.export.jobs.ExportJob.all", lambda directory: iter([job])):
+            delete_expired_jobs(0, self.directory)
@@ -0,0 +1,186 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from flask import Flask, g, request
+
+from gobstuf.auth.routes import MKS_USER_KEY, MKS_APPLICATION_KEY
+from gobstuf.export import worker
+from gobstuf.export.jobs import ExportJob, QUEUED, RUNNING, DONE, FAILED
+from gobstuf.export.worker import run_job, ExportWorkerPool, get_worker_pool
+
+
+def exporter(spec, chunk, rate_limiter):
+    """Returns a line for every item, with the request context in which it is exported"""
+    return [{'item': item, 'url': request.url, 'user': g.get(MKS_USER_KEY), 'app': g.get(MKS_APPLICATION_KEY)}
+            for item in chunk]
+
+
+SPEC = {
+    'type': 'any',
+    'items': ['a', 'b', 'c', 'd', 'e'],
+    'args': {},
+    'user': 'user',
+    'application': 'app',
+    'base_url': 'https://any.host/root/',
+    'path': '/brp/exports',
+    'endpoint': 'exports',
+}
+
+
+@patch("gobstuf.export.worker.EXPORT_CHUNK_SIZE", 2)
+class TestRunJob(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        # A GET of the path of the job resolves to another endpoint
+        self.app.add_url_rule('/brp/<bsn>', 'bsn', lambda bsn: '', methods=['GET'])
+        self.app.add_url_rule('/brp/exports', 'exports', lambda: '', methods=['POST'])
+        self.job = ExportJob.create(SPEC, total=5, directory=self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _lines(self):
+        with open(self.job.result_path) as f:
+            return f.read().splitlines()
+
+    def test_run_job(self):
+        mock_exporter = MagicMock(side_effect=exporter)
+        run_job(self.app, self.job, mock_exporter)
+
+        progress = self.job.progress
+        self.assertEqual(DONE, progress['state'])
+        self.assertEqual((5, 5), (progress['processed'], progress['lines']))
+        self.assertEqual([
+            '{"item":"%s","url":"https://any.host/root/brp/exports","user":"user","app":"app"}' % item
+            for item in SPEC['items']
+        ], self._lines())
+        self.assertEqual(3, mock_exporter.call_count)
+
+        # A finished job is not executed again
+        mock_exporter.reset_mock()
+        run_job(self.app, self.job, mock_exporter)
+        mock_exporter.assert_not_called()
+
+    def test_resume(self):
+        # Interrupted after the first chunk, while the second chunk was being written
+        with open(self.job.result_path, 'w') as f:
+            f.write('{"item":"a"}\n{"item":"b"}\n{"item":"c"}\n{"ite')
+        self.job.save_progress(state=RUNNING, processed=2, lines=2, size=26)
+
+        run_job(self.app, self.job, lambda spec, chunk, rate_limiter: [{'item': item} for item in chunk])
+
+        self.assertEqual(['{"item":"%s"}' % item for item in SPEC['items']], self._lines())
+        self.assertEqual(5, self.job.progress['lines'])
+
+    def test_failed(self):
+        def failing_exporter(spec, chunk, rate_limiter):
+            if 'c' in chunk:
+                raise Exception('any error')
+            return exporter(spec, chunk, rate_limiter)
+
+        with patch("gobstuf.export.worker.logging"):
+            run_job(self.app, self.job, failing_exporter)
+
+        progress = self.job.progress
+        self.assertEqual((FAILED, 'any error', 2), (progress['state'], progress['error'], progress['processed']))
+        self.assertEqual(2, len(self._lines()))
+
+    def test_endpoint(self):
+        # The path of the job no longer resolves to the endpoint that submitted it
+        self.job = ExportJob.create({**SPEC, 'endpoint': 'other'}, total=5, directory=self.tmpdir.name)
+        mock_exporter = MagicMock()
+        with patch("gobstuf.export.worker.logging"):
+            run_job(self.app, self.job, mock_exporter)
+        mock_exporter.assert_not_called()
+        self.assertEqual(FAILED, self.job.state)
+        self.assertEqual("Export path /brp/exports resolves to exports, other expected", self.job.progress['error'])
+
+    def test_locked(self):
+        mock_exporter = MagicMock()
+        with ExportJob.get(self.job.id, self.tmpdir.name).lock():
+            run_job(self.app, self.job, mock_exporter)
+        mock_exporter.assert_not_called()
+        self.assertEqual(QUEUED, self.job.state)
+
+
+@patch("gobstuf.export.worker.threading")
+class TestExportWorkerPool(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_init(self, mock_threading):
+        pool = ExportWorkerPool('app', {}, workers=3, max_queued=1)
+        self.assertEqual(3, mock_threading.Thread.call_count)
+        mock_threading.Thread.assert_called_with(target=pool._work, name='export-worker-2', daemon=True)
+        mock_threading.Thread.return_value.start.assert_called_with()
+
+    def test_submit(self, mock_threading):
+        pool = ExportWorkerPool('app', {}, workers=1, max_queued=2)
+        self.assertTrue(pool.submit('job 1'))
+        self.assertTrue(pool.submit('job 2'))
+        # Backpressure
+        self.assertFalse(pool.submit('job 3'))
+
+    def test_resume(self, mock_threading):
+        jobs = [ExportJob.create({}, total=1, directory=self.tmpdir.name) for _ in range(4)]
+        jobs[0].save_progress(state=DONE)
+        jobs[1].save_progress(state=FAILED)
+        jobs[2].save_progress(state=RUNNING)
+
+        with patch("gobstuf.export.jobs.EXPORT_DIR", self.tmpdir.name):
+            pool = ExportWorkerPool('app', {}, workers=1, max_queued=3)
+            pool.resume()
+            self.assertEqual({jobs[2].id, jobs[3].id}, {pool.queue.get().id, pool.queue.get().id})
+            self.assertTrue(pool.queue.empty())
+
+            # Stops when the queue is full
+            pool = ExportWorkerPool('app', {}, workers=1, max_queued=1)
+            pool.resume()
+            self.assertEqual(1, pool.queue.qsize())
+
+    @patch("gobstuf.export.worker.run_job")
+    def test_work(self, mock_run_job, mock_threading):
+        pool = ExportWorkerPool('app', {'any': 'exporter'}, workers=1, max_queued=3)
+        job = MagicMock()
+        job.spec = {'type': 'any'}
+        pool.submit(job)
+        pool.submit(job)
+
+        # Stop the worker after the third job
+        class Stop(BaseException):
+            pass
+
+        mock_run_job.side_effect = [None, Exception('any error'), Stop]
+        with patch("gobstuf.export.worker.logging") as mock_logging, self.assertRaises(Stop):
+            pool.submit(job)
+            pool._work()
+
+        mock_run_job.assert_called_with('app', job, 'exporter')
+        mock_logging.error.assert_called()
+
+    @patch("gobstuf.export.worker.ExportWorkerPool")
+    def test_get_worker_pool(self, mock_pool, mock_threading):
+        with patch("gobstuf.export.worker._pool", None), patch("gobstuf.export.worker.os") as mock_os:
+            mock_os.getpid.return_value = 1
+            mock_pool.return_value.pid = 1
+
+            pool = get_worker_pool('app', 'exporters')
+            self.assertEqual(mock_pool.return_value, pool)
+            mock_pool.assert_called_once_with('app', 'exporters')
+            pool.resume.assert_called_once()
+
+            self.assertEqual(pool, get_worker_pool('app', 'exporters'))
+            mock_pool.assert_called_once()
+
+            # Another pool in a forked process
+            mock_os.getpid.return_value = 2
+            get_worker_pool('app', 'exporters')
+            self.assertEqual(2, mock_pool.call_count)
+            self.assertIsNotNone(worker._pool)
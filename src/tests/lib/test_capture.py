@@ -0,0 +1,189 @@
+import os
+import stat
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from cryptography.fernet import Fernet
+
+from gobstuf.lib.capture import Pseudonymiser, CaptureStore, Capture
+from gobstuf.stuf.brp.request.ingeschrevenpersonen import IngeschrevenpersonenBsnStufRequest
+
+KEY = Fernet.generate_key()
+
+RESPONSE = """<BG:object StUF:entiteittype="NPS">
+    <BG:inp.bsn>999991619</BG:inp.bsn>
+    <BG:geslachtsnaam>Jansen-de Vries</BG:geslachtsnaam>
+    <BG:voornamen xsi:nil="true" StUF:noValue="geenWaarde"/>
+    <BG:geboortedatum>19700101</BG:geboortedatum>
+    <BG:aoa.postcode>1011PN</BG:aoa.postcode>
+    <BG:aoa.huisnummer>1</BG:aoa.huisnummer>
+    <BG:gor.openbareRuimteNaam>Amstel &amp; Gracht</BG:gor.openbareRuimteNaam>
+    <StUF:extraElement naam="opgemaakteNaam">J. Jansen-de Vries</StUF:extraElement>
+    <StUF:extraElement naam="omschrijvingBurgerlijkeStaat">Ongehuwd</StUF:extraElement>
+    <BG:inp.heeftAlsEchtgenootPartner>
+        <BG:gerelateerde><BG:inp.bsn>999991619</BG:inp.bsn></BG:gerelateerde>
+    </BG:inp.heeftAlsEchtgenootPartner>
+</BG:object>"""
+
+
+def is_bsn(value: str) -> bool:
+    digits = [int(digit) for digit in value]
+    return len(digits) == 9 and sum(d * w for d, w in zip(digits, [9, 8, 7, 6, 5, 4, 3, 2, -1])) % 11 == 0
+
+
+class MockResponse:
+
+    def __init__(self, status_code=200, text="<response/>"):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+
+
+class TestPseudonymiser(TestCase):
+
+    def test_shape(self):
+        pseudonymiser = Pseudonymiser(KEY)
+        pseudonym = pseudonymiser.shape('Jansen-de Vries 12a')
+        self.assertNotEqual('Jansen-de Vries 12a', pseudonym)
+        self.assertRegex(pseudonym, r'^[A-Z][a-z]{5}-[a-z]{2} [A-Z][a-z]{4} \d{2}[a-z]$')
+
+        # The same value and key always give the same pseudonym
+        self.assertEqual(pseudonym, Pseudonymiser(KEY).shape('Jansen-de Vries 12a'))
+        self.assertNotEqual(pseudonym, Pseudonymiser(Fernet.generate_key()).shape('Jansen-de Vries 12a'))
+        self.assertNotEqual(pseudonym, pseudonymiser.shape('Jansen-de Vries 12b'))
+
+        # Long values
+        self.assertRegex(pseudonymiser.shape('a' * 100), r'^[a-z]{100}$')
+
+    def test_bsn(self):
+        pseudonymiser = Pseudonymiser(KEY)
+        pseudonyms = {pseudonymiser.bsn(str(bsn)) for bsn in range(100000000, 100000100)}
+        self.assertEqual(100, len(pseudonyms))
+        self.assertTrue(all(is_bsn(pseudonym) for pseudonym in pseudonyms))
+        self.assertEqual(pseudonymiser.bsn('999991619'), pseudonymiser.bsn(' 999991619 '))
+
+    def test_pseudonymise(self):
+        pseudonymiser = Pseudonymiser(KEY)
+        result = pseudonymiser.pseudonymise(RESPONSE)
+
+        bsn = pseudonymiser.bsn('999991619')
+        self.assertNotIn('999991619', result)
+        self.assertEqual(2, result.count(f'<BG:inp.bsn>{bsn}</BG:inp.bsn>'))
+        self.assertIn(f"<BG:geslachtsnaam>{pseudonymiser.shape('Jansen-de Vries')}</BG:geslachtsnaam>", result)
+        self.assertIn(f"<BG:aoa.postcode>{pseudonymiser.shape('1011PN')}</BG:aoa.postcode>", result)
+        self.assertIn(f"<StUF:extraElement naam=\"opgemaakteNaam\">{pseudonymiser.shape('J. Jansen-de Vries')}<",
+                      result)
+        self.assertNotIn('Amstel', result)
+        self.assertIn('&amp;', result)
+
+        # Other data is kept
+        for kept in ['<BG:voornamen xsi:nil="true" StUF:noValue="geenWaarde"/>',
+                     '<BG:geboortedatum>19700101</BG:geboortedatum>',
+                     '<StUF:extraElement naam="omschrijvingBurgerlijkeStaat">Ongehuwd</StUF:extraElement>']:
+            self.assertIn(kept, result)
+
+        blank = '<geslachtsnaam> </geslachtsnaam>'
+        self.assertEqual(blank, pseudonymiser.pseudonymise(blank))
+
+    def test_pseudonymise_request(self):
+        request = IngeschrevenpersonenBsnStufRequest('medewerker.jansen', 'any application')
+        request.set_values({'bsn': '999991619'})
+        pseudonymiser = Pseudonymiser(KEY)
+        result = pseudonymiser.pseudonymise(request.to_string().decode('utf-8'))
+
+        # The user name of the employee and the requested BSN are pseudonymised
+        self.assertNotIn('medewerker.jansen', result)
+        self.assertIn(f"<StUF:gebruiker>{pseudonymiser.shape('medewerker.jansen')}</StUF:gebruiker>", result)
+        self.assertIn(f"<BG:inp.bsn>{pseudonymiser.bsn('999991619')}</BG:inp.bsn>", result)
+        self.assertIn('<StUF:applicatie>any application</StUF:applicatie>', result)
+
+    def test_record(self):
+        pseudonymiser = Pseudonymiser(KEY)
+        record = {'request': RESPONSE, 'response': RESPONSE, 'status': 200, 'pseudonymised': False}
+        result = pseudonymiser.record(record)
+        self.assertEqual(result['request'], result['response'])
+        self.assertNotIn('999991619', result['response'])
+        self.assertEqual((200, True), (result['status'], result['pseudonymised']))
+        self.assertIn('999991619', record['request'])
+
+
+class TestCaptureStore(TestCase):
+
+    def test_append_read(self):
+        store = CaptureStore(KEY)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'test.capture')
+            store.append(path, {'a': 1})
+            store.append(path, {'b': 'é'})
+            with open(path, 'ab') as f:
+                f.write(b'\n')
+
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+            with open(path, 'rb') as f:
+                self.assertNotIn(b'"a"', f.read())
+            self.assertEqual([{'a': 1}, {'b': 'é'}], list(store.read(path)))
+
+            with self.assertRaisesRegex(ValueError, 'test.capture:1 cannot be decrypted'):
+                list(CaptureStore(Fernet.generate_key()).read(path))
+
+
+class TestCapture(TestCase):
+
+    def test_disabled(self):
+        capture = Capture('/any/dir', None, enabled=False)
+        capture.record('http://any/310', {}, 'data', MockResponse(), 0, 0)
+        self.assertEqual({'enabled': False, 'records': 0, 'dropped': 0, 'errors': 0}, capture.metrics())
+
+    def test_record(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = os.path.join(tmpdir, 'captures')
+            capture = Capture(directory, KEY.decode(), pseudonymise=False, max_records=2)
+            self.assertEqual(os.path.join(directory, f'mks-{os.getpid()}.capture'), capture.path)
+
+            capture.record('http://mks:8000/310?any', {'Soapaction': 'npsLv01'}, RESPONSE.encode('utf-8'),
+                           MockResponse(200, RESPONSE), 1000.0, 0.5)
+            capture.record('http://mks:8000/310', None, None, MockResponse(500), 1001.0, 0.1)
+            capture.record('http://mks:8000/310', None, None, MockResponse(500), 1002.0, 0.1)
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(directory).st_mode))
+
+            first, second = CaptureStore(KEY).read(capture.path)
+
+        self.assertEqual({
+            'time': 1000.0,
+            'path': '/310',
+            'soap_action': 'npsLv01',
+            'status': 200,
+            'duration': 0.5,
+            'request_bytes': len(RESPONSE.encode('utf-8')),
+            'response_bytes': len(RESPONSE.encode('utf-8')),
+            'request': RESPONSE,
+            'response': RESPONSE,
+            'pseudonymised': False,
+        }, first)
+        self.assertEqual(('', '', 500), (second['soap_action'], second['request'], second['status']))
+        self.assertEqual({'enabled': True, 'records': 2, 'dropped': 1, 'errors': 0}, capture.metrics())
+
+    def test_pseudonymise(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            capture = Capture(tmpdir, KEY.decode())
+            capture.record('http://mks/310', {}, RESPONSE, MockResponse(200, RESPONSE), 0, 0)
+            record, = CaptureStore(KEY).read(capture.path)
+
+        self.assertTrue(record['pseudonymised'])
+        self.assertNotIn('999991619', record['request'] + record['response'])
+        self.assertEqual(len(RESPONSE.encode('utf-8')), record['response_bytes'])
+
+    @patch("gobstuf.lib.capture.logger")
+    def test_write_error(self, mock_logger):
+        capture = Capture('/any/dir', KEY.decode())
+        with patch("gobstuf.lib.capture.os.makedirs", MagicMock(side_effect=PermissionError("any error"))):
+            capture.record('http://mks/310', {}, 'data', MockResponse(), 0, 0)
+        self.assertEqual({'enabled': True, 'records': 1, 'dropped': 0, 'errors': 1}, capture.metrics())
+        mock_logger.warning.assert_called_with("MKS capture not written: any error")
+
+        # Any failure to capture the request is logged
+        response = MagicMock(status_code=200, content=None)
+        capture.record('http://mks/310', {}, 'data', response, 0, 0)
+        self.assertEqual({'enabled': True, 'records': 2, 'dropped': 0, 'errors': 2}, capture.metrics())
+        mock_logger.warning.assert_called_with("MKS capture not written: object of type 'NoneType' has no len()")
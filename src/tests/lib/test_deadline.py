@@ -0,0 +1,92 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, g
+
+from gobstuf.lib.deadline import Deadline, DeadlineExceeded, get_deadline, upstream_timeout, request_timeout, \
+    init_deadlines, DEADLINE_KEY
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeadline(TestCase):
+
+    def test_deadline(self):
+        clock = Clock()
+        deadline = Deadline(10, clock)
+        self.assertEqual(10, deadline.remaining())
+        deadline.check('any phase')
+
+        clock.now = 110
+        self.assertEqual(0, deadline.remaining())
+        with self.assertRaises(DeadlineExceeded) as cm:
+            deadline.check('map')
+        self.assertEqual('map', cm.exception.phase)
+        self.assertEqual('Deadline exceeded before map', str(cm.exception))
+
+    def test_get_deadline(self):
+        self.assertIsNone(get_deadline())
+
+        with Flask(__name__).app_context():
+            self.assertIsNone(get_deadline())
+            setattr(g, DEADLINE_KEY, 'any deadline')
+            self.assertEqual('any deadline', get_deadline())
+
+    @patch("gobstuf.lib.deadline.MKS_CONNECT_TIMEOUT", 5)
+    @patch("gobstuf.lib.deadline.MKS_READ_TIMEOUT", 30)
+    def test_upstream_timeout(self):
+        self.assertEqual((5, 30), upstream_timeout(None))
+
+        clock = Clock()
+        deadline = Deadline(60, clock)
+        self.assertEqual((5, 30), upstream_timeout(deadline))
+
+        clock.now += 40
+        self.assertEqual((5, 20), upstream_timeout(deadline))
+
+        clock.now += 17
+        self.assertEqual((3, 3), upstream_timeout(deadline))
+
+        clock.now += 3
+        with self.assertRaises(DeadlineExceeded):
+            upstream_timeout(deadline)
+
+    @patch("gobstuf.lib.deadline.REQUEST_TIMEOUT", 30)
+    @patch("gobstuf.lib.deadline.REQUEST_TIMEOUTS", {'brp_batch': 120})
+    def test_request_timeout(self):
+        self.assertEqual(30, request_timeout(None, None))
+        self.assertEqual(30, request_timeout('hc.brp_any', None))
+        self.assertEqual(120, request_timeout('hc.brp_batch', None))
+        self.assertEqual(120, request_timeout('brp_batch', None))
+
+        # The client can shorten the timeout
+        self.assertEqual(2.5, request_timeout('hc.brp_any', '2.5'))
+        self.assertEqual(30, request_timeout('hc.brp_any', '60'))
+        for header in ['0', '-1', 'any', '']:
+            self.assertEqual(30, request_timeout('hc.brp_any', header))
+
+        # No timeout
+        with patch("gobstuf.lib.deadline.REQUEST_TIMEOUT", 0):
+            self.assertEqual(0, request_timeout('hc.brp_any', None))
+            self.assertEqual(60, request_timeout('hc.brp_any', '60'))
+
+    @patch("gobstuf.lib.deadline.REQUEST_TIMEOUT", 30)
+    def test_init_deadlines(self):
+        app = Flask(__name__)
+        app.route('/any')(lambda: str(get_deadline().remaining()))
+        init_deadlines(app)
+
+        with app.test_client() as client:
+            self.assertTrue(29 < float(client.get('/any').text) <= 30)
+            self.assertTrue(1 < float(client.get('/any', headers={'X-Request-Timeout': '2'}).text) <= 2)
+
+        with patch("gobstuf.lib.deadline.REQUEST_TIMEOUT", 0), app.test_request_context('/any'):
+            app.preprocess_request()
+            self.assertIsNone(get_deadline())
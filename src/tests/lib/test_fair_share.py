@@ -0,0 +1,240 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from gobstuf.lib.deadline import DeadlineExceeded
+from gobstuf.lib.fair_share import FairShareScheduler, SharedSlots, UNKNOWN_APPLICATION
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFairShareScheduler(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = FairShareScheduler(2, app_limit=2, weights={'fp_balie': 4}, queue_size=10, max_wait=5,
+                                            clock=self.clock)
+
+    def _occupy(self, *applications):
+        # Admit a query for every application, without releasing it
+        return [self.scheduler._admit(application, None) for application in applications]
+
+    def _wait(self, application):
+        # Queue a query in another thread, it is admitted when a slot is released
+        thread = threading.Thread(target=self.scheduler._admit, args=(application, None))
+        thread.start()
+        while not self.scheduler.applications.get(application) or not \
+                self.scheduler.applications[application].queue:
+            threading.Event().wait(0.001)
+        return thread
+
+    def test_call(self):
+        func = MagicMock(return_value='any result')
+        self.assertEqual('any result', self.scheduler.call('fp_balie', func))
+        self.assertEqual('any result', self.scheduler.call(None, func))
+
+        metrics = self.scheduler.metrics()
+        self.assertEqual(0, metrics['in_use'])
+        self.assertEqual({
+            'weight': 4,
+            'queued': 0,
+            'running': 0,
+            'admitted': 1,
+            'rejected': 0,
+            'timeouts': 0,
+            'shared_timeouts': 0,
+            'wait_time': 0.0,
+        }, metrics['applications']['fp_balie'])
+        self.assertEqual(1, metrics['applications'][UNKNOWN_APPLICATION]['weight'])
+
+        # Released on an exception
+        func.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            self.scheduler.call('fp_balie', func)
+        self.assertEqual(0, self.scheduler.in_use)
+
+    def test_disabled(self):
+        self.scheduler.enabled = False
+        func = MagicMock()
+        self.assertEqual(func.return_value, self.scheduler.call('fp_balie', func))
+        self.assertEqual({}, self.scheduler.applications)
+
+    def test_weighted_share(self):
+        apps = self._occupy('fp_batch', 'fp_batch')
+        self.clock.now = 1
+
+        waiting = [self._wait('fp_batch'), self._wait('fp_balie'), self._wait('fp_balie')]
+
+        # fp_balie has four times the weight of fp_batch, both its queries are admitted before fp_batch
+        self.clock.now = 2
+        self.scheduler._release(apps[0])
+        self.scheduler._release(apps[1])
+        for thread in waiting[1:]:
+            thread.join(1)
+        balie = self.scheduler.applications['fp_balie']
+        self.assertEqual(2, balie.admitted)
+        self.assertEqual(1, len(self.scheduler.applications['fp_batch'].queue))
+        self.assertEqual(2.0, balie.wait_time)
+
+        self.scheduler._release(balie)
+        waiting[0].join(1)
+        self.assertEqual(3, self.scheduler.applications['fp_batch'].admitted)
+
+    def test_app_limit(self):
+        self.scheduler.capacity = 3
+        self.scheduler.app_limit = 1
+        self._occupy('fp_batch')
+
+        # The second query of fp_batch waits, although there is capacity
+        thread = self._wait('fp_batch')
+        self.scheduler.call('fp_balie', MagicMock())
+        self.assertEqual(1, self.scheduler.in_use)
+
+        self.scheduler._release(self.scheduler.applications['fp_batch'])
+        thread.join(1)
+        self.assertEqual(2, self.scheduler.applications['fp_batch'].admitted)
+
+    def test_queue_full(self):
+        self.scheduler.queue_size = 0
+        with self.assertRaises(UpstreamUnavailable) as cm:
+            self.scheduler.call('fp_balie', MagicMock())
+        self.assertEqual(1, cm.exception.retry_after)
+        self.assertEqual(1, self.scheduler.applications['fp_balie'].rejected)
+
+    def test_max_wait(self):
+        self._occupy('fp_batch', 'fp_batch')
+        self.scheduler.max_wait = 0.01
+
+        with self.assertRaises(UpstreamUnavailable):
+            self.scheduler.call('fp_balie', MagicMock())
+        self.assertEqual(1, self.scheduler.applications['fp_balie'].timeouts)
+        self.assertEqual(0, len(self.scheduler.applications['fp_balie'].queue))
+
+        # The deadline passes before the maximum wait
+        deadline = MagicMock()
+        deadline.remaining.return_value = -1
+        with self.assertRaises(DeadlineExceeded):
+            self.scheduler.call('fp_balie', MagicMock(), deadline)
+
+    def test_admitted_after_timeout(self):
+        self._occupy('fp_batch', 'fp_batch')
+        batch = self.scheduler.applications['fp_batch']
+
+        def wait(event, timeout=None):
+            # The slot is released just after the wait timed out
+            self.scheduler._release(batch)
+            return False
+
+        with patch.object(threading.Event, 'wait', wait):
+            admitted = self.scheduler._admit('fp_balie', None)
+        self.assertEqual(self.scheduler.applications['fp_balie'], admitted)
+        self.assertEqual(0, admitted.timeouts)
+
+
+class TestSharedSlots(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, 'fair_share')
+        self.slots = SharedSlots(self.directory, 2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_acquire(self):
+        held = [self.slots.acquire('fp_batch'), self.slots.acquire('fp_batch')]
+        self.assertIsNone(self.slots.acquire('fp_batch'))
+        # Every application has its own slots, names are safe file names
+        fd = self.slots.acquire('fp/balie')
+        self.assertIsNotNone(fd)
+        self.assertIn('fp_balie-0.lock', os.listdir(self.directory))
+        self.slots.release(fd)
+
+        self.slots.release(held[0])
+        fd = self.slots.acquire('fp_batch')
+        self.assertIsNotNone(fd)
+        for fd in [fd, held[1]]:
+            self.slots.release(fd)
+
+    def test_other_process(self):
+        # The slot of a process is released when the process is killed
+        self.slots.limit = 1
+        self.slots.release(self.slots.acquire('fp_batch'))
+        process = subprocess.Popen([sys.executable, '-c', f"""
+import fcntl, os, sys
+fd = os.open({self.slots._path('fp_batch', 0)!r}, os.O_RDWR)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print('locked', flush=True)
+sys.stdin.read()
+"""], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            self.assertEqual('locked', process.stdout.readline().strip())
+            self.assertIsNone(self.slots.acquire('fp_batch'))
+        finally:
+            process.kill()
+            process.wait()
+        fd = self.slots.acquire('fp_batch')
+        self.assertIsNotNone(fd)
+        self.slots.release(fd)
+
+
+class TestFairShareSchedulerShared(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shared = SharedSlots(self.tmpdir.name, 1)
+        self.scheduler = FairShareScheduler(2, app_limit=2, weights={}, queue_size=10, max_wait=0.05,
+                                            shared=self.shared)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_call(self):
+        def func():
+            # The slot of fp_batch is held during the query
+            self.assertIsNone(self.shared.acquire('fp_batch'))
+            return 'any result'
+
+        self.assertEqual('any result', self.scheduler.call('fp_batch', func))
+        self.assertEqual('any result', self.scheduler.call('fp_batch', func))
+
+    def test_wait(self):
+        # Another process holds the slot of fp_batch and releases it while the query waits
+        fd = self.shared.acquire('fp_batch')
+        threading.Timer(0.02, self.shared.release, [fd]).start()
+        self.scheduler.max_wait = 1
+
+        self.assertEqual('any result', self.scheduler.call('fp_batch', MagicMock(return_value='any result')))
+        self.assertGreater(self.scheduler.applications['fp_batch'].wait_time, 0)
+
+    def test_max_wait(self):
+        fd = self.shared.acquire('fp_batch')
+        try:
+            with self.assertRaises(UpstreamUnavailable) as cm:
+                self.scheduler.call('fp_batch', MagicMock())
+            self.assertEqual(1, cm.exception.retry_after)
+            self.assertEqual(1, self.scheduler.applications['fp_batch'].shared_timeouts)
+
+            # Other applications are admitted
+            self.scheduler.call('fp_balie', MagicMock())
+
+            # The deadline passes before the maximum wait
+            deadline = MagicMock()
+            deadline.remaining.return_value = -1
+            with self.assertRaises(DeadlineExceeded):
+                self.scheduler.call('fp_batch', MagicMock(), deadline)
+            self.assertEqual(2, self.scheduler.applications['fp_batch'].shared_timeouts)
+        finally:
+            self.shared.release(fd)
@@ -0,0 +1,234 @@
+import threading
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from flask import Flask, g
+
+from gobstuf.lib.deadline import Deadline, DEADLINE_KEY, get_deadline
+from gobstuf.lib.hedging import LatencyTracker, HedgingPolicy, soap_action_name, MAX_TOKENS
+
+
+class TestLatencyTracker(TestCase):
+
+    def test_soap_action_name(self):
+        self.assertEqual('npsLv01', soap_action_name('http://www.egem.nl/StUF/sector/bg/0310/npsLv01'))
+        self.assertEqual('npsLv01', soap_action_name('"http://www.egem.nl/StUF/sector/bg/0310/npsLv01"'))
+        self.assertEqual('npsLv01', soap_action_name('npsLv01'))
+
+    def test_value(self):
+        tracker = LatencyTracker(percentile=90, window=20, min_samples=10)
+        for latency in range(9):
+            tracker.add(latency)
+        self.assertIsNone(tracker.value())
+
+        tracker.add(9)
+        self.assertEqual(9, tracker.value())
+
+        # Recomputed after every 10% of the window
+        tracker.add(0)
+        self.assertEqual(9, tracker.value())
+        tracker.add(0)
+        self.assertEqual(8, tracker.value())
+
+        tracker = LatencyTracker(percentile=100, window=10, min_samples=1)
+        tracker.add(1)
+        self.assertEqual(1, tracker.value())
+
+
+class Attempts:
+    """Attempts that are answered with the given responses when they are released"""
+
+    def __init__(self, *responses):
+        self.responses = responses
+        self.released = [threading.Event() for _ in responses]
+        self.started = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            n = len(self.started)
+            self.started.append(n)
+        self.released[n].wait(5)
+        if isinstance(self.responses[n], Exception):
+            raise self.responses[n]
+        return self.responses[n]
+
+    def release(self, n, after=0.0):
+        threading.Timer(after, self.released[n].set).start()
+
+
+class TestHedgingPolicy(TestCase):
+
+    def setUp(self):
+        self.policy = HedgingPolicy(['npsLv01'], percentile=95, budget=0.5, window=10, min_samples=1, workers=4)
+        # Recent latency of npsLv01 is very short
+        self.policy.trackers['npsLv01'].add(0.001)
+
+    def test_not_hedged(self):
+        attempt = MagicMock()
+        self.assertEqual(attempt.return_value, self.policy.call('npsLv07', attempt))
+
+        self.policy.enabled = False
+        self.assertEqual(attempt.return_value, self.policy.call('npsLv01', attempt))
+        self.assertEqual(0, self.policy.requests)
+
+    def test_no_latencies(self):
+        self.policy.trackers['npsLv01'] = LatencyTracker(95, 10, 1)
+        threads = []
+
+        def attempt():
+            threads.append(threading.get_ident())
+            return 'response'
+
+        # Executed by the thread of the caller
+        self.assertEqual('response', self.policy.call('npsLv01', attempt))
+        self.assertEqual([threading.get_ident()], threads)
+        self.assertEqual(1, self.policy.requests)
+        self.assertIsNotNone(self.policy.trackers['npsLv01'].value())
+        self.assertIsNone(self.policy._executor)
+
+    def test_hedge_won(self):
+        attempts = Attempts('first', 'hedge')
+
+        # Only the hedge is answered
+        attempts.release(1, after=0.1)
+        self.assertEqual('hedge', self.policy.call('http://any/npsLv01', attempts))
+        self.assertEqual(1, self.policy.hedges)
+        self.assertEqual(1, self.policy.hedges_won)
+        attempts.release(0)
+
+    def test_first_won(self):
+        attempts = Attempts('first', 'hedge')
+
+        attempts.release(0, after=0.1)
+        self.assertEqual('first', self.policy.call('npsLv01', attempts))
+        self.assertEqual(1, self.policy.hedges)
+        self.assertEqual(0, self.policy.hedges_won)
+        attempts.release(1)
+
+    def test_first_answer_failed(self):
+        attempts = Attempts(Exception('first'), 'hedge')
+
+        attempts.release(0, after=0.1)
+        attempts.release(1, after=0.2)
+        self.assertEqual('hedge', self.policy.call('npsLv01', attempts))
+        self.assertEqual(1, self.policy.hedges_won)
+
+        # Both failed
+        attempts = Attempts(Exception('first'), Exception('hedge'))
+
+        attempts.release(1, after=0.1)
+        attempts.release(0, after=0.2)
+        with self.assertRaisesRegex(Exception, 'first'):
+            self.policy.call('npsLv01', attempts)
+
+    def test_context(self):
+        app = Flask(__name__)
+        with app.test_request_context('/'):
+            deadline = Deadline(10)
+            setattr(g, DEADLINE_KEY, deadline)
+            g.value = 'request'
+
+            # The first attempt and the hedge run in the context of the request
+            seen = []
+            attempts = Attempts('first', 'hedge')
+
+            def attempt():
+                seen.append((get_deadline(), g.value))
+                return attempts()
+
+            attempts.release(1, after=0.1)
+            self.assertEqual('hedge', self.policy.call('npsLv01', attempt))
+            attempts.release(0)
+            self.assertEqual([(deadline, 'request')] * 2, seen)
+
+    def test_budget(self):
+        self.policy._tokens = 0
+        attempts = Attempts('first')
+
+        attempts.release(0, after=0.1)
+        self.assertEqual('first', self.policy.call('npsLv01', attempts))
+        self.assertEqual([0], attempts.started)
+        self.assertEqual(1, self.policy.hedges_skipped)
+        self.assertEqual(0.5, self.policy._tokens)
+        # Executed by the thread of the caller, its latency is recorded
+        self.assertIsNone(self.policy._executor)
+        self.assertGreater(self.policy.trackers['npsLv01']._latencies[-1], 0.1)
+
+        # Answered within the hedge delay
+        self.policy.trackers['npsLv01'].add(10)
+        self.policy.trackers['npsLv01']._value = 10
+        self.assertEqual('response', self.policy.call('npsLv01', lambda: 'response'))
+        self.assertEqual(1, self.policy.hedges_skipped)
+
+        for _ in range(100):
+            self.policy._start_request()
+        self.assertEqual(MAX_TOKENS, self.policy._tokens)
+
+    def test_workers(self):
+        self.policy.workers = 1
+        attempts = Attempts('first', 'hedge')
+
+        # No thread for the hedge
+        attempts.release(0, after=0.1)
+        self.assertEqual('first', self.policy.call('npsLv01', attempts))
+        self.assertEqual([0], attempts.started)
+        self.assertEqual(0, self.policy.hedges)
+        self.assertEqual(1, self.policy.hedges_skipped)
+        self.assertEqual(1.5, self.policy._tokens)
+        self.assertEqual(0, self.policy._running)
+
+        # No thread for the request, it is executed by the thread of the caller
+        self.policy._running = 1
+        threads = []
+
+        def attempt():
+            threads.append(threading.get_ident())
+            return 'response'
+
+        self.assertEqual('response', self.policy.call('npsLv01', attempt))
+        self.assertEqual([threading.get_ident()], threads)
+
+    def test_reserve_hedge(self):
+        self.assertTrue(self.policy._reserve_hedge())
+        self.assertEqual(1, self.policy._running)
+        self.assertEqual(0, self.policy._tokens)
+
+        # The token has been taken by another request
+        self.assertFalse(self.policy._reserve_hedge())
+        self.assertEqual(1, self.policy._running)
+
+    def test_delay_from_start(self):
+        class SlowExecutor:
+            def submit(self, fn, *args):
+                # The request starts after the hedge delay
+                future = Future()
+                threading.Timer(0.1, lambda: future.set_result(fn(*args))).start()
+                return future
+
+        self.policy._get_executor = SlowExecutor
+        self.policy.trackers['npsLv01']._value = 0.05
+        attempts = Attempts('first', 'hedge')
+        attempts.release(0)
+        self.assertEqual('first', self.policy.call('npsLv01', attempts))
+        self.assertEqual(0, self.policy.hedges)
+
+    def test_metrics(self):
+        self.assertEqual({
+            'requests': 0,
+            'hedges': 0,
+            'hedges_won': 0,
+            'hedges_skipped': 0,
+            'delays': {'npsLv01': 0.001},
+        }, self.policy.metrics())
+
+    @patch("gobstuf.lib.hedging.os.getpid")
+    def test_executor(self, mock_getpid):
+        mock_getpid.return_value = 1
+        executor = self.policy._get_executor()
+        self.assertEqual(executor, self.policy._get_executor())
+
+        # New executor after a fork
+        mock_getpid.return_value = 2
+        self.assertNotEqual(executor, self.policy._get_executor())
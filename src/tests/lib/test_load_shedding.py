@@ -0,0 +1,88 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from gobstuf.lib.load_shedding import LoadShedder, queue_delay, init_load_shedding, load_shedder
+
+
+class TestQueueDelay(TestCase):
+
+    def test_queue_delay(self):
+        def clock():
+            return 1700000010.5
+
+        self.assertEqual(10.5, queue_delay('t=1700000000', clock))
+        self.assertEqual(10.5, queue_delay('1700000000000', clock))
+        self.assertEqual(10.5, queue_delay('t=1700000000000000', clock))
+        # Clock skew
+        self.assertEqual(0, queue_delay('t=1700000020', clock))
+
+        for header in [None, '', 't=', 'any']:
+            self.assertIsNone(queue_delay(header, clock))
+
+
+class TestLoadShedder(TestCase):
+
+    def test_admit(self):
+        shedder = LoadShedder(max_queue_delay=5, max_in_flight=2, retry_after=1)
+        self.assertTrue(shedder.admit(None))
+        self.assertFalse(shedder.admit(5.1))
+        self.assertTrue(shedder.admit(5))
+        self.assertFalse(shedder.admit(0))
+
+        shedder.finish()
+        self.assertTrue(shedder.admit(0))
+        self.assertEqual({
+            'in_flight': 2,
+            'admitted': 3,
+            'shed_queue_delay': 1,
+            'shed_in_flight': 1,
+        }, shedder.metrics())
+
+    def test_no_maximum(self):
+        shedder = LoadShedder(max_queue_delay=0, max_in_flight=0, retry_after=1)
+        for _ in range(10):
+            self.assertTrue(shedder.admit(100))
+
+        shedder = LoadShedder(max_queue_delay=5, max_in_flight=1, retry_after=1, enabled=False)
+        self.assertTrue(shedder.admit(100))
+        self.assertTrue(shedder.admit(100))
+
+
+@patch("gobstuf.lib.load_shedding.load_shedder", LoadShedder(max_queue_delay=5, max_in_flight=1, retry_after=3))
+class TestInitLoadShedding(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        init_load_shedding(self.app)
+        self.app.route('/brp/status/health/', endpoint='_health')(lambda: 'OK')
+        self.app.route('/any')(lambda: 'any')
+
+    def test_shed(self):
+        from gobstuf.lib import load_shedding
+
+        with self.app.test_client() as client:
+            response = client.get('/any', headers={'X-Request-Start': 't=1'})
+            self.assertEqual(503, response.status_code)
+            self.assertEqual('3', response.headers['Retry-After'])
+
+            # Finished requests are not in flight
+            self.assertEqual(200, client.get('/any').status_code)
+            self.assertEqual(200, client.get('/any').status_code)
+            self.assertEqual(0, load_shedding.load_shedder.in_flight)
+
+            # Health checks are never refused
+            load_shedding.load_shedder.in_flight = 1
+            self.assertEqual(503, client.get('/any').status_code)
+            self.assertEqual(200, client.get('/brp/status/health/', headers={'X-Request-Start': 't=1'}).status_code)
+            self.assertEqual(1, load_shedding.load_shedder.in_flight)
+
+    @patch("gobstuf.lib.load_shedding.record_timing")
+    def test_queue_timing(self, mock_record_timing):
+        with self.app.test_client() as client:
+            client.get('/any', headers={'X-Request-Start': 't=1'})
+        self.assertEqual('queue', mock_record_timing.call_args[0][0])
+
+    def test_default(self):
+        self.assertTrue(load_shedder.enabled)
@@ -0,0 +1,269 @@
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from flask import Flask, Response, stream_with_context
+from prometheus_client import CollectorRegistry
+from prometheus_client.parser import text_string_to_metric_families
+
+import gobstuf
+from gobstuf.lib.metrics import ComponentMetrics, count_mapped_objects, record_mks_call, record_request, \
+    init_metrics, REGISTRY, METRICS_PATH, OTHER, MAX_LABEL_VALUES, _bounded, _size, _metrics, _mark_process_dead
+
+FAULT = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>
+<soapenv:Fault><detail><StUF:Fo02Bericht xmlns:StUF="http://www.egem.nl/StUF/StUF0301">
+<StUF:stuurgegevens><StUF:berichtcode>Fo02</StUF:berichtcode></StUF:stuurgegevens>
+<StUF:body><StUF:code>StUF005</StUF:code></StUF:body>
+</StUF:Fo02Bericht></detail></soapenv:Fault></soapenv:Body></soapenv:Envelope>"""
+
+# Records metrics in a separate process, eg a uWSGI worker
+WORKER = """
+import atexit
+from gobstuf.lib.metrics import ComponentMetrics, CollectorRegistry, record_mks_call, _mark_process_dead
+atexit.register(_mark_process_dead)
+record_mks_call({'Soapaction': 'npsLv01'}, 'any data', None, 0.2)
+component = type('Component', (), {'metrics': lambda self: {'calls': 2, 'in_flight': 1}})()
+ComponentMetrics({'worker': component}, CollectorRegistry()).sync()
+"""
+
+
+def value(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MockResponse:
+
+    def __init__(self, status_code=200, text="<response/>"):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode('utf-8')
+
+
+class MockComponent:
+
+    def __init__(self, **values):
+        self.values = values
+
+    def metrics(self) -> dict:
+        return self.values
+
+
+class TestMetrics(TestCase):
+
+    def test_bounded(self):
+        with patch("gobstuf.lib.metrics._label_values", {'any': set()}):
+            values = [_bounded('any', str(n)) for n in range(MAX_LABEL_VALUES + 1)]
+            self.assertEqual(OTHER, values[-1])
+            self.assertEqual('1', _bounded('any', '1'))
+
+    def test_size(self):
+        self.assertEqual(0, _size(None))
+        self.assertEqual(2, _size('é'))
+        self.assertEqual(3, _size(b'any'))
+
+    def test_count_mapped_objects(self):
+        # Ignored outside a request
+        count_mapped_objects()
+
+        with Flask(__name__).test_request_context():
+            count_mapped_objects(0)
+            count_mapped_objects()
+            count_mapped_objects(2)
+            from flask import g
+            self.assertEqual(3, g.mapped_objects)
+
+            with patch("gobstuf.lib.metrics.METRICS_ENABLED", False):
+                count_mapped_objects()
+            self.assertEqual(3, g.mapped_objects)
+
+    def test_record_mks_call(self):
+        labels = {'soap_action': 'npsLv99'}
+        requests = value('gobstuf_mks_requests_total', status='200', **labels)
+        record_mks_call({'Soapaction': 'http://www.egem.nl/StUF/sector/bg/0310/npsLv99'}, 'any data',
+                        MockResponse(200, 'x' * 5000), 0.2)
+        self.assertEqual(requests + 1, value('gobstuf_mks_requests_total', status='200', **labels))
+        self.assertEqual(1, value('gobstuf_mks_request_duration_seconds_count', **labels))
+        self.assertEqual(0.2, value('gobstuf_mks_request_duration_seconds_sum', **labels))
+        self.assertEqual(8, value('gobstuf_mks_request_bytes_sum', **labels))
+        self.assertEqual(1, value('gobstuf_mks_response_bytes_bucket', le='16384.0', **labels))
+        self.assertEqual(0, value('gobstuf_mks_response_bytes_bucket', le='4096.0', **labels))
+
+        # Faults and failed calls
+        record_mks_call({'Soapaction': 'npsLv99'}, None, MockResponse(500, FAULT), 0.1)
+        record_mks_call({'Soapaction': 'npsLv99'}, None, MockResponse(500, 'Internal Server Error'), 0.1)
+        record_mks_call({'Soapaction': 'npsLv99'}, 'any data', None, 5)
+        self.assertEqual(1, value('gobstuf_mks_faults_total', code='StUF005', **labels))
+        self.assertEqual(2, value('gobstuf_mks_requests_total', status='500', **labels))
+        self.assertEqual(1, value('gobstuf_mks_requests_total', status='error', **labels))
+        self.assertEqual(4, value('gobstuf_mks_request_duration_seconds_count', **labels))
+        self.assertEqual(3, value('gobstuf_mks_response_bytes_count', **labels))
+
+        # Without a soap action
+        requests = value('gobstuf_mks_requests_total', soap_action='unknown', status='200')
+        record_mks_call(None, 'any data', MockResponse(), 0.1)
+        self.assertEqual(requests + 1, value('gobstuf_mks_requests_total', soap_action='unknown', status='200'))
+
+        with patch("gobstuf.lib.metrics.METRICS_ENABLED", False):
+            record_mks_call({'Soapaction': 'npsLv99'}, 'any data', None, 5)
+        self.assertEqual(1, value('gobstuf_mks_requests_total', status='error', **labels))
+
+    def test_record_request(self):
+        record_request('/record/<id>', 'GET', 200, 0.3, {'mks': 0.2, 'map': 0.05}, 3)
+        record_request('/record/<id>', 'GET', 404, 0.1, {}, None)
+
+        labels = {'route': '/record/<id>'}
+        self.assertEqual(1, value('gobstuf_requests_total', method='GET', status='200', **labels))
+        self.assertEqual(1, value('gobstuf_requests_total', method='GET', status='404', **labels))
+        self.assertEqual(2, value('gobstuf_request_duration_seconds_count', method='GET', **labels))
+        self.assertEqual(0.2, value('gobstuf_phase_duration_seconds_sum', phase='mks', **labels))
+        self.assertEqual(0.05, value('gobstuf_phase_duration_seconds_sum', phase='map', **labels))
+        self.assertEqual(1, value('gobstuf_mapped_objects_count', **labels))
+        self.assertEqual(3, value('gobstuf_mapped_objects_sum', **labels))
+
+
+class TestComponentMetrics(TestCase):
+
+    def test_sync(self):
+        registry = CollectorRegistry()
+        component = MockComponent(enabled=True, state='closed', calls=2, delays={'npsLv01': 0.2, 'npsLv07': None},
+                                  applications={'fp_balie': {'queued': 1, 'admitted': 5}}, limit=None)
+        clock = MagicMock(return_value=0)
+        component_metrics = ComponentMetrics({'any': component}, registry, interval=1, clock=clock)
+        component_metrics.sync_if_due()
+
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_enabled'))
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_state', {'state': 'closed'}))
+        self.assertEqual(2, registry.get_sample_value('gobstuf_any_calls'))
+        self.assertEqual(0.2, registry.get_sample_value('gobstuf_any_delays', {'soap_action': 'npsLv01'}))
+        self.assertIsNone(registry.get_sample_value('gobstuf_any_delays', {'soap_action': 'npsLv07'}))
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_queued', {'application': 'fp_balie'}))
+        self.assertEqual(5, registry.get_sample_value('gobstuf_any_admitted', {'application': 'fp_balie'}))
+        self.assertIsNone(registry.get_sample_value('gobstuf_any_limit'))
+
+        # The metrics are copied at most once per interval
+        component.values.update(state='open', calls=3)
+        clock.return_value = 0.5
+        component_metrics.sync_if_due()
+        self.assertEqual(2, registry.get_sample_value('gobstuf_any_calls'))
+
+        clock.return_value = 1
+        component_metrics.sync_if_due()
+        self.assertEqual(3, registry.get_sample_value('gobstuf_any_calls'))
+        self.assertEqual(0, registry.get_sample_value('gobstuf_any_state', {'state': 'closed'}))
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_state', {'state': 'open'}))
+
+        component_metrics.sync()
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_state', {'state': 'open'}))
+
+    def test_nested_label(self):
+        registry = CollectorRegistry()
+        ComponentMetrics({'any': MockComponent(other={'a': 1})}, registry).sync()
+        self.assertEqual(1, registry.get_sample_value('gobstuf_any_other', {'key': 'a'}))
+
+
+class TestInitMetrics(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.component = MockComponent(calls=1)
+        init_metrics(self.app, {'test_component': self.component})
+
+        @self.app.route('/any/<id>')
+        def any_route(id):
+            count_mapped_objects(2)
+            return 'any'
+
+        @self.app.route('/fail')
+        def fail():
+            raise Exception("any error")
+
+        @self.app.route('/stream')
+        def stream():
+            def generate():
+                yield 'a'
+                count_mapped_objects(5)
+                yield 'b'
+            return Response(stream_with_context(generate()))
+
+    def test_requests(self):
+        samples = [
+            ('gobstuf_requests_total', {'route': '/any/<id>', 'method': 'GET', 'status': '200'}),
+            ('gobstuf_mapped_objects_sum', {'route': '/any/<id>'}),
+            ('gobstuf_requests_total', {'route': '/fail', 'method': 'GET', 'status': '500'}),
+            ('gobstuf_requests_total', {'route': 'unmatched', 'method': 'GET', 'status': '404'}),
+            ('gobstuf_mapped_objects_count', {'route': 'unmatched'}),
+            ('gobstuf_mapped_objects_sum', {'route': '/stream'}),
+        ]
+        before = [value(name, **labels) for name, labels in samples]
+
+        with self.app.test_client() as client:
+            for path in ['/any/1', '/any/2', '/fail', '/unknown', '/stream']:
+                client.get(path).get_data()
+
+        # The streamed response is registered when it has been sent
+        self.assertEqual([2, 4, 1, 1, 0, 5],
+                         [value(name, **labels) - count for (name, labels), count in zip(samples, before)])
+
+    def test_metrics(self):
+        with self.app.test_client() as client:
+            client.get('/any/1')
+            self.component.values['calls'] = 2
+            response = client.get(METRICS_PATH)
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain; version='))
+        families = {family.name: family for family in text_string_to_metric_families(response.text)}
+        self.assertEqual(2, families['gobstuf_test_component_calls'].samples[0].value)
+        self.assertIn('gobstuf_request_duration_seconds', families)
+
+        # The metrics requests are not registered
+        self.assertEqual(0, value('gobstuf_requests_total', route=METRICS_PATH, method='GET', status='200'))
+
+    @patch("gobstuf.lib.metrics.atexit")
+    @patch("gobstuf.lib.metrics.PROMETHEUS_MULTIPROC_DIR", "/any/dir")
+    def test_multiprocess(self, mock_atexit):
+        init_metrics(Flask(__name__), {})
+        mock_atexit.register.assert_called_with(_mark_process_dead)
+
+    @patch("gobstuf.lib.metrics.METRICS_ENABLED", False)
+    def test_disabled(self):
+        app = Flask(__name__)
+        init_metrics(app, {})
+        with app.test_client() as client:
+            self.assertEqual(404, client.get(METRICS_PATH).status_code)
+
+
+class TestMultiprocess(TestCase):
+
+    def _worker(self, directory: str) -> int:
+        env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory}
+        process = subprocess.run([sys.executable, '-c', WORKER], env=env, check=True,
+                                 cwd=Path(gobstuf.__file__).parent.parent)
+        return process.returncode
+
+    def test_aggregate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                self._worker(directory)
+
+            with patch("gobstuf.lib.metrics.PROMETHEUS_MULTIPROC_DIR", directory):
+                text = _metrics().get_data(as_text=True)
+                families = {family.name: family for family in text_string_to_metric_families(text)}
+
+                requests, = [sample for sample in families['gobstuf_mks_requests'].samples
+                             if sample.name == 'gobstuf_mks_requests_total']
+                self.assertEqual(2, requests.value)
+
+                # Counters of stopped processes are included, current values are not
+                self.assertEqual(4, families['gobstuf_worker_calls'].samples[0].value)
+                self.assertNotIn('gobstuf_worker_in_flight', families)
+
+    @patch("gobstuf.lib.metrics.multiprocess")
+    @patch("gobstuf.lib.metrics.PROMETHEUS_MULTIPROC_DIR", "/any/dir")
+    def test_mark_process_dead(self, mock_multiprocess):
+        _mark_process_dead()
+        mock_multiprocess.mark_process_dead.assert_called_with(os.getpid(), "/any/dir")
@@ -0,0 +1,33 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.lib.rate_limit import RateLimiter
+
+
+@patch("gobstuf.lib.rate_limit.time")
+class TestRateLimiter(TestCase):
+
+    def test_acquire(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = RateLimiter(4)
+
+        # The first call is immediate, the next ones are spaced by 1 / rate
+        limiter.acquire()
+        mock_time.sleep.assert_not_called()
+        limiter.acquire()
+        mock_time.sleep.assert_called_with(0.25)
+        limiter.acquire()
+        mock_time.sleep.assert_called_with(0.5)
+
+        # No waiting after a pause
+        mock_time.sleep.reset_mock()
+        mock_time.monotonic.return_value = 200.0
+        limiter.acquire()
+        mock_time.sleep.assert_not_called()
+
+    def test_no_limit(self, mock_time):
+        limiter = RateLimiter(0)
+        limiter.acquire()
+        limiter.acquire()
+        mock_time.sleep.assert_not_called()
+        mock_time.monotonic.assert_not_called()
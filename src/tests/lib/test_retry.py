@@ -0,0 +1,81 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from gobstuf.lib.retry import RetryPolicy
+
+
+def response(status_code=200, code=None):
+    text = f'<StUF:berichtcode>Fo02</StUF:berichtcode><StUF:code>{code}</StUF:code>' if code else ''
+    return MagicMock(status_code=status_code, text=text)
+
+
+OK = response(200)
+NOT_FOUND = response(500, 'StUF003')
+TIMEOUT = response(500, 'StUF005')
+
+
+@patch("gobstuf.lib.retry.random.uniform", lambda low, high: high)
+class TestRetryPolicy(TestCase):
+
+    def setUp(self):
+        self.sleep = MagicMock()
+        self.policy = RetryPolicy(3, base_delay=0.1, max_delay=0.15, sleep=self.sleep)
+
+    def test_no_retry(self):
+        for answer in [OK, NOT_FOUND]:
+            attempt = MagicMock(return_value=answer)
+            self.assertEqual(answer, self.policy.call(attempt))
+            self.assertEqual(1, attempt.call_count)
+        self.sleep.assert_not_called()
+
+    def test_retry_succeeded(self):
+        attempt = MagicMock(side_effect=[TIMEOUT, TIMEOUT, OK])
+        self.assertEqual(OK, self.policy.call(attempt))
+
+        # Exponential delays, limited to the maximum delay
+        self.assertEqual([((0.1,),), ((0.15,),)], self.sleep.call_args_list)
+        self.assertEqual({
+            'retries': 2,
+            'retries_succeeded': 1,
+            'retries_exhausted': 0,
+            'retries_skipped': 0,
+        }, self.policy.metrics())
+
+    def test_retries_exhausted(self):
+        attempt = MagicMock(return_value=TIMEOUT)
+        self.assertEqual(TIMEOUT, self.policy.call(attempt))
+        self.assertEqual(3, attempt.call_count)
+        self.assertEqual(1, self.policy.retries_exhausted)
+
+        # No retries
+        self.policy.attempts = 1
+        attempt.reset_mock()
+        self.assertEqual(TIMEOUT, self.policy.call(attempt))
+        self.assertEqual(1, attempt.call_count)
+
+    def test_deadline(self):
+        deadline = MagicMock()
+        deadline.remaining.return_value = 0.12
+        attempt = MagicMock(side_effect=[TIMEOUT, TIMEOUT, OK])
+
+        # The second retry would not end before the deadline
+        self.assertEqual(TIMEOUT, self.policy.call(attempt, deadline))
+        self.assertEqual(2, attempt.call_count)
+        self.assertEqual(1, self.policy.retries)
+        self.assertEqual(1, self.policy.retries_skipped)
+
+    @patch("gobstuf.lib.retry.asyncio.sleep")
+    def test_call_async(self, mock_sleep):
+        attempt = AsyncMock(side_effect=[TIMEOUT, TIMEOUT, OK])
+        self.assertEqual(OK, asyncio.run(self.policy.call_async(attempt)))
+        self.assertEqual([((0.1,),), ((0.15,),)], mock_sleep.call_args_list)
+        self.assertEqual(1, self.policy.retries_succeeded)
+
+        deadline = MagicMock()
+        deadline.remaining.return_value = 0.12
+        attempt = AsyncMock(return_value=TIMEOUT)
+        self.assertEqual(TIMEOUT, asyncio.run(self.policy.call_async(attempt, deadline)))
+        self.assertEqual(2, attempt.await_count)
+        self.assertEqual(1, self.policy.retries_skipped)
+        self.sleep.assert_not_called()
@@ -0,0 +1,43 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, g
+
+from gobstuf.lib.timing import record_timing, get_timings, timed, server_timing_header, TIMINGS_KEY
+
+
+class TestTiming(TestCase):
+
+    def test_record_timing(self):
+        app = Flask(__name__)
+        with app.app_context():
+            record_timing('serialise', 0.5)
+            record_timing('serialise', 0.25)
+            record_timing('map', 1.0)
+            self.assertEqual({'serialise': 0.75, 'map': 1.0}, g.get(TIMINGS_KEY))
+            self.assertEqual({'serialise': 0.75, 'map': 1.0}, get_timings())
+
+    def test_no_app_context(self):
+        # Timings are ignored outside an app context
+        record_timing('serialise', 0.5)
+        self.assertEqual({}, get_timings())
+
+    @patch("gobstuf.lib.timing.time.perf_counter")
+    def test_timed(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [1.0, 1.5, 2.0, 4.0]
+        app = Flask(__name__)
+        with app.app_context():
+            with timed('serialise'):
+                pass
+
+            # Duration is also registered on exceptions
+            with self.assertRaises(ValueError):
+                with timed('serialise'):
+                    raise ValueError()
+
+            self.assertEqual({'serialise': 2.5}, get_timings())
+
+    def test_server_timing_header(self):
+        self.assertEqual('', server_timing_header({}))
+        self.assertEqual('serialise;dur=1.200, map;dur=2000.000',
+                         server_timing_header({'serialise': 0.0012, 'map': 2}))
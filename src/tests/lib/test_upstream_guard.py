@@ -0,0 +1,280 @@
+import asyncio
+import threading
+from unittest import TestCase
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from gobstuf.lib.upstream_guard import AdaptiveLimit, CircuitBreaker, UpstreamGuard, UpstreamUnavailable, \
+    is_failure, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def response(status_code=200, text=''):
+    return MagicMock(status_code=status_code, text=text)
+
+
+def fault(code):
+    return f'<StUF:berichtcode>Fo02</StUF:berichtcode><StUF:code>{code}</StUF:code>'
+
+
+class TestIsFailure(TestCase):
+
+    def test_is_failure(self):
+        self.assertFalse(is_failure(response(200)))
+        self.assertFalse(is_failure(response(500, fault('StUF003'))))
+        self.assertFalse(is_failure(response(500, 'any error')))
+        for code in ['StUF002', 'StUF005', 'StUF008']:
+            self.assertTrue(is_failure(response(500, fault(code))))
+        for status_code in [502, 503, 504]:
+            self.assertTrue(is_failure(response(status_code)))
+
+
+class TestAdaptiveLimit(TestCase):
+
+    def test_acquire(self):
+        limit = AdaptiveLimit(2, 1, 10)
+        self.assertTrue(limit.acquire(0))
+        self.assertTrue(limit.acquire(0))
+        self.assertFalse(limit.acquire(0))
+        self.assertEqual(2, limit.in_flight)
+
+        # A released slot is given to a waiting call
+        threading.Timer(0.01, limit.release, args=(True,)).start()
+        self.assertTrue(limit.acquire(5))
+
+    def test_release(self):
+        limit = AdaptiveLimit(4, 2, 5)
+
+        # Additive increase
+        limit.acquire(0)
+        limit.release(True)
+        self.assertEqual(4.25, limit.limit)
+        self.assertEqual(0, limit.in_flight)
+
+        for _ in range(20):
+            limit.acquire(0)
+            limit.release(True)
+        self.assertEqual(5, limit.limit)
+
+        # Multiplicative decrease
+        limit.acquire(0)
+        limit.release(False)
+        self.assertEqual(3.75, limit.limit)
+
+        for _ in range(10):
+            limit.acquire(0)
+            limit.release(False)
+        self.assertEqual(2, limit.limit)
+
+
+@patch("gobstuf.lib.upstream_guard.logger", MagicMock())
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, slow_rate=0.75, open_seconds=30,
+                                      probes=2, clock=self.clock)
+
+    def _calls(self, *outcomes):
+        for failed, slow in outcomes:
+            self.assertEqual((True, False), self.breaker.allow())
+            self.breaker.record(failed, slow, False)
+
+    def test_open_on_failures(self):
+        self._calls((True, False), (True, False), (True, False))
+        # Not enough calls
+        self.assertEqual(CLOSED, self.breaker.state)
+
+        self._calls((False, False))
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertEqual((False, False), self.breaker.allow())
+        self.assertEqual(30, self.breaker.retry_after())
+
+        self.clock.now = 20.5
+        self.assertEqual(10, self.breaker.retry_after())
+
+    def test_open_on_slow_calls(self):
+        self._calls((False, True), (False, True), (False, True), (False, False))
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_closed(self):
+        self._calls(*[(False, False)] * 4, *[(True, False)] * 3, *[(False, True)] * 3)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_half_open(self):
+        self._calls(*[(True, False)] * 4)
+
+        self.clock.now = 30
+        # One probe at a time
+        self.assertEqual((True, True), self.breaker.allow())
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertEqual((False, False), self.breaker.allow())
+        self.assertEqual(1, self.breaker.retry_after())
+
+        # A failing probe opens the breaker again
+        self.breaker.record(True, False, True)
+        self.assertEqual(OPEN, self.breaker.state)
+
+        # A cancelled probe lets another probe through
+        self.clock.now = 60
+        self.assertEqual((True, True), self.breaker.allow())
+        self.breaker.cancel(True)
+        self.assertEqual((True, True), self.breaker.allow())
+
+        # The breaker closes after the required number of successful probes
+        self.breaker.record(False, False, True)
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertEqual((True, True), self.breaker.allow())
+        self.breaker.record(False, False, True)
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertEqual(5, self.breaker.state_changes)
+
+        # With a clean window
+        self._calls(*[(True, False)] * 3)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_calls_in_flight_when_opened(self):
+        self._calls(*[(True, False)] * 4)
+        self.breaker.record(True, False, False)
+        self.breaker.cancel(False)
+        self.assertEqual(OPEN, self.breaker.state)
+
+
+@patch("gobstuf.lib.upstream_guard.logger", MagicMock())
+class TestUpstreamGuard(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limit = AdaptiveLimit(2, 1, 10)
+        self.breaker = CircuitBreaker(window=10, min_calls=3, failure_rate=0.6, slow_rate=1, open_seconds=30,
+                                      probes=1, clock=self.clock)
+        self.guard = UpstreamGuard(self.limit, self.breaker, limit_timeout=0, slow_call=2)
+
+    def test_call(self):
+        func = MagicMock(return_value=response(200))
+        self.assertEqual(func.return_value, self.guard.call(func, 'any url', data='any data'))
+        func.assert_called_with('any url', data='any data')
+        self.assertEqual(2.5, self.limit.limit)
+        self.assertEqual(0, self.limit.in_flight)
+
+        # Failing calls open the breaker
+        func.return_value = response(503)
+        self.guard.call(func)
+        func.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self.guard.call(func)
+        self.assertEqual(OPEN, self.breaker.state)
+
+        with self.assertRaises(UpstreamUnavailable) as cm:
+            self.guard.call(func)
+        self.assertEqual(30, cm.exception.retry_after)
+
+        self.assertEqual({
+            'state': OPEN,
+            'state_changes': 1,
+            'limit': 1,
+            'in_flight': 0,
+            'calls': 3,
+            'failures': 2,
+            'slow_calls': 0,
+            'rejected_open': 1,
+            'rejected_limit': 0,
+        }, self.guard.metrics())
+
+        # Successful probe
+        self.clock.now = 30
+        func.side_effect = None
+        func.return_value = response(200)
+        self.guard.call(func)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    @patch("gobstuf.lib.upstream_guard.time.perf_counter")
+    def test_slow_call(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [0, 3]
+        self.guard.call(MagicMock(return_value=response(200)))
+        self.assertEqual(1, self.guard.slow_calls)
+        self.assertEqual(1.5, self.limit.limit)
+
+    def test_limit_reached(self):
+        self.limit.acquire(0)
+        self.limit.acquire(0)
+
+        # The probe is cancelled when no slot is available
+        self.clock.now = 30
+        self.breaker._open()
+        self.clock.now = 60
+
+        with self.assertRaises(UpstreamUnavailable) as cm:
+            self.guard.call(MagicMock())
+        self.assertEqual(1, cm.exception.retry_after)
+        self.assertEqual(1, self.guard.rejected_limit)
+        self.assertFalse(self.breaker._probing)
+
+    def test_disabled(self):
+        self.guard.enabled = False
+        self.breaker._open()
+        func = MagicMock()
+        self.assertEqual(func.return_value, self.guard.call(func, 'any'))
+        self.assertEqual(0, self.guard.calls)
+
+    def test_call_async(self):
+        func = AsyncMock(return_value=response(200))
+        self.assertEqual(func.return_value, asyncio.run(self.guard.call_async(func, 'any url', data='any data')))
+        func.assert_awaited_with('any url', data='any data')
+        self.assertEqual(2.5, self.limit.limit)
+        self.assertEqual(0, self.limit.in_flight)
+
+        func.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            asyncio.run(self.guard.call_async(func))
+        self.assertEqual(1, self.guard.failures)
+
+        self.guard.enabled = False
+        func.side_effect = None
+        self.assertEqual(func.return_value, asyncio.run(self.guard.call_async(func)))
+        self.assertEqual(2, self.guard.calls)
+
+    def test_call_async_cancelled(self):
+        self.clock.now = 30
+        self.breaker._open()
+        self.clock.now = 60
+
+        async def call():
+            task = asyncio.ensure_future(self.guard.call_async(asyncio.sleep, 10))
+            await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        # The probe and the slot are given back, the call is not counted
+        asyncio.run(call())
+        self.assertEqual(0, self.limit.in_flight)
+        self.assertFalse(self.breaker._probing)
+        self.assertEqual(0, self.guard.calls)
+
+    @patch("gobstuf.lib.upstream_guard.ASYNC_POLL_INTERVAL", 0)
+    def test_call_async_limit(self):
+        self.limit.acquire(0)
+        self.limit.acquire(0)
+
+        with self.assertRaises(UpstreamUnavailable):
+            asyncio.run(self.guard.call_async(AsyncMock()))
+        self.assertEqual(1, self.guard.rejected_limit)
+
+        # A slot comes available while waiting
+        self.guard.limit_timeout = 10
+        func = AsyncMock(return_value=response(200))
+
+        async def call():
+            task = asyncio.ensure_future(self.guard.call_async(func))
+            await asyncio.sleep(0)
+            self.limit.release(True)
+            return await task
+
+        self.assertEqual(func.return_value, asyncio.run(call()))
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from flask import Blueprint, Flask, url_for
+
+from gobstuf.lib.url_templates import URLTemplate, init_url_templates, url_prefix, get_url_template
+
+
+def _get_app():
+    app = Flask(__name__)
+    bp = Blueprint('bp', __name__, url_prefix='/base')
+
+    def view(**kwargs):
+        return ''  # pragma: no cover
+
+    bp.add_url_rule('/persons/<bsn>', 'person', view)
+    bp.add_url_rule('/persons/<bsn>/partners/<partners_id>', 'partner', view)
+    bp.add_url_rule('/persons/<bsn>/kinderen/<int:kinderen_id>', 'kind', view)
+    bp.add_url_rule('/any{thing}/<path:rest>', 'braces', view)
+    app.register_blueprint(bp)
+
+    init_url_templates(app)
+    return app
+
+
+class TestURLTemplates(TestCase):
+
+    def setUp(self):
+        self.app = _get_app()
+
+    def test_templates(self):
+        with self.app.app_context():
+            self.assertEqual('/base/persons/{bsn}', get_url_template('bp.person').path)
+            self.assertEqual('/base/persons/{bsn}/partners/{partners_id}', get_url_template('bp.partner').path)
+            self.assertIsNone(get_url_template('bp.any'))
+            # Typed arguments have no template
+            self.assertIsNone(get_url_template('bp.kind'))
+
+    def test_expand(self):
+        # Equal to url_for, including the quoting of the values
+        with self.app.test_request_context():
+            for endpoint, values in [
+                ('bp.person', {'bsn': '123456789'}),
+                ('bp.person', {'bsn': 'a b/c?d'}),
+                ('bp.partner', {'bsn': '123456789', 'partners_id': 2}),
+                ('bp.braces', {'rest': 'any/path'}),
+            ]:
+                self.assertEqual(url_for(endpoint, **values), get_url_template(endpoint).expand(**values))
+
+    def test_url_prefix(self):
+        with self.app.test_request_context('/base/persons/1', base_url='https://any.host:8000/root'):
+            self.assertEqual('https://any.host:8000/root', url_prefix())
+            # Computed once per request
+            with self.app.test_request_context(base_url='http://other.host'):
+                pass
+            self.assertEqual('https://any.host:8000/root', url_prefix())
+
+        with self.app.test_request_context(base_url='http://other.host'):
+            self.assertEqual('http://other.host', url_prefix())
+
+    def test_not_initialised(self):
+        with Flask(__name__).app_context():
+            self.assertIsNone(get_url_template('bp.person'))
+
+    def test_url_template(self):
+        self.assertEqual('/a/1/b', URLTemplate('/a/{x}/b').expand(x=1))
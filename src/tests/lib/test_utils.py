@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from gobstuf.lib.utils import get_value
+from gobstuf.lib.utils import get_value, prune_none_values
+
 
 class TestUtils(TestCase):
 
@@ -14,3 +15,22 @@ class TestUtils(TestCase):
         }
         self.assertEqual(get_value(dict, 'a', 'b', 'c'), 'd')
         self.assertEqual(get_value(dict, 'a', 'b', 'c', 'd'), None)
+
+    def test_prune_none_values(self):
+        nested = {'e': None, 'f': {'g': None}}
+        obj = {
+            'a': None,
+            'b': {'c': None},
+            'd': [{'e': None}, {'f': 1}, nested],
+            'g': 0,
+            'h': [],
+            'i': False,
+            'j': {'k': '', 'l': None},
+        }
+        self.assertIs(obj, prune_none_values(obj))
+        self.assertEqual({'d': [{'f': 1}], 'g': 0, 'h': [], 'i': False, 'j': {'k': ''}}, obj)
+        self.assertEqual({}, nested)
+
+        # Order of the keys is unchanged
+        obj = {'c': 1, 'b': None, 'a': 2}
+        self.assertEqual(['c', 'a'], list(prune_none_values(obj)))
@@ -1,10 +1,16 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
+from requests.exceptions import Timeout
+
 from gobstuf.auth.routes import MKS_USER_KEY, MKS_APPLICATION_KEY
+from gobstuf.lib.deadline import DeadlineExceeded
+from gobstuf.lib.fair_share import mks_fair_share
+from gobstuf.lib.retry import RetryPolicy
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
 from gobstuf.rest.brp.base_view import (
     StufRestView, HTTPError,
-    NoStufAnswerException,
+    NoStufAnswerException, answer_content,
     StufRestFilterView, StufRestViewAsList
 )
 from gobstuf.stuf.brp.base_response import StufMappedResponse
@@ -12,6 +18,22 @@ from gobstuf.stuf.brp.error_response import UnknownErrorCode
 from gobstuf.stuf.exception import NoStufAnswerFilterException
 
 
+class TestAnswerContent(TestCase):
+
+    def test_answer_content(self):
+        content = b'''<BG:npsLa01 xmlns:BG="bg">
+    <BG:stuurgegevens>
+        <StUF:referentienummer>S1</StUF:referentienummer>
+    </BG:stuurgegevens>
+    <BG:antwoord><BG:object/></BG:antwoord>
+</BG:npsLa01>'''
+        self.assertEqual(b'<BG:npsLa01 xmlns:BG="bg">\n    \n    <BG:antwoord><BG:object/></BG:antwoord>\n</BG:npsLa01>',
+                         answer_content(content))
+        self.assertEqual(b'<a/><antwoord/>', answer_content(b'<a/><StUF:stuurgegevens x="y">1</StUF:stuurgegevens>'
+                                                            b'<antwoord/>'))
+        self.assertEqual(b'<antwoord/>', answer_content(b'<antwoord/>'))
+
+
 class TestStufRestView(TestCase):
 
 
@@ -76,13 +98,18 @@ class TestStufRestView(TestCase):
     @patch("gobstuf.rest.brp.base_view.ROUTE_SCHEME", 'scheme')
     @patch("gobstuf.rest.brp.base_view.ROUTE_NETLOC", 'netloc')
     @patch("gobstuf.rest.brp.base_view.ROUTE_PATH_310", '/route/path')
+    @patch("gobstuf.rest.brp.base_view.upstream_timeout")
     @patch("gobstuf.rest.brp.base_view.cert_post")
-    def test_make_request(self, mock_post):
+    def test_make_request(self, mock_post, mock_upstream_timeout):
+        mock_post.return_value.status_code = 200
         stufreq = MagicMock()
         stufreq.soap_action = 'THE SOAP action'
         stufreq.to_string = lambda: 'string repr'
+        stufreq.applicatie = 'fp_test'
 
         view = StufRestView()
+        view.deadline = MagicMock()
+        view.deadline.remaining.return_value = 10
         self.assertEqual(mock_post.return_value, view._make_request(stufreq))
 
         mock_post.assert_called_with(
@@ -91,8 +118,31 @@ class TestStufRestView(TestCase):
             headers={
                 'Soapaction': 'THE SOAP action',
                 'Content-Type': 'text/xml',
-            }
+            },
+            timeout=mock_upstream_timeout.return_value
         )
+        mock_upstream_timeout.assert_called_with(view.deadline)
+
+        # Within the fair share of the application
+        self.assertEqual(1, mks_fair_share.metrics()['applications']['fp_test']['admitted'])
+
+    @patch("gobstuf.rest.brp.base_view.mks_retry", RetryPolicy(2, base_delay=0, max_delay=0))
+    @patch("gobstuf.rest.brp.base_view.upstream_timeout")
+    @patch("gobstuf.rest.brp.base_view.cert_post")
+    def test_make_request_retried(self, mock_post, mock_upstream_timeout):
+        text = '<StUF:berichtcode>Fo02</StUF:berichtcode><StUF:code>StUF002</StUF:code>'
+        fault = MagicMock(status_code=500, text=text)
+        mock_post.side_effect = [fault, MagicMock(status_code=200)]
+        mock_upstream_timeout.side_effect = [(5, 30), (5, 29)]
+        stufreq = MagicMock()
+        stufreq.to_string = lambda: 'string repr'
+
+        view = StufRestView()
+        view.deadline = None
+        self.assertEqual(200, view._make_request(stufreq).status_code)
+
+        # The retry gets the remaining time
+        self.assertEqual((5, 29), mock_post.call_args[1]['timeout'])
 
     @patch("gobstuf.rest.brp.base_view.logging")
     @patch("gobstuf.rest.brp.base_view.RESTResponse")
@@ -170,6 +220,7 @@ class TestStufRestView(TestCase):
                 'e': 19,
             }, view._get_functional_query_parameters())
 
+    @patch("gobstuf.rest.brp.base_view.ETAG_VERSION", b'any version')
     @patch("gobstuf.rest.brp.base_view.StufErrorResponse")
     @patch("gobstuf.rest.brp.base_view.RESTResponse")
     def test_get(self, mock_rest_response, mock_response):
@@ -196,10 +247,12 @@ class TestStufRestView(TestCase):
 
             view = StuffRestViewImpl()
             view._make_request = MagicMock()
+            view._make_request.return_value.content = b'<stuurgegevens>any</stuurgegevens><antwoord/>'
             view._error_response = MagicMock()
             view._json_response = MagicMock()
             view._validate_called = True
             view._get_functional_query_parameters = MagicMock(return_value={'funcparam': True})
+            mock_rest_response.matching_etag.return_value = None
 
             # Success response
             self.assertEqual(mock_rest_response.ok.return_value, view._get(a=1, b=2))
@@ -208,7 +261,19 @@ class TestStufRestView(TestCase):
             view._make_request.assert_called_with(view.request_template.return_value)
 
             view.response_template.assert_called_with(view._make_request.return_value.text, a=1, b=2, funcparam=True, wildcards={})
-            mock_rest_response.ok.assert_called_with(view.response_template.return_value.get_answer_object.return_value)
+            mock_rest_response.etag.assert_called_with(b'any version', mock_request.url.encode.return_value,
+                                                       b'<antwoord/>')
+            mock_rest_response.ok.assert_called_with(view.response_template.return_value.get_answer_object.return_value,
+                                                     etag=mock_rest_response.etag.return_value)
+
+            # Not modified, the response is not mapped
+            view.response_template.reset_mock()
+            mock_rest_response.matching_etag.return_value = 'any etag'
+            self.assertEqual(mock_rest_response.not_modified.return_value, view._get(a=1, b=2))
+            mock_rest_response.matching_etag.assert_called_with(mock_rest_response.etag.return_value)
+            mock_rest_response.not_modified.assert_called_with('any etag')
+            view.response_template.assert_not_called()
+            mock_rest_response.matching_etag.return_value = None
 
             # Error response
             view._make_request.return_value.raise_for_status.side_effect = HTTPError
@@ -218,6 +283,7 @@ class TestStufRestView(TestCase):
 
             # 404 response
             view._make_request = MagicMock()
+            view._make_request.return_value.content = b'<antwoord/>'
             view.response_template.return_value.get_answer_object.side_effect = NoStufAnswerException
             view._not_found_response = MagicMock()
 
@@ -247,10 +313,37 @@ class TestStufRestView(TestCase):
         result = view.get(any='thing')
         self.assertEqual(result, mock_rest_response.internal_server_error.return_value)
 
+        # MKS request refused by the upstream guard
+        view._get.side_effect = UpstreamUnavailable("any reason", 10)
+        result = view.get(any='thing')
+        self.assertEqual(result, mock_rest_response.service_unavailable.return_value)
+        mock_rest_response.service_unavailable.assert_called_with(retry_after=10)
+
+        # Deadline passed or MKS did not answer in time
+        for exception in [DeadlineExceeded('map'), Timeout()]:
+            view._get.side_effect = exception
+            result = view.get(any='thing')
+            self.assertEqual(result, mock_rest_response.gateway_timeout.return_value)
+
         view._validate.side_effect = StufRestFilterView.InvalidQueryParametersException({'any': 'error'})
         view.get(any='thing')
         mock_rest_response.bad_request.assert_called_with(any='error')
 
+    @patch("gobstuf.rest.brp.base_view.get_deadline")
+    def test_deadline(self, mock_get_deadline):
+        view = StufRestView()
+        self.assertEqual(mock_get_deadline.return_value, view.deadline)
+
+        view.deadline = MagicMock()
+        self.assertNotEqual(mock_get_deadline.return_value, view.deadline)
+        view._check_deadline('any phase')
+        view.deadline.check.assert_called_with('any phase')
+
+        # No deadline
+        view.deadline = None
+        mock_get_deadline.return_value = None
+        view._check_deadline('any phase')
+
 
 class StufRestFilterViewImpl(StufRestFilterView):
     name = 'stufrestfilterviewobjects'
@@ -316,7 +409,7 @@ class TestStufRestFilterView(TestCase):
         response_obj = MagicMock()
         response_obj.get_all_answer_objects = lambda: [{'object': 'A'}, {'object': 'B'}]
 
-        self.assertEqual(mock_rest_response.ok.return_value, view._build_response(response_obj))
+        self.assertEqual(mock_rest_response.ok.return_value, view._build_response(response_obj, etag='any etag'))
         mock_rest_response.ok.assert_called_with({
             '_embedded': {
                 'stufrestfilterviewobjects': [
@@ -324,7 +417,67 @@ class TestStufRestFilterView(TestCase):
                     {'object': 'B'},
                 ]
             }
-        }, {})
+        }, {}, etag='any etag')
+
+    @patch("gobstuf.rest.brp.base_view.to_compact", lambda obj: f"compact {obj}")
+    def test_get_all_answer_objects(self):
+        view = StufRestFilterViewImpl()
+        response_obj = MagicMock()
+
+        view.compact_results = False
+        self.assertEqual(response_obj.get_all_answer_objects.return_value, view._get_all_answer_objects(response_obj))
+
+        view.compact_results = True
+        response_obj.iter_answer_objects.return_value = iter(['A', 'B'])
+        self.assertEqual(['compact A', 'compact B'], view._get_all_answer_objects(response_obj))
+
+    @patch("gobstuf.rest.brp.base_view.RESTResponse")
+    def test_build_response_stream(self, mock_rest_response):
+        view = StufRestFilterViewImpl()
+        view.stream_response = True
+        view._stream_response = MagicMock()
+        response_obj = MagicMock()
+
+        self.assertEqual(view._stream_response.return_value, view._build_response(response_obj, etag='any etag'))
+        view._stream_response.assert_called_with(response_obj.iter_answer_objects.return_value, etag='any etag')
+        response_obj.get_all_answer_objects.assert_not_called()
+
+    @patch("gobstuf.rest.brp.base_view.RESTResponse")
+    def test_stream_response(self, mock_rest_response):
+        view = StufRestFilterViewImpl()
+
+        def objects():
+            yield {'object': 'A'}
+            yield {'object': 'B'}
+
+        self.assertEqual(mock_rest_response.ok_stream.return_value, view._stream_response(objects(), 'any etag'))
+        name, streamed, links = mock_rest_response.ok_stream.call_args[0]
+        self.assertEqual('stufrestfilterviewobjects', name)
+        self.assertEqual([{'object': 'A'}, {'object': 'B'}], list(streamed))
+        self.assertEqual({}, links)
+        self.assertEqual({'on_error': view._stream_error, 'etag': 'any etag'}, mock_rest_response.ok_stream.call_args[1])
+
+        # No objects, regular response
+        self.assertEqual(mock_rest_response.ok.return_value, view._stream_response(iter([])))
+        mock_rest_response.ok.assert_called_with({'_embedded': {'stufrestfilterviewobjects': []}}, {}, etag=None)
+
+        # An exception when producing the first object is raised before the response is started
+        def failing_objects():
+            raise NoStufAnswerException()
+            yield
+
+        with self.assertRaises(NoStufAnswerException):
+            view._stream_response(failing_objects())
+
+    @patch("gobstuf.rest.brp.base_view.log_incomplete_response")
+    @patch("gobstuf.rest.brp.base_view.logging")
+    def test_stream_error(self, mock_logging, mock_log_incomplete_response):
+        view = StufRestFilterViewImpl()
+        exception = Exception('any error')
+        view._stream_error(exception)
+
+        self.assertEqual(2, mock_logging.error.call_count)
+        mock_log_incomplete_response.assert_called_with(exception)
 
     def test_transform_query_parameter_value(self):
         view = StufRestFilterViewImpl()
@@ -470,6 +623,9 @@ class TestStufRestFilterView(TestCase):
             }, view._validate_request_args(some='kwargs'))
             view._request_template_parameters.assert_called_with(some='kwargs')
 
+            # The checks of the request template are left unchanged
+            self.assertEqual(1, len(view.request_template.parameter_checks['attr7']))
+
 
 class TestStufRestViewAsList(TestCase):
 
@@ -487,10 +643,11 @@ class TestStufRestViewAsList(TestCase):
         response_obj = MagicMock(spec=StufMappedResponse)
         response_obj.get_all_answer_objects.return_value = [{'object': 'A'}, {'object': 'B'}]
 
-        assert mock_rest_response.ok.return_value == view._build_response(response_obj)
+        assert mock_rest_response.ok.return_value == view._build_response(response_obj, etag='any etag')
         mock_rest_response.ok.assert_called_with(
             data={'_embedded': {'my_list_view': [{'object': 'A'}, {'object': 'B'}]}},
-            links={}
+            links={},
+            etag='any etag'
         )
 
         response_obj.get_all_answer_objects.side_effect = NoStufAnswerException
@@ -501,6 +658,37 @@ class TestStufRestViewAsList(TestCase):
         view._build_response(response_obj)
         mock_rest_response.ok.assert_called_with(
             data={"_embedded": {"my_list_view": []}},
-            links={}
+            links={},
+            etag=None
+        )
+
+    @patch("gobstuf.rest.brp.base_view.RESTResponse")
+    def test_build_response_stream(self, mock_rest_response):
+        class MyListView(StufRestViewAsList):
+            name = "my_list_view"
+            request_template = None
+            response_template = None
+            stream_response = True
+
+            def get_not_found_message(self, **kwargs):
+                return "not found!"
+
+        view = MyListView()
+        view._stream_response = MagicMock()
+        response_obj = MagicMock(spec=StufMappedResponse)
+
+        self.assertEqual(view._stream_response.return_value, view._build_response(response_obj, etag='any etag'))
+        view._stream_response.assert_called_with(response_obj.iter_answer_objects.return_value, etag='any etag')
+
+        view._stream_response.side_effect = NoStufAnswerException
+        view._build_response(response_obj)
+        mock_rest_response.not_found.assert_called_with(detail="not found!")
+
+        view._stream_response.side_effect = NoStufAnswerFilterException
+        view._build_response(response_obj)
+        mock_rest_response.ok.assert_called_with(
+            data={"_embedded": {"my_list_view": []}},
+            links={},
+            etag=None
         )
 
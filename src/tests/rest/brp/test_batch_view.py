@@ -0,0 +1,129 @@
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from flask import Flask
+
+from gobstuf.lib.deadline import DeadlineExceeded
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
+from gobstuf.rest.brp.batch_view import StufRestBatchView
+
+
+class StufRestBatchViewImpl(StufRestBatchView):
+    item_view = MagicMock()
+    keys = 'keys'
+    key = 'key'
+    key_name = 'key_name'
+    item_name = 'item'
+    name = 'items'
+
+
+class TestStufRestBatchView(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_validate(self):
+        view = StufRestBatchViewImpl()
+        view.max_size = 2
+
+        for body in [None, [], {}, {'keys': []}, {'keys': 'a'}, {'keys': ['a', 1]}]:
+            self.assertEqual('paramsRequired', view._validate(body)['code'])
+
+        self.assertEqual('paramsValidation', view._validate({'keys': ['a', 'b', 'c']})['code'])
+
+        # The other parameters are validated by the item view
+        item_view = view.item_view.return_value
+        self.assertEqual(item_view._validate.return_value, view._validate({'keys': ['a', 'b'], 'expand': 'x'}))
+        self.assertEqual({'expand': 'x'}, item_view.args)
+        item_view._validate.assert_called_with()
+
+    def test_get_args(self):
+        view = StufRestBatchViewImpl()
+        self.assertEqual({
+            'a': 'true',
+            'b': 'false',
+            'c': 'x,y',
+            'd': '1',
+            'e': 'x',
+        }, view._get_args({'keys': ['k'], 'a': True, 'b': False, 'c': ['x', 'y'], 'd': 1, 'e': 'x', 'f': None}))
+
+    @patch("gobstuf.rest.brp.batch_view.RESTResponse")
+    def test_post(self, mock_rest_response):
+        view = StufRestBatchViewImpl()
+        view._validate = MagicMock(return_value={})
+        view._batch = MagicMock()
+
+        with self.app.test_request_context(json={'keys': ['a']}):
+            self.assertEqual(view._batch.return_value, view.post())
+            view._validate.assert_called_with({'keys': ['a']})
+            view._batch.assert_called_with({'keys': ['a']})
+
+            view._batch.side_effect = Exception
+            self.assertEqual(mock_rest_response.internal_server_error.return_value, view.post())
+
+            view._validate.return_value = {'any': 'error'}
+            self.assertEqual(mock_rest_response.bad_request.return_value, view.post())
+            mock_rest_response.bad_request.assert_called_with(any='error')
+
+        # No JSON body
+        with self.app.test_request_context(data='any'):
+            view.post()
+            view._validate.assert_called_with(None)
+
+    def test_make_requests(self):
+        view = StufRestBatchViewImpl()
+        view.concurrency = 2
+        views = {key: MagicMock() for key in 'abc'}
+        views['c']._post.side_effect = Exception('any error')
+
+        futures = view._make_requests(views, {key: ('action', f'msg {key}') for key in 'abc'})
+        self.assertEqual(['a', 'b', 'c'], list(futures))
+        self.assertEqual(views['a']._post.return_value, futures['a'].result())
+        views['a']._post.assert_called_with('action', 'msg a')
+        self.assertIsInstance(futures['c'].exception(), Exception)
+
+        self.assertEqual({}, view._make_requests({}, {}))
+
+    def test_post_item(self):
+        view = StufRestBatchViewImpl()
+        item_view = MagicMock()
+        self.assertEqual(item_view._post.return_value, view._post_item(item_view, ('action', 'msg')))
+        item_view._post.assert_called_with('action', 'msg')
+
+        view.rate_limiter = MagicMock()
+        view._post_item(item_view, ('action', 'msg'))
+        view.rate_limiter.acquire.assert_called_once()
+
+    @patch("gobstuf.rest.brp.batch_view.logging", MagicMock())
+    @patch("gobstuf.rest.brp.batch_view.RESTResponse")
+    def test_get_result(self, mock_rest_response):
+        view = StufRestBatchViewImpl()
+        view._get_answer_object = MagicMock()
+        item_view = MagicMock()
+        future = MagicMock()
+
+        self.assertEqual(view._get_answer_object.return_value, view._get_result(item_view, 'a', future))
+        view._get_answer_object.assert_called_with(item_view, 'a', future.result.return_value)
+
+        future.result.side_effect = Exception
+        self.assertEqual(mock_rest_response.internal_server_error.return_value,
+                         view._get_result(item_view, 'a', future))
+
+        future.result.side_effect = UpstreamUnavailable("any reason", 10)
+        self.assertEqual(mock_rest_response.service_unavailable.return_value,
+                         view._get_result(item_view, 'a', future))
+        mock_rest_response.service_unavailable.assert_called_with(retry_after=10)
+
+        future.result.side_effect = DeadlineExceeded('mks')
+        self.assertEqual(mock_rest_response.gateway_timeout.return_value, view._get_result(item_view, 'a', future))
+
+    def test_format_result(self):
+        view = StufRestBatchViewImpl()
+        self.assertEqual({'key_name': 'a', 'status': 200, 'item': {'any': 'object'}},
+                         view._format_result('a', {'any': 'object'}))
+
+        with self.app.test_request_context():
+            from gobstuf.rest.brp.rest_response import RESTResponse
+            result = view._format_result('a', RESTResponse.not_found(detail='any detail'))
+        self.assertEqual(404, result['status'])
+        self.assertEqual('any detail', result['fout']['detail'])
@@ -1,15 +1,21 @@
+import tempfile
+from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 import json
 
-from gobstuf.rest.brp.rest_response import RESTResponse
+from flask import Response
+from werkzeug.http import parse_etags
+
+from gobstuf.rest.brp.rest_response import RESTResponse, representation_version
 
 mock_response = MagicMock()
 any_data = {"any": "data"}
 
 mock_request = MagicMock()
 mock_request.url = "any url"
+mock_request.method = "GET"
 
 
 @patch("gobstuf.rest.brp.rest_response.Response", mock_response)
@@ -23,7 +29,7 @@ class TestRESTResponse(TestCase):
         with patch("gobstuf.rest.brp.rest_response.request", mock_request):
             # Return the data as a JSON string response
             result = RESTResponse._json_response(any_data)
-            self.assertEqual(result['response'], json.dumps(any_data))
+            self.assertEqual(result['response'], b'{"any":"data"}')
 
             # Include any other arguments in the Response
             result = RESTResponse._json_response(any_data, aap="noot")
@@ -48,18 +54,104 @@ class TestRESTResponse(TestCase):
             self.assertEqual(response['title'], 'any title')
             self.assertEqual(response['any'], 'other')
 
-    def test_hal(self):
+    def test_hal_links(self):
         with patch("gobstuf.rest.brp.rest_response.request", mock_request):
-            hal = RESTResponse._hal(any_data)
-            self.assertEqual(hal, {'_links': {'self': {'href': 'any url'}}, 'any': 'data'})
+            self.assertEqual(RESTResponse._hal_links(), {'self': {'href': 'any url'}})
+            self.assertEqual(RESTResponse._hal_links({'other': {'href': 'other url'}}),
+                             {'self': {'href': 'any url'}, 'other': {'href': 'other url'}})
 
+    @patch("gobstuf.rest.brp.rest_response.RESTResponse._cacheable", lambda response, etag: {**response, 'etag': etag})
     def test_ok(self):
         with patch("gobstuf.rest.brp.rest_response.request", mock_request):
             result = RESTResponse.ok(any_data)
-            response = json.loads(result['response'])
             self.assertEqual(result['content_type'], 'application/hal+json')
             self.assertEqual(result['status'], 200)
-            self.assertEqual(response, RESTResponse._hal(any_data))
+            self.assertEqual(result['response'], b'{"_links":{"self":{"href":"any url"}},"any":"data"}')
+            # Identified by the body
+            self.assertEqual(result['etag'], RESTResponse.etag(result['response']))
+
+            # Links in the data replace the envelope links, at the first position
+            result = RESTResponse.ok({'any': 'data', '_links': {'self': {'href': 'data url'}}})
+            self.assertEqual(result['response'], b'{"_links":{"self":{"href":"data url"}},"any":"data"}')
+
+            # Identified by the given etag
+            result = RESTResponse.ok(any_data, etag='any etag')
+            self.assertEqual(result['etag'], 'any etag')
+
+    @patch("gobstuf.rest.brp.rest_response.RESTResponse.not_modified")
+    def test_ok_not_modified(self, mock_not_modified):
+        request = MagicMock()
+        request.url = "any url"
+        request.method = "GET"
+        with patch("gobstuf.rest.brp.rest_response.request", request), \
+                patch("gobstuf.rest.brp.rest_response.RESTResponse.serializer") as mock_serializer:
+            mock_serializer.dumps_hal.return_value = b'any body'
+
+            # Identified by the given etag, the data is not serialised
+            request.if_none_match = parse_etags('"any etag-gzip"')
+            self.assertEqual(mock_not_modified.return_value, RESTResponse.ok(any_data, etag='any etag'))
+            mock_not_modified.assert_called_with('any etag-gzip')
+            mock_serializer.dumps_hal.assert_not_called()
+
+            # Identified by the body
+            etag = RESTResponse.etag(b'any body')
+            request.if_none_match = parse_etags(f'"{etag}"')
+            self.assertEqual(mock_not_modified.return_value, RESTResponse.ok(any_data))
+            mock_not_modified.assert_called_with(etag)
+
+    @patch("gobstuf.rest.brp.rest_response.stream_with_context", lambda generator: generator)
+    def test_ok_stream(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            objects = [{'any': 'data'}, {'other': 'data'}]
+            result = RESTResponse.ok_stream('objects', iter(objects))
+            self.assertEqual(result['content_type'], 'application/hal+json')
+            self.assertEqual(result['status'], 200)
+
+            chunks = list(result['response'])
+            self.assertEqual(4, len(chunks))
+            self.assertEqual(b''.join(chunks),
+                             RESTResponse.serializer.dumps_hal({'_embedded': {'objects': objects}},
+                                                               RESTResponse._hal_links()))
+
+            # Empty list
+            result = RESTResponse.ok_stream('objects', iter([]), {'other': {'href': 'other url'}})
+            self.assertEqual(json.loads(b''.join(result['response'])), {
+                '_links': {'self': {'href': 'any url'}, 'other': {'href': 'other url'}},
+                '_embedded': {'objects': []}
+            })
+
+    @patch("gobstuf.rest.brp.rest_response.stream_with_context", lambda generator: generator)
+    @patch("gobstuf.rest.brp.rest_response.RESTResponse._cacheable", lambda response, etag: {**response, 'etag': etag})
+    def test_ok_stream_etag(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            result = RESTResponse.ok_stream('objects', iter([]))
+            self.assertNotIn('etag', result)
+
+            result = RESTResponse.ok_stream('objects', iter([]), etag='any etag')
+            self.assertEqual(result['etag'], 'any etag')
+
+    @patch("gobstuf.rest.brp.rest_response.stream_with_context", lambda generator: generator)
+    def test_ok_stream_error(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            def objects():
+                yield {'any': 'data'}
+                raise ValueError('any error')
+
+            on_error = MagicMock()
+            result = RESTResponse.ok_stream('objects', objects(), on_error=on_error)
+            response = result['response']
+            self.assertEqual(next(response), b'{"_links":{"self":{"href":"any url"}},"_embedded":{"objects":[')
+            self.assertEqual(next(response), b'{"any":"data"}')
+
+            # The response is aborted after on_error has been called
+            with self.assertRaises(ValueError):
+                next(response)
+            self.assertIsInstance(on_error.call_args[0][0], ValueError)
+
+            # Without error handler
+            result = RESTResponse.ok_stream('objects', objects())
+            with self.assertRaises(ValueError):
+                list(result['response'])
 
     def test_errors(self):
         with patch("gobstuf.rest.brp.rest_response.request", mock_request):
@@ -89,3 +181,106 @@ class TestRESTResponse(TestCase):
         with patch("gobstuf.rest.brp.rest_response.request", mock_request):
             result = RESTResponse.internal_server_error()
             self.assertEqual(result['status'], 500)
+
+
+class TestRESTResponseHeaders(TestCase):
+
+    def test_accepted(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            response = RESTResponse.accepted(any_data, location='any location')
+            self.assertEqual(202, response.status_code)
+            self.assertEqual('application/hal+json', response.content_type)
+            self.assertEqual('any location', response.headers['Location'])
+            self.assertEqual({'any': 'data', '_links': {'self': {'href': 'any url'}}}, response.get_json())
+
+            response = RESTResponse.accepted(any_data)
+            self.assertNotIn('Location', response.headers)
+
+    def test_conflict(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            response = RESTResponse.conflict(detail='any detail')
+            self.assertEqual(409, response.status_code)
+            self.assertEqual('conflict', response.get_json()['code'])
+            self.assertEqual('any detail', response.get_json()['detail'])
+
+    def test_gateway_timeout(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            response = RESTResponse.gateway_timeout()
+            self.assertEqual(504, response.status_code)
+            self.assertEqual('timeout', response.get_json()['code'])
+
+    def test_service_unavailable(self):
+        with patch("gobstuf.rest.brp.rest_response.request", mock_request):
+            response = RESTResponse.service_unavailable(retry_after=60)
+            self.assertEqual(503, response.status_code)
+            self.assertEqual('notAvailable', response.get_json()['code'])
+            self.assertEqual('60', response.headers['Retry-After'])
+
+            response = RESTResponse.service_unavailable()
+            self.assertNotIn('Retry-After', response.headers)
+
+
+class TestRESTResponseConditional(TestCase):
+
+    def test_etag(self):
+        etag = RESTResponse.etag(b'any', b'data')
+        self.assertEqual(32, len(etag))
+        self.assertEqual(etag, RESTResponse.etag(b'any', b'data'))
+        self.assertNotEqual(etag, RESTResponse.etag(b'anyd', b'ata'))
+        self.assertNotEqual(etag, RESTResponse.etag(b'anydata'))
+
+    def test_representation_version(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'mapping.py').write_text('any mapping')
+            Path(directory, 'README.md').write_text('any text')
+            version = representation_version(directory)
+            self.assertEqual(32, len(version))
+            self.assertEqual(version, representation_version(directory))
+
+            # Other files than code do not change the version
+            Path(directory, 'README.md').write_text('any other text')
+            self.assertEqual(version, representation_version(directory))
+
+            # Changed code does
+            Path(directory, 'mapping.py').write_text('any other mapping')
+            self.assertNotEqual(version, representation_version(directory))
+
+            Path(directory, 'sub').mkdir()
+            Path(directory, 'sub', 'links.py').write_text('')
+            self.assertNotEqual(version, representation_version(directory))
+
+    def test_matching_etag(self):
+        request = MagicMock()
+        request.method = 'GET'
+        with patch("gobstuf.rest.brp.rest_response.request", request):
+            for header, expect in [
+                ('', None),
+                ('"other"', None),
+                ('"other", "abc"', 'abc'),
+                ('W/"abc"', 'abc'),
+                ('"abc-gzip"', 'abc-gzip'),
+                ('"abc-br"', 'abc-br'),
+                ('"abc-deflate"', None),
+                ('*', None),
+            ]:
+                request.if_none_match = parse_etags(header)
+                self.assertEqual(expect, RESTResponse.matching_etag('abc'), header)
+
+            # Only GET and HEAD requests are conditional
+            request.if_none_match = parse_etags('"abc"')
+            for method, expect in [('HEAD', 'abc'), ('POST', None), ('PUT', None)]:
+                request.method = method
+                self.assertEqual(expect, RESTResponse.matching_etag('abc'), method)
+
+    def test_not_modified(self):
+        response = RESTResponse.not_modified('abc-gzip')
+        self.assertIsInstance(response, Response)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"abc-gzip"', response.headers['ETag'])
+        self.assertEqual('private, no-cache', response.headers['Cache-Control'])
+        self.assertEqual(b'', response.get_data())
+
+    def test_cacheable(self):
+        response = RESTResponse._cacheable(Response(b'any body'), 'abc')
+        self.assertEqual('"abc"', response.headers['ETag'])
+        self.assertEqual('private, no-cache', response.headers['Cache-Control'])
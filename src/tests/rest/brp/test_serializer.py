@@ -0,0 +1,84 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.rest.brp.serializer import JSONSerializer, OrjsonSerializer, get_serializer
+from gobstuf.stuf.brp.compact import to_compact
+
+
+data = {
+    'burgerservicenummer': '123456789',
+    'naam': {'voornamen': 'Jan Ĳsbrand', 'geslachtsnaam': 'Jansen'},
+    'leeftijd': 42,
+    'geheimhoudingPersoonsgegevens': True,
+    'nationaliteiten': [{'code': '0001'}, {'code': '0052'}],
+}
+
+links = {'self': {'href': 'any url'}}
+
+
+class TestSerializers(TestCase):
+
+    def test_dumps(self):
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            result = serializer.dumps(data)
+            self.assertIsInstance(result, bytes)
+            # Compact, unescaped output
+            self.assertEqual(result, json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+    def test_dumps_hal(self):
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            expected = {'_links': links, **data}
+            result = serializer.dumps_hal(data, links)
+            self.assertEqual(result, serializer.dumps(expected))
+            # Key order is kept
+            self.assertEqual(list(json.loads(result).keys()), list(expected.keys()))
+            # The data is not modified
+            self.assertNotIn('_links', data)
+
+    def test_dumps_hal_empty_data(self):
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            self.assertEqual(serializer.dumps_hal({}, links), b'{"_links":{"self":{"href":"any url"}}}')
+
+    def test_dumps_hal_data_links(self):
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            data_with_links = {'any': 'data', '_links': {'self': {'href': 'data url'}}}
+            expected = {'_links': links, **data_with_links}
+            result = serializer.dumps_hal(data_with_links, links)
+            self.assertEqual(result, serializer.dumps(expected))
+            self.assertEqual(result, b'{"_links":{"self":{"href":"data url"}},"any":"data"}')
+
+
+class TestGetSerializer(TestCase):
+
+    def test_get_serializer(self):
+        self.assertIsInstance(get_serializer(), OrjsonSerializer)
+        self.assertIsInstance(get_serializer('json'), JSONSerializer)
+        self.assertIsInstance(get_serializer('orjson'), OrjsonSerializer)
+
+        with self.assertRaises(KeyError):
+            get_serializer('any')
+
+    @patch("gobstuf.rest.brp.serializer.orjson", None)
+    def test_get_serializer_fallback(self):
+        serializer = get_serializer()
+        self.assertIsInstance(serializer, JSONSerializer)
+        self.assertNotIsInstance(serializer, OrjsonSerializer)
+
+        with self.assertRaises(ImportError):
+            get_serializer('orjson')
+
+
+class TestCompactSerialisation(TestCase):
+
+    def test_dumps_compact(self):
+        expected = json.dumps({'_embedded': {'any': [data]}}, separators=(',', ':'), ensure_ascii=False).encode()
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            # Top level and nested compact objects
+            self.assertEqual(serializer.dumps(to_compact(data)), serializer.dumps(data))
+            self.assertEqual(serializer.dumps({'_embedded': {'any': [to_compact(data)]}}), expected)
+
+    def test_dumps_unserializable(self):
+        for serializer in [JSONSerializer(), OrjsonSerializer()]:
+            with self.assertRaises(TypeError):
+                serializer.dumps({'any': object()})
@@ -1,7 +1,18 @@
+import json
+import os
+from pathlib import Path
+from unittest.mock import patch
+
 import freezegun
 import pytest
+from requests.exceptions import ReadTimeout
 from urllib.parse import urlencode
 
+from gobstuf.export.exporters import EXPORTERS
+from gobstuf.export.jobs import ExportJob, FAILED
+from gobstuf.export.worker import ExportWorkerPool, get_worker_pool
+from gobstuf.lib.metrics import REGISTRY, METRICS_PATH
+from gobstuf.lib.upstream_guard import UpstreamGuard, AdaptiveLimit, CircuitBreaker
 from gobstuf.stuf.message import StufMessage
 
 
@@ -24,6 +35,90 @@ class TestIngeschrevenpersonenBsnView:
 
         assert follow_key_path(response.json, key_path) == expected
 
+    def test_mks_unavailable(self, requests_mock, app_base_path, client, jwt_header):
+        """Requests fail fast with 503 once the circuit breaker has opened on gateway errors from MKS."""
+        url = f"{os.environ['ROUTE_SCHEME']}://{os.environ['ROUTE_NETLOC']}{os.environ['ROUTE_PATH_310']}"
+        requests_mock.post(url, status_code=503, text="Service Unavailable")
+        guard = UpstreamGuard(AdaptiveLimit(2, 1, 10), CircuitBreaker(10, 2, 0.5, 1, 30, 1),
+                              limit_timeout=0, slow_call=10)
+
+        with patch("gobstuf.rest.brp.base_view.mks_guard", guard):
+            responses = [client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
+                         for _ in range(3)]
+
+        assert [response.status_code for response in responses] == [500, 500, 503]
+        assert responses[2].headers['Retry-After'] == '30'
+        assert requests_mock.call_count == 2
+
+    def test_phase_timings(self, stuf_310_response, app_base_path, client, jwt_header):
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
+        phases = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+        assert phases[:6] == ['validate', 'mks', 'parse', 'filter', 'map', 'serialise']
+
+    def test_metrics(self, stuf_310_response, app_base_path, client, jwt_header):
+        route = f"{app_base_path}/brp/ingeschrevenpersonen/<bsn>"
+        samples = [
+            ('gobstuf_requests_total', {'route': route, 'method': 'GET', 'status': '200'}),
+            ('gobstuf_mapped_objects_sum', {'route': route}),
+            ('gobstuf_phase_duration_seconds_count', {'route': route, 'phase': 'filter'}),
+            ('gobstuf_mks_requests_total', {'soap_action': 'npsLv01', 'status': '200'}),
+        ]
+        before = [REGISTRY.get_sample_value(name, labels) or 0 for name, labels in samples]
+
+        client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
+
+        after = [REGISTRY.get_sample_value(name, labels) for name, labels in samples]
+        # The person and its related persons are mapped
+        assert [value - count for value, count in zip(after, before)] == [1, 3, 1, 1]
+
+        response = client.get(METRICS_PATH)
+        assert response.status_code == 200
+        assert 'gobstuf_mks_guard_calls' in response.text
+
+    def test_mks_timeout(self, requests_mock, app_base_path, client, jwt_header):
+        url = f"{os.environ['ROUTE_SCHEME']}://{os.environ['ROUTE_NETLOC']}{os.environ['ROUTE_PATH_310']}"
+        requests_mock.post(url, exc=ReadTimeout)
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
+        assert response.status_code == 504
+        # The read timeout is limited by the deadline of the request
+        connect_timeout, read_timeout = requests_mock.last_request.timeout
+        assert connect_timeout == 5
+        assert 29 < read_timeout < 30
+
+    def test_not_modified(self, requests_mock, tests_dir, app_base_path, client, jwt_header):
+        """MKS answers differ in their stuurgegevens on every call, the response is still not modified."""
+        url = f"{os.environ['ROUTE_SCHEME']}://{os.environ['ROUTE_NETLOC']}{os.environ['ROUTE_PATH_310']}"
+        first = Path(tests_dir, "fixtures", "response_310.xml").read_text()
+        second = first.replace('S15568059631', 'S15568059632') \
+            .replace('2019050812144008', '2019050812150012') \
+            .replace('K15568713071', 'K15568713072')
+        assert first != second
+        requests_mock.post(url, [{'text': first}, {'text': second}, {'text': second}])
+
+        path = f"{app_base_path}/brp/ingeschrevenpersonen/123456789"
+        response = client.get(path, headers=jwt_header)
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+
+        response = client.get(path, headers={**jwt_header, 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        assert requests_mock.call_count == 2
+
+        # After a deploy of other code the response may differ, the tag no longer matches
+        with patch("gobstuf.rest.brp.base_view.ETAG_VERSION", b'other version'):
+            response = client.get(path, headers={**jwt_header, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_deadline(self, stuf_310_response, requests_mock, app_base_path, client, jwt_header):
+        """The request stops when the deadline that is requested by the client has passed."""
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789",
+                              headers={**jwt_header, 'X-Request-Timeout': '0.000001'})
+        assert response.status_code == 504
+        assert response.json['code'] == 'timeout'
+        assert requests_mock.call_count == 0
+
     @pytest.mark.parametrize("stuf_310_response", ["response_310_in_onderzoek_j.xml"], indirect=True)
     def test_in_onderzoek_j(self, stuf_310_response, app_base_path, client, jwt_header):
         """Make sure inOnderzoek is set when it ha value J in XML."""
@@ -289,3 +384,208 @@ class TestIngeschrevenpersonenBsnView:
         response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789", headers=jwt_header)
         assert response.status_code == 200
         assert "historieMaterieel" not in response.json
+
+
+class TestIngeschrevenpersonenBatchView:
+
+    @pytest.fixture
+    def stuf_310_batch_response(self, requests_mock, tests_dir):
+        """Mocks the 310 stuf endpoint, the response depends on the requested bsn."""
+        responses = {
+            '123456789': Path(tests_dir, "fixtures", "response_310.xml").read_text(),
+            '111111110': Path(tests_dir, "fixtures", "response_310_empty.xml").read_text(),
+        }
+
+        def response(request, context):
+            bsn = StufMessage(request.text).get_elm_value("soapenv:Body BG:npsLv01 BG:gelijk BG:inp.bsn")
+            if bsn in responses:
+                return responses[bsn]
+            context.status_code = 500
+            return "Any error"
+
+        url = f"{os.environ['ROUTE_SCHEME']}://{os.environ['ROUTE_NETLOC']}{os.environ['ROUTE_PATH_310']}"
+        requests_mock.post(url, text=response)
+
+    def test_batch_deadline(self, stuf_310_batch_response, requests_mock, app_base_path, client, jwt_header):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/batch",
+                               headers={**jwt_header, 'X-Request-Timeout': '0.000001'},
+                               json={'burgerservicenummers': ['123456789', '12345']})
+        assert response.status_code == 200
+
+        results = response.json['_embedded']['ingeschrevenpersonen']
+        assert [(r['burgerservicenummer'], r['status']) for r in results] == [('123456789', 504), ('12345', 400)]
+        assert requests_mock.call_count == 0
+
+    def test_batch(self, stuf_310_batch_response, requests_mock, app_base_path, client, jwt_header):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/batch", headers=jwt_header, json={
+            'burgerservicenummers': ['123456789', '111111110', '12345', '222222220', '123456789'],
+            'expand': 'partners',
+        })
+        assert response.status_code == 200
+
+        results = response.json['_embedded']['ingeschrevenpersonen']
+        assert [(r['burgerservicenummer'], r['status']) for r in results] == [
+            ('123456789', 200),
+            ('111111110', 404),
+            ('12345', 400),
+            ('222222220', 500),
+        ]
+
+        # The mapped person equals the response of the single request
+        single = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789?expand=partners", headers=jwt_header)
+        assert results[0]['ingeschrevenpersoon'] == single.json
+
+        assert results[1]['fout']['detail'] == \
+            "Ingeschreven persoon niet gevonden met burgerservicenummer 111111110."
+        assert results[2]['fout']['invalid-params'][0]['name'] == 'bsn'
+
+        # One request for each valid unique bsn, and one for the single request
+        assert requests_mock.call_count == 4
+
+    def test_batch_not_conditional(self, stuf_310_batch_response, app_base_path, client, jwt_header):
+        """Not Modified is no valid response to a POST, If-None-Match is ignored."""
+        path = f"{app_base_path}/brp/ingeschrevenpersonen/batch"
+        body = {'burgerservicenummers': ['123456789']}
+        etag = client.post(path, headers=jwt_header, json=body).headers['ETag']
+
+        response = client.post(path, headers={**jwt_header, 'If-None-Match': etag}, json=body)
+        assert response.status_code == 200
+        assert response.headers['ETag'] == etag
+
+    @pytest.mark.parametrize("body", [
+        None,
+        {},
+        {'burgerservicenummers': []},
+        {'burgerservicenummers': '123456789'},
+        {'burgerservicenummers': [123456789]},
+        {'burgerservicenummers': ['123456789'], 'expand': 'any'},
+        {'burgerservicenummers': ['123456789'], 'inclusiefoverledenpersonen': 'any'},
+    ])
+    def test_batch_bad_request(self, requests_mock, app_base_path, client, jwt_header, body):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/batch", headers=jwt_header, json=body)
+        assert response.status_code == 400
+        assert requests_mock.call_count == 0
+
+    def test_batch_forbidden(self, app_base_path, client, jwt_header_forbidden):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/batch", headers=jwt_header_forbidden,
+                               json={'burgerservicenummers': ['123456789']})
+        assert response.status_code == 403
+
+
+class TestIngeschrevenpersonenExportViews:
+
+    @pytest.fixture
+    def export_dir(self, tmp_path):
+        with patch("gobstuf.export.jobs.EXPORT_DIR", str(tmp_path)):
+            yield tmp_path
+
+    def _wait(self, app):
+        get_worker_pool(app, EXPORTERS).queue.join()
+
+    def test_export_bsn(self, export_dir, stuf_310_response, requests_mock, app, app_base_path, client, jwt_header):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header, json={
+            'burgerservicenummers': ['123456789', '12345', '123456789'],
+            'expand': 'partners',
+        })
+        assert response.status_code == 202
+        job_id = response.json['id']
+        assert response.headers['Location'] == \
+            f"http://localhost{app_base_path}/brp/ingeschrevenpersonen/exports/{job_id}"
+        assert response.json['totaal'] == 3
+
+        self._wait(app)
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/exports/{job_id}", headers=jwt_header)
+        assert response.status_code == 200
+        assert response.json['status'] == 'done'
+        assert response.json['verwerkt'] == 3
+        assert response.json['regels'] == 2
+        result_url = response.json['_links']['resultaat']['href']
+
+        response = client.get(result_url, headers=jwt_header)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        assert [(line['burgerservicenummer'], line['status']) for line in lines] == [('123456789', 200), ('12345', 400)]
+
+        single = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/123456789?expand=partners", headers=jwt_header)
+        assert lines[0]['ingeschrevenpersoon'] == single.json
+
+    def test_export_search(self, export_dir, stuf_310_response, app, app_base_path, client, jwt_header):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header, json={
+            'zoekvragen': [
+                {'verblijfplaats__postcode': '1234AB', 'verblijfplaats__huisnummer': 1},
+                {'verblijfplaats__postcode': 'any'},
+            ],
+        })
+        assert response.status_code == 202
+        job_id = response.json['id']
+
+        self._wait(app)
+
+        response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/exports/{job_id}/resultaat",
+                              headers=jwt_header)
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        assert [(line['zoekvraag'], line['status']) for line in lines] == [
+            ({'verblijfplaats__postcode': '1234AB', 'verblijfplaats__huisnummer': '1'}, 200),
+            ({'verblijfplaats__postcode': 'any'}, 400),
+        ]
+        assert lines[0]['ingeschrevenpersoon']['burgerservicenummer']
+
+    @pytest.mark.parametrize("body", [
+        None,
+        {},
+        {'burgerservicenummers': []},
+        {'burgerservicenummers': ['123456789'], 'zoekvragen': [{}]},
+        {'zoekvragen': ['123456789']},
+        {'burgerservicenummers': ['123456789'], 'expand': 'any'},
+    ])
+    def test_export_bad_request(self, export_dir, app_base_path, client, jwt_header, body):
+        response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header, json=body)
+        assert response.status_code == 400
+        assert list(export_dir.iterdir()) == []
+
+    def test_export_not_found(self, export_dir, app_base_path, client, jwt_header):
+        for url in ['exports/any', f'exports/{"0" * 32}', f'exports/{"0" * 32}/resultaat']:
+            response = client.get(f"{app_base_path}/brp/ingeschrevenpersonen/{url}", headers=jwt_header)
+            assert response.status_code == 404
+
+    def test_export_too_large(self, export_dir, app_base_path, client, jwt_header):
+        with patch("gobstuf.rest.brp.export_view.ExportJobsView.max_size", 1):
+            response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header,
+                                   json={'burgerservicenummers': ['123456789', '123456790']})
+        assert response.status_code == 400
+        assert response.json['code'] == 'paramsValidation'
+
+    def test_export_queue_full(self, export_dir, app, app_base_path, client, jwt_header):
+        get_worker_pool(app, EXPORTERS)
+        with patch.object(ExportWorkerPool, "submit", return_value=False):
+            response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header,
+                                   json={'burgerservicenummers': ['123456789']})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '60'
+        assert list(export_dir.iterdir()) == []
+
+    def test_export_not_done(self, export_dir, app, app_base_path, client, jwt_header):
+        get_worker_pool(app, EXPORTERS)
+        with patch.object(ExportWorkerPool, "submit", return_value=True):
+            response = client.post(f"{app_base_path}/brp/ingeschrevenpersonen/exports", headers=jwt_header,
+                                   json={'burgerservicenummers': ['123456789']})
+        job_id = response.json['id']
+        url = f"{app_base_path}/brp/ingeschrevenpersonen/exports/{job_id}"
+
+        response = client.get(f"{url}/resultaat", headers=jwt_header)
+        assert response.status_code == 409
+
+        job = ExportJob.get(job_id)
+        job.save_progress(state=FAILED, error='any error')
+        response = client.get(url, headers=jwt_header)
+        assert response.json['status'] == 'failed'
+        assert response.json['fout'] == 'any error'
+        assert 'resultaat' not in response.json['_links']
+
+        # Jobs of other applications are not found
+        job._write(ExportJob.SPEC_FILE, {**job.spec, 'application': 'any other application'})
+        response = client.get(url, headers=jwt_header)
+        assert response.status_code == 404
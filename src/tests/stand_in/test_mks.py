@@ -0,0 +1,235 @@
+import argparse
+import random
+import threading
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from gobstuf.benchmarks.responses import SIZES
+from gobstuf.stand_in.mks import Latency, FaultInjection, FixtureAnswers, GeneratedAnswers, StandInMKS, Answer, \
+    request_parameters, create_server, main, _latency_arg, _fault_arg, DEFAULT, SLOW_BODY, RESET
+from gobstuf.stuf.fault import parse_fault
+
+FIXTURES = Path(__file__).parent.parent / 'fixtures'
+
+NPS_LV01 = 'http://www.egem.nl/StUF/sector/bg/0310/npsLv01'
+NPS_LV07 = 'http://www.egem.nl/StUF/sector/bg/0310/npsLv07'
+
+
+def request(**parameters) -> bytes:
+    elms = ''.join(f'<BG:{name}>{value}</BG:{name}>' for name, value in parameters.items())
+    return (f'<BG:npsLv01 xmlns:BG="http://www.egem.nl/StUF/sector/bg/0310"><BG:gelijk>{elms}<BG:verblijfsadres>'
+            f'<BG:aoa.postcode> </BG:aoa.postcode></BG:verblijfsadres></BG:gelijk></BG:npsLv01>').encode('utf-8')
+
+
+class TestLatency(TestCase):
+
+    def test_parse(self):
+        rng = random.Random(1)
+        self.assertEqual(0.2, Latency.parse('fixed:0.2').sample(rng))
+        self.assertTrue(0.1 <= Latency.parse('uniform:0.1,0.2').sample(rng) <= 0.2)
+        self.assertTrue(0 <= Latency.parse('exponential:0.1').sample(rng))
+        self.assertTrue(0 < Latency.parse('lognormal:0.05,0.5').sample(rng))
+        self.assertEqual(0, Latency.parse('fixed:-1').sample(rng))
+
+        for spec in ['any:1', 'fixed', 'uniform:1', 'exponential:0', 'lognormal:0,1', 'fixed:a']:
+            with self.assertRaises(ValueError):
+                Latency.parse(spec)
+
+    def test_latency_arg(self):
+        self.assertEqual((DEFAULT, Latency('fixed', (0.1,))), _latency_arg('fixed:0.1'))
+        self.assertEqual(('npsLv07', Latency('fixed', (0.1,))), _latency_arg('npsLv07=fixed:0.1'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            _latency_arg('any')
+
+
+class TestFaultInjection(TestCase):
+
+    def test_draw(self):
+        faults = FaultInjection({'StUF005': 0.1, 'StUF002': 0.1}, slow_body=0.1, reset=0.1)
+        rng = MagicMock()
+        for value, expect in [
+            (0.05, (None, 'StUF005')),
+            (0.15, (None, 'StUF002')),
+            (0.25, (SLOW_BODY, None)),
+            (0.35, (RESET, None)),
+            (0.45, (None, None)),
+        ]:
+            rng.random.return_value = value
+            self.assertEqual(expect, faults.draw(rng))
+
+        self.assertEqual((None, None), FaultInjection().draw(random.Random()))
+        self.assertIsNone(FaultInjection().faults)
+
+    def test_fault_arg(self):
+        self.assertEqual(('StUF005', 0.01), _fault_arg('StUF005=0.01'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            _fault_arg('StUF005')
+
+
+class TestFixtureAnswers(TestCase):
+
+    def setUp(self):
+        self.answers = FixtureAnswers(FIXTURES)
+
+    def test_request_parameters(self):
+        self.assertEqual({'inp.bsn': '123456789', 'geslachtsnaam': 'Jansen'},
+                         request_parameters(request(**{'inp.bsn': ' 123456789 ', 'geslachtsnaam': 'Jansen'})))
+        self.assertEqual({}, request_parameters(b'<any/>'))
+
+    def test_answer_bsn(self):
+        text = self.answers.answer('npsLa01', {'inp.bsn': '999991619'})
+        self.assertEqual(Path(FIXTURES, 'response_310.xml').read_text(), text)
+
+        text = self.answers.answer('npsLa07', {'inp.bsn': '230161418'})
+        self.assertIn('<BG:npsLa07', text)
+
+    def test_answer_other(self):
+        # Any bsn is answered, with the bsn filled in
+        text = self.answers.answer('npsLa01', {'inp.bsn': '123456789'})
+        self.assertIn('<BG:inp.bsn>123456789</BG:inp.bsn>', text)
+
+        # The same search always gets the same answer
+        search = {'geslachtsnaam': 'Jansen', 'geboortedatum': '19700101'}
+        self.assertEqual(self.answers.answer('npsLa01', search), self.answers.answer('npsLa01', dict(search)))
+
+        self.assertIsNone(self.answers.answer('npsLa99', {}))
+
+    def test_fixtures(self):
+        # Files without objects or answers are skipped
+        self.assertTrue(all(bsn for bsn, _ in self.answers.fixtures['npsLa01']))
+        answers = FixtureAnswers(Path(__file__).parent)
+        self.assertEqual({}, answers.fixtures)
+
+        answers._add('<BG:npsLa01 xmlns:BG="http://www.egem.nl/StUF/sector/bg/0310"><BG:antwoord><BG:object/>'
+                     '</BG:antwoord></BG:npsLa01>')
+        self.assertEqual(None, answers.fixtures['npsLa01'][0][0])
+        self.assertIsNotNone(answers.answer('npsLa01', {'inp.bsn': '123456789'}))
+
+        answers._add('<any/>')
+
+
+class TestGeneratedAnswers(TestCase):
+
+    def test_answer(self):
+        answers = GeneratedAnswers(SIZES['minimal'], seed=1)
+
+        text = answers.answer('npsLa01', {'inp.bsn': '123456789'})
+        self.assertIn('<BG:inp.bsn>123456789</BG:inp.bsn>', text)
+        self.assertEqual(text, answers.answer('npsLa01', {'inp.bsn': '123456789'}))
+        self.assertNotEqual(text, answers.answer('npsLa01', {'inp.bsn': '123456780'}))
+
+        self.assertIn('<BG:npsLa07', answers.answer('npsLa07', {}))
+        self.assertIsNone(answers.answer('npsLa99', {}))
+
+
+class TestStandInMKS(TestCase):
+
+    def setUp(self):
+        self.stand_in = StandInMKS(FixtureAnswers(FIXTURES), latencies={
+            DEFAULT: Latency('fixed', (0.1,)),
+            'npsLv07': Latency('fixed', (0.2,)),
+        })
+
+    def test_answer(self):
+        answer = self.stand_in.answer(NPS_LV01, request(**{'inp.bsn': '999991619'}))
+        self.assertEqual(200, answer.status)
+        self.assertEqual(0.1, answer.delay)
+        self.assertIsNone(answer.behaviour)
+
+        answer = self.stand_in.answer(f'"{NPS_LV07}"', request(**{'inp.bsn': '230161418'}))
+        self.assertEqual(200, answer.status)
+        self.assertEqual(0.2, answer.delay)
+
+        self.stand_in.latencies = {}
+        self.assertEqual(0, self.stand_in.answer(NPS_LV01, request()).delay)
+
+    def test_faults(self):
+        answer = self.stand_in.answer('any', request())
+        self.assertEqual(500, answer.status)
+        self.assertIn('Unknown Soapaction any', answer.body)
+
+        answer = self.stand_in.answer(NPS_LV01, b'no xml')
+        self.assertEqual('StUF011', parse_fault(answer.body).code)
+
+        self.stand_in.answers = MagicMock()
+        self.stand_in.answers.answer.return_value = None
+        self.assertEqual('StUF003', parse_fault(self.stand_in.answer(NPS_LV01, request()).body).code)
+
+        self.stand_in.faults = FaultInjection({'StUF005': 1})
+        answer = self.stand_in.answer(NPS_LV01, request())
+        self.assertEqual(500, answer.status)
+        self.assertEqual('StUF005', parse_fault(answer.body).code)
+
+    def test_wsdl(self):
+        wsdl = self.stand_in.wsdl('http://localhost:8166/310')
+        self.assertIn('<soap:address location="http://localhost:8166/310"/>', wsdl)
+
+
+class TestServer(TestCase):
+
+    def setUp(self):
+        self.stand_in = StandInMKS(FixtureAnswers(FIXTURES), faults=FaultInjection(slow_body_seconds=0))
+        self.server = create_server(self.stand_in, port=0)
+        self.url = f"http://localhost:{self.server.server_address[1]}/310"
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, session=requests):
+        return session.post(self.url, data=request(**{'inp.bsn': '999991619'}), headers={'Soapaction': NPS_LV01})
+
+    def test_post(self):
+        with requests.Session() as session:
+            for _ in range(2):
+                response = self.post(session)
+                self.assertEqual(200, response.status_code)
+                self.assertIn('<BG:inp.bsn>999991619</BG:inp.bsn>', response.text)
+
+    def test_slow_body(self):
+        self.stand_in.answer = MagicMock(return_value=Answer(200, 'any body', behaviour=SLOW_BODY))
+        self.assertEqual('any body', self.post().text)
+
+    def test_reset(self):
+        self.stand_in.answer = MagicMock(return_value=Answer(200, 'any body', behaviour=RESET))
+        with self.assertRaises(requests.ConnectionError):
+            self.post()
+
+    def test_get(self):
+        response = requests.get(f"{self.url}?wsdl")
+        self.assertEqual(200, response.status_code)
+        self.assertIn(f'location="{self.url}"', response.text)
+
+        self.assertEqual(404, requests.get(self.url).status_code)
+
+
+class TestMain(TestCase):
+
+    @patch("gobstuf.stand_in.mks.print")
+    @patch("gobstuf.stand_in.mks.create_server")
+    def test_main(self, mock_create_server, mock_print):
+        server = mock_create_server.return_value
+        server.server_address = ('localhost', 8166)
+        server.serve_forever.side_effect = KeyboardInterrupt
+
+        main(['--fixtures', str(FIXTURES), '--latency', 'lognormal:0.05,0.5', '--latency', 'npsLv07=fixed:0.2',
+              '--fault', 'StUF005=0.01', '--reset', '0.01', '--seed', '1'])
+
+        stand_in = mock_create_server.call_args[0][0]
+        self.assertEqual({DEFAULT: Latency('lognormal', (0.05, 0.5)), 'npsLv07': Latency('fixed', (0.2,))},
+                         stand_in.latencies)
+        self.assertEqual(FaultInjection({'StUF005': 0.01}, 0.0, 0.01, 5.0), stand_in.faults)
+        self.assertIsInstance(stand_in.answers, FixtureAnswers)
+        mock_print.assert_called_with("MKS stand-in listening on http://localhost:8166")
+        server.server_close.assert_called()
+
+        main(['--generate', 'worst'])
+        stand_in = mock_create_server.call_args[0][0]
+        self.assertEqual(SIZES['worst'], stand_in.answers.size)
+        self.assertEqual(0, stand_in.answers.seed)
@@ -0,0 +1,22 @@
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from gobstuf.stuf.brp.response.ingeschrevenpersonen import IngeschrevenpersonenStufHistorieResponse
+
+
+@patch("gobstuf.stuf.brp.base_response.StufMessage", MagicMock())
+class TestIngeschrevenpersonenStufHistorieResponse(TestCase):
+
+    @patch("gobstuf.stuf.brp.base_response.StufMappedResponse.get_answer_object")
+    def test_get_all_answer_objects(self, mock_get_answer_object):
+        resp = IngeschrevenpersonenStufHistorieResponse('msg')
+
+        mock_get_answer_object.return_value = {
+            'verblijfplaats': {'a': 1},
+            'historieMaterieel': [{'b': 2}, {'c': 3}]
+        }
+        self.assertEqual([{'a': 1}, {'b': 2}, {'c': 3}], resp.get_all_answer_objects())
+        self.assertEqual([{'a': 1}, {'b': 2}, {'c': 3}], list(resp.iter_answer_objects()))
+
+        mock_get_answer_object.return_value = {'historieMaterieel': [{'b': 2}]}
+        self.assertEqual([{'b': 2}], list(resp.iter_answer_objects()))
@@ -385,6 +385,25 @@ class StufMappedResponseTest(TestCase):
         self.assertEqual(result, ['obj1'])
         mock_filter.filter_response.assert_has_calls([call('obj1'), call('obj2')])
 
+    def test_iter_answer_objects(self):
+        resp = StufMappedResponseImpl('msg')
+        resp.get_all_object_elms = MagicMock(return_value=['A', 'B', 'C', 'D'])
+        resp.create_object_from_element = MagicMock(side_effect=lambda x: None if x == 'B' else 'obj' + x)
+
+        mock_filter = MockWildcardSearchResponseFilter(resp)
+        mock_filter.filter_response.side_effect = lambda x: None if x == 'objC' else x
+        resp.response_filters_instances = [mock_filter]
+
+        result = resp.iter_answer_objects()
+
+        # Objects are created when requested
+        resp.create_object_from_element.assert_not_called()
+        self.assertEqual('objA', next(result))
+        resp.create_object_from_element.assert_called_once_with('A')
+
+        self.assertEqual(['objD'], list(result))
+        mock_filter.filter_response.assert_has_calls([call('objA'), call('objC'), call('objD')])
+
     def test_get_mapped_related_object(self):
         class RelatedMappingImpl(RelatedMapping):
             answer_code = "ANS"
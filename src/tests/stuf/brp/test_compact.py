@@ -0,0 +1,80 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from gobstuf.benchmarks.results import person, verblijfplaatshistorie
+from gobstuf.stuf.brp.compact import CompactObject, compact_class, to_compact, to_dict, dumps
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class TestCompact(TestCase):
+
+    def test_to_compact(self):
+        obj = {'code': '0363', 'omschrijving': 'Amsterdam', 'list': [{'a': 1}, {'a': 2}], 'empty': {}}
+        result = to_compact(obj)
+
+        self.assertIsInstance(result, CompactObject)
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertEqual('0363', result.code)
+        self.assertEqual('Amsterdam', result.omschrijving)
+        self.assertIsInstance(result.list, tuple)
+        self.assertEqual(1, result.list[0].a)
+        self.assertEqual({}, result.empty)
+
+        # Objects with the same shape share the same class
+        self.assertIs(type(result.list[0]), type(result.list[1]))
+        self.assertIs(type(result), type(to_compact(obj)))
+
+        # Other key order is another shape
+        self.assertIsNot(type(to_compact({'a': 1, 'b': 2})), type(to_compact({'b': 2, 'a': 1})))
+
+        # Scalars are unchanged
+        for value in ['any', 1, 1.5, True, None]:
+            self.assertEqual(value, to_compact(value))
+
+    def test_invalid_keys(self):
+        # Keys that cannot be slots are kept in a dict, the values are converted
+        for key in ['any key', 'class', '__any', 1]:
+            result = to_compact({key: {'a': 1}})
+            self.assertIsInstance(result, dict)
+            self.assertIsInstance(result[key], CompactObject)
+
+    @patch("gobstuf.stuf.brp.compact.MAX_SHAPES", 0)
+    @patch("gobstuf.stuf.brp.compact._CLASSES", {})
+    def test_max_shapes(self):
+        self.assertIsNone(compact_class(('a',)))
+        self.assertEqual({'a': 1}, to_compact({'a': 1}))
+
+    def test_to_dict(self):
+        for obj in [person(1), verblijfplaatshistorie(1)]:
+            result = to_dict(to_compact(obj))
+            self.assertEqual(obj, result)
+            self.assertEqual(_dumps(obj), _dumps(result))
+            self.assertEqual(obj, to_compact(obj).to_dict())
+
+    def test_dumps(self):
+        for obj in [person(1), verblijfplaatshistorie(1)]:
+            self.assertEqual(_dumps(obj), dumps(to_compact(obj)))
+            self.assertEqual(_dumps(obj), to_compact(obj).to_json())
+
+        for value in [
+            {'a': 'Ĳ"\\\n\t\x00\x1f/ ', 'b': -1, 'c': 1.5, 'd': True, 'e': False, 'f': None},
+            {'a': [], 'b': [[], {}], 'c': {'any key': [{'a': 1}]}, 'd': ({'a': 1}, 2)},
+            [], {}, 'any', 1, None,
+        ]:
+            self.assertEqual(_dumps(value), dumps(to_compact(value)))
+
+        with self.assertRaises(TypeError):
+            dumps({'a': object()})
+
+    def test_eq_repr(self):
+        a = to_compact({'a': 1, 'b': {'c': 'd'}})
+        self.assertEqual(a, to_compact({'a': 1, 'b': {'c': 'd'}}))
+        self.assertNotEqual(a, to_compact({'a': 1, 'b': {'c': 'e'}}))
+        self.assertNotEqual(a, to_compact({'b': {'c': 'd'}, 'a': 1}))
+        self.assertNotEqual(a, {'a': 1, 'b': {'c': 'd'}})
+        self.assertEqual("CompactObject(a=1, b=CompactObject(c='d'))", repr(a))
+        self.assertEqual([('a', 1), ('b', a.b)], list(a.items()))
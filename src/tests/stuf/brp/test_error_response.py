@@ -1,6 +1,8 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
+from flask import Flask
+
 from gobstuf.stuf.brp.error_response import StufErrorResponse, UnknownErrorCode
 
 
@@ -24,8 +26,7 @@ class TestErrorResponse(TestCase):
         self.assertEqual(response.stuf_message.get_elm_value.return_value, response.get_berichtcode())
         response.stuf_message.get_elm_value.assert_called_with('StUF:stuurgegevens StUF:berichtcode', 'a')
 
-    @patch("gobstuf.stuf.brp.error_response.RESTResponse")
-    def test_get_http_response(self, mock_rest_response):
+    def test_get_http_response(self):
         response = StufErrorResponse('')
         response.get_berichtcode = MagicMock(return_value='something else')
 
@@ -35,11 +36,11 @@ class TestErrorResponse(TestCase):
         response.get_berichtcode.return_value = 'Fo02'
         response.get_error_code = MagicMock()
 
-        for i in range(1, 14):
-            response.get_error_code.return_value = f"StUF{i:03}"
-
-            # No exceptions
-            response.get_http_response()
+        expected = {1: 400, 3: 404, 10: 403, 52: 403}
+        with Flask(__name__).test_request_context('/any'):
+            for i in [*range(1, 14), 52]:
+                response.get_error_code.return_value = f"StUF{i:03}"
+                self.assertEqual(expected.get(i, 500), response.get_http_response().status_code)
 
         response.get_error_code.return_value = f"StUFUnknown"
 
@@ -82,6 +82,9 @@ class TestStufObjectMapping(TestCase):
         with self.assertRaises(Exception):
             StufObjectMapping.get_for_entity_type('NONEXISTENT', "NONEXISTENT")
 
+        # A failed lookup does not change the mappings
+        self.assertNotIn('NONEXISTENT', StufObjectMapping.mappings)
+
 
 class TestNPSMapping(TestCase):
 
@@ -0,0 +1,44 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from gobstuf.stuf.fault import StufFault, parse_fault, is_transient_fault
+
+FAULT = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <soapenv:Fault>
+      <faultcode>soapenv:Server</faultcode>
+      <detail>
+        <StUF:Fo02Bericht xmlns:StUF="http://www.egem.nl/StUF/StUF0301">
+          <StUF:stuurgegevens>
+            <StUF:berichtcode>Fo02</StUF:berichtcode>
+          </StUF:stuurgegevens>
+          <StUF:body>
+            <StUF:code>{code}</StUF:code>
+            <StUF:plek>server</StUF:plek>
+          </StUF:body>
+        </StUF:Fo02Bericht>
+      </detail>
+    </soapenv:Fault>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class TestFault(TestCase):
+
+    def test_parse_fault(self):
+        self.assertEqual(StufFault('Fo02', 'StUF003'), parse_fault(FAULT.format(code='StUF003')))
+        self.assertEqual(StufFault('Fo02', None), parse_fault(FAULT.replace('StUF:code', 'StUF:other')))
+        self.assertIsNone(parse_fault(FAULT.replace('Fo02', 'La01')))
+        self.assertIsNone(parse_fault('any text'))
+
+    def test_is_transient(self):
+        self.assertTrue(StufFault('Fo02', 'StUF005').is_transient)
+        self.assertFalse(StufFault('Fo02', 'StUF003').is_transient)
+        self.assertFalse(StufFault('Fo02', None).is_transient)
+
+    def test_is_transient_fault(self):
+        for code in ['StUF002', 'StUF005', 'StUF008']:
+            self.assertTrue(is_transient_fault(MagicMock(status_code=500, text=FAULT.format(code=code))))
+        self.assertFalse(is_transient_fault(MagicMock(status_code=500, text=FAULT.format(code='StUF010'))))
+        self.assertFalse(is_transient_fault(MagicMock(status_code=500, text='any error')))
+        self.assertFalse(is_transient_fault(MagicMock(status_code=200, text=FAULT.format(code='StUF002'))))
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock, call
 
-from gobstuf.stuf.message import StufMessage
+from gobstuf.stuf.message import StufMessage, register_namespaces
 
 
 class StufMessageInitLoadTest(TestCase):
@@ -30,6 +30,7 @@ class StufMessageInitLoadTest(TestCase):
 @patch("gobstuf.stuf.message.StufMessage.load", MagicMock())
 class StufMessageTest(TestCase):
 
+    @patch("gobstuf.stuf.message._registered_namespaces", {})
     @patch("gobstuf.stuf.message.StringIO")
     @patch("gobstuf.stuf.message.ET")
     def test_set_namespaces(self, mock_et, mock_stringio):
@@ -55,6 +56,24 @@ class StufMessageTest(TestCase):
             'prefix3': 'url3',
         }, message.namespaces)
 
+        # Namespaces are registered only once
+        mock_et.register_namespace.reset_mock()
+        mock_et.iterparse.return_value.append((4, ('prefix4', 'url4')))
+        message.set_namespaces(msg)
+        mock_et.register_namespace.assert_called_once_with('prefix4', 'url4')
+
+        mock_et.register_namespace.reset_mock()
+        register_namespaces({'prefix1': 'url1'})
+        mock_et.register_namespace.assert_not_called()
+
+        # The last prefix of an url is registered, also when another prefix of the url has been registered before
+        register_namespaces({'other': 'url1', 'prefix5': 'url1'})
+        mock_et.register_namespace.assert_called_once_with('prefix5', 'url1')
+
+        mock_et.register_namespace.reset_mock()
+        register_namespaces({'prefix1': 'url1'})
+        mock_et.register_namespace.assert_called_once_with('prefix1', 'url1')
+
     def test_find_elm(self):
         message = StufMessage('')
         message.tree = MagicMock()
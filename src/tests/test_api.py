@@ -1,13 +1,19 @@
+import re
 import unittest
 from os import environ
+from pathlib import Path
 from unittest import mock
 
-from werkzeug.exceptions import BadRequest, MethodNotAllowed
+from requests.exceptions import Timeout
+from werkzeug.exceptions import BadRequest, MethodNotAllowed, ServiceUnavailable, GatewayTimeout
 
-from gobstuf.api import _health
+from gobstuf.api import _health, _add_server_timing
+from gobstuf.compression import compress_response
 from gobstuf.api import get_flask_app
 from gobstuf.blueprints.secure import _routed_url, _update_response, _update_request, _get_stuf, _post_stuf, _stuf, \
     _handle_stuf_request
+from gobstuf.lib.deadline import DeadlineExceeded
+from gobstuf.lib.upstream_guard import UpstreamUnavailable
 
 
 class MockResponse:
@@ -25,6 +31,19 @@ class TestAPI(unittest.TestCase):
         result = _health()
         self.assertEqual(result, "Connectivity OK")
 
+    @mock.patch("gobstuf.api.get_timings")
+    def test_add_server_timing(self, mock_get_timings):
+        response = mock.MagicMock()
+        response.headers = {}
+
+        mock_get_timings.return_value = {}
+        self.assertEqual(response, _add_server_timing(response))
+        self.assertEqual({}, response.headers)
+
+        mock_get_timings.return_value = {'serialise': 0.001}
+        self.assertEqual(response, _add_server_timing(response))
+        self.assertEqual({'Server-Timing': 'serialise;dur=1.000'}, response.headers)
+
     def test_routed_url(self):
         result = _routed_url("proto://domain/path?args")
         NETLOC = environ.get('ROUTE_NETLOC')
@@ -71,17 +90,23 @@ class TestAPI(unittest.TestCase):
         result = _update_request("...localhost...")
         self.assertEqual(result, "...localhost...")
 
+    @mock.patch("gobstuf.blueprints.secure.upstream_timeout", lambda deadline: (1, 2))
     @mock.patch("gobstuf.blueprints.secure.cert_get")
     def test_get_stuf(self, mock_get):
         mock_get.return_value = "get"
 
         response = _get_stuf("any url")
         self.assertEqual(response, "get")
-        mock_get.assert_called_with("any url")
+        mock_get.assert_called_with("any url", timeout=(1, 2))
+
+        mock_get.side_effect = Timeout
+        with self.assertRaises(GatewayTimeout):
+            _get_stuf("any url")
 
+    @mock.patch("gobstuf.blueprints.secure.upstream_timeout", lambda deadline: (1, 2))
     @mock.patch("gobstuf.blueprints.secure.cert_post")
     def test_post_stuf(self, mock_post):
-        mock_post.return_value = "post"
+        mock_post.return_value = mock.MagicMock(status_code=200)
 
         url = "any url"
         data = "any data"
@@ -96,8 +121,8 @@ class TestAPI(unittest.TestCase):
         }
 
         response = _post_stuf(url, data, headers)
-        self.assertEqual(response, "post")
-        mock_post.assert_called_with(url, data=data, headers=expect_headers)
+        self.assertEqual(response, mock_post.return_value)
+        mock_post.assert_called_with(url, data=data, headers=expect_headers, timeout=(1, 2))
 
         for h in [{},
                   {"Soapaction": "Any action"},
@@ -107,6 +132,33 @@ class TestAPI(unittest.TestCase):
                 headers = h
                 response = _post_stuf(url, data, headers)
 
+        # Refused by the upstream guard
+        with mock.patch("gobstuf.blueprints.secure.mks_guard") as mock_guard:
+            mock_guard.call.side_effect = UpstreamUnavailable("any reason", 10)
+            with self.assertRaises(ServiceUnavailable) as cm:
+                _post_stuf(url, data, expect_headers)
+            self.assertEqual(10, cm.exception.retry_after)
+
+            mock_guard.call.side_effect = DeadlineExceeded('mks')
+            with self.assertRaises(GatewayTimeout):
+                _post_stuf(url, data, expect_headers)
+
+    @mock.patch("gobstuf.blueprints.secure.get_deadline")
+    @mock.patch("gobstuf.blueprints.secure.upstream_timeout")
+    @mock.patch("gobstuf.blueprints.secure.cert_post")
+    @mock.patch("gobstuf.blueprints.secure.mks_hedging")
+    def test_post_stuf_hedged(self, mock_hedging, mock_post, mock_upstream_timeout, mock_get_deadline):
+        # The first attempt and the hedge
+        mock_hedging.call.side_effect = lambda soap_action, attempt: [attempt(), attempt()][-1]
+        mock_upstream_timeout.side_effect = [(1, 2), (0.5, 1)]
+        mock_post.return_value = mock.MagicMock(status_code=200)
+
+        _post_stuf("any url", "any data", {"Soapaction": "Any action", "Content-Type": "text/xml"})
+
+        # Every attempt gets the time that remains before the deadline
+        self.assertEqual(2, mock_get_deadline.call_count)
+        self.assertEqual([(1, 2), (0.5, 1)], [c.kwargs['timeout'] for c in mock_post.call_args_list])
+
     @mock.patch("gobstuf.blueprints.secure._get_stuf")
     @mock.patch("gobstuf.blueprints.secure._post_stuf")
     @mock.patch("gobstuf.blueprints.secure._update_request")
@@ -155,14 +207,18 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(BadRequest):
             response = _stuf()
 
+    @mock.patch("gobstuf.api.init_url_templates")
     @mock.patch("gobstuf.api.CORS", mock.MagicMock())
     @mock.patch("gobstuf.api.Flask")
-    def test_get_app(self, mock_flask):
+    def test_get_app(self, mock_flask, mock_init_url_templates):
         mock_app = mock.MagicMock()
         mock_flask.return_value = mock_app
         app = get_flask_app()
         mock_flask.assert_called()
         mock_app.route.assert_called()
+        mock_app.after_request.assert_any_call(_add_server_timing)
+        mock_app.after_request.assert_called_with(compress_response)
+        mock_init_url_templates.assert_called_with(mock_app)
 
 
 class TestAPIMiddleware(unittest.TestCase):
@@ -175,3 +231,20 @@ class TestAPIMiddleware(unittest.TestCase):
         mock_flask.return_value = mock_app
         app = get_flask_app()
         mock_middleware.assert_called_with(app)
+
+
+class TestOAuth2ProxyConfig(unittest.TestCase):
+
+    def test_skip_auth_routes(self):
+        config = (Path(__file__).parent.parent / 'oauth2-proxy.cfg').read_text()
+        skip_auth_routes = re.search(r'^skip_auth_routes="(.*)"$', config, re.MULTILINE)[1]
+
+        # Health checks and metrics are not authenticated, oauth2-proxy searches the path for the expression
+        app = get_flask_app()
+        routes = [rule.rule for rule in app.url_map.iter_rules() if rule.endpoint in ('_health', '_metrics')]
+        self.assertEqual(['/brp/status/health/', '/brp/status/metrics'], sorted(routes))
+        for path in routes + ['/brp/status/health']:
+            self.assertTrue(re.search(skip_auth_routes, path), path)
+
+        for path in ['/brp/status/healthy', '/brp/status/metrics/any', '/brp/ingeschrevenpersonen/123456789']:
+            self.assertFalse(re.search(skip_auth_routes, path), path)
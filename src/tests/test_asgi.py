@@ -0,0 +1,10 @@
+import unittest
+from unittest import mock
+
+class TestAsgi(unittest.TestCase):
+
+    @mock.patch('gobstuf.async_api.get_asgi_app')
+    @mock.patch('gobstuf.app.get_app')
+    def test_asgi(self, mock_get_app, mock_get_asgi_app):
+        import gobstuf.asgi
+        mock_get_asgi_app.assert_called_with(mock_get_app.return_value)
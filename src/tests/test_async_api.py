@@ -0,0 +1,276 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+from flask import Response
+
+from gobstuf.async_api import AsgiApp, get_asgi_app, wsgi_environ
+from gobstuf.lib.upstream_guard import UpstreamGuard, AdaptiveLimit, CircuitBreaker
+
+FAULT = '<StUF:berichtcode>Fo02</StUF:berichtcode><StUF:code>{code}</StUF:code>'
+
+
+class MKS:
+    """Answers the MKS requests of the async client"""
+
+    def __init__(self, text='', status_code=200, exception=None):
+        self.text = text
+        self.status_code = status_code
+        self.exception = exception
+        self.requests = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.exception:
+            raise self.exception
+        return httpx.Response(self.status_code, text=self.text)
+
+
+@pytest.fixture
+def asgi_app(app) -> AsgiApp:
+    return get_asgi_app(app)
+
+
+@pytest.fixture
+def stuf_310_text(tests_dir) -> str:
+    return Path(tests_dir, "fixtures", "response_310.xml").read_text()
+
+
+@pytest.fixture(autouse=True)
+def guard():
+    # A fresh guard for every test, the breaker state should not leak
+    guard = UpstreamGuard(AdaptiveLimit(10, 1, 10), CircuitBreaker(10, 10, 1, 1, 30, 1),
+                          limit_timeout=0, slow_call=10)
+    with patch("gobstuf.rest.brp.async_view.mks_guard", guard):
+        yield guard
+
+
+def _get(asgi_app: AsgiApp, mks: MKS, path: str, headers: dict = None) -> httpx.Response:
+    headers = {k: v for k, v in (headers or {}).items() if not k.startswith('_')}
+
+    async def get():
+        asgi_app._client = httpx.AsyncClient(transport=httpx.MockTransport(mks))
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await client.get(path, headers=headers)
+
+    return asyncio.run(get())
+
+
+class TestAsgiApp:
+
+    def test_get(self, asgi_app, stuf_310_text, app_base_path, jwt_header):
+        mks = MKS(stuf_310_text)
+        response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert response.status_code == 200
+        assert response.json()['burgerservicenummer'] == '999991619'
+        assert 'npsLv01' in mks.requests[0].headers['Soapaction']
+        assert b'123456789' in mks.requests[0].content
+
+        phases = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+        assert phases[:6] == ['validate', 'mks', 'parse', 'filter', 'map', 'serialise']
+
+    def test_get_list(self, asgi_app, stuf_310_text, app_base_path, jwt_header):
+        response = _get(asgi_app, MKS(stuf_310_text),
+                        f"{app_base_path}/brp/ingeschrevenpersonen?burgerservicenummer=123456789", jwt_header)
+
+        assert response.status_code == 200
+        assert len(response.json()['_embedded']['ingeschrevenpersonen']) == 1
+
+    def test_bad_request(self, asgi_app, app_base_path, jwt_header):
+        mks = MKS()
+        response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/1234", jwt_header)
+
+        assert response.status_code == 400
+        assert mks.requests == []
+
+    def test_forbidden(self, asgi_app, app_base_path):
+        response = _get(asgi_app, MKS(), f"{app_base_path}/brp/ingeschrevenpersonen/123456789")
+        assert response.status_code == 403
+
+    def test_mks_fault(self, asgi_app, app_base_path, jwt_header):
+        mks = MKS(FAULT.format(code='StUF003'), status_code=500)
+        with patch("gobstuf.rest.brp.base_view.StufErrorResponse") as mock_error_response:
+            mock_error_response.return_value.get_http_response.return_value = ('Not found', 404)
+            response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert response.status_code == 404
+        mock_error_response.assert_called_with(FAULT.format(code='StUF003'))
+
+    def test_mks_retried(self, asgi_app, app_base_path, jwt_header):
+        mks = MKS(FAULT.format(code='StUF005'), status_code=500)
+        with patch("gobstuf.lib.retry.asyncio.sleep") as mock_sleep:
+            _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert len(mks.requests) == 3
+        assert mock_sleep.call_count == 2
+
+    def test_mks_timeout(self, asgi_app, app_base_path, jwt_header):
+        mks = MKS(exception=httpx.ReadTimeout("any timeout"))
+        response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert response.status_code == 504
+        assert response.json()['code'] == 'timeout'
+
+    def test_mks_error(self, asgi_app, app_base_path, jwt_header):
+        mks = MKS(exception=httpx.ConnectError("any error"))
+        response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert response.status_code == 500
+
+    def test_mks_unavailable(self, asgi_app, app_base_path, jwt_header, guard):
+        guard.breaker._open()
+        mks = MKS()
+        response = _get(asgi_app, mks, f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+
+        assert response.status_code == 503
+        assert mks.requests == []
+
+    def test_other_routes(self, asgi_app, app_base_path, jwt_header):
+        # Handled by the Flask app
+        response = _get(asgi_app, MKS(), "/brp/status/health/")
+        assert response.status_code == 200
+        assert response.text == 'Connectivity OK'
+
+        response = _get(asgi_app, MKS(), f"{app_base_path}/brp/ingeschrevenpersonen/exports/any", jwt_header)
+        assert response.status_code == 404
+
+        response = _get(asgi_app, MKS(), "/any/route")
+        assert response.status_code == 404
+
+    def test_exception(self, asgi_app, app_base_path, jwt_header):
+        with patch("gobstuf.async_api.AsyncStufRestView.get", side_effect=ValueError):
+            response = _get(asgi_app, MKS(), f"{app_base_path}/brp/ingeschrevenpersonen/123456789", jwt_header)
+        assert response.status_code == 500
+
+    def test_exception_in_hook(self, asgi_app):
+        # Flask propagates the exception when testing, the handler is mocked
+        with patch.object(asgi_app.app, "finalize_request", side_effect=ValueError), \
+                patch.object(asgi_app.app, "handle_exception", return_value=Response("Any error", 500)) as mock_handle:
+            response = _get(asgi_app, MKS(), "/brp/status/health/")
+        assert response.status_code == 500
+        assert isinstance(mock_handle.call_args[0][0], ValueError)
+
+    def test_client_disconnect(self, asgi_app, app_base_path, jwt_header):
+        mks_called = asyncio.Event
+        sent = []
+
+        async def call():
+            called = mks_called()
+
+            async def mks(request):
+                called.set()
+                await asyncio.Event().wait()
+
+            asgi_app._client = httpx.AsyncClient(transport=httpx.MockTransport(mks))
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False},
+                        {'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                # The client goes away while MKS is queried
+                await called.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': f"{app_base_path}/brp/ingeschrevenpersonen/123456789",
+                'query_string': b'',
+                'http_version': '1.1',
+                'headers': [(k.lower().encode(), v.encode()) for k, v in jwt_header.items() if not k.startswith('_')],
+            }
+            await asyncio.wait_for(asgi_app(scope, receive, send), 5)
+
+        with patch("gobstuf.async_api.logger") as mock_logger:
+            asyncio.run(call())
+
+        assert sent == []
+        mock_logger.info.assert_called_with("Client disconnected, request is cancelled")
+
+    def test_disconnect_before_body(self, asgi_app):
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            raise AssertionError("Nothing should be sent")
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/any', 'query_string': b'', 'http_version': '1.1',
+                 'headers': []}
+        asyncio.run(asgi_app(scope, receive, send))
+
+    def test_lifespan(self, asgi_app):
+        sent = []
+
+        async def lifespan():
+            messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message['type'])
+
+            # The client is created on first use
+            assert asgi_app.client is asgi_app.client
+            await asgi_app({'type': 'lifespan'}, receive, send)
+
+        asyncio.run(lifespan())
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+        assert asgi_app.client.is_closed
+
+        # Shutdown without client
+        asgi_app._client = None
+        messages = [{'type': 'lifespan.shutdown'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            pass
+
+        asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+
+
+def test_wsgi_environ():
+    scope = {
+        'method': 'POST',
+        'path': '/brp/any',
+        'query_string': b'a=1',
+        'http_version': '1.1',
+        'server': ('example.com', 8000),
+        'client': ('1.2.3.4', 1234),
+        'scheme': 'https',
+        'headers': [
+            (b'content-type', b'text/xml'),
+            (b'x-any', b'a'),
+            (b'x-any', b'b'),
+            (b'cookie', b'a=1'),
+            (b'cookie', b'b=2'),
+        ],
+    }
+    environ = wsgi_environ(scope, b'any body')
+
+    assert environ['REQUEST_METHOD'] == 'POST'
+    assert environ['PATH_INFO'] == '/brp/any'
+    assert environ['QUERY_STRING'] == 'a=1'
+    assert environ['SERVER_NAME'] == 'example.com'
+    assert environ['SERVER_PORT'] == '8000'
+    assert environ['REMOTE_ADDR'] == '1.2.3.4'
+    assert environ['wsgi.url_scheme'] == 'https'
+    assert environ['wsgi.input'].read() == b'any body'
+    assert environ['CONTENT_TYPE'] == 'text/xml'
+    assert environ['HTTP_X_ANY'] == 'a,b'
+    assert environ['HTTP_COOKIE'] == 'a=1; b=2'
+
+    del scope['server'], scope['client'], scope['scheme']
+    environ = wsgi_environ(scope, b'')
+    assert environ['SERVER_NAME'] == 'localhost'
+    assert environ['wsgi.url_scheme'] == 'http'
@@ -3,7 +3,8 @@ from unittest.mock import patch, MagicMock, ANY
 
 import json
 
-from gobstuf.audit_log import GOBAuditLogHandler, get_log_handler, get_user_from_request, get_nested_item, on_audit_log_exception, log_request, log_response
+from gobstuf.audit_log import GOBAuditLogHandler, get_log_handler, get_user_from_request, get_nested_item, on_audit_log_exception, log_request, log_response, \
+    log_incomplete_response
 
 class TestAuditLog(unittest.TestCase):
 
@@ -121,3 +122,28 @@ class TestAuditLog(unittest.TestCase):
         msg_to_be_logged = 'any message'
         on_audit_log_exception(Exception(), msg_to_be_logged)
         mock_logger.error.assert_called_with(ANY, msg_to_be_logged)
+
+    @patch('gobstuf.audit_log.uuid.uuid4', lambda: 'any uuid')
+    @patch('gobstuf.audit_log.get_client_ip', lambda request: 'any ip')
+    @patch('gobstuf.audit_log.log_response')
+    def test_log_incomplete_response(self, mock_log_response):
+        mock_request = MagicMock()
+
+        with patch('gobstuf.audit_log.request', mock_request):
+            mock_request.url = 'any url'
+            mock_request.headers = {}
+
+            log_incomplete_response(Exception('any error'))
+            mock_log_response.assert_called_with(
+                source='any url',
+                destination='any ip',
+                extra_data={
+                    'http_response': {
+                        'incomplete': True,
+                        'exception': 'any error',
+                    },
+                    'X-Correlation-ID': None,
+                    'X-Unique-ID': None,
+                },
+                request_uuid='any uuid'
+            )
@@ -1,8 +1,14 @@
+import asyncio
+import ssl
+import threading
 import unittest
 from os import environ
 from unittest import mock
 
-from gobstuf.certrequest import cert_get, cert_post
+import httpx
+from requests.exceptions import Timeout
+
+from gobstuf.certrequest import cert_get, cert_post, cert_ssl_context, get_async_client, async_cert_post
 
 
 class MockResponse:
@@ -28,8 +34,10 @@ class TestConfig(unittest.TestCase):
 
         self.assertIsInstance(response, MockResponse)
 
+    @mock.patch("gobstuf.certrequest.record_mks_call")
+    @mock.patch("gobstuf.certrequest.mks_capture")
     @mock.patch("gobstuf.certrequest.post")
-    def test_post(self, mock_post):
+    def test_post(self, mock_post, mock_capture, mock_record_mks_call):
         mock_post.return_value = MockResponse()
 
         cert_post("any url", data="any data", headers={"a": 0})
@@ -52,3 +60,88 @@ class TestConfig(unittest.TestCase):
         )
 
         self.assertIsInstance(response, MockResponse)
+
+        # The request is offered to the capture
+        url, headers, data, captured_response, start, duration = mock_capture.record.call_args[0]
+        self.assertEqual(("any url", {}, "any data", response), (url, headers, data, captured_response))
+        self.assertGreater(start, 0)
+        self.assertGreaterEqual(duration, 0)
+
+        # And registered in the metrics, also when it fails
+        mock_record_mks_call.assert_called_with({}, "any data", response, duration)
+
+        mock_post.side_effect = Timeout
+        with self.assertRaises(Timeout):
+            cert_post("any url", data="any data", headers={})
+        self.assertIsNone(mock_record_mks_call.call_args[0][2])
+
+    def test_ssl_context(self):
+        self.assertIsInstance(cert_ssl_context(), ssl.SSLContext)
+
+        with mock.patch("gobstuf.certrequest.PKCS12_FILENAME", None):
+            self.assertIsInstance(cert_ssl_context(), ssl.SSLContext)
+
+    def test_get_async_client(self):
+        client = get_async_client(5)
+        self.assertIsInstance(client, httpx.AsyncClient)
+        asyncio.run(client.aclose())
+
+    @mock.patch("gobstuf.certrequest.record_mks_call")
+    @mock.patch("gobstuf.certrequest.mks_capture")
+    def test_async_post(self, mock_capture, mock_record_mks_call):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(500, text="any text", headers={"Content-Type": "text/xml; charset=utf-8"})
+
+        async def post(handler):
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                return await async_cert_post(client, "http://any.url/", data="any data", headers={"a": "b"},
+                                             timeout=(1, 2))
+
+        # The response is returned as a requests response
+        response = asyncio.run(post(handler))
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("Internal Server Error", response.reason)
+        self.assertEqual("any text", response.text)
+        self.assertEqual("text/xml; charset=utf-8", response.headers["content-type"])
+        self.assertEqual("http://any.url/", response.url)
+
+        self.assertEqual(b"any data", requests[0].content)
+        self.assertEqual("b", requests[0].headers["a"])
+        self.assertEqual({'connect': 1, 'read': 2, 'write': 2, 'pool': 2}, requests[0].extensions['timeout'])
+
+        url, headers, data, captured_response = mock_capture.record.call_args[0][:4]
+        self.assertEqual(("http://any.url/", {"a": "b"}, "any data", response), (url, headers, data, captured_response))
+        self.assertEqual(({"a": "b"}, "any data", response), mock_record_mks_call.call_args[0][:3])
+
+        # The request is captured outside the thread of the event loop
+        threads = []
+        mock_capture.record.side_effect = lambda *args: threads.append(threading.get_ident())
+        asyncio.run(post(handler))
+        self.assertEqual(1, len(threads))
+        self.assertNotEqual(threading.get_ident(), threads[0])
+
+        # Not when capture is disabled
+        mock_capture.enabled = False
+        mock_capture.record.reset_mock()
+        asyncio.run(post(handler))
+        mock_capture.record.assert_not_called()
+
+        # Timeouts are raised like requests timeouts
+        def timeout(request):
+            raise httpx.ReadTimeout("any timeout")
+
+        with self.assertRaises(Timeout):
+            asyncio.run(post(timeout))
+        self.assertIsNone(mock_record_mks_call.call_args[0][2])
+
+        # Other errors are raised as is
+        def connect_error(request):
+            raise httpx.ConnectError("any error")
+
+        mock_record_mks_call.reset_mock()
+        with self.assertRaises(httpx.ConnectError):
+            asyncio.run(post(connect_error))
+        self.assertIsNone(mock_record_mks_call.call_args[0][2])
@@ -0,0 +1,163 @@
+import gzip
+from unittest import TestCase
+from unittest.mock import patch
+
+import brotli
+from flask import Flask, Response, request, stream_with_context
+
+from gobstuf.compression import (
+    init_compression, compress_response, compress, compress_stream, get_compressor, available_encodings,
+    GzipCompressor, BrotliCompressor, encode_etag, decode_etag
+)
+
+BODY = b'{"any":"data"}' * 100
+
+
+def _get_app():
+    app = Flask(__name__)
+
+    @app.route('/json')
+    def json_view():
+        return Response(BODY, content_type='application/hal+json')
+
+    @app.route('/etag')
+    def etag_view():
+        response = Response(BODY, content_type='application/hal+json')
+        response.set_etag(request.args['etag'], weak=request.args.get('weak') == 'true')
+        return response
+
+    @app.route('/not_modified')
+    def not_modified_view():
+        response = Response(status=304)
+        response.set_etag('abc-gzip')
+        return response
+
+    @app.route('/small')
+    def small_view():
+        return Response(b'{"any":"data"}', content_type='application/hal+json')
+
+    @app.route('/xml')
+    def xml_view():
+        return Response(BODY.decode(), mimetype='text/xml')
+
+    @app.route('/text')
+    def text_view():
+        return Response(BODY, mimetype='text/plain')
+
+    @app.route('/error')
+    def error_view():
+        return Response(BODY, status=500, content_type='application/problem+json')
+
+    @app.route('/stream')
+    def stream_view():
+        def generate():
+            yield b'{"_embedded":['
+            yield BODY
+            yield ']}'
+        return Response(stream_with_context(generate()), content_type='application/hal+json')
+
+    init_compression(app)
+    return app
+
+
+@patch("gobstuf.compression.COMPRESSION_MIN_SIZE", 1024)
+class TestCompression(TestCase):
+
+    def setUp(self):
+        self.client = _get_app().test_client()
+
+    def test_gzip(self):
+        response = self.client.get('/json', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(BODY, gzip.decompress(response.data))
+        self.assertEqual(str(len(response.data)), response.headers['Content-Length'])
+
+    def test_brotli(self):
+        response = self.client.get('/xml', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual('br', response.headers['Content-Encoding'])
+        self.assertEqual(BODY, brotli.decompress(response.data))
+
+    def test_quality(self):
+        response = self.client.get('/json', headers={'Accept-Encoding': 'br;q=0.5, gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+
+    def test_not_accepted(self):
+        for headers in [{}, {'Accept-Encoding': 'identity'}, {'Accept-Encoding': 'gzip;q=0'}]:
+            response = self.client.get('/json', headers=headers)
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(BODY, response.data)
+
+    def test_below_min_size(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(b'{"any":"data"}', response.data)
+
+    def test_not_compressible(self):
+        for path in ['/text', '/error']:
+            response = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertNotIn('Vary', response.headers)
+
+    def test_stream(self):
+        response = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(b'{"_embedded":[' + BODY + b']}', gzip.decompress(response.data))
+
+    def test_etag(self):
+        response = self.client.get('/etag?etag=abc', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('"abc-gzip"', response.headers['ETag'])
+
+        response = self.client.get('/etag?etag=abc', headers={'Accept-Encoding': 'br'})
+        self.assertEqual('"abc-br"', response.headers['ETag'])
+
+        response = self.client.get('/etag?etag=abc')
+        self.assertEqual('"abc"', response.headers['ETag'])
+
+        # Weak tags are valid for any encoding
+        response = self.client.get('/etag?etag=abc&weak=true', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('W/"abc"', response.headers['ETag'])
+
+    def test_not_modified(self):
+        response = self.client.get('/not_modified', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual('"abc-gzip"', response.headers['ETag'])
+
+    def test_already_encoded(self):
+        response = Response(BODY, content_type='application/hal+json', headers={'Content-Encoding': 'gzip'})
+        with Flask(__name__).test_request_context(headers={'Accept-Encoding': 'br'}):
+            self.assertEqual(BODY, compress_response(response).get_data())
+
+
+class TestCompressors(TestCase):
+
+    def test_get_compressor(self):
+        self.assertIsInstance(get_compressor('gzip'), GzipCompressor)
+        self.assertIsInstance(get_compressor('br', 1), BrotliCompressor)
+
+    def test_compress(self):
+        self.assertEqual(BODY, gzip.decompress(compress(BODY, 'gzip', 1)))
+        self.assertEqual(BODY, brotli.decompress(compress(BODY, 'br', 1)))
+
+    def test_compress_stream(self):
+        for encoding, decompress in [('gzip', gzip.decompress), ('br', brotli.decompress)]:
+            chunks = compress_stream(iter([b'abc', 'def']), encoding)
+            # Every chunk is flushed, so the first chunk can be decompressed on its own
+            first = next(chunks)
+            self.assertTrue(first)
+            self.assertEqual(b'abcdef', decompress(first + b''.join(chunks)))
+
+    def test_encode_decode_etag(self):
+        for etag in ['abc', 'abc-def', '']:
+            self.assertEqual(etag, decode_etag(etag))
+            for encoding in ['gzip', 'br']:
+                self.assertEqual(etag, decode_etag(encode_etag(etag, encoding)))
+
+    def test_available_encodings(self):
+        self.assertEqual(['br', 'gzip'], available_encodings())
+
+        with patch("gobstuf.compression.brotli", None):
+            self.assertEqual(['gzip'], available_encodings())
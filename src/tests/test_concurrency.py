@@ -0,0 +1,95 @@
+"""
+Concurrency stress test
+
+Many simultaneous requests are handled by the app in separate threads, as they would be by a threaded or gevent
+worker. A stand-in MKS answers every request with the person that has been asked for, after a random delay.
+Every response should contain the requested person only, and no state of one request should leak into another.
+
+The mapping of all threads competes for the same interpreter, the MKS calls seem slow. The upstream guard and the fair
+share scheduler would refuse requests, they are disabled.
+
+"""
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import patch
+
+from requests import Response
+
+from gobstuf.lib.fair_share import mks_fair_share
+from gobstuf.lib.upstream_guard import mks_guard
+from gobstuf.stuf.brp.request.ingeschrevenpersonen import IngeschrevenpersonenFilterStufRequest
+
+THREADS = 32
+REQUESTS = 300
+
+# The person in the response fixture
+FIXTURE_BSN = '999991619'
+
+
+class StandInMKS:
+    """Answers every request with the fixture, for the requested bsn
+
+    Used instead of cert_post. Mocked requests would be handled one at a time.
+    """
+
+    def __init__(self, fixture: str):
+        self.fixture = fixture
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, url: str, data: bytes, **kwargs) -> Response:
+        with self._lock:
+            self.requests += 1
+
+        # Namespace prefixes are part of the request, whatever other requests are serialised at the same time
+        text = data.decode('utf-8')
+        assert '<StUF:tijdstipBericht>' in text
+
+        time.sleep(random.uniform(0, 0.005))
+        bsn = re.search(r'<BG:inp\.bsn>(\d+)</BG:inp\.bsn>', text)
+
+        response = Response()
+        response.status_code = 200
+        response._content = self.fixture.replace(FIXTURE_BSN, bsn.group(1) if bsn else FIXTURE_BSN).encode('utf-8')
+        response.encoding = 'utf-8'
+        return response
+
+
+def test_concurrent_requests(app, tests_dir, app_base_path, jwt_header):
+    mks = StandInMKS(Path(tests_dir, "fixtures", "response_310.xml").read_text())
+
+    headers = {k: v for k, v in jwt_header.items() if not k.startswith('_')}
+    base_url = f"{app_base_path}/brp/ingeschrevenpersonen"
+    wildcard_checks = list(IngeschrevenpersonenFilterStufRequest.parameter_checks['naam__geslachtsnaam'])
+
+    def get(n: int):
+        bsn = str(100000000 + n)
+        with app.test_client() as client:
+            if n % 3 == 0:
+                response = client.get(f"{base_url}/{bsn}", headers=headers)
+                return n, response.status_code, [response.json['burgerservicenummer']]
+            elif n % 3 == 1:
+                response = client.get(f"{base_url}?burgerservicenummer={bsn}", headers=headers)
+            else:
+                response = client.get(f"{base_url}?geboorte__datum=1970-01-01&naam__geslachtsnaam=Ja*",
+                                      headers=headers)
+                return n, response.status_code, None
+            persons = response.json['_embedded']['ingeschrevenpersonen']
+            return n, response.status_code, [person['burgerservicenummer'] for person in persons]
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor, patch("gobstuf.rest.brp.base_view.cert_post", mks), \
+            patch.object(mks_guard, 'enabled', False), patch.object(mks_fair_share, 'enabled', False):
+        results = list(executor.map(get, range(REQUESTS)))
+
+    assert mks.requests == REQUESTS
+    for n, status_code, bsns in results:
+        assert status_code == 200
+        if bsns is not None:
+            assert bsns == [str(100000000 + n)]
+
+    # The request templates are shared by all requests and should not have changed
+    assert IngeschrevenpersonenFilterStufRequest.parameter_checks['naam__geslachtsnaam'] == wildcard_checks